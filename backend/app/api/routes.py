@@ -1,55 +1,174 @@
+import os
+import hmac
+import math
+import json
+import time
+import uuid
+import asyncio
 import logging
-from fastapi import APIRouter, File, UploadFile, HTTPException, Request, Query
-from fastapi.responses import JSONResponse
+import cv2
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request, Query, Header, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, FileResponse
 
 from app.dependencies import limiter
-from app.core.model_loader import cnn_model, CLASS_LABELS
-from app.core.concurrency import _run_inference_safely
-from app.services.gemini_service import get_ai_analysis, settings
-from app.schemas.response import DetectionResponse, BatchDetectionResponse, Prediction, AIAnalysis
+from app.core.rate_limit import get_remote_address, parse_rate
+# Before model_loader: concurrency exports the thread settings TensorFlow reads on import
+from app.core.concurrency import _infer_batch, _format_prediction, inference_slot, admission, buffer_pool, runtime_layout, calibrate_confidence
+from app.core.model_loader import model_registry, load_and_validate_model
+from app.core.model_registry import ModelRegistryError
+from app.core.runtime import apply_threadpool_limit, runtime_snapshot
+from app.core.predictor import preprocess_tensors, rejection_to_http
+from app.core.pipeline import build_pipeline, parse_overrides, register, Stage, StageRejected
+from app.core.explain import ScanTensorCache, HeatmapStore, ExplainWorker, ExplainQueueFull
+from app.core.rollups import RollupStore, DIMENSIONS
+from app.core.drift import DriftMonitor, profile_baseline_path
+from app.core.shadow import ShadowEvaluator
+from app.core.archive import UploadArchive
+from app.core.similar_cases import CaseStore
+from app.core.stages import label_for, split_label
+from app.core.cascade import get_cascade_stats
+from app.core.ood_detector import validate_plant_presence
+from app.core.tiling import prepare_field_tiles, aggregate_field
+from app.core.live_scan import LiveScanSession, MicroBatcher, dhash
+from app.core.admission import inference_priority, PRIORITY_BATCH
+from app.core.deadline import start_budget
+from app.services.gemini_service import get_advisory, settings
+from app.schemas.response import BatchDetectionResponse, FieldDetectionResponse
 from app.utils.file_validator import validate_and_read_image
+from app.utils.image_utils import decode_image, compute_blur_score, quick_leaf_metrics, resize_and_normalize
+from app.utils.structured_logging import log_event
+from app.utils.serialization import negotiate, dumps
+from app.utils.tensor_codec import decode_tensor_upload, read_tensor_body, HEADER
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+# Per field / crop / region risk aggregates, updated as each scan completes (GET /risk/...)
+risk_rollups = RollupStore(settings.rollup_db_path, settings.rollup_bucket_s, settings.rollup_flush_interval_s)
+
+# Embeddings of past scans: GET /similar/{scan_id} and the kNN signal of every new scan
+similar_cases = CaseStore(
+    settings.cases_db_path,
+    code_dim=settings.ann_code_dim,
+    nlist=settings.ann_nlist,
+    nprobe=settings.ann_nprobe,
+    train_min=settings.ann_train_min,
+    flush_interval_s=settings.ann_flush_interval_s
+)
+# Only scans of the active model are searched; the index is rebuilt from the log when it changes
+model_registry.on_swap(lambda bundle: similar_cases.use_version(bundle.version, bundle.feature_extractor.output_shape[-1]))
+register(Stage("neighbors", "ivf", similar_cases.neighbors, requires=("features", "class_idx", "confidence", "scan_id", "metrics", "bundle"),
+               provides=("confidence",), blocking=True))
+
+# Shared by /predict/batch, /predict/field and /predict/tensor, which charge it per image
+API_PREDICT_RATE = "10/minute"
+
+router = APIRouter(
+    on_startup=[lambda: apply_threadpool_limit(runtime_layout["threadpool_tokens"]), risk_rollups.start, similar_cases.start,
+                model_registry.start],
+    on_shutdown=[risk_rollups.stop, similar_cases.stop, model_registry.stop]
+)
+
+# Live camera frames from every open /ws/scan session share these forward passes
+live_batcher = MicroBatcher(
+    lambda batch, metrics_list: _infer_batch(batch, metrics_list, tta=False),
+    max_batch=settings.live_scan_batch_max,
+    max_wait_s=settings.live_scan_batch_wait_ms / 1000.0
+)
+live_sessions = 0
+
+# Model inputs of recent scans, for on-demand explanation heatmaps (GET /explain/{scan_id})
+scan_tensors = ScanTensorCache(settings.explain_cache_mb * 2**20)
+register(Stage("retain", "scan_cache", scan_tensors.retain, requires=("tensor", "buffers", "scan_id", "class_idx", "crop", "disease")))
+
+def _explain_slot():
+    # Explanations queue behind every prediction, single or batch
+    return admission.slot(priority=PRIORITY_BATCH)
+
+def _model_of(version: str = None):
+    """The model of a version that may have been swapped out since (None once it is unloaded)."""
+    bundle = model_registry.get(version) if version else model_registry.current
+    return bundle.model if bundle is not None else None
+
+explainer = ExplainWorker(
+    scan_tensors,
+    HeatmapStore(settings.explain_dir),
+    model_fn=_model_of,
+    slot=_explain_slot,
+    batch_max=settings.explain_batch_max,
+    queue_max=settings.explain_queue_max,
+    run_blocking=run_in_threadpool
+)
+
+# Single-image scans, decode through advise (see app/core/pipeline.py)
+pipeline = build_pipeline(
+    settings.pipeline_profile,
+    parse_overrides(settings.pipeline_overrides),
+    inputs=("image_bytes", "language", "model", "slot", "scan_id", "bundle", "labels"),
+    resources={"buffers": buffer_pool.lease}
+)
+drift_monitor = DriftMonitor(profile_baseline_path(settings.drift_baseline_path, pipeline.name), settings.drift_window_s, settings.drift_min_samples)
+pipeline.observe(drift_monitor.observe)
+
+# Candidate model compared with the primary on a sample of live scans, on spare capacity only (GET /shadow)
+shadow = None
+if settings.shadow_model_path and model_registry.current is None:
+    logger.error("Shadow evaluation disabled: no primary model to compare the candidate with")
+elif settings.shadow_model_path:
+    try:
+        candidate_model = load_and_validate_model(settings.shadow_model_path, len(model_registry.current.labels))
+    except (FileNotFoundError, RuntimeError) as e:
+        logger.error(f"Shadow evaluation disabled: {e}")
+    else:
+        shadow = ShadowEvaluator(
+            scan_tensors,
+            candidate_fn=lambda: candidate_model,
+            primary_fn=_model_of,
+            admission=admission,
+            sample_rate=settings.shadow_sample_rate,
+            batch_max=settings.shadow_batch_max,
+            queue_max=settings.shadow_queue_max,
+            max_age_s=settings.shadow_max_age_s,
+            calibrate=calibrate_confidence,
+            run_blocking=run_in_threadpool
+        )
+        pipeline.observe(shadow.observe)
+
+# Accepted uploads, written behind the response for retraining (ARCHIVE_DIR; see app/core/archive.py)
+upload_archive = None
+if settings.archive_dir:
+    upload_archive = UploadArchive(
+        settings.archive_dir,
+        max_side=settings.archive_max_side,
+        jpeg_quality=settings.archive_jpeg_quality,
+        queue_mb=settings.archive_queue_mb,
+        batch_max=settings.archive_batch_max,
+        run_blocking=run_in_threadpool
+    )
+    # Started and stopped by the app's lifespan (app/main.py), like the one writer it is
+    pipeline.observe(upload_archive.observe)
 
 @router.get("/")
 async def root():
     return {"message": "Welcome to LeafSense AI Production"}
 
-@router.get("/health")
-async def health_check():
-    cfg_gemini = bool(settings.gemini_api_key and settings.gemini_api_key != "your_google_gemini_api_key_here")
-    
-    from app.core.model_loader import get_health_status
-    model_status = get_health_status()
-    
-    is_fully_healthy = model_status["loaded"] and model_status["warmup_passed"] and cfg_gemini
-    is_degraded = model_status["loaded"] and model_status["warmup_passed"] and not cfg_gemini
-    
-    status_str = "healthy" if is_fully_healthy else ("degraded" if is_degraded else "unhealthy")
-    
-    return JSONResponse(
-        status_code=200 if (is_fully_healthy or is_degraded) else 503,
-        content={
-            "status": status_str,
-            "model": model_status,
-            "gemini": {
-                "api_key_present": cfg_gemini
-            },
-            "version": "1.0.0"
-        }
-    )
-
-@router.get("/health/ready")
-async def readiness_check():
-    from app.core.model_loader import get_health_status
-    model_status = get_health_status()
-    
-    is_ready = model_status["loaded"] and model_status["warmup_passed"]
-    return JSONResponse(
-        status_code=200 if is_ready else 503,
-        content={"status": "ready" if is_ready else "not_ready"}
-    )
+def health_snapshot() -> dict:
+    """What the router's subsystems report under the app's GET /health."""
+    current = model_registry.current
+    return {
+        "cascade": {"enabled": current is not None and current.cascade_head is not None, **get_cascade_stats()},
+        "models": model_registry.snapshot(),
+        "admission": admission.snapshot(),
+        "live_scan": {"sessions": live_sessions, **live_batcher.snapshot()},
+        "buffer_pool": buffer_pool.snapshot(),
+        "pipeline": pipeline.snapshot(),
+        "explain": explainer.snapshot(),
+        "rollups": risk_rollups.snapshot(),
+        "similar_cases": similar_cases.snapshot(),
+        "drift": drift_monitor.snapshot(),
+        "shadow": shadow.snapshot() if shadow else None,
+        "archive": upload_archive.snapshot() if upload_archive else None,
+        "runtime": runtime_snapshot()
+    }
 
 @router.get("/demo-samples")
 async def get_demo_samples(request: Request):
@@ -63,150 +182,541 @@ def calculate_severity_factor(severity_str: str) -> float:
     mapping = {"Critical": 1.0, "High": 0.8, "Medium": 0.5, "Low": 0.2, "None": 0.0}
     return mapping.get(severity_str, 0.5)
 
-@router.post("/predict", response_model=DetectionResponse)
-@limiter.limit("10/minute")
-async def predict_disease(request: Request, file: UploadFile = File(...), expert_mode: bool = Query(False)):
+def scan_risk(confidence: float, severity: str, metrics: dict) -> tuple:
+    """(risk_index, disease_progression) of one scan, as the /risk rollups count it."""
+    lesion_density = metrics.get("lesion_density_percent", 0.0) / 100.0
+    risk_index = confidence * calculate_severity_factor(severity) * lesion_density * 100.0
+    if lesion_density > 0.4:
+        progression = "Advanced Stage"
+    elif lesion_density > 0.1:
+        progression = "Mid Stage"
+    elif lesion_density > 0.0:
+        progression = "Early Stage"
+    else:
+        progression = "None"
+    return risk_index, progression
+
+def _record_scan(detection: dict, field_id: str = None, region: str = None):
+    prediction = detection["prediction"]
+    risk_rollups.record(detection["risk_index"], prediction["crop"], prediction["disease"],
+                        detection["disease_progression"], field_id, region)
+
+# The last stage before the advisory: app/main.py runs the same scan and writes its own advisory
+scan_until = next(s.name for s in reversed(pipeline.stages) if s.name != "advise")
+
+async def run_scan(image_bytes: bytes, language: str, stop_after: str = None):
+    """
+    One single-image scan on `pipeline` (up to and including `stop_after`) under a new scan_id,
+    so /explain, /similar and /shadow see it. Rejections come back as StageRejected.
+    """
+    # Taken once: a model swapped in while this request runs does not affect it
+    bundle = model_registry.current
+    if bundle is None:
+        raise StageRejected("MODEL_ERROR", "Model not loaded.", status=503)
+    scan_id = f"scan_{uuid.uuid4().hex[:12]}"
+    return await pipeline.run({"image_bytes": image_bytes, "language": language, "model": bundle.model, "slot": inference_slot,
+                               "scan_id": scan_id, "bundle": bundle, "labels": bundle.labels}, stop_after)
+
+async def _predict_single(request: Request, file: UploadFile, expert_mode: bool, language: str = "en",
+                          field_id: str = None, region: str = None) -> dict:
+    """Runs one scan and returns a DetectionResponse-shaped dict (serialized without re-validation)."""
+    start_budget(settings.predict_budget_s)
     image_bytes = await validate_and_read_image(file)
         
     try:
-        # returns dict with "crop", "disease", "confidence", "top_k", "metrics"
-        prediction_result = await _run_inference_safely(image_bytes)
-        metrics = prediction_result.get("metrics", {})
-        
-        # 1. Fetch AI Analysis (Structured Template or Gemini)
-        if prediction_result["confidence"] < 0.60:
-             ai_analysis_result = {
-                 "disease_name": "Unknown",
-                 "severity": "Unknown",
-                 "cause": "Low confidence. Please capture a clearer image of the plant leaf.",
-                 "immediate_action": "Retake photo.",
-                 "treatment_plan": [],
-                 "prevention": "Ensure good lighting and focus.",
-                 "estimated_crop_loss_risk": "Unknown",
-                 "consult_expert": False
-             }
-        elif prediction_result["disease"].strip().lower() == "healthy":
-             ai_analysis_result = {
-                 "disease_name": "Healthy",
-                 "severity": "None",
-                 "cause": "The neural network indicates this plant is healthy.",
-                 "immediate_action": "None",
-                 "treatment_plan": [],
-                 "prevention": "Continue current watering and fertilizing schedules. Monitor for future anomalies.",
-                 "estimated_crop_loss_risk": "Low",
-                 "consult_expert": False
-             }
-        else:
-            ai_analysis_result = await get_ai_analysis(
-                crop=prediction_result["crop"],
-                disease=prediction_result["disease"],
-                confidence=prediction_result["confidence"]
-            )
-            # Ensure it is a dict
-            if isinstance(ai_analysis_result, dict) and "parse_error" in ai_analysis_result:
-                 ai_analysis_result = {
-                     "disease_name": prediction_result["disease"],
-                     "severity": "Medium",
-                     "cause": ai_analysis_result.get("raw_advice", "Failed to parse AI advice"),
-                     "immediate_action": "Monitor plant closely.",
-                     "treatment_plan": [],
-                     "prevention": "Maintain optimal growing conditions.",
-                     "estimated_crop_loss_risk": "Medium",
-                     "consult_expert": True
-                 }
-        
-        # 2. Decision Engine Calculations
-        model_conf = prediction_result["confidence"]
-        top_k = prediction_result.get("top_k", [])
-        top_2_conf = top_k[1]["confidence"] if len(top_k) > 1 else model_conf
-        confidence_gap = model_conf - top_2_conf
-        
-        lesion_density = metrics.get("lesion_density_percent", 0.0) / 100.0
-        texture_complexity = metrics.get("texture_complexity", 0.0)
-        
-        # New Final Decision Score Formula
-        final_decision_score = (model_conf * 0.6) + (confidence_gap * 0.1) + (lesion_density * 0.2) + (texture_complexity * 0.1)
-        # Scale to 0-100
-        final_decision_score = min(max(final_decision_score * 100.0, 0.0), 100.0)
-        
-        # Risk Index Calculation
-        severity_factor = calculate_severity_factor(ai_analysis_result.get("severity", "Medium"))
-        risk_index = model_conf * severity_factor * lesion_density * 100.0
-        
-        # Tier Assignment
-        if final_decision_score > 85:
-            tier = "Tier 1: High Confidence Diagnosis"
-        elif final_decision_score > 65:
-            tier = "Tier 2: Probable Diagnosis"
-        else:
-            tier = "Tier 3: Uncertain Diagnosis - Expert Review Advised"
-            
-        # Disease Progression
-        if lesion_density > 0.4:
-            progression = "Advanced Stage"
-        elif lesion_density > 0.1:
-            progression = "Mid Stage"
-        elif lesion_density > 0.0:
-            progression = "Early Stage"
-        else:
-            progression = "None"
-            
-        # Clean up expert fields if not expert_mode
-        if not expert_mode:
-             prediction_result["metrics"] = None
-             
-        # Mock Environmental Hook (If raining season -> +10 risk)
-        # Assuming location data hook here.
-        
-        return DetectionResponse(
-            scan_id=f"scan_{int(request.state.limiter._storage.storage.time() if hasattr(request.state.limiter._storage, 'storage') else 0)}", # Mock ID
-            prediction=Prediction(**prediction_result),
-            ai_analysis=AIAnalysis(**ai_analysis_result),
-            final_decision_score=round(final_decision_score, 2),
-            risk_index=round(risk_index, 2),
-            tier=tier,
-            disease_progression=progression
-        )
-        
+        ctx = await run_scan(image_bytes, language)
+        # dict with "crop", "disease", "confidence", "top_k", "metrics", "model_version"
+        prediction_result = _format_prediction(ctx["probs"], ctx["class_idx"], ctx["confidence"], ctx["metrics"], ctx["bundle"])
+        detection = await _build_detection(prediction_result, expert_mode, language, ai_analysis=ctx.get("ai_analysis"), scan_id=ctx["scan_id"])
+        _record_scan(detection, field_id, region)
+        return detection
+    except StageRejected as rejection:
+        raise rejection_to_http(rejection)
     except HTTPException as he:
         raise he
     except ValueError as ve:
-        return JSONResponse(status_code=400, content={"detail": str(ve)})
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         logger.error(f"Internal API Error: {e}")
         raise e
 
+async def _build_detection(prediction_result: dict, expert_mode: bool, language: str = "en", ai_analysis: dict = None, scan_id: str = None) -> dict:
+    """Decision engine on top of a model prediction; the advisory is looked up unless the pipeline already did."""
+    metrics = prediction_result.get("metrics", {})
+    
+    # 1. Fetch AI Analysis (Structured Template or Gemini)
+    ai_analysis_result = ai_analysis
+    if ai_analysis_result is None:
+        ai_analysis_result = await get_advisory(prediction_result["crop"], prediction_result["disease"],
+                                                prediction_result["confidence"], language)
+    
+    # 2. Decision Engine Calculations
+    model_conf = prediction_result["confidence"]
+    top_k = prediction_result.get("top_k", [])
+    top_2_conf = top_k[1]["confidence"] if len(top_k) > 1 else model_conf
+    confidence_gap = model_conf - top_2_conf
+    
+    lesion_density = metrics.get("lesion_density_percent", 0.0) / 100.0
+    texture_complexity = metrics.get("texture_complexity", 0.0)
+    
+    # New Final Decision Score Formula
+    final_decision_score = (model_conf * 0.6) + (confidence_gap * 0.1) + (lesion_density * 0.2) + (texture_complexity * 0.1)
+    # Scale to 0-100
+    final_decision_score = min(max(final_decision_score * 100.0, 0.0), 100.0)
+    
+    # Risk Index and Disease Progression
+    risk_index, progression = scan_risk(model_conf, ai_analysis_result.get("severity", "Medium"), metrics)
+    
+    # Tier Assignment
+    if final_decision_score > 85:
+        tier = "Tier 1: High Confidence Diagnosis"
+    elif final_decision_score > 65:
+        tier = "Tier 2: Probable Diagnosis"
+    else:
+        tier = "Tier 3: Uncertain Diagnosis - Expert Review Advised"
+        
+    # Clean up expert fields if not expert_mode
+    if not expert_mode:
+         prediction_result["metrics"] = None
+         
+    log_event(logger, "prediction", crop=prediction_result["crop"], disease=prediction_result["disease"],
+              confidence=round(model_conf, 4), tier=tier, risk_index=round(risk_index, 2))
+
+    # Mock Environmental Hook (If raining season -> +10 risk)
+    # Assuming location data hook here.
+    
+    return {
+        "scan_id": scan_id or f"scan_{uuid.uuid4().hex[:12]}",
+        "prediction": prediction_result,
+        "ai_analysis": ai_analysis_result,
+        "final_decision_score": round(final_decision_score, 2),
+        "risk_index": round(risk_index, 2),
+        "tier": tier,
+        "disease_progression": progression
+    }
+
 @router.post("/predict/batch", response_model=BatchDetectionResponse)
 @limiter.limit("5/minute")
-async def predict_disease_batch(request: Request, files: list[UploadFile] = File(...), expert_mode: bool = Query(False)):
+@limiter.limit(API_PREDICT_RATE, scope="api_predict", cost=lambda kwargs: len(kwargs["files"]))  # Each file counts against the router's scan budget
+async def predict_disease_batch(request: Request, files: list[UploadFile] = File(...), expert_mode: bool = Query(False),
+                                field_id: str = Query(None, max_length=64), region: str = Query(None, max_length=64)):
     results = []
     total_risk = 0.0
-    for file in files:
-        # Re-use single predict logic (mocked up as a direct call for simplicity)
-        res = await predict_disease(request, file, expert_mode)
-        results.append(res)
-        total_risk += res.risk_index if res.risk_index else 0.0
+    # Batch inferences queue behind interactive single-image requests
+    priority_token = inference_priority.set(PRIORITY_BATCH)
+    try:
+        for file in files:
+            # Re-use single predict logic (mocked up as a direct call for simplicity)
+            res = await _predict_single(request, file, expert_mode, field_id=field_id, region=region)
+            results.append(res)
+            total_risk += res["risk_index"] or 0.0
+    finally:
+        inference_priority.reset(priority_token)
         
     avg_risk = total_risk / len(files) if files else 0.0
     directive = "Immediate field-wide action required." if avg_risk > 50 else "Monitor field conditions."
+    batch_id = f"batch_{uuid.uuid4().hex[:8]}"
+    scan_tensors.group(batch_id, [r["scan_id"] for r in results])
     
-    import uuid
-    return BatchDetectionResponse(
-        batch_id=f"batch_{uuid.uuid4().hex[:8]}",
-        results=results,
-        overall_risk_index=round(avg_risk, 2),
-        summary_directive=directive
+    return negotiate(request, {
+        "batch_id": batch_id,
+        "results": results,
+        "overall_risk_index": round(avg_risk, 2),
+        "summary_directive": directive
+    })
+
+@router.post("/predict/field", response_model=FieldDetectionResponse)
+async def predict_field(request: Request, file: UploadFile = File(...), expert_mode: bool = Query(False),
+                        field_id: str = Query(None, max_length=64), region: str = Query(None, max_length=64)):
+    """
+    Wide photos of a crop row: scores overlapping leaf-sized tiles in one forward pass
+    instead of squashing the whole frame into a single model input.
+    """
+    image_bytes = await validate_and_read_image(file)
+    # A field costs at least one scan; a client out of budget is turned away before any decoding or tiling
+    identity = get_remote_address(request)
+    await limiter.hit("api_predict", identity, API_PREDICT_RATE)
+    try:
+        image = await run_in_threadpool(decode_image, image_bytes)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    is_plant, _, reason, scores = await run_in_threadpool(validate_plant_presence, image)
+    if not is_plant:
+        raise HTTPException(status_code=422, detail={"detail": reason, "code": "NOT_A_PLANT", "validator_scores": scores})
+
+    batch, records, tiling = await run_in_threadpool(
+        prepare_field_tiles, image, settings.field_tile_px, settings.field_tile_overlap,
+        settings.field_min_plant_ratio, settings.field_max_tiles, settings.model_input_size
     )
+    if not records:
+        raise HTTPException(status_code=422, detail={
+            "detail": "No sharp leaf area found in the photo. Move closer or hold the camera steady.",
+            "code": "NO_LEAF_TILES", "validator_scores": tiling
+        })
+    # Tiles skip TTA, so three tiles cost about as much as one /predict scan; the rest is charged before the model runs
+    extra = math.ceil(len(records) / 3) - 1
+    if extra > 0:
+        await limiter.hit("api_predict", identity, API_PREDICT_RATE, cost=extra)
+
+    priority_token = inference_priority.set(PRIORITY_BATCH)
+    try:
+        predictions = await _infer_batch(batch, [r["metrics"] for r in records], tta=False)
+    finally:
+        inference_priority.reset(priority_token)
+
+    verdict = aggregate_field(predictions, records)
+    # Advisory for the field is fetched once, for the tile that best represents the verdict
+    detection = await _build_detection(dict(predictions[verdict["representative_tile"]]), expert_mode)
+    severity_factor = calculate_severity_factor(detection["ai_analysis"].get("severity", "Medium"))
+    risk_index = round(verdict["lesion_load"] * severity_factor * 100.0, 2)
+
+    tiles = []
+    for record, prediction in zip(records, predictions):
+        tiles.append({
+            "box": record["box"],
+            "plant_coverage": record["plant_coverage"],
+            "prediction": {**prediction, "metrics": prediction["metrics"] if expert_mode else None}
+        })
+    log_event(logger, "field_prediction", crop=verdict["crop"], disease=verdict["disease"],
+              tiles=len(tiles), diseased_tiles=verdict["diseased_tiles"], risk_index=risk_index)
+    risk_rollups.record(risk_index, verdict["crop"], verdict["disease"], detection["disease_progression"], field_id, region)
+
+    return negotiate(request, {
+        "scan_id": detection["scan_id"],
+        "field_verdict": verdict,
+        "ai_analysis": detection["ai_analysis"],
+        "risk_index": risk_index,
+        "tier": detection["tier"],
+        "disease_progression": detection["disease_progression"],
+        "model_version": predictions[0]["model_version"],
+        "tiles": tiles,
+        "tiling": tiling
+    })
+
+@router.post("/predict/tensor")
+async def predict_tensor(request: Request, expert_mode: bool = Query(False),
+                         field_id: str = Query(None, max_length=64), region: str = Query(None, max_length=64)):
+    """
+    Edge clients that already resize on-device send a raw NHWC tensor (see
+    app/utils/tensor_codec.py) instead of a JPEG, skipping decode and resize here.
+    """
+    # A body the limiter could never admit is refused before it is read
+    max_count = min(settings.tensor_batch_max, int(parse_rate(API_PREDICT_RATE)[0]))
+    max_bytes = HEADER.size + max_count * settings.model_input_size ** 2 * 3 * 2
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise HTTPException(status_code=413, detail={"detail": "Tensor upload too large.", "code": "FILE_TOO_LARGE"})
+    # Content-Length is optional (chunked uploads), so the body itself is capped while it streams in
+    body = await read_tensor_body(request.stream(), settings.model_input_size, max_count)
+    images, _ = decode_tensor_upload(body, settings.model_input_size, max_count)
+    count = images.shape[0]
+    # Same budget as /predict: every tensor in the body counts as one scan
+    await limiter.hit("api_predict", get_remote_address(request), API_PREDICT_RATE, cost=count)
+
+    priority_token = inference_priority.set(PRIORITY_BATCH if count > 1 else inference_priority.get())
+    try:
+        batch, metrics_list = await run_in_threadpool(preprocess_tensors, images)
+        predictions = await _infer_batch(batch, metrics_list)
+        results = [await _build_detection(p, expert_mode) for p in predictions]
+        for detection in results:
+            _record_scan(detection, field_id, region)
+    except HTTPException as he:
+        raise he
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    finally:
+        inference_priority.reset(priority_token)
+
+    if count == 1:
+        return negotiate(request, results[0])
+    avg_risk = sum(r["risk_index"] for r in results) / count
+    return negotiate(request, {
+        "batch_id": f"batch_{uuid.uuid4().hex[:8]}",
+        "results": results,
+        "overall_risk_index": round(avg_risk, 2),
+        "summary_directive": "Immediate field-wide action required." if avg_risk > 50 else "Monitor field conditions."
+    })
+
+def _prepare_live_frame(frame: bytes):
+    """Decode, blur gate and hash. Returns (image, blur_score, frame_hash); image is None for blurry frames."""
+    image = decode_image(frame)
+    blur_score = compute_blur_score(image)
+    if blur_score < 50.0:
+        return None, blur_score, None
+    return image, blur_score, dhash(image)
+
+def _prepare_live_tensor(image, blur_score: float):
+    """OOD check and model input on the resized frame. Returns (tensor, metrics, rejection)."""
+    size = settings.model_input_size
+    small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    is_plant, _, reason, _ = validate_plant_presence(small)
+    if not is_plant:
+        return None, None, {"code": "NOT_A_PLANT", "detail": reason}
+    metrics = {**quick_leaf_metrics(small), "blur_score": round(blur_score, 2)}
+    return resize_and_normalize(image, size)[0], metrics, None
+
+async def _read_live_frames(websocket: WebSocket, session: LiveScanSession) -> bool:
+    """Reader half of a live session: only ever keeps the newest frame. Returns False on disconnect."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return False
+        if message.get("bytes") is not None:
+            if len(message["bytes"]) > settings.live_scan_max_frame_bytes:
+                session.stats["frames_oversized"] += 1
+                continue
+            session.slot.put(message["bytes"])
+        elif message.get("text") is not None:
+            try:
+                control = json.loads(message["text"])
+            except ValueError:
+                continue
+            if isinstance(control, dict) and control.get("type") == "end":
+                return True
+
+@router.websocket("/ws/scan")
+async def live_scan(websocket: WebSocket, expert_mode: bool = False):
+    """
+    Live camera scanning. The client sends JPEG frames as binary messages (and optionally
+    {"type": "end"}); the server answers per processed frame with a JSON message of type
+    "result", "duplicate", "rejected" or "busy", and a final "summary".
+    """
+    global live_sessions
+    if live_sessions >= settings.live_scan_max_sessions:
+        await websocket.close(code=1013)  # Try again later
+        return
+    # Counted before the first await, so concurrent handshakes cannot all pass the check
+    live_sessions += 1
+    session, reader = LiveScanSession(settings.live_scan_max_fps), None
+
+    async def send(message: dict):
+        await websocket.send_text(dumps(message).decode())
+
+    try:
+        await websocket.accept()
+        reader = asyncio.create_task(_read_live_frames(websocket, session))
+        while True:
+            await session.pace()
+            take = asyncio.create_task(session.slot.take())
+            await asyncio.wait({take, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not take.done():
+                take.cancel()
+                break
+            frame, frame_no, started = take.result(), session.slot.received, time.perf_counter()
+
+            try:
+                image, blur_score, frame_hash = await run_in_threadpool(_prepare_live_frame, frame)
+            except ValueError:
+                session.stats["frames_invalid"] += 1
+                await send({"type": "rejected", "frame": frame_no, "code": "INVALID_FORMAT", "detail": "Frame is not a decodable image."})
+                continue
+            if image is None:
+                session.stats["frames_blurry"] += 1
+                await send({"type": "rejected", "frame": frame_no, "code": "IMAGE_TOO_BLURRY", "blur_score": round(blur_score, 2)})
+                continue
+
+            model_version = model_registry.current.version if model_registry.current else None
+            cached = session.deduper.lookup(frame_hash, model_version)
+            if cached is not None:
+                session.stats["frames_duplicate"] += 1
+                await send({"type": "duplicate", "frame": frame_no, **cached})
+                continue
+
+            tensor, metrics, rejection = await run_in_threadpool(_prepare_live_tensor, image, blur_score)
+            if rejection is not None:
+                session.stats["frames_rejected"] += 1
+                session.deduper.add(frame_hash, {"rejected": rejection}, model_version)
+                await send({"type": "rejected", "frame": frame_no, **rejection})
+                continue
+
+            try:
+                prediction = await live_batcher.submit(tensor, metrics)
+            except HTTPException as he:
+                session.stats["frames_busy"] += 1
+                await send({"type": "busy", "frame": frame_no, "retry_after": (he.headers or {}).get("Retry-After")})
+                continue
+
+            if not expert_mode:
+                prediction = {**prediction, "metrics": None}
+            session.stats["frames_scored"] += 1
+            session.record(prediction)
+            session.deduper.add(frame_hash, {"prediction": prediction}, prediction["model_version"])
+            await send({
+                "type": "result",
+                "frame": frame_no,
+                "prediction": prediction,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "summary": session.summary()
+            })
+
+        if reader.result():
+            await send({"type": "summary", **session.summary()})
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if reader is not None:
+            reader.cancel()
+        live_sessions -= 1
+        log_event(logger, "live_scan", **session.summary())
+
+def _explain_state(scan_id: str) -> dict:
+    try:
+        state = explainer.request(scan_id)
+    except ExplainQueueFull:
+        raise HTTPException(status_code=503, detail={"detail": "Explanation queue is full. Please retry.", "code": "SERVER_BUSY"},
+                            headers={"Retry-After": "5"})
+    return state or {"status": "not_found", "scan_id": scan_id}
+
+@router.get("/explain/heatmaps/{name}")
+async def explain_heatmap(name: str):
+    digest = name.removesuffix(".png")
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise HTTPException(status_code=404, detail={"detail": "Unknown heatmap.", "code": "NOT_FOUND"})
+    path = explainer.store.path(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail={"detail": "Unknown heatmap.", "code": "NOT_FOUND"})
+    # Content-addressed: the bytes behind a name never change
+    return FileResponse(path, media_type="image/png", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@router.get("/explain/batch/{batch_id}")
+async def explain_batch(batch_id: str):
+    """Heatmaps for every scan of a /predict/batch job; 202 until all of them are done."""
+    scan_ids = scan_tensors.members(batch_id)
+    if scan_ids is None:
+        raise HTTPException(status_code=404, detail={"detail": "Batch not found or no longer cached.", "code": "SCAN_NOT_CACHED"})
+    results = [_explain_state(scan_id) for scan_id in scan_ids]
+    pending = any(r["status"] in ("queued", "running") for r in results)
+    return JSONResponse(status_code=202 if pending else 200, headers={"Retry-After": "1"} if pending else None,
+                        content={"batch_id": batch_id, "status": "pending" if pending else "done", "results": results})
+
+@router.get("/explain/{scan_id}")
+async def explain_scan(scan_id: str):
+    """
+    Where the model looked for a /predict scan, as a heatmap overlay on the model input.
+    Computed lazily by a background worker from the scan's cached input: the first call
+    queues it and answers 202; poll until 200 and fetch heatmap_url.
+    """
+    state = _explain_state(scan_id)
+    if state["status"] == "not_found":
+        raise HTTPException(status_code=404, detail={"detail": "Scan not found or no longer cached.", "code": "SCAN_NOT_CACHED"})
+    pending = state["status"] in ("queued", "running")
+    return JSONResponse(status_code=202 if pending else 200, content=state, headers={"Retry-After": "1"} if pending else None)
+
+@router.get("/similar/{scan_id}")
+async def similar_scans(scan_id: str, k: int = Query(5, ge=1, le=50), confirmed_only: bool = Query(True)):
+    """
+    Past scans that look most like this one, best first, with their diagnoses (the confirmed
+    one where there is one). By default only scans with a confirmed diagnosis are returned.
+    """
+    case = await run_in_threadpool(similar_cases.case, scan_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail={"detail": "Scan not indexed. New scans become searchable within a few seconds.",
+                                                     "code": "SCAN_NOT_INDEXED"})
+    embedding, version = case
+    bundle = model_registry.get(similar_cases.version)
+    if version != similar_cases.version or bundle is None:
+        raise HTTPException(status_code=409, detail={"detail": f"Scan was scored by model version {version}; similar cases are only "
+                                                               f"searched among scans of the active version.", "code": "MODEL_VERSION_CHANGED"})
+    cases = await run_in_threadpool(similar_cases.similar, embedding, k, confirmed_only, scan_id)
+    for case in cases:
+        case["crop"], case["disease"] = split_label(label_for(bundle.labels, case["class_idx"]))
+    return {"scan_id": scan_id, "model_version": version, "confirmed_only": confirmed_only, "cases": cases}
+
+@router.post("/similar/{scan_id}/confirm")
+async def confirm_scan(scan_id: str, class_idx: int = Query(..., ge=0)):
+    """Records the diagnosis an expert confirmed for a scan, for similar-case answers and the kNN signal."""
+    if model_registry.current is None:
+        raise HTTPException(status_code=503, detail={"detail": "Model not loaded.", "code": "MODEL_ERROR"})
+    labels = model_registry.current.labels
+    if class_idx >= len(labels):
+        raise HTTPException(status_code=400, detail={"detail": f"class_idx must be below {len(labels)}.", "code": "INVALID_LABEL"})
+    if not await run_in_threadpool(similar_cases.confirm, scan_id, class_idx):
+        raise HTTPException(status_code=404, detail={"detail": "Scan not indexed. New scans become searchable within a few seconds.",
+                                                     "code": "SCAN_NOT_INDEXED"})
+    crop, disease = split_label(label_for(labels, class_idx))
+    return {"scan_id": scan_id, "class_idx": class_idx, "crop": crop, "disease": disease, "confirmed": True}
+
+@router.get("/shadow")
+async def shadow_report():
+    """
+    How the candidate model (SHADOW_MODEL_PATH) compares with the primary on mirrored live
+    scans: agreement, confidence deltas and latency, overall and per primary class.
+    """
+    if shadow is None:
+        return {"enabled": False, "detail": "Set SHADOW_MODEL_PATH to a candidate model to evaluate it on live traffic."}
+    return {"enabled": True, "candidate": settings.shadow_model_path, **shadow.report()}
+
+def _require_admin(token: str):
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail={"detail": "Model administration is disabled. Set ADMIN_TOKEN to enable it.",
+                                                     "code": "ADMIN_DISABLED"})
+    if not token or not hmac.compare_digest(token.encode(), settings.admin_token.encode()):
+        raise HTTPException(status_code=401, detail={"detail": "Missing or invalid X-Admin-Token.", "code": "UNAUTHORIZED"})
+
+def _model_change(start) -> JSONResponse:
+    try:
+        state = start()
+    except ModelRegistryError as e:
+        raise HTTPException(status_code=e.status, detail={"detail": e.message, "code": e.code})
+    return JSONResponse(status_code=202 if state["status"] == "loading" else 200, content=state)
+
+@router.get("/models")
+async def list_models():
+    """Model versions in the registry, the active one, and any still loading or draining."""
+    return model_registry.describe()
+
+@router.post("/models/{version}/activate")
+async def activate_model(version: str, x_admin_token: str = Header(None)):
+    """
+    Loads and warms `version` in the background (202), then swaps it in for new requests while
+    in-flight ones finish on the old model. Every worker follows within MODEL_REGISTRY_POLL_S.
+    Poll GET /models: the swap is done when "version" changes; a failed load shows in "last_error".
+    """
+    _require_admin(x_admin_token)
+    return _model_change(lambda: model_registry.activate(version))
+
+@router.post("/models/rollback")
+async def rollback_model(x_admin_token: str = Header(None)):
+    """Re-activates the version that was active before the current one, the same way as activate."""
+    _require_admin(x_admin_token)
+    return _model_change(model_registry.rollback)
+
+def _risk_dimension(dimension: str):
+    if dimension not in DIMENSIONS:
+        raise HTTPException(status_code=404, detail={"detail": f"Unknown dimension. Use one of: {', '.join(DIMENSIONS)}.", "code": "NOT_FOUND"})
+
+@router.get("/risk/{dimension}")
+async def risk_ranking(dimension: str, days: int = Query(30, ge=1, le=366), limit: int = Query(50, ge=1, le=500)):
+    """Every field / crop / region seen in the window, highest mean risk first, with its trend."""
+    _risk_dimension(dimension)
+    keys = await run_in_threadpool(risk_rollups.ranking, dimension, days, limit, settings.rollup_trend_threshold)
+    return {"dimension": dimension, "days": days, "keys": keys}
+
+@router.get("/risk/{dimension}/{key}")
+async def risk_series(dimension: str, key: str, days: int = Query(30, ge=1, le=366), bucket_days: int = Query(1, ge=1, le=31)):
+    """Risk summary, disease and progression counts, per-bucket series and trend of one field / crop / region."""
+    _risk_dimension(dimension)
+    buckets_per_point = max(1, bucket_days * 86400 // settings.rollup_bucket_s)
+    result = await run_in_threadpool(risk_rollups.series, dimension, key, days, buckets_per_point, settings.rollup_trend_threshold)
+    if not result["summary"]["scans"]:
+        raise HTTPException(status_code=404, detail={"detail": "No scans recorded for this key in the window.", "code": "NOT_FOUND"})
+    return result
 
 @router.get("/scan/history")
-async def get_scan_history(request: Request):
-    # Mocked History
-    return {
-        "scans": [
-            {"scan_id": "scan_12345", "date": "2023-10-01", "disease": "Early Blight", "risk_index": 72.5, "trend": "worsening"},
-            {"scan_id": "scan_12340", "date": "2023-09-25", "disease": "Early Blight", "risk_index": 45.0, "trend": "stable"}
-        ]
-    }
+async def get_scan_history(request: Request, field_id: str = Query(None, max_length=64), days: int = Query(30, ge=1, le=366)):
+    """Per-day history of one field (or of every scan), newest first; trend compares each day with the one before."""
+    dimension, key = ("field", field_id) if field_id else ("all", "all")
+    series = (await run_in_threadpool(risk_rollups.series, dimension, key, days))["series"]
+    scans, previous = [], None
+    for point in series:
+        trend = "stable"
+        if previous is not None and abs(point["risk_mean"] - previous) > settings.rollup_trend_threshold:
+            trend = "worsening" if point["risk_mean"] > previous else "improving"
+        scans.append({"date": point["date"][:10], "scans": point["scans"], "disease": point["top_disease"],
+                      "risk_index": point["risk_mean"], "trend": trend})
+        previous = point["risk_mean"]
+    return {"scans": scans[::-1]}
 
 @router.get("/export/pdf/{scan_id}")
 async def export_pdf_report(scan_id: str):
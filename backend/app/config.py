@@ -2,9 +2,100 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     gemini_api_key: str = "your_google_gemini_api_key_here"
+    gemini_api_base: str = ""  # e.g. http://127.0.0.1:8089/v1beta for tools/fake_gemini.py
     model_path: str = "models/plant_disease_model.h5"
     labels_path: str = "models/class_labels.json"
+    model_input_size: int = 224  # Distilled students may be served at 96/128 px (see calibration_metrics.json)
     frontend_url: str = "http://localhost:3000"
+    advisory_bundle_path: str = "models/advisory_bundle.lsab"  # Built by tools/build_advisory_bundle.py
+    cascade_head_path: str = "models/cascade_head.npz"
+    cascade_enabled: bool = True
+    centroids_path: str = "models/class_centroids.npy"  # Memory-mapped; without it, fixed pseudo-random centroids
+    # private: each worker loads the Keras model | mmap: workers share the weights of the .tflite export (see app/core/shared_weights.py)
+    model_sharing: str = "private"
+    # Versioned model registry with hot swap and rollback (see app/core/model_registry.py)
+    model_registry_dir: str = "models/registry"  # Empty or no active.json: MODEL_PATH / LABELS_PATH, as version "base"
+    model_registry_poll_s: float = 5.0  # How often each worker checks active.json for a version another worker activated
+    admin_token: str = ""  # X-Admin-Token for the /models admin endpoints; empty disables them
+    # POST /predict/field: overlapping leaf-sized tiles of a wide photo (see app/core/tiling.py)
+    field_tile_px: int = 512
+    field_tile_overlap: float = 0.25
+    field_min_plant_ratio: float = 0.2
+    field_max_tiles: int = 24
+    tensor_batch_max: int = 10  # Max images per POST /predict/tensor body (see app/utils/tensor_codec.py); at most the api_predict limit
+    # WebSocket /ws/scan (see app/core/live_scan.py)
+    live_scan_max_fps: float = 4.0
+    live_scan_max_sessions: int = 64
+    live_scan_max_frame_bytes: int = 512 * 1024
+    live_scan_batch_max: int = 8
+    live_scan_batch_wait_ms: float = 20.0
+    # Adaptive admission control for inference (see app/core/admission.py)
+    admission_initial_limit: int = 1
+    admission_min_limit: int = 1
+    admission_max_limit: int = 4
+    admission_target_latency_s: float = 2.0
+    admission_max_queue_wait_s: float = 12.0
+    # Worker / thread sizing from detected cores and cgroup quota (see app/core/runtime.py)
+    runtime_profile: str = "latency"  # latency | throughput
+    runtime_workers: int = 0  # 0 = derived from the profile
+    runtime_max_workers: int = 4  # Each worker holds its own copy of the model
+    runtime_pin_cores: bool = False
+    # End-to-end budget for single-image /predict; the advisory call only gets what is left (see app/core/deadline.py)
+    predict_budget_s: float = 10.0
+    advisory_min_budget_s: float = 1.0  # Less than this left: answer from the fallback instead of the LLM
+    # Circuit breaker around the Gemini advisory call (see app/core/circuit_breaker.py)
+    advisory_breaker_window_s: float = 60.0
+    advisory_breaker_min_calls: int = 10
+    advisory_breaker_failure_rate: float = 0.5
+    advisory_breaker_slow_call_s: float = 5.0
+    advisory_breaker_slow_rate: float = 0.8
+    advisory_breaker_open_s: float = 30.0
+    buffer_pool_idle: int = 4  # Preprocessing buffer sets kept between requests (see app/utils/buffer_pool.py)
+    # Prediction stage graph (see app/core/pipeline.py). Overrides swap or skip stages, e.g. "calibrate=none,validate=histogram"
+    pipeline_profile: str = "production"  # Every single-image scan (app/main.py and the app/api router) and leafsense.py
+    pipeline_overrides: str = ""
+    # Expert-mode explanation heatmaps, computed in the background (see app/core/explain.py)
+    explain_cache_mb: int = 64  # Model inputs of recent scans kept per worker; ~150 KB each at 224 px
+    explain_dir: str = "data/heatmaps"  # Content-addressed overlay PNGs
+    explain_batch_max: int = 8
+    explain_queue_max: int = 256
+    # Field / crop / region risk rollups, one SQLite file shared by the workers of a host (see app/core/rollups.py)
+    rollup_db_path: str = "data/rollups.sqlite3"
+    rollup_bucket_s: int = 86400
+    rollup_flush_interval_s: float = 2.0
+    rollup_trend_threshold: float = 5.0  # Risk-index points over the window before a trend is worsening / improving
+    # Similar past cases: IVF index over scan embeddings, logged to one SQLite file per host (see app/core/similar_cases.py)
+    cases_db_path: str = "data/cases.sqlite3"
+    ann_code_dim: int = 256  # PCA dims kept per int8 code; ~270 MB per million scans per worker at 256
+    ann_nlist: int = 1024
+    ann_nprobe: int = 16
+    ann_train_min: int = 20000  # Exhaustive search below this many scans
+    ann_flush_interval_s: float = 2.0
+    # Input / prediction drift against the baseline evaluate_model.py saves (see app/core/drift.py)
+    drift_baseline_path: str = "models/drift_baseline.json"  # Suffixed per pipeline profile: drift_baseline_<profile>.json
+    drift_window_s: float = 3600.0
+    drift_min_samples: int = 200  # Fewer scans in a window: insufficient_data instead of a score
+    # Shadow evaluation of a candidate model on mirrored live scans (see app/core/shadow.py)
+    shadow_model_path: str = ""  # Empty: disabled
+    shadow_sample_rate: float = 0.1
+    shadow_batch_max: int = 8
+    shadow_queue_max: int = 64
+    shadow_max_age_s: float = 30.0  # Mirrored scans still waiting for spare capacity after this are dropped
+    # Accepted uploads kept for retraining: content-addressed files plus a SQLite manifest (see app/core/archive.py)
+    archive_dir: str = ""  # Empty: disabled, e.g. data/archive
+    archive_max_side: int = 1024  # Longer side above this: downscaled and re-encoded as JPEG; 0 keeps every upload as sent
+    archive_jpeg_quality: int = 90
+    archive_queue_mb: float = 32.0  # Uploads waiting to be written, per worker; past this new ones are dropped
+    archive_batch_max: int = 32
+    # memory:// (per worker) | mmap:///path/buckets.bin (per host) | redis://host:6379/0 (cluster)
+    rate_limit_storage: str = "memory://"
+    # Structured JSON-lines logging (see app/utils/structured_logging.py)
+    log_dir: str = "logs"
+    log_level: str = "INFO"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_tail_sampling: bool = True
+    log_slow_request_ms: float = 2000.0
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,153 @@
+import asyncio
+import math
+import time
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_SINGLE = 0
+PRIORITY_BATCH = 1
+
+# Set by endpoints that fan out into many inferences (e.g. /predict/batch) so that
+# nested calls queue behind interactive single-image requests.
+inference_priority: ContextVar[int] = ContextVar("inference_priority", default=PRIORITY_SINGLE)
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Server overloaded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Adaptive concurrency limiter for model inference.
+
+    The limit follows AIMD on observed service time: it grows by ~1 per window while
+    service time stays under `target_latency_s` and shrinks multiplicatively when it
+    does not. Requests whose estimated queue wait (from an EWMA of service times)
+    exceeds their deadline are rejected immediately instead of waiting to time out.
+    Waiters are woken strictly by priority, then FIFO.
+    """
+
+    def __init__(self, initial_limit: int = 1, min_limit: int = 1, max_limit: int = 8,
+                 target_latency_s: float = 2.0, max_queue_wait_s: float = 12.0,
+                 decrease_factor: float = 0.8, ewma_alpha: float = 0.2):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency_s = target_latency_s
+        self.max_queue_wait_s = max_queue_wait_s
+        self.decrease_factor = decrease_factor
+        self.ewma_alpha = ewma_alpha
+        self.ewma_service_s = target_latency_s / 2
+        self.in_flight = 0
+        self._waiters = {PRIORITY_SINGLE: deque(), PRIORITY_BATCH: deque()}
+        self._last_decrease = 0.0
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    @property
+    def _slots(self) -> int:
+        return max(int(self.limit), self.min_limit)
+
+    def _queued_ahead(self, priority: int) -> int:
+        return sum(len(q) for p, q in self._waiters.items() if p <= priority)
+
+    def estimate_wait(self, priority: int = PRIORITY_SINGLE) -> float:
+        """Expected seconds until a new request at `priority` would start."""
+        backlog = self._queued_ahead(priority) + max(self.in_flight - self._slots, 0)
+        if self.in_flight < self._slots and backlog == 0:
+            return 0.0
+        rounds = math.ceil((backlog + 1) / self._slots)
+        return rounds * self.ewma_service_s
+
+    async def acquire(self, priority: int = PRIORITY_SINGLE, deadline: Optional[float] = None):
+        budget = self.max_queue_wait_s if deadline is None else min(deadline - time.monotonic(), self.max_queue_wait_s)
+
+        if self.in_flight < self._slots and self._queued_ahead(priority) == 0:
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return
+
+        estimated = self.estimate_wait(priority)
+        if estimated > budget:
+            self._stats["rejected"] += 1
+            raise Overloaded(retry_after=estimated)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(fut)
+        try:
+            await asyncio.wait_for(fut, timeout=max(budget, 0.0))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # Slot was handed over just as we gave up; pass it on.
+                self.in_flight -= 1
+                self._wake_waiters()
+            else:
+                try:
+                    self._waiters[priority].remove(fut)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._stats["timed_out"] += 1
+            raise Overloaded(retry_after=self.estimate_wait(priority))
+        self._stats["admitted"] += 1
+
+    def try_acquire(self) -> bool:
+        """A slot only if one is free and nobody is waiting; for optional work that is dropped under load."""
+        if self.in_flight < self._slots and not any(self._waiters.values()):
+            self.in_flight += 1
+            return True
+        return False
+
+    def release(self, service_time_s: Optional[float] = None):
+        """`service_time_s` None: the slot served work that should not steer the limit (e.g. shadow inference)."""
+        self.in_flight -= 1
+        if service_time_s is None:
+            self._wake_waiters()
+            return
+        self.ewma_service_s += self.ewma_alpha * (service_time_s - self.ewma_service_s)
+
+        now = time.monotonic()
+        if service_time_s > self.target_latency_s:
+            # Decrease at most once per service time so one slow burst doesn't collapse the limit
+            if now - self._last_decrease > self.ewma_service_s:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        for priority in sorted(self._waiters):
+            queue = self._waiters[priority]
+            while queue and self.in_flight < self._slots:
+                fut = queue.popleft()
+                if fut.done():
+                    continue
+                self.in_flight += 1
+                fut.set_result(True)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None, deadline: Optional[float] = None):
+        if priority is None:
+            priority = inference_priority.get()
+        await self.acquire(priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": {"single": len(self._waiters[PRIORITY_SINGLE]), "batch": len(self._waiters[PRIORITY_BATCH])},
+            "ewma_service_ms": round(self.ewma_service_s * 1000, 1),
+            **self._stats
+        }
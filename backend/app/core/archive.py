@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional, Tuple
+import cv2
+import numpy as np
+from app.core.model_registry import BASE_VERSION
+from app.core.stages import label_for
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.sqlite3"
+OBJECTS = "objects"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload (
+    sha256 TEXT PRIMARY KEY,  -- Of the bytes as uploaded; the stored file may be a re-encode
+    path TEXT NOT NULL,  -- Relative to the archive directory
+    bytes INTEGER NOT NULL, width INTEGER NOT NULL, height INTEGER NOT NULL,
+    label TEXT NOT NULL, class_idx INTEGER NOT NULL, confidence REAL NOT NULL, model_version TEXT NOT NULL,
+    validation TEXT NOT NULL,  -- JSON validator scores
+    metrics TEXT NOT NULL,  -- JSON image metrics (blur score, ...)
+    scan_id TEXT, first_seen REAL NOT NULL, last_seen REAL NOT NULL, seen INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS upload_by_label ON upload (label, confidence);
+CREATE INDEX IF NOT EXISTS upload_by_version ON upload (model_version);
+"""
+
+class Upload(NamedTuple):
+    data: bytes
+    width: int
+    height: int
+    label: str
+    class_idx: int
+    confidence: float
+    model_version: str
+    validation: dict
+    metrics: dict
+    scan_id: Optional[str]
+    ts: float
+
+def _extension(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
+class UploadArchive:
+    """
+    Accepted uploads, kept for retraining under `root`: one file per distinct image in
+    objects/<aa>/<sha256>.<ext>, and one manifest row per image in manifest.sqlite3 with the
+    prediction, validator scores and model version (see read_manifest()).
+
+    As a pipeline observer it only appends a reference to the upload's bytes to a queue, so the
+    request pays no hashing, encoding or I/O. A background task writes the queue in batches on a
+    thread. The queue is bounded by `queue_mb`: past that, new uploads are dropped and counted
+    instead of waiting. Uploads already in the archive (same bytes, from any worker) only bump
+    `seen`. Images with a longer side above `max_side` are downscaled and re-encoded as JPEG;
+    the rest are kept byte for byte.
+    """
+
+    def __init__(self, root: str, max_side: int = 1024, jpeg_quality: int = 90, queue_mb: float = 32.0,
+                 batch_max: int = 32, run_blocking: Callable = None, clock: Callable[[], float] = time.time):
+        self.root = root
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.queue_bytes_max = int(queue_mb * 2**20)
+        self.batch_max = batch_max
+        self.run_blocking = run_blocking or asyncio.to_thread
+        self._clock = clock
+        self._queue: deque = deque()
+        self._queued_bytes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.stats = {"queued": 0, "archived": 0, "duplicates": 0, "reencoded": 0, "dropped_backpressure": 0,
+                      "failed": 0, "bytes_written": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.root, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.root, MANIFEST), check_same_thread=False, timeout=10.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def observe(self, ctx, error: Optional[BaseException] = None):
+        """Pipeline observer: queues completed scans; rejected and failed ones are not archived."""
+        if error is not None or "class_idx" not in ctx or "image_bytes" not in ctx:
+            return
+        data = ctx["image_bytes"]
+        if self._queued_bytes + len(data) > self.queue_bytes_max:
+            self.stats["dropped_backpressure"] += 1
+            return
+        height, width = ctx["image"].shape[:2] if "image" in ctx else (0, 0)
+        labels = ctx["labels"] if "labels" in ctx else ctx.params.get("labels", {})
+        bundle = ctx.get("bundle")
+        self._queue.append(Upload(
+            data, width, height, label_for(labels, ctx["class_idx"]), int(ctx["class_idx"]), float(ctx["confidence"]),
+            bundle.version if bundle is not None else BASE_VERSION, ctx.get("validation") or {},
+            ctx.get("metrics") or {}, ctx.get("scan_id"), self._clock()
+        ))
+        self._queued_bytes += len(data)
+        self.stats["queued"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _take(self) -> List[Upload]:
+        batch = [self._queue.popleft() for _ in range(min(self.batch_max, len(self._queue)))]
+        self._queued_bytes -= sum(len(u.data) for u in batch)
+        return batch
+
+    def _encode(self, upload: Upload) -> Tuple[bytes, str, int, int]:
+        """The bytes to store for an upload, their extension and the stored image size."""
+        if not self.max_side or max(upload.width, upload.height) <= self.max_side:
+            return upload.data, _extension(upload.data), upload.width, upload.height
+        image = cv2.imdecode(np.frombuffer(upload.data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return upload.data, _extension(upload.data), upload.width, upload.height
+        scale = self.max_side / max(image.shape[:2])
+        image = cv2.resize(image, (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            return upload.data, _extension(upload.data), upload.width, upload.height
+        self.stats["reencoded"] += 1
+        return encoded.tobytes(), "jpg", image.shape[1], image.shape[0]
+
+    def write(self, batch: List[Upload]) -> int:
+        """Stores a batch and records it in the manifest; returns how many images were new."""
+        db = self._conn()
+        digests = [hashlib.sha256(u.data).hexdigest() for u in batch]
+        marks = ",".join("?" * len(digests))
+        known = {digest for (digest,) in db.execute(f"SELECT sha256 FROM upload WHERE sha256 IN ({marks})", digests)}
+        rows, new = [], 0
+        for upload, digest in zip(batch, digests):
+            if digest in known:
+                # Same image again: the manifest keeps the first prediction and counts the rest
+                rows.append((digest, "", 0, 0, 0) + self._meta(upload))
+                self.stats["duplicates"] += 1
+                continue
+            known.add(digest)
+            data, ext, width, height = self._encode(upload)
+            path = os.path.join(OBJECTS, digest[:2], f"{digest}.{ext}")
+            full = os.path.join(self.root, path)
+            if not os.path.exists(full):
+                os.makedirs(os.path.dirname(full), exist_ok=True)
+                tmp = f"{full}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, full)
+                self.stats["bytes_written"] += len(data)
+            rows.append((digest, path, len(data), width, height) + self._meta(upload))
+            new += 1
+        with db:
+            db.executemany(
+                "INSERT INTO upload VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1) ON CONFLICT (sha256) DO UPDATE SET "
+                "seen = seen + 1, last_seen = max(last_seen, excluded.last_seen)", rows)
+        self.stats["archived"] += new
+        return new
+
+    @staticmethod
+    def _meta(upload: Upload) -> tuple:
+        return (upload.label, upload.class_idx, upload.confidence, upload.model_version, json.dumps(upload.validation, default=float),
+                json.dumps(upload.metrics, default=float), upload.scan_id, upload.ts, upload.ts)
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            batch = self._take()
+            try:
+                await self.run_blocking(self.write, batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"Archiving {len(batch)} upload(s) failed: {e}", exc_info=True)
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Lets the writer finish the batch it is on and the rest of the queue, then returns."""
+        if self._task is not None:
+            # Cancelling would abandon a batch mid-write on its thread, and drain() could write it again alongside
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await asyncio.to_thread(self.drain)
+
+    def drain(self):
+        """Writes whatever is still queued (shutdown, or callers without an event loop)."""
+        while self._queue:
+            batch = self._take()
+            try:
+                self.write(batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"Archiving {len(batch)} upload(s) failed: {e}")
+
+    def snapshot(self) -> dict:
+        return {"root": self.root, "queue": len(self._queue), "queue_mb": round(self._queued_bytes / 2**20, 2), **self.stats}
+
+def read_manifest(root: str, min_confidence: float = 0.0, labels: Optional[List[str]] = None,
+                  model_versions: Optional[List[str]] = None) -> List[dict]:
+    """Manifest rows of an archive, oldest first, with `file` the absolute path of the stored image."""
+    where, args = ["confidence >= ?"], [min_confidence]
+    for column, values in (("label", labels), ("model_version", model_versions)):
+        if values:
+            where.append(f"{column} IN ({','.join('?' * len(values))})")
+            args.extend(values)
+    db = sqlite3.connect(f"file:{os.path.join(root, MANIFEST)}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    try:
+        rows = db.execute(f"SELECT * FROM upload WHERE {' AND '.join(where)} ORDER BY first_seen", args).fetchall()
+    finally:
+        db.close()
+    out = []
+    for row in rows:
+        row = dict(row)
+        row["file"] = os.path.abspath(os.path.join(root, row["path"]))
+        row["validation"], row["metrics"] = json.loads(row["validation"]), json.loads(row["metrics"])
+        out.append(row)
+    return out
@@ -0,0 +1,149 @@
+import os
+import logging
+import threading
+import cv2
+import numpy as np
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Size the student looks at. The full model sees 224x224, the student only needs coarse colour/texture.
+FEATURE_SIZE = 64
+HUE_BINS = 18
+SAT_BINS = 4
+VAL_BINS = 4
+
+def extract_cascade_features(image_tensor: np.ndarray) -> np.ndarray:
+    """Cheap colour/texture descriptor computed from a MobileNetV2-normalized RGB tensor ([-1, 1])."""
+    rgb = image_tensor[0] if image_tensor.ndim == 4 else image_tensor
+    small = cv2.resize(rgb, (FEATURE_SIZE, FEATURE_SIZE), interpolation=cv2.INTER_AREA)
+    small = np.clip((small + 1.0) * 127.5, 0, 255).astype(np.uint8)
+    bgr = cv2.cvtColor(small, cv2.COLOR_RGB2BGR)
+    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+    total = float(FEATURE_SIZE * FEATURE_SIZE)
+
+    # Colour distribution
+    h_hist = cv2.calcHist([hsv], [0], None, [HUE_BINS], [0, 180]).flatten() / total
+    s_hist = cv2.calcHist([hsv], [1], None, [SAT_BINS], [0, 256]).flatten() / total
+    v_hist = cv2.calcHist([hsv], [2], None, [VAL_BINS], [0, 256]).flatten() / total
+    mean, std = cv2.meanStdDev(hsv)
+
+    # Same plant / lesion ranges as enhance_image_pipeline
+    mask_green = cv2.inRange(hsv, np.array([25, 40, 40]), np.array([95, 255, 255]))
+    mask_brown = cv2.inRange(hsv, np.array([5, 40, 40]), np.array([25, 255, 255]))
+    green_ratio = cv2.countNonZero(mask_green) / total
+    brown_ratio = cv2.countNonZero(mask_brown) / total
+    plant_pixels = cv2.countNonZero(mask_green) + cv2.countNonZero(mask_brown)
+    lesion_density = brown_ratio * total / plant_pixels if plant_pixels > 0 else 0.0
+
+    # Texture
+    gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    edge_density = cv2.countNonZero(cv2.Canny(gray, 50, 150)) / total
+    laplacian = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    return np.concatenate([
+        h_hist, s_hist, v_hist,
+        mean.flatten() / 255.0, std.flatten() / 255.0,
+        [green_ratio, brown_ratio, lesion_density, edge_density, np.log1p(laplacian)]
+    ]).astype(np.float32)
+
+class CascadeHead:
+    """Linear softmax head over cascade features with per-class early-exit thresholds.
+
+    Artifacts are produced by evaluate_model.py (section 11) as an .npz holding
+    `weights`, `bias`, `feature_mean`, `feature_std` and `thresholds`.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, feature_mean: np.ndarray,
+                 feature_std: np.ndarray, thresholds: np.ndarray):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.feature_mean = feature_mean.astype(np.float32)
+        self.feature_std = np.maximum(feature_std.astype(np.float32), 1e-6)
+        self.thresholds = thresholds.astype(np.float32)
+
+    @classmethod
+    def load(cls, path: str) -> "CascadeHead":
+        data = np.load(path)
+        return cls(data["weights"], data["bias"], data["feature_mean"], data["feature_std"], data["thresholds"])
+
+    def save(self, path: str):
+        np.savez(path, weights=self.weights, bias=self.bias, feature_mean=self.feature_mean,
+                 feature_std=self.feature_std, thresholds=self.thresholds)
+
+    @property
+    def num_classes(self) -> int:
+        return self.weights.shape[1]
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        z = ((features - self.feature_mean) / self.feature_std) @ self.weights + self.bias
+        z = z - np.max(z, axis=-1, keepdims=True)
+        e = np.exp(z)
+        return e / np.sum(e, axis=-1, keepdims=True)
+
+    def try_exit(self, features: np.ndarray) -> Optional[np.ndarray]:
+        """Returns the student probabilities if confident enough to skip the full model, else None."""
+        probs = self.predict_proba(features)
+        class_idx = int(np.argmax(probs))
+        if probs[class_idx] >= self.thresholds[class_idx]:
+            return probs
+        return None
+
+def tune_cascade_thresholds(probs: np.ndarray, y_true: np.ndarray, num_classes: int, target_precision: float = 0.97,
+                            min_support: int = 20) -> np.ndarray:
+    """
+    Lowest per-class threshold at which the student's exits stay above `target_precision`.
+    Classes with fewer than `min_support` exits at that precision get inf (never exit early).
+    Tune on samples the head was not fitted on, or the precision is optimistic.
+    """
+    thresholds = np.full(num_classes, np.inf, dtype=np.float32)
+    pred = np.argmax(probs, axis=1)
+    conf = np.max(probs, axis=1)
+    for k in range(num_classes):
+        idx = np.where(pred == k)[0]
+        if len(idx) < min_support:
+            continue
+        order = idx[np.argsort(conf[idx])[::-1]]
+        correct = np.cumsum(y_true[order] == k)
+        precision = correct / np.arange(1, len(order) + 1)
+        ok = np.where((precision >= target_precision) & (np.arange(1, len(order) + 1) >= min_support))[0]
+        if len(ok):
+            thresholds[k] = conf[order[ok[-1]]]
+    return thresholds
+
+_stats_lock = threading.Lock()
+_stats = {
+    "student_exits": 0,
+    "full_model": 0
+}
+
+def record_stage(stage: str):
+    with _stats_lock:
+        if stage == "student":
+            _stats["student_exits"] += 1
+        else:
+            _stats["full_model"] += 1
+
+def get_cascade_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        total = _stats["student_exits"] + _stats["full_model"]
+        return {
+            "student_exits": _stats["student_exits"],
+            "full_model": _stats["full_model"],
+            "exit_rate": round(_stats["student_exits"] / total, 4) if total else 0.0
+        }
+
+def load_cascade_head(path: str, expected_num_classes: int) -> Optional[CascadeHead]:
+    if not os.path.exists(path):
+        logger.info(f"No cascade head at {path}; every request goes to the full model.")
+        return None
+    try:
+        head = CascadeHead.load(path)
+    except Exception as e:
+        logger.error(f"Failed to load cascade head from {path}: {e}")
+        return None
+    if head.num_classes != expected_num_classes:
+        logger.error(f"Cascade head has {head.num_classes} classes, expected {expected_num_classes}. Disabling cascade.")
+        return None
+    logger.info(f"Cascade head loaded from {path} ({int(np.isfinite(head.thresholds).sum())} classes may exit early).")
+    return head
@@ -0,0 +1,110 @@
+import time
+import logging
+from collections import deque
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Three-state breaker for a slow or flaky dependency, driven by a rolling window of calls.
+
+    Closed: calls go through. The breaker opens once at least `min_calls` calls in the last
+    `window_s` seconds fail at `failure_rate` or more, or take longer than `slow_call_s` at
+    `slow_call_rate` or more. Open: allow() is False for `open_s` seconds, so callers answer
+    from a fallback immediately. Half-open: up to `half_open_calls` probes go through. One
+    healthy probe closes the breaker with a fresh window; a failed or slow one reopens it.
+
+    Not thread-safe; meant to be used from the event loop like AdmissionController.
+    """
+
+    def __init__(self, name: str, window_s: float = 60.0, min_calls: int = 10, failure_rate: float = 0.5,
+                 slow_call_s: float = 5.0, slow_call_rate: float = 0.8, open_s: float = 30.0,
+                 half_open_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_s = slow_call_s
+        self.slow_call_rate = slow_call_rate
+        self.open_s = open_s
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._calls: deque = deque()  # (timestamp, failed, slow)
+        self._stats = {"calls": 0, "failures": 0, "slow": 0, "short_circuited": 0, "opened": 0}
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window_s:
+            self._calls.popleft()
+
+    def _transition(self, state: str, now: float):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = now
+            self._stats["opened"] += 1
+        elif state == CLOSED:
+            self._calls.clear()
+        self._probes = 0
+
+    def allow(self) -> bool:
+        """True if a call may go ahead. Every allowed call must be followed by record() or release()."""
+        now = self._clock()
+        if self.state == OPEN and now - self._opened_at >= self.open_s:
+            self._transition(HALF_OPEN, now)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self._probes < self.half_open_calls:
+            self._probes += 1
+            return True
+        self._stats["short_circuited"] += 1
+        return False
+
+    def record(self, ok: bool, latency_s: float):
+        now = self._clock()
+        slow = latency_s >= self.slow_call_s
+        self._stats["calls"] += 1
+        self._stats["failures"] += int(not ok)
+        self._stats["slow"] += int(slow)
+
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED if ok and not slow else OPEN, now)
+            return
+        if self.state == OPEN:
+            return  # A call admitted before the breaker opened; the decision is already made
+        self._calls.append((now, not ok, slow))
+        self._trim(now)
+        total = len(self._calls)
+        if total < self.min_calls:
+            return
+        failed = sum(1 for _, f, _ in self._calls if f)
+        slowed = sum(1 for _, _, s in self._calls if s)
+        if failed / total >= self.failure_rate or slowed / total >= self.slow_call_rate:
+            self._transition(OPEN, now)
+
+    def release(self):
+        """For an allowed call abandoned before it had an outcome (e.g. the client went away)."""
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def snapshot(self) -> dict:
+        now = self._clock()
+        self._trim(now)
+        total = len(self._calls)
+        return {
+            "state": self.state,
+            "window_calls": total,
+            "window_failure_rate": round(sum(1 for _, f, _ in self._calls if f) / total, 3) if total else 0.0,
+            "window_slow_rate": round(sum(1 for _, _, s in self._calls if s) / total, 3) if total else 0.0,
+            "retry_in_s": round(max(0.0, self.open_s - (now - self._opened_at)), 1) if self.state == OPEN else 0.0,
+            **self._stats,
+        }
@@ -1,30 +1,44 @@
-import asyncio
+import os
+import math
 import numpy as np
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
 from fastapi import HTTPException
 from fastapi.concurrency import run_in_threadpool
+from app.config import get_settings
+from app.core.runtime import configure_runtime, WORKER_SLOT_ENV
+
+# Thread env vars only take effect if set before model_loader imports TensorFlow
+runtime_layout = configure_runtime(get_settings(), worker_slot=int(os.getenv(WORKER_SLOT_ENV, "0")))
+
 # no tf
-from app.core.model_loader import cnn_model, CLASS_LABELS, feature_extractor, class_centroids, TEMPERATURE_CALIBRATION
-from app.core.predictor import preprocess_image
+from app.core.model_loader import model_registry, settings
+from app.core.model_registry import ModelBundle
+from app.core.pipeline import stage
+from app.core.stages import scored, label_for, split_label, SCORE_KEYS
+from app.utils.image_utils import apply_tta
+from app.core.cascade import extract_cascade_features, record_stage
+from app.core.admission import AdmissionController, Overloaded
+from app.core.deadline import request_deadline
+from app.utils.buffer_pool import BufferPool, PreprocessBuffers
 
-inference_lock = asyncio.Semaphore(1)
+admission = AdmissionController(
+    initial_limit=min(settings.admission_initial_limit, runtime_layout["inference_slots"]),
+    min_limit=settings.admission_min_limit,
+    max_limit=runtime_layout["inference_slots"],  # Ceiling set by the runtime profile
+    target_latency_s=settings.admission_target_latency_s,
+    max_queue_wait_s=settings.admission_max_queue_wait_s
+)
 
-async def acquire_slot(timeout=12):
-    try:
-        await asyncio.wait_for(inference_lock.acquire(), timeout)
-        return True
-    except asyncio.TimeoutError:
-        return False
-
-def apply_tta(image_tensor: np.ndarray) -> np.ndarray:
-    """Applies basic Test-Time Augmentation: Original, Flipped, Brightness Shift."""
-    flipped = np.fliplr(image_tensor[0])
-    flipped_tensor = np.expand_dims(flipped, axis=0)
-    
-    # Slight brightness shift (simulate by adding a small constant, since it's preprocessed, be careful)
-    # MobileNetV2 preprocess maps to [-1, 1], so we shift slightly
-    bright = np.clip(image_tensor + 0.1, -1.0, 1.0)
-    
-    return np.vstack([image_tensor, flipped_tensor, bright])
+# Per-request scratch planes and TTA tensors, reused across requests
+buffer_pool = BufferPool(settings.model_input_size, max_idle=settings.buffer_pool_idle)
+
+def server_busy(exc: Overloaded) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={"detail": "Server under high demand. Please retry.", "code": "SERVER_BUSY"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
 
 def calibrate_confidence(probs: np.ndarray, temperature: float) -> np.ndarray:
     """Applies temperature scaling to soften or sharpen probabilities."""
@@ -35,51 +49,89 @@ def calibrate_confidence(probs: np.ndarray, temperature: float) -> np.ndarray:
     exp_logits = np.exp(scaled_logits - np.max(scaled_logits)) # numerical stability
     return exp_logits / np.sum(exp_logits)
 
-async def _run_inference_safely(image_bytes: bytes) -> dict:
-    if cnn_model is None:
-         raise RuntimeError("ML Model is not loaded on the server.")
-         
-    tensor_input, metrics = preprocess_image(image_bytes)
-    
+@asynccontextmanager
+async def inference_slot():
+    """
+    An admission slot, with overload surfaced as 503 SERVER_BUSY. A request with a budget
+    (start_budget) waits for the slot only as long as the budget has left.
+    """
+    try:
+        async with admission.slot(deadline=request_deadline.get()):
+            yield
+    except Overloaded as e:
+        raise server_busy(e)
+
+async def _infer_batch(batch: np.ndarray, metrics_list: list, tta: bool = True, buffers: Optional[PreprocessBuffers] = None,
+                       bundle: Optional[ModelBundle] = None) -> list:
+    """Scores an (N, H, W, 3) normalized batch into prediction dicts (see _forward_batch)."""
+    bundle = bundle or model_registry.current
+    outputs = await _forward_batch(batch, metrics_list, tta, buffers, bundle)
+    return [_score(probs, features, metrics, bundle) for (probs, features), metrics in zip(outputs, metrics_list)]
+
+async def _forward_batch(batch: np.ndarray, metrics_list: list, tta: bool = True, buffers: Optional[PreprocessBuffers] = None,
+                         bundle: Optional[ModelBundle] = None) -> list:
+    """
+    (probs, features) per image. Cascade exits first, with features None; the rest share one
+    forward pass. With leased `buffers` (single-image requests), TTA views are built inside buffers.tensor.
+    Everything comes from one `bundle` (default: the current version), even if another is swapped in meanwhile.
+    """
+    bundle = bundle or model_registry.current
+    if bundle is None:
+         raise HTTPException(status_code=503, detail={"detail": "Model not loaded.", "code": "MODEL_ERROR"})
+    cascade_head = bundle.cascade_head
+
+    outputs = [None] * len(batch)
+    pending = []
+    for i, metrics in enumerate(metrics_list):
+        # Stage 1: cheap student on colour/texture features. Confident cases never touch the CNN.
+        if cascade_head is not None:
+            student_probs = cascade_head.try_exit(extract_cascade_features(batch[i]))
+            if student_probs is not None:
+                record_stage("student")
+                metrics["inference_stage"] = "student"
+                outputs[i] = (student_probs, None)
+                continue
+        record_stage("full")
+        metrics["inference_stage"] = "full"
+        pending.append(i)
+
+    if not pending:
+        return outputs
+
+    originals = batch if len(pending) == len(batch) else batch[pending]
     # Generate TTA batch
-    tta_batch = apply_tta(tensor_input)
+    tta_out = buffers.tensor if buffers is not None and 3 * len(originals) <= len(buffers.tensor) else None
+    model_input = apply_tta(originals, out=tta_out) if tta else originals
         
-    slot_acquired = await acquire_slot()
-    if not slot_acquired:
-        raise HTTPException(
-            status_code=503, 
-            detail={"detail": "Server under high demand. Please retry.", "code": "SERVER_BUSY"}
-        )
-
-    try:
+    async with inference_slot():
         # Run prediction on the batch
-        prediction_probs_batch = await run_in_threadpool(cnn_model.predict, tta_batch, verbose=0)
+        prediction_probs_batch = await run_in_threadpool(bundle.model.predict, model_input, verbose=0)
         # Extract features for similarity scoring (only on original image)
-        features = await run_in_threadpool(feature_extractor.predict, tensor_input, verbose=0)
-    finally:
-        inference_lock.release()
-        
+        features = await run_in_threadpool(bundle.feature_extractor.predict, originals, verbose=0)
+
     # Average TTA predictions
-    avg_probs = np.mean(prediction_probs_batch, axis=0)
-    
+    prediction_probs_batch = np.asarray(prediction_probs_batch)
+    probs = prediction_probs_batch.reshape(-1, len(pending), prediction_probs_batch.shape[-1]).mean(axis=0)
+    for j, i in enumerate(pending):
+        outputs[i] = (probs[j], features[j])
+    return outputs
+
+def _score(probs: np.ndarray, features: Optional[np.ndarray], metrics: dict, bundle: ModelBundle) -> dict:
+    if features is None:
+        # Cascade student: its probabilities are used as they are
+        class_idx = int(np.argmax(probs))
+        return _format_prediction(probs, class_idx, float(probs[class_idx]), metrics, bundle)
     # Temperature Scaling Calibration
-    calibrated_probs = calibrate_confidence(avg_probs, TEMPERATURE_CALIBRATION)
-    
-    top_3_indices = np.argsort(calibrated_probs)[-3:][::-1]
-    
-    top_k = []
-    for idx in top_3_indices:
-        lbl = CLASS_LABELS.get(str(idx)) or CLASS_LABELS.get(idx) or f"Unknown_{idx}"
-        top_k.append({
-            "label": lbl.replace("___", " - ").replace("_", " "),
-            "confidence": float(calibrated_probs[idx])
-        })
-        
-    class_idx = int(top_3_indices[0])
+    calibrated_probs = calibrate_confidence(probs, bundle.temperature)
+    class_idx, confidence = centroid_adjust(calibrated_probs, features, metrics, bundle.centroids)
+    return _format_prediction(calibrated_probs, class_idx, confidence, metrics, bundle)
+
+def centroid_adjust(calibrated_probs: np.ndarray, feature_vector: np.ndarray, metrics: dict, class_centroids: np.ndarray) -> Tuple[int, float]:
+    """Top class and its confidence, penalized when the features sit far from the class centroid."""
+    class_idx = int(np.argsort(calibrated_probs)[-1])
     base_confidence = float(calibrated_probs[class_idx])
     
     # Similarity-based Confidence Adjustment
-    feature_vector = features[0]
     feature_vector = feature_vector / (np.linalg.norm(feature_vector) + 1e-7)
     centroid = class_centroids[class_idx]
     
@@ -94,23 +146,55 @@ async def _run_inference_safely(image_bytes: bytes) -> dict:
         adjusted_confidence = base_confidence
 
     metrics["feature_distance"] = round(float(distance), 4)
+    return class_idx, adjusted_confidence
+
+def _format_prediction(probs: np.ndarray, class_idx: int, confidence: float, metrics: dict, bundle: ModelBundle) -> dict:
+    top_3_indices = np.argsort(probs)[-3:][::-1]
+    labels = bundle.labels
+    
+    top_k = []
+    for idx in top_3_indices:
+        lbl = label_for(labels, int(idx))
+        top_k.append({
+            "label": lbl.replace("___", " - ").replace("_", " "),
+            "confidence": float(probs[idx])
+        })
 
-    disease_name = CLASS_LABELS.get(str(class_idx)) or CLASS_LABELS.get(class_idx)
+    disease_name = labels.get(str(class_idx)) or labels.get(class_idx)
     if not disease_name:
-         raise RuntimeError(f"Index {class_idx} not found in CLASS_LABELS lookup.")
-         
-    parts = disease_name.split("___")
-    if len(parts) == 2:
-        crop = parts[0].replace("_", " ")
-        disease = parts[1].replace("_", " ")
-    else:
-        crop = "Unknown Crop Type"
-        disease = disease_name.replace("_", " ")
+         raise RuntimeError(f"Index {class_idx} not found in the labels of model version {bundle.version}.")
+    crop, disease = split_label(disease_name)
 
     return {
         "crop": crop,
         "disease": disease,
-        "confidence": adjusted_confidence,
+        "confidence": confidence,
         "top_k": top_k,
-        "metrics": metrics
+        "metrics": metrics,
+        "model_version": bundle.version
     }
+
+# Pipeline stages for the "production" profile (see app/core/pipeline.py)
+
+# The "bundle" input is the ModelBundle the run took at its start (see app/core/model_registry.py)
+
+@stage("infer", "cascade_tta", requires=("tensor", "metrics", "buffers", "bundle"), provides=("probs", "features", "inference_stage"))
+async def infer_cascade_tta(ctx):
+    ((probs, features),) = await _forward_batch(ctx["tensor"], [ctx["metrics"]], tta=ctx.params.get("tta", True), buffers=ctx["buffers"],
+                                                bundle=ctx["bundle"])
+    return {"probs": probs, "features": features, "inference_stage": ctx["metrics"]["inference_stage"]}
+
+@stage("calibrate", "temperature", requires=("probs", "bundle"), provides=("probs",))
+def calibrate_temperature(ctx):
+    if ctx.get("inference_stage") == "student":
+        return None
+    return {"probs": calibrate_confidence(ctx["probs"], ctx["bundle"].temperature)}
+
+@stage("score", "centroid", requires=("probs", "features", "metrics", "bundle"), provides=SCORE_KEYS)
+def score_centroid(ctx):
+    probs = ctx["probs"]
+    if ctx["features"] is None:
+        class_idx = int(np.argmax(probs))
+        return scored(ctx, probs, class_idx, float(probs[class_idx]))
+    class_idx, confidence = centroid_adjust(probs, ctx["features"], ctx["metrics"], ctx["bundle"].centroids)
+    return scored(ctx, probs, class_idx, confidence)
@@ -0,0 +1,21 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Monotonic time by which the current request should have answered. Set by the endpoint and
+# read by anything downstream that waits on a dependency, so that a slow upstream call only
+# gets the time that is left rather than its own full timeout.
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def start_budget(seconds: float):
+    return request_deadline.set(time.monotonic() + seconds)
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None if it has none."""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def budget_for(timeout: float) -> float:
+    """The smaller of `timeout` and the time left; may be <= 0 once the budget is spent."""
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
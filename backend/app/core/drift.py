@@ -0,0 +1,282 @@
+import os
+import json
+import math
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+from app.core.pipeline import StageRejected
+from app.utils.structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# name -> (lo, hi, bins, log-spaced). Values outside [lo, hi) land in an under/overflow bin.
+FEATURES = {
+    "green_ratio": (0.0, 1.0, 20, False),
+    "entropy": (0.0, 8.0, 32, False),
+    "edge_density": (0.0, 0.4, 20, False),
+    "blur_score": (1.0, 10000.0, 32, True),
+    "lesion_density_percent": (0.0, 100.0, 20, False),
+    "confidence": (0.0, 1.0, 20, False),
+    "confidence_gap": (0.0, 1.0, 20, False),
+}
+CATEGORIES = ("predicted_class", "outcome")
+STABLE, SHIFTING, DRIFT, INSUFFICIENT = "stable", "shifting", "drift", "insufficient_data"
+PSI_SHIFTING = 0.1
+PSI_DRIFT = 0.25
+
+class BinnedQuantiles:
+    """
+    Quantile sketch with fixed bin edges: O(1) add, constant memory, exact merge. Edges are
+    the same in every window and in the baseline, so histograms compare bin by bin.
+    """
+    __slots__ = ("lo", "hi", "bins", "log", "counts", "n")
+
+    def __init__(self, lo: float, hi: float, bins: int, log: bool = False):
+        self.lo, self.hi, self.bins, self.log = lo, hi, bins, log
+        self.counts = [0] * (bins + 2)  # [underflow, bins..., overflow]
+        self.n = 0
+
+    def _scale(self, x: float) -> float:
+        if self.log:
+            return (math.log(max(x, 1e-12)) - math.log(self.lo)) / (math.log(self.hi) - math.log(self.lo))
+        return (x - self.lo) / (self.hi - self.lo)
+
+    def add(self, x: float):
+        pos = self._scale(x)
+        i = 0 if pos < 0 else self.bins + 1 if pos >= 1 else int(pos * self.bins) + 1
+        self.counts[i] += 1
+        self.n += 1
+
+    def merge(self, other: "BinnedQuantiles"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+
+    def _edge(self, pos: float) -> float:
+        if self.log:
+            return math.exp(math.log(self.lo) + pos * (math.log(self.hi) - math.log(self.lo)))
+        return self.lo + pos * (self.hi - self.lo)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Interpolated within the bin; under/overflow report the range limit."""
+        if not self.n:
+            return None
+        target, seen = q * self.n, 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= target:
+                if i == 0:
+                    return self.lo
+                if i == self.bins + 1:
+                    return self.hi
+                return round(self._edge((i - 1 + (target - seen) / c) / self.bins), 4)
+            seen += c
+        return self.hi
+
+    def to_dict(self) -> dict:
+        return {"lo": self.lo, "hi": self.hi, "bins": self.bins, "log": self.log, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "BinnedQuantiles":
+        sketch = cls(d["lo"], d["hi"], d["bins"], d["log"])
+        sketch.counts = list(d["counts"])
+        sketch.n = sum(sketch.counts)
+        return sketch
+
+class Reservoir:
+    """Uniform sample of at most `size` items from a stream of unknown length (Algorithm R)."""
+
+    def __init__(self, size: int, seed: Optional[int] = None):
+        self.size = size
+        self.items: List[dict] = []
+        self.seen = 0
+        self._rng = random.Random(seed)
+
+    def add(self, item: dict):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            j = self._rng.randrange(self.seen)
+            if j < self.size:
+                self.items[j] = item
+
+class DriftWindow:
+    """Sketches of one stretch of traffic (or of the evaluation set, for the baseline)."""
+
+    def __init__(self, started: Optional[float] = None, reservoir_size: int = 0):
+        self.started = started if started is not None else time.time()
+        self.features = {name: BinnedQuantiles(*spec) for name, spec in FEATURES.items()}
+        self.categories: Dict[str, Counter] = {name: Counter() for name in CATEGORIES}
+        self.reservoir = Reservoir(reservoir_size)
+        self.n = 0
+
+    def add(self, values: Dict[str, float], categories: Dict[str, str]):
+        self.n += 1
+        for name, x in values.items():
+            self.features[name].add(x)
+        for name, value in categories.items():
+            self.categories[name][value] += 1
+        if self.reservoir.size:
+            self.reservoir.add({**values, **categories})
+
+    def to_dict(self) -> dict:
+        return {"scans": self.n, "started": self.started,
+                "features": {name: s.to_dict() for name, s in self.features.items()},
+                "categories": {name: dict(c) for name, c in self.categories.items()}}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "DriftWindow":
+        window = cls(d.get("started", 0.0))
+        window.n = d["scans"]
+        for name, sketch in d["features"].items():
+            if name in window.features:
+                window.features[name] = BinnedQuantiles.from_dict(sketch)
+        for name, counts in d["categories"].items():
+            window.categories[name] = Counter(counts)
+        return window
+
+def psi(expected: List[int], actual: List[int], eps: float = 1e-4) -> float:
+    """Population stability index between two count vectors over the same bins."""
+    e_total, a_total = sum(expected), sum(actual)
+    score = 0.0
+    for e, a in zip(expected, actual):
+        pe, pa = max(e / e_total, eps), max(a / a_total, eps)
+        score += (pa - pe) * math.log(pa / pe)
+    return score
+
+def _status(value: float) -> str:
+    return DRIFT if value >= PSI_DRIFT else SHIFTING if value >= PSI_SHIFTING else STABLE
+
+def compare(baseline: DriftWindow, window: DriftWindow, min_samples: int = 200) -> dict:
+    """Per-feature PSI of a window against the baseline, with the window's quartiles next to the baseline median."""
+    features, categories = {}, {}
+    for name, sketch in window.features.items():
+        base = baseline.features[name]
+        entry = {"scans": sketch.n, "p25": sketch.quantile(0.25), "p50": sketch.quantile(0.5), "p75": sketch.quantile(0.75),
+                 "baseline_p50": base.quantile(0.5)}
+        if sketch.n < min_samples or not base.n:
+            entry.update(psi=None, status=INSUFFICIENT)
+        else:
+            value = psi(base.counts, sketch.counts)
+            entry.update(psi=round(value, 4), status=_status(value))
+        features[name] = entry
+    for name, counts in window.categories.items():
+        base = baseline.categories.get(name, Counter())
+        total = sum(counts.values())
+        entry = {"scans": total, "top": dict(counts.most_common(5))}
+        if total < min_samples or not base:
+            entry.update(psi=None, status=INSUFFICIENT)
+        else:
+            keys = sorted(set(base) | set(counts))
+            value = psi([base.get(k, 0) for k in keys], [counts.get(k, 0) for k in keys])
+            entry.update(psi=round(value, 4), status=_status(value))
+        categories[name] = entry
+    statuses = [e["status"] for e in (*features.values(), *categories.values())]
+    status = next((s for s in (DRIFT, SHIFTING) if s in statuses), STABLE if STABLE in statuses else INSUFFICIENT)
+    return {"started": window.started, "scans": window.n, "status": status, "features": features, "categories": categories}
+
+def observation(ctx, error: Optional[BaseException] = None):
+    """(values, categories) to sketch for one pipeline run, or None if it failed for reasons other than its input."""
+    if error is not None and not (isinstance(error, StageRejected) and error.status < 500):
+        return None
+    values: Dict[str, float] = {}
+    scores = ctx.get("validation")
+    if scores is None and isinstance(error, StageRejected) and error.code == "NOT_A_PLANT":
+        scores = error.details
+    for name in ("green_ratio", "entropy", "edge_density"):
+        if scores and name in scores:
+            values[name] = scores[name]
+    metrics = ctx.get("metrics") or {}
+    for name in ("blur_score", "lesion_density_percent"):
+        if name in metrics:
+            values[name] = metrics[name]
+    categories = {"outcome": error.code if error is not None else "accepted"}
+    if "confidence" in ctx:
+        # Before the centroid and kNN penalties, which depend on the live case log and cannot be
+        # reproduced offline: the baseline records the same (evaluate_model.build_drift_baseline)
+        top = ctx.get("top") or ()
+        values["confidence"] = top[0][1] if top else ctx["confidence"]
+        categories["predicted_class"] = str(ctx["class_idx"])
+        if len(top) > 1:
+            values["confidence_gap"] = top[0][1] - top[1][1]
+    return values, categories
+
+def profile_baseline_path(path: str, profile: str) -> str:
+    """The baseline of one pipeline profile: models/drift_baseline.json -> models/drift_baseline_legacy.json."""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{profile}{ext}"
+
+class DriftMonitor:
+    """
+    Streams the inputs and predictions of every pipeline run (pipeline.observe(monitor.observe))
+    into tumbling windows of `window_s` seconds and compares the current and last complete
+    window with the baseline evaluate_model.py saved for the pipeline's profile (see
+    profile_baseline_path(); legacy and production see different scores). Each observation is a handful of O(1)
+    sketch updates; memory is constant whatever the traffic. Every worker process keeps its own
+    windows, so a report covers the share of traffic that reached the worker that answered.
+    """
+
+    def __init__(self, baseline_path: str, window_s: float = 3600.0, min_samples: int = 200, reservoir_size: int = 64,
+                 clock=time.time):
+        self.baseline_path = baseline_path
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self.reservoir_size = reservoir_size
+        self._clock = clock
+        self.baseline = self._load(baseline_path)
+        self.current = DriftWindow(clock(), reservoir_size)
+        self.previous: Optional[DriftWindow] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load(path: str) -> Optional[DriftWindow]:
+        if not os.path.exists(path):
+            logger.warning(f"Drift baseline not found at {path}; run evaluate_model.py to create it. Drift scores are disabled.")
+            return None
+        with open(path) as f:
+            return DriftWindow.from_dict(json.load(f))
+
+    def _roll(self, now: float):
+        closed = self.current
+        self.previous, self.current = closed, DriftWindow(now, self.reservoir_size)
+        if self.baseline is not None and closed.n >= self.min_samples:
+            result = compare(self.baseline, closed, self.min_samples)
+            drifted = [name for name, e in {**result["features"], **result["categories"]}.items() if e["status"] == DRIFT]
+            log_event(logger, "drift_window", logging.WARNING if drifted else logging.INFO,
+                      scans=closed.n, status=result["status"], drifted=",".join(drifted))
+
+    def observe(self, ctx, error: Optional[BaseException] = None):
+        obs = observation(ctx, error)
+        if obs is None:
+            return
+        now = self._clock()
+        with self._lock:
+            if now - self.current.started >= self.window_s:
+                self._roll(now)
+            self.current.add(*obs)
+
+    def report(self, samples: bool = False) -> dict:
+        with self._lock:
+            if self._clock() - self.current.started >= self.window_s:
+                self._roll(self._clock())
+            current, previous = self.current, self.previous
+            sample = [dict(item) for item in current.reservoir.items] if samples else None
+        if self.baseline is None:
+            return {"status": "no_baseline", "baseline": {"path": self.baseline_path, "scans": 0},
+                    "current": {"started": current.started, "scans": current.n}}
+        out = {
+            "baseline": {"path": self.baseline_path, "scans": self.baseline.n},
+            "window_s": self.window_s,
+            "current": compare(self.baseline, current, self.min_samples),
+            "previous": compare(self.baseline, previous, self.min_samples) if previous is not None else None,
+        }
+        decided = [w["status"] for w in (out["previous"], out["current"]) if w and w["status"] != INSUFFICIENT]
+        out["status"] = decided[-1] if decided else INSUFFICIENT
+        if sample is not None:
+            out["samples"] = sample
+        return out
+
+    def snapshot(self) -> dict:
+        return {"baseline": self.baseline is not None, "window_scans": self.current.n}
@@ -0,0 +1,285 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ScanTensorCache:
+    """
+    Model inputs of recent scans, kept so that an explanation never has to re-run decode and
+    enhancement. Inputs are stored as the RGB uint8 image they were normalized from (a
+    quarter of the float32 size; tensor() rebuilds the float input exactly). Least recently
+    used entries go first once `max_bytes` is reached. Batch jobs are remembered as groups.
+    Each entry records the model version that scored it, so it is explained by that same model.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20, max_groups: int = 256):
+        self.max_bytes = max_bytes
+        self.max_groups = max_groups
+        self._entries: OrderedDict = OrderedDict()  # scan_id -> (rgb, class_idx, label, model_version)
+        self._groups: OrderedDict = OrderedDict()   # batch_id -> [scan_id]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def put(self, scan_id: str, tensor: np.ndarray, class_idx: int, label: str, model_version: Optional[str] = None):
+        rgb = np.rint((tensor.reshape(tensor.shape[-3:]) + 1.0) * 127.5).astype(np.uint8)
+        with self._lock:
+            if scan_id in self._entries:
+                self._bytes -= self._entries.pop(scan_id)[0].nbytes
+            self._entries[scan_id] = (rgb, class_idx, label, model_version)
+            self._bytes += rgb.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._bytes -= self._entries.popitem(last=False)[1][0].nbytes
+                self.evicted += 1
+
+    def get(self, scan_id: str):
+        """(rgb, class_idx, label, model_version) or None."""
+        with self._lock:
+            entry = self._entries.get(scan_id)
+            if entry is not None:
+                self._entries.move_to_end(scan_id)
+            return entry
+
+    def group(self, group_id: str, scan_ids: Sequence[str]):
+        with self._lock:
+            self._groups[group_id] = list(scan_ids)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+
+    def members(self, group_id: str) -> Optional[List[str]]:
+        with self._lock:
+            return self._groups.get(group_id)
+
+    @staticmethod
+    def tensor(rgb: np.ndarray) -> np.ndarray:
+        return rgb.astype(np.float32) / np.float32(127.5) - np.float32(1.0)
+
+    def retain(self, ctx):
+        """Pipeline stage: keeps this scan's input, before its buffers go back to the pool."""
+        self.put(ctx["scan_id"], ctx["tensor"], ctx["class_idx"], f"{ctx['crop']} - {ctx['disease']}",
+                 ctx["bundle"].version if "bundle" in ctx else None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"scans": len(self._entries), "batches": len(self._groups), "mb": round(self._bytes / 2**20, 1),
+                    "evicted": self.evicted}
+
+def occlusion_maps(predict: Callable[[np.ndarray], np.ndarray], batch: np.ndarray, class_idxs: Sequence[int],
+                   patch: int = 32, chunk: int = 64) -> List[np.ndarray]:
+    """
+    Model-agnostic saliency: how much the target class probability drops when each
+    patch x patch square is greyed out. Needs only predict(); the occluded copies of all
+    images in `batch` go through the model `chunk` at a time.
+    """
+    n, height, width = batch.shape[:3]
+    rows, cols = -(-height // patch), -(-width // patch)
+    base = np.asarray(predict(batch))[np.arange(n), class_idxs]
+    variants = np.repeat(batch, rows * cols, axis=0)
+    for k in range(rows * cols):
+        y, x = (k // cols) * patch, (k % cols) * patch
+        variants[k::rows * cols, y:y + patch, x:x + patch] = 0.0  # Mid-grey in [-1, 1]
+    drops = np.empty(len(variants), dtype=np.float32)
+    for start in range(0, len(variants), chunk):
+        probs = np.asarray(predict(variants[start:start + chunk]))
+        targets = np.repeat(class_idxs, rows * cols)[start:start + chunk]
+        drops[start:start + chunk] = probs[np.arange(len(probs)), targets]
+    drops = base[:, None] - drops.reshape(n, rows * cols)
+    return [np.maximum(d, 0.0).reshape(rows, cols) for d in drops]
+
+# Keyed by the model itself, so the grad model goes when its version is unloaded (and an id is never reused for another)
+_grad_models: "weakref.WeakKeyDictionary[object, object]" = weakref.WeakKeyDictionary()
+
+def _output_rank(layer) -> int:
+    # Keras 3 layers have no output_shape; .output raises for layers that were never called
+    try:
+        return len(layer.output.shape)
+    except (AttributeError, ValueError):
+        return 0
+
+def gradcam_maps(model, batch: np.ndarray, class_idxs: Sequence[int]) -> List[np.ndarray]:
+    """Grad-CAM on the last layer with a spatial (4-D) output, for a Keras model."""
+    import tensorflow as tf
+    grad_model = _grad_models.get(model)
+    if grad_model is None:
+        conv = next((layer for layer in reversed(model.layers) if _output_rank(layer) == 4), None)
+        if conv is None:
+            raise ValueError("Model has no layer with a spatial (4-D) output.")
+        grad_model = _grad_models[model] = tf.keras.Model(model.inputs, [conv.output, model.output])
+    with tf.GradientTape() as tape:
+        features, probs = grad_model(tf.convert_to_tensor(batch), training=False)
+        score = tf.gather(probs, tf.constant(list(class_idxs)), axis=1, batch_dims=1)
+    grads = tape.gradient(score, features)
+    weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+    cams = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1)).numpy()
+    return list(cams)
+
+def supports_gradcam(model) -> bool:
+    if not (hasattr(model, "layers") and hasattr(model, "inputs")):
+        return False
+    try:
+        import tensorflow  # Only to see whether it is installed
+    except ImportError:
+        return False
+    return True
+
+def render_overlay(rgb: np.ndarray, heat: np.ndarray, alpha: float = 0.45) -> bytes:
+    """JET heatmap blended over the model input, as PNG bytes."""
+    heat = cv2.resize(heat.astype(np.float32), (rgb.shape[1], rgb.shape[0]), interpolation=cv2.INTER_CUBIC)
+    peak = float(heat.max())
+    scaled = np.clip(heat / peak * 255.0, 0, 255) if peak > 0 else np.zeros_like(heat)
+    colored = cv2.applyColorMap(scaled.astype(np.uint8), cv2.COLORMAP_JET)
+    blended = cv2.addWeighted(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), 1.0 - alpha, colored, alpha, 0)
+    return cv2.imencode(".png", blended)[1].tobytes()
+
+class HeatmapStore:
+    """Content-addressed PNGs: <root>/<aa>/<sha256>.png, so identical overlays are stored once."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.png")
+
+    def put(self, png: bytes) -> str:
+        digest = hashlib.sha256(png).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(png)
+            os.replace(tmp, path)
+        return digest
+
+class ExplainQueueFull(Exception):
+    pass
+
+class ExplainWorker:
+    """
+    Computes explanations off the request path. Requests enqueue a scan_id and return at once;
+    one background task drains the queue, up to `batch_max` scans per model call, and renders
+    and stores the overlays. `slot` is an async context manager around the model work (e.g.
+    a low-priority admission slot) so explanations yield to live predictions. `model_fn(version)`
+    returns the model of a version, or None once that version is no longer loaded.
+    """
+
+    def __init__(self, cache: ScanTensorCache, store: HeatmapStore, model_fn: Callable[[Optional[str]], object], slot: Callable,
+                 batch_max: int = 8, queue_max: int = 256, max_results: int = 4096, run_blocking: Callable = None):
+        self.cache = cache
+        self.store = store
+        self.model_fn = model_fn
+        self.slot = slot
+        self.batch_max = batch_max
+        self.queue_max = queue_max
+        self.max_results = max_results
+        self.run_blocking = run_blocking or asyncio.to_thread
+        self.results: OrderedDict = OrderedDict()  # scan_id -> {"status": ...}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"explained": 0, "failed": 0, "batches": 0}
+
+    def _set(self, scan_id: str, result: dict):
+        self.results[scan_id] = result
+        self.results.move_to_end(scan_id)
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+
+    def request(self, scan_id: str) -> Optional[dict]:
+        """Current state for scan_id, enqueueing it if needed; None if the scan is not cached."""
+        result = self.results.get(scan_id)
+        if result is not None and result["status"] != "failed":
+            return result
+        entry = self.cache.get(scan_id)
+        if entry is None:
+            return result
+        if self.model_fn(entry[3]) is None:
+            self._set(scan_id, {"status": "failed", "scan_id": scan_id, "model_version": entry[3],
+                                "error": f"Scan was scored by model version {entry[3]}, which is no longer loaded."})
+            return self.results[scan_id]
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._queue.qsize() >= self.queue_max:
+            raise ExplainQueueFull()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._set(scan_id, {"status": "queued", "scan_id": scan_id})
+        self._queue.put_nowait(scan_id)
+        return self.results[scan_id]
+
+    async def _run(self):
+        while True:
+            scan_ids = [await self._queue.get()]
+            while len(scan_ids) < self.batch_max and not self._queue.empty():
+                scan_ids.append(self._queue.get_nowait())
+            try:
+                await self._explain(scan_ids)
+            except Exception as e:
+                logger.error(f"Explanation batch failed: {e}", exc_info=True)
+                for scan_id in scan_ids:
+                    self._set(scan_id, {"status": "failed", "scan_id": scan_id, "error": str(e)})
+                self.stats["failed"] += len(scan_ids)
+
+    async def _explain(self, scan_ids: List[str]):
+        entries, models = [], {}
+        for scan_id in scan_ids:
+            entry = self.cache.get(scan_id)
+            if entry is not None and entry[3] not in models:
+                models[entry[3]] = self.model_fn(entry[3])
+            if entry is None:
+                error = "Scan evicted from cache before it was explained."
+            elif models[entry[3]] is None:
+                error = f"Scan was scored by model version {entry[3]}, which is no longer loaded."
+            else:
+                self._set(scan_id, {"status": "running", "scan_id": scan_id})
+                entries.append((scan_id, entry))
+                continue
+            self._set(scan_id, {"status": "failed", "scan_id": scan_id, "error": error})
+            self.stats["failed"] += 1
+        if not entries:
+            return
+        started = time.perf_counter()
+        async with self.slot():
+            results = await self.run_blocking(self._compute, [entry for _, entry in entries], models)
+        for (scan_id, (_, class_idx, label, version)), (method, digest, peak) in zip(entries, results):
+            self._set(scan_id, {"status": "ready", "scan_id": scan_id, "method": method, "class_idx": class_idx, "label": label,
+                                "model_version": version, "sha256": digest, "heatmap_url": f"/explain/heatmaps/{digest}.png", "peak": peak})
+        self.stats["explained"] += len(entries)
+        self.stats["batches"] += 1
+        logger.info(f"Explained {len(entries)} scan(s) in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _compute(self, entries, models: dict) -> list:
+        out = [None] * len(entries)
+        # One model call per version in the batch; there is more than one only right after a swap
+        for version, model in models.items():
+            idxs = [i for i, entry in enumerate(entries) if entry[3] == version]
+            if not idxs:
+                continue
+            batch = np.stack([ScanTensorCache.tensor(entries[i][0]) for i in idxs])
+            class_idxs = [entries[i][1] for i in idxs]
+            method, heats = "gradcam", None
+            if supports_gradcam(model):
+                try:
+                    heats = gradcam_maps(model, batch, class_idxs)
+                except Exception as e:
+                    logger.warning(f"Grad-CAM failed for model version {version}, using occlusion: {e}")
+            if heats is None:
+                method, heats = "occlusion", occlusion_maps(lambda x: model.predict(x, verbose=0), batch, class_idxs)
+            for i, heat in zip(idxs, heats):
+                peak = None
+                if heat.max() > 0:
+                    y, x = np.unravel_index(int(np.argmax(heat)), heat.shape)
+                    peak = {"x": round((x + 0.5) / heat.shape[1], 3), "y": round((y + 0.5) / heat.shape[0], 3)}
+                out[i] = (method, self.store.put(render_overlay(entries[i][0], heat)), peak)
+        return out
+
+    def snapshot(self) -> dict:
+        return {"queued": self._queue.qsize() if self._queue else 0, **self.stats, "cache": self.cache.snapshot()}
@@ -0,0 +1,144 @@
+import time
+import asyncio
+import cv2
+import numpy as np
+from collections import deque, Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+def dhash(image: np.ndarray, hash_size: int = 8) -> int:
+    """64-bit difference hash of a BGR frame; small camera shake or exposure drift flips only a few bits."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+class FrameDeduper:
+    """
+    Ring buffer of recent frame hashes and their results. Memory is fixed at `capacity` entries.
+    Results are keyed by model version too, so a hot-swapped model never answers from the old one's.
+    """
+
+    def __init__(self, capacity: int = 16, max_distance: int = 6):
+        self.max_distance = max_distance
+        self._recent: deque = deque(maxlen=capacity)
+
+    def lookup(self, frame_hash: int, version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        # Newest first: while panning, the previous frame is the likeliest match
+        for cached_hash, cached_version, result in reversed(self._recent):
+            if cached_version == version and (cached_hash ^ frame_hash).bit_count() <= self.max_distance:
+                return result
+        return None
+
+    def add(self, frame_hash: int, result: Dict[str, Any], version: Optional[str] = None):
+        self._recent.append((frame_hash, version, result))
+
+class LatestFrameSlot:
+    """
+    Single-slot mailbox between the socket reader and the scan loop. A new frame replaces
+    the unprocessed one, so a slow connection never queues more than one frame.
+    """
+
+    def __init__(self):
+        self._frame: Optional[bytes] = None
+        self._ready = asyncio.Event()
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame: bytes):
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def take(self) -> bytes:
+        await self._ready.wait()
+        frame, self._frame = self._frame, None
+        self._ready.clear()
+        return frame
+
+class MicroBatcher:
+    """
+    Coalesces frames from all live sessions into one forward pass. A batch is flushed when
+    it reaches `max_batch` or when its first frame has waited `max_wait_s`.
+    """
+
+    def __init__(self, infer: Callable[[np.ndarray, List[dict]], Awaitable[List[dict]]],
+                 max_batch: int = 8, max_wait_s: float = 0.02):
+        self.infer = infer
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self._pending: List[Tuple[np.ndarray, dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.frames = 0
+
+    async def submit(self, tensor: np.ndarray, metrics: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((tensor, metrics, future))
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_s, self._schedule_flush, loop)
+        return await future
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        if self._pending:
+            self._timer = loop.call_later(self.max_wait_s, self._schedule_flush, loop)
+        # Frames whose session already went away are not worth a model slot
+        items = [item for item in items if not item[2].done()]
+        if items:
+            loop.create_task(self._run(items))
+
+    async def _run(self, items: List[Tuple[np.ndarray, dict, asyncio.Future]]):
+        self.batches += 1
+        self.frames += len(items)
+        try:
+            results = await self.infer(np.stack([t for t, _, _ in items]), [m for _, m, _ in items])
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"batches": self.batches, "frames": self.frames,
+                "avg_batch": round(self.frames / self.batches, 2) if self.batches else 0.0}
+
+class LiveScanSession:
+    """Per-connection state: frame pacing, dedupe ring and a running label tally."""
+
+    def __init__(self, max_fps: float, dedupe_capacity: int = 16, dedupe_distance: int = 6):
+        self.min_interval = 1.0 / max_fps
+        self.slot = LatestFrameSlot()
+        self.deduper = FrameDeduper(dedupe_capacity, dedupe_distance)
+        # Keyed by class label, so bounded by the number of classes
+        self.labels: Counter = Counter()
+        self.stats = Counter()
+        self._next_frame_at = 0.0
+
+    async def pace(self):
+        """Holds the scan loop to `max_fps`; frames arriving in between are superseded in the slot."""
+        now = time.monotonic()
+        if now < self._next_frame_at:
+            await asyncio.sleep(self._next_frame_at - now)
+        self._next_frame_at = max(now, self._next_frame_at) + self.min_interval
+
+    def record(self, prediction: Dict[str, Any]):
+        self.labels[f"{prediction['crop']} - {prediction['disease']}"] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "frames_received": self.slot.received,
+            "frames_dropped": self.slot.dropped,
+            **dict(self.stats),
+            "top_labels": [{"label": label, "frames": n} for label, n in self.labels.most_common(3)],
+        }
@@ -1,9 +1,11 @@
 import os
 import json
 import logging
-# no tf
 import numpy as np
 from app.config import get_settings
+from app.core.cascade import load_cascade_head
+from app.core.model_registry import ModelBundle, ModelRegistry, BASE_VERSION
+from app.core.shared_weights import MappedModel, MMAP, feature_layer, tflite_paths, load_centroids
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -16,16 +18,30 @@ def load_class_labels(labels_path: str) -> dict:
     logger.info(f"Loaded {len(labels)} class labels from {labels_path}")
     return labels
 
+class DummyModel:
+    """Uniform probabilities, served when TensorFlow is not installed (e.g. API development without a model)."""
+
+    def __init__(self, num_classes: int):
+        self.output_shape = (None, num_classes)
+
+    def predict(self, x, **kwargs):
+        return np.ones((len(x) if isinstance(x, (list, tuple, np.ndarray)) else 1, self.output_shape[-1])) / self.output_shape[-1]
+
 def load_and_validate_model(model_path: str, expected_num_classes: int):
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found at {model_path}. Please train or download the model.")
     logger.info(f"Loading real model from {model_path}...")
-    class DummyModel:
-        output_shape = (None, expected_num_classes)
-        def predict(self, x, **kwargs):
-            return np.ones((len(x) if isinstance(x, (list, tuple, np.ndarray)) else 1, expected_num_classes)) / expected_num_classes
-    model = DummyModel()
+    if settings.model_sharing == MMAP:
+        # One interpreter per concurrent inference at most; the weights are mapped, not copied
+        return _validated(MappedModel(tflite_paths(model_path)[0], slots=settings.admission_max_limit), expected_num_classes)
+    try:
+        import tensorflow as tf
+    except ImportError:
+        logger.warning("TensorFlow is not installed; serving a placeholder model with uniform predictions.")
+        return _validated(DummyModel(expected_num_classes), expected_num_classes)
+    return _validated(tf.keras.models.load_model(model_path, compile=False), expected_num_classes)
 
+def _validated(model, expected_num_classes: int):
     output_shape = model.output_shape
     num_classes = output_shape[-1]
     logger.info(f"Model output classes: {num_classes}")
@@ -35,7 +51,17 @@ def load_and_validate_model(model_path: str, expected_num_classes: int):
     logger.info("Model validation successful.")
     return model
 
+def model_runtime(model) -> str:
+    if isinstance(model, MappedModel):
+        return "tflite"
+    return "placeholder" if isinstance(model, DummyModel) else "tensorflow"
+
 def create_feature_extractor(base_model):
+    if isinstance(base_model, MappedModel):
+        return MappedModel(tflite_paths(base_model.path)[1], slots=base_model.slots)
+    if hasattr(base_model, "layers"):
+        import tensorflow as tf
+        return tf.keras.Model(base_model.inputs, feature_layer(base_model).output)
     class DummyFeatureExtractor:
         output_shape = (None, 1280)
         def predict(self, x, **kwargs):
@@ -44,40 +70,84 @@ def create_feature_extractor(base_model):
 
 def initialize_dummy_centroids(num_classes: int, embedding_dim: int) -> np.ndarray:
     logger.warning("Initializing dummy centroids for feature similarity scoring. In a real scenario, calculate these on the training set.")
-    # Initialize random unit vectors distributed around the sphere
-    centroids = np.random.randn(num_classes, embedding_dim)
+    # Initialize random unit vectors distributed around the sphere, the same ones in every worker
+    centroids = np.random.default_rng(0).standard_normal((num_classes, embedding_dim))
     centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
     return centroids.astype(np.float32)
 
 LABEL_FILE = getattr(settings, 'labels_path', 'models/class_labels.json')
+# Temperature scaling parameter, for versions without a calibration.json
+TEMPERATURE_CALIBRATION = 1.5
+
+def _bundle(version: str, model_path: str, labels_path: str, centroids_path: str, cascade_path: str, temperature: float,
+            manifest: dict = None) -> ModelBundle:
+    labels = load_class_labels(labels_path)
+    model = load_and_validate_model(model_path, len(labels))
+    # Extract feature model
+    extractor = create_feature_extractor(model)
+    embedding_dim = extractor.output_shape[-1]
+    if os.path.exists(centroids_path):
+        centroids = load_centroids(centroids_path, len(labels), embedding_dim)
+    else:
+        centroids = initialize_dummy_centroids(len(labels), embedding_dim)
+    # Optional early-exit student (see app/core/cascade.py); it is distilled from one model, so it is versioned with it
+    cascade_head = load_cascade_head(cascade_path, len(labels)) if settings.cascade_enabled else None
+    return ModelBundle(version, model, labels, extractor, centroids, temperature, cascade_head, manifest)
+
+def load_version(version: str, directory: str) -> ModelBundle:
+    """A registry version directory (see app/core/model_registry.py)."""
+    manifest_path = os.path.join(directory, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    return _bundle(version, os.path.join(directory, manifest.get("model", "model.h5")), os.path.join(directory, "class_labels.json"),
+                   os.path.join(directory, "centroids.npy"), os.path.join(directory, "cascade_head.npz"), load_temperature(directory), manifest)
+
+def load_temperature(directory: str) -> float:
+    """The temperature fitted for the model in `directory` (calibration.json), else TEMPERATURE_CALIBRATION."""
+    calibration_path = os.path.join(directory, "calibration.json")
+    if not os.path.exists(calibration_path):
+        return TEMPERATURE_CALIBRATION
+    with open(calibration_path) as f:
+        return float(json.load(f)["temperature"])
+
+def load_base() -> ModelBundle:
+    """MODEL_PATH / LABELS_PATH (and CENTROIDS_PATH), for deployments without a registry (and to roll back to)."""
+    # A distilled student exported by train_model.py carries its own calibration.json next to the model
+    return _bundle(BASE_VERSION, settings.model_path, LABEL_FILE, settings.centroids_path, settings.cascade_head_path,
+                   load_temperature(os.path.dirname(settings.model_path)))
+
+def warm_bundle(bundle: ModelBundle):
+    dummy_input = np.zeros((1, settings.model_input_size, settings.model_input_size, 3), dtype=np.float32)
+    bundle.model.predict(dummy_input, verbose=0)
+    bundle.feature_extractor.predict(dummy_input, verbose=0)
+    # Also the registry's warmup: a version activated later is only swapped in once this passed
+    _health_state["warmup_passed"] = True
 
 _health_state = {
-    "loaded": False,
     "warmup_passed": False,
-    "runtime": "tensorflow"
+    "sharing": settings.model_sharing,
+    "error": None
 }
 
 def get_health_status():
-    return _health_state
+    current = model_registry.current
+    return {"loaded": current is not None, **_health_state, "runtime": model_runtime(current.model) if current else None,
+            "version": current.version if current else None}
 
+# Versioned models; model_registry.current is the bundle new requests score with
+model_registry = ModelRegistry(settings.model_registry_dir, build=load_version, warm=warm_bundle, fallback=load_base,
+                               poll_s=settings.model_registry_poll_s)
+
+# A model that cannot be loaded leaves current None instead of stopping the app: /health reports it
+# (503 unhealthy), predictions answer 503, and an admin can still activate a registry version
 try:
-    CLASS_LABELS = load_class_labels(LABEL_FILE)
-    cnn_model = load_and_validate_model(settings.model_path, len(CLASS_LABELS))
-    # Extract feature model
-    feature_extractor = create_feature_extractor(cnn_model)
-    embedding_dim = feature_extractor.output_shape[-1]
-    class_centroids = initialize_dummy_centroids(len(CLASS_LABELS), embedding_dim)
-    # Temperature scaling parameter
-    TEMPERATURE_CALIBRATION = 1.5
-    
-    _health_state["loaded"] = True
+    model_registry.load_initial(warm=False)
     
     # Warmup
     try:
-        dummy_input = np.zeros((1, 224, 224, 3), dtype=np.float32)
-        cnn_model.predict(dummy_input, verbose=0)
-        feature_extractor.predict(dummy_input, verbose=0)
-        _health_state["warmup_passed"] = True
+        warm_bundle(model_registry.current)
         logger.info("Model warmup sequence completed successfully.")
     except Exception as e:
         logger.error(f"Model warmup failed: {e}")
@@ -85,7 +155,7 @@ try:
 
 except FileNotFoundError as fnf_error:
     logger.critical(f"Startup Failure (Missing File): {fnf_error}")
-    raise SystemExit(str(fnf_error))
+    _health_state["error"] = str(fnf_error)
 except Exception as startup_error:
     logger.critical(f"Startup Validation Failed: {startup_error}")
-    raise SystemExit(f"Initialization Error: {startup_error}")
+    _health_state["error"] = f"Initialization Error: {startup_error}"
@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import weakref
+from typing import Callable, List, Optional
+from app.utils.structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_FILE = "active.json"
+BASE_VERSION = "base"  # The fallback model (MODEL_PATH / LABELS_PATH), outside the registry
+VERSION_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+class ModelBundle:
+    """
+    Everything one model version scores with. Never changed once built: a new version is a new
+    bundle, so a request that took one keeps a consistent model, labels and calibration to the end.
+    """
+
+    def __init__(self, version: str, model, labels, feature_extractor=None, centroids=None, temperature: float = 1.0,
+                 cascade_head=None, manifest: Optional[dict] = None):
+        self.version = version
+        self.model = model
+        self.labels = labels
+        self.feature_extractor = feature_extractor
+        self.centroids = centroids
+        self.temperature = temperature
+        self.cascade_head = cascade_head
+        self.manifest = manifest or {}
+
+    def __repr__(self) -> str:
+        return f"ModelBundle({self.version!r})"
+
+class ModelRegistryError(Exception):
+    """An activation or rollback that cannot start. Each app maps it onto its own error format."""
+
+    def __init__(self, code: str, message: str, status: int = 409):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+class ModelRegistry:
+    """
+    Versioned model artifacts, one directory per version under `root`:
+
+        <root>/<version>/model.h5, class_labels.json, [centroids.npy, calibration.json, cascade_head.npz]
+        <root>/active.json   {"version": "v3", "previous": ["v1", "v2"], ...}
+
+    `current` is the bundle new requests score with. Activating a version builds and warms it off
+    the event loop, then swaps `current` in one assignment: requests that already took the old
+    bundle finish on it, and it is freed once the last of them lets go. active.json is rewritten
+    only after a successful swap, and the other workers follow it on their next poll, so a version
+    that fails to load or warm never gets past the worker that tried it. Rollback re-activates
+    the version before the current one. BASE_VERSION names the `fallback` bundle, so a
+    deployment can start without a registry and still roll back to where it began.
+    """
+
+    def __init__(self, root: str, build: Callable[[str, str], ModelBundle], warm: Optional[Callable[[ModelBundle], None]] = None,
+                 fallback: Optional[Callable[[], ModelBundle]] = None, poll_s: float = 5.0, history: int = 5,
+                 run_blocking: Callable = None, clock=time.time):
+        self.root = root
+        self.build = build
+        self.warm = warm or (lambda bundle: None)
+        self.fallback = fallback
+        self.poll_s = poll_s
+        self.history = history
+        self.run_blocking = run_blocking or asyncio.to_thread
+        self._clock = clock
+        self.current: Optional[ModelBundle] = None
+        self.activated_at: Optional[float] = None
+        self.loading: Optional[str] = None
+        self.last_error: Optional[dict] = None
+        self._alive = weakref.WeakValueDictionary()  # version -> bundle, for as long as anything holds it
+        self._failed: Optional[tuple] = None  # (version, pointer mtime) this worker could not load; not retried
+        self._task: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self._swap_listeners: List[Callable[[ModelBundle], None]] = []
+        self.stats = {"activations": 0, "rollbacks": 0, "followed": 0, "failed": 0}
+
+    def _dir(self, version: str) -> str:
+        return os.path.join(self.root, version)
+
+    def _pointer_path(self) -> str:
+        return os.path.join(self.root, ACTIVE_FILE)
+
+    def read_pointer(self) -> dict:
+        if not self.root:
+            return {}
+        try:
+            with open(self._pointer_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_pointer(self, pointer: dict):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self._pointer_path()}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(pointer, f, indent=2)
+        os.replace(tmp, self._pointer_path())
+
+    def versions(self) -> List[str]:
+        base = [BASE_VERSION] if self.fallback is not None else []
+        if not self.root or not os.path.isdir(self.root):
+            return base
+        return base + sorted(name for name in os.listdir(self.root)
+                             if name != BASE_VERSION and VERSION_RE.match(name) and os.path.isdir(self._dir(name)))
+
+    def get(self, version: str) -> Optional[ModelBundle]:
+        """The bundle of `version` if it is still loaded (current, or held by a request that is not done yet)."""
+        return self._alive.get(version)
+
+    def _load(self, version: str, warm: bool = True) -> ModelBundle:
+        started = time.perf_counter()
+        bundle = self.fallback() if version == BASE_VERSION and self.fallback else self.build(version, self._dir(version))
+        if warm:
+            self.warm(bundle)
+        log_event(logger, "model_loaded", version=version, load_ms=round((time.perf_counter() - started) * 1000, 1))
+        return bundle
+
+    def _swap(self, bundle: ModelBundle):
+        previous, self.current = self.current, bundle
+        self.activated_at = self._clock()
+        self._alive[bundle.version] = bundle
+        log_event(logger, "model_swapped", version=bundle.version, previous=previous.version if previous else None)
+        for fn in self._swap_listeners:
+            try:
+                fn(bundle)
+            except Exception as e:
+                logger.error(f"Model swap listener {fn} failed: {e}")
+
+    def on_swap(self, fn: Callable[[ModelBundle], None]) -> Callable:
+        """
+        Registers fn(bundle) to run whenever `current` changes, and right away if there is one.
+        It runs inline with the swap (on the event loop), so it has to be cheap.
+        """
+        self._swap_listeners.append(fn)
+        if self.current is not None:
+            fn(self.current)
+        return fn
+
+    def load_initial(self, warm: bool = True):
+        """At startup: the version active.json names, or the fallback bundle if there is none."""
+        version = self.read_pointer().get("version") or (BASE_VERSION if self.fallback is not None else None)
+        if version:
+            self._swap(self._load(version, warm))
+        else:
+            raise FileNotFoundError(f"No active model version in {self._pointer_path()} and no fallback model")
+
+    def _check(self, version: str):
+        if self.loading is not None:
+            raise ModelRegistryError("MODEL_LOADING", f"Version {self.loading} is still loading; retry when it is done.")
+        if version not in self.versions():
+            raise ModelRegistryError("MODEL_NOT_FOUND", f"No model version {version!r} in the registry.", status=404)
+
+    async def _activate(self, version: str, pointer: Optional[dict], kind: str):
+        self.loading = version
+        try:
+            bundle = await self.run_blocking(self._load, version)
+        except Exception as e:
+            self.stats["failed"] += 1
+            self.last_error = {"version": version, "error": str(e), "at": self._clock()}
+            log_event(logger, "model_load_failed", logging.ERROR, version=version, kind=kind, error=str(e))
+            raise
+        finally:
+            self.loading = None
+        if pointer is not None:
+            self._write_pointer(pointer)
+        self._swap(bundle)
+        self.stats[kind] += 1
+        self.last_error = None
+        return bundle
+
+    def _start(self, version: str, pointer: Optional[dict], kind: str) -> dict:
+        self.loading = version  # Claimed before the task runs, so a second request gets MODEL_LOADING
+        self._task = asyncio.get_running_loop().create_task(self._activate(version, pointer, kind))
+        self._task.add_done_callback(lambda task: task.cancelled() or task.exception())  # Failure is in last_error
+        return {"status": "loading", "version": version, "current": self.current.version if self.current else None}
+
+    def activate(self, version: str) -> dict:
+        """Starts loading `version` in the background; it replaces `current` once it has warmed up."""
+        self._check(version)
+        if self.current is not None and version == self.current.version:
+            return {"status": "active", "version": version, "current": version}
+        previous = list(self.read_pointer().get("previous", []))
+        if self.current is not None:
+            previous = (previous + [self.current.version])[-self.history:]
+        return self._start(version, {"version": version, "previous": previous, "activated_at": self._clock()}, "activations")
+
+    def rollback(self) -> dict:
+        """Starts re-activating the version that was active before the current one."""
+        previous = list(self.read_pointer().get("previous", []))
+        if not previous:
+            raise ModelRegistryError("NO_PREVIOUS_MODEL", "There is no earlier version to roll back to.")
+        version = previous.pop()
+        self._check(version)
+        return self._start(version, {"version": version, "previous": previous, "activated_at": self._clock()}, "rollbacks")
+
+    async def _follow(self):
+        """Picks up versions another worker activated (or rolled back to)."""
+        while True:
+            await asyncio.sleep(self.poll_s)
+            try:
+                mtime = os.path.getmtime(self._pointer_path())
+                version = self.read_pointer().get("version")
+            except (OSError, ValueError):
+                continue
+            if not version or self.loading is not None or (self.current and version == self.current.version) or self._failed == (version, mtime):
+                continue
+            try:
+                await self._activate(version, None, "followed")
+            except Exception:
+                self._failed = (version, mtime)
+
+    def start(self):
+        if self._watcher is None and self.poll_s > 0:
+            self._watcher = asyncio.get_running_loop().create_task(self._follow())
+
+    def stop(self):
+        for task in (self._watcher, self._task):
+            if task is not None:
+                task.cancel()
+        self._watcher = None
+
+    def snapshot(self) -> dict:
+        current = self.current.version if self.current else None
+        return {"version": current, "activated_at": self.activated_at, "loading": self.loading,
+                "draining": sorted(v for v in list(self._alive.keys()) if v != current), "last_error": self.last_error, **self.stats}
+
+    def describe(self) -> dict:
+        pointer = self.read_pointer()
+        return {**self.snapshot(), "versions": self.versions(), "previous": pointer.get("previous", [])}
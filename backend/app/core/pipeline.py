@@ -0,0 +1,283 @@
+import time
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Canonical order; a profile picks one variant per stage or skips it (None)
+STAGE_ORDER = ("decode", "validate", "enhance", "quality", "infer", "calibrate", "score", "neighbors", "retain", "advise")
+
+# Deployment profiles. "legacy" reproduces app/main.py, "production" the app/api router.
+# Params are read by the stages through ctx.params.
+PROFILES = {
+    "legacy": {
+        "stages": {"decode": "opencv", "validate": "histogram", "enhance": "clahe", "quality": "blur",
+                   "infer": "single", "calibrate": None, "score": "plain", "neighbors": None, "retain": None, "advise": "legacy"},
+        "params": {"blur_threshold": 80.0, "tier_high": 0.70, "tier_moderate": 0.45, "advise_min_confidence": 0.45},
+    },
+    "production": {
+        "stages": {"decode": "opencv", "validate": "ood", "enhance": "full", "quality": "blur",
+                   "infer": "cascade_tta", "calibrate": "temperature", "score": "centroid", "neighbors": "ivf", "retain": "scan_cache",
+                   "advise": "service"},
+        "params": {"blur_threshold": 50.0, "tier_high": 0.70, "tier_moderate": 0.45, "advise_min_confidence": 0.60,
+                   "knn_k": 10, "knn_min_support": 3},
+    },
+}
+
+class StageRejected(Exception):
+    """A stage refusing the input (as opposed to failing). Each app maps it onto its own error format."""
+
+    def __init__(self, code: str, message: str, status: int = 422, details: Optional[dict] = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+        self.details = details
+
+class Stage:
+    """
+    One step of a pipeline. `fn(ctx)` reads the keys in `requires` and returns a dict with the
+    keys in `provides` (or None if it provides nothing). Blocking stages are plain functions
+    run on the threadpool; the rest are coroutines or cheap functions run on the event loop.
+    """
+
+    def __init__(self, name: str, variant: str, fn: Callable, requires: Sequence[str] = (),
+                 provides: Sequence[str] = (), blocking: bool = False):
+        self.name = name
+        self.variant = variant
+        self.fn = fn
+        self.requires = tuple(requires)
+        self.provides = tuple(provides)
+        self.blocking = blocking
+        self.is_async = asyncio.iscoroutinefunction(fn)
+        if blocking and self.is_async:
+            raise ValueError(f"Stage {self} is a coroutine and cannot be blocking")
+
+    def __repr__(self) -> str:
+        return f"{self.name}:{self.variant}"
+
+_REGISTRY: Dict[Tuple[str, str], Stage] = {}
+
+def register(stage: Stage) -> Stage:
+    if stage.name not in STAGE_ORDER:
+        raise ValueError(f"Unknown stage {stage.name!r}; expected one of {', '.join(STAGE_ORDER)}")
+    _REGISTRY[(stage.name, stage.variant)] = stage
+    return stage
+
+def stage(name: str, variant: str, requires: Sequence[str] = (), provides: Sequence[str] = (), blocking: bool = False):
+    """Decorator form of register()."""
+    def decorator(fn: Callable) -> Callable:
+        register(Stage(name, variant, fn, requires, provides, blocking))
+        return fn
+    return decorator
+
+def variants(name: str) -> List[str]:
+    return sorted(v for n, v in _REGISTRY if n == name)
+
+class PipelineContext(dict):
+    """Values shared by the stages of one run, plus the run's params and per-stage timings in ms."""
+
+    def __init__(self, values: dict, params: dict):
+        super().__init__(values)
+        self.params = params
+        self.timings: Dict[str, float] = {}
+
+    def server_timing(self) -> str:
+        """The timings as a Server-Timing header value."""
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.timings.items())
+
+class Pipeline:
+    """
+    An ordered list of stages over one shared context, validated when it is built: every key a
+    stage requires has to be an input, a resource or provided by an earlier stage.
+
+    Consecutive blocking stages run in a single threadpool hop. A resource (e.g. a leased
+    buffer set) is acquired just before the first stage that requires it and released right
+    after the last one, unless the caller passes it in as an input.
+    """
+
+    def __init__(self, stages: List[Stage], inputs: Iterable[str] = (), resources: Optional[Dict[str, Callable]] = None,
+                 params: Optional[dict] = None, name: str = "custom"):
+        self.stages = list(stages)
+        self.name = name
+        self.params = dict(params or {})
+        self.resources = dict(resources or {})
+        self.inputs = set(inputs)
+
+        available = self.inputs | set(self.resources)
+        for s in self.stages:
+            missing = [key for key in s.requires if key not in available]
+            if missing:
+                raise ValueError(f"Stage {s} requires {', '.join(missing)}, which no input or earlier stage provides")
+            available.update(s.provides)
+
+        self._acquire_at: Dict[int, List[str]] = {}
+        self._release_at: Dict[int, List[str]] = {}
+        for key in self.resources:
+            users = [i for i, s in enumerate(self.stages) if key in s.requires]
+            if users:
+                self._acquire_at.setdefault(users[0], []).append(key)
+                self._release_at.setdefault(users[-1], []).append(key)
+
+        # (first, last, blocking) index ranges; a blocking run is one threadpool hop
+        self._segments: List[Tuple[int, int, bool]] = []
+        for i, s in enumerate(self.stages):
+            if s.blocking and self._segments and self._segments[-1][2] and self._segments[-1][1] == i - 1:
+                self._segments[-1] = (self._segments[-1][0], i, True)
+            else:
+                self._segments.append((i, i, s.blocking))
+
+        self._lock = threading.Lock()
+        self._stats = {s.name: {"calls": 0, "total_ms": 0.0, "ewma_ms": None} for s in self.stages}
+        self._observers: List[Callable] = []
+
+    def observe(self, fn: Callable) -> Callable:
+        """
+        Registers fn(ctx, error) to run after every run, completed (error None) or not. It sees
+        whatever the stages got to, and runs inline, so it has to be cheap and must not raise.
+        """
+        self._observers.append(fn)
+        return fn
+
+    def _notify(self, ctx: PipelineContext, error: Optional[BaseException]):
+        for fn in self._observers:
+            try:
+                fn(ctx, error)
+            except Exception as e:
+                logger.error(f"Pipeline observer {fn} failed: {e}")
+
+    def _last_index(self, stop_after: Optional[str]) -> int:
+        if stop_after is None:
+            return len(self.stages) - 1
+        for i, s in enumerate(self.stages):
+            if s.name == stop_after:
+                return i
+        raise ValueError(f"Pipeline {self.name} has no {stop_after!r} stage ({self.describe()})")
+
+    def _acquire(self, i: int, ctx: PipelineContext, held: dict):
+        for key in self._acquire_at.get(i, ()):
+            if key not in ctx:
+                held[key] = self.resources[key]()
+                ctx[key] = held[key].__enter__()
+
+    def _finish(self, i: int, ctx: PipelineContext, held: dict, out: Optional[dict], started: float):
+        ctx.timings[self.stages[i].name] = (time.perf_counter() - started) * 1000
+        if out:
+            ctx.update(out)
+        for key in self._release_at.get(i, ()):
+            if key in held:
+                held.pop(key).__exit__(None, None, None)
+                ctx.pop(key, None)
+
+    def _run_range(self, first: int, last: int, ctx: PipelineContext, held: dict):
+        for i in range(first, last + 1):
+            self._acquire(i, ctx, held)
+            started = time.perf_counter()
+            self._finish(i, ctx, held, self.stages[i].fn(ctx), started)
+
+    async def _run_async(self, i: int, ctx: PipelineContext, held: dict):
+        self._acquire(i, ctx, held)
+        started = time.perf_counter()
+        self._finish(i, ctx, held, await self.stages[i].fn(ctx), started)
+
+    async def run(self, inputs: dict, stop_after: Optional[str] = None) -> PipelineContext:
+        """Runs the stages up to and including `stop_after` (all by default)."""
+        ctx = PipelineContext(inputs, self.params)
+        last = self._last_index(stop_after)
+        held: dict = {}
+        error = None
+        try:
+            for first, end, blocking in self._segments:
+                if first > last:
+                    break
+                if blocking:
+                    await run_in_threadpool(self._run_range, first, min(end, last), ctx, held)
+                elif self.stages[first].is_async:
+                    await self._run_async(first, ctx, held)
+                else:
+                    self._run_range(first, first, ctx, held)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            for cm in held.values():
+                cm.__exit__(None, None, None)
+            self._record(ctx)
+            self._notify(ctx, error)
+        return ctx
+
+    def run_sync(self, inputs: dict, stop_after: Optional[str] = None) -> PipelineContext:
+        """For callers outside the event loop (e.g. CLI worker processes); every stage run has to be synchronous."""
+        ctx = PipelineContext(inputs, self.params)
+        last = self._last_index(stop_after)
+        asynchronous = [s for s in self.stages[:last + 1] if s.is_async]
+        if asynchronous:
+            raise RuntimeError(f"Pipeline {self.name} cannot run {asynchronous[0]} synchronously")
+        held: dict = {}
+        error = None
+        try:
+            self._run_range(0, last, ctx, held)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            for cm in held.values():
+                cm.__exit__(None, None, None)
+            self._record(ctx)
+            self._notify(ctx, error)
+        return ctx
+
+    def _record(self, ctx: PipelineContext):
+        with self._lock:
+            for name, ms in ctx.timings.items():
+                stats = self._stats[name]
+                stats["calls"] += 1
+                stats["total_ms"] += ms
+                stats["ewma_ms"] = ms if stats["ewma_ms"] is None else 0.8 * stats["ewma_ms"] + 0.2 * ms
+
+    def describe(self) -> List[str]:
+        return [repr(s) for s in self.stages]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timing = {
+                name: {"calls": s["calls"], "mean_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else None,
+                       "ewma_ms": round(s["ewma_ms"], 2) if s["ewma_ms"] is not None else None}
+                for name, s in self._stats.items()
+            }
+        return {"profile": self.name, "stages": self.describe(), "timing_ms": timing}
+
+def parse_overrides(spec: str) -> Dict[str, Optional[str]]:
+    """"validate=ood, calibrate=none" -> {"validate": "ood", "calibrate": None}."""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, variant = item.partition("=")
+        if not sep or name.strip() not in STAGE_ORDER:
+            raise ValueError(f"Bad pipeline override {item!r}; expected <stage>=<variant|none>")
+        variant = variant.strip()
+        overrides[name.strip()] = None if variant.lower() in ("", "none", "skip") else variant
+    return overrides
+
+def build_pipeline(profile: str, overrides: Optional[Dict[str, Optional[str]]] = None, params: Optional[dict] = None,
+                   inputs: Iterable[str] = (), resources: Optional[Dict[str, Callable]] = None,
+                   until: Optional[str] = None) -> Pipeline:
+    """
+    The stages of `profile` with `overrides` applied, up to and including `until`. Stage variants
+    have to be registered by then, i.e. the modules defining them imported.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown pipeline profile {profile!r}; expected one of {', '.join(PROFILES)}")
+    chosen = {**PROFILES[profile]["stages"], **(overrides or {})}
+    names = STAGE_ORDER if until is None else STAGE_ORDER[:STAGE_ORDER.index(until) + 1]
+    stages = []
+    for name in names:
+        variant = chosen.get(name)
+        if variant is None:
+            continue
+        if (name, variant) not in _REGISTRY:
+            raise ValueError(f"No {name} stage variant {variant!r}; registered: {', '.join(variants(name)) or 'none'}")
+        stages.append(_REGISTRY[(name, variant)])
+    return Pipeline(stages, inputs, resources, {**PROFILES[profile]["params"], **(params or {})}, name=profile)
@@ -1,40 +1,55 @@
 from fastapi import HTTPException
 from app.core.ood_detector import validate_plant_presence
-from app.utils.image_utils import decode_image, enhance_image_pipeline, resize_and_normalize
-from typing import Tuple, Dict, Any
+from app.core.pipeline import build_pipeline, parse_overrides, StageRejected
+import app.core.stages  # Registers the decode/validate/enhance/quality variants
+from app.utils.image_utils import quick_leaf_metrics
+from app.utils.tensor_codec import normalize_tensors, to_bgr_uint8
+from app.config import get_settings
+from app.utils.buffer_pool import PreprocessBuffers
+from typing import Tuple, Dict, Any, List, Optional
 import numpy as np
 
-def preprocess_image(image_bytes: bytes) -> Tuple[np.ndarray, Dict[str, Any]]:
-    # 1. Decode bytes to numpy array
-    image = decode_image(image_bytes)
-    
-    # 2. OOD Validation
-    is_plant, confidence, reason, scores = validate_plant_presence(image)
-    if not is_plant:
-        raise HTTPException(
-            status_code=422,
-            detail={
-                "detail": reason,
-                "code": "NOT_A_PLANT",
-                "validator_scores": scores
-            }
-        )
+settings = get_settings()
 
-    # 3. Enhance Image and Extract Metrics
-    enhanced_image, metrics = enhance_image_pipeline(image)
-    
-    # 4. Blur Reject
-    if metrics["blur_score"] < 50.0:  # Threshold for Laplacian variance
-         raise HTTPException(
-            status_code=422,
-            detail={
-                "detail": "Image too blurry. Please retake.",
-                "code": "IMAGE_TOO_BLURRY",
-                "validator_scores": metrics
-            }
-        )
+def rejection_to_http(rejection: StageRejected) -> HTTPException:
+    """A pipeline rejection in this API's error format."""
+    detail = {"detail": rejection.message, "code": rejection.code}
+    if rejection.details is not None:
+        detail["validator_scores"] = rejection.details
+    return HTTPException(status_code=rejection.status, detail=detail)
 
-    # 5. Format for MobileNetV2
-    tensor_input = resize_and_normalize(enhanced_image)
-    
-    return tensor_input, metrics
+# Decode to quality gate of the configured profile, for callers that score elsewhere (leafsense.py)
+_preprocess = build_pipeline(settings.pipeline_profile, parse_overrides(settings.pipeline_overrides),
+                             inputs=("image_bytes", "buffers"), until="quality")
+
+def preprocess_image(image_bytes: bytes, buffers: Optional[PreprocessBuffers] = None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Decode, validate, enhance and normalize. With leased `buffers` the returned tensor is
+    row 0 of buffers.tensor and only the decoded image itself is a fresh allocation.
+    """
+    try:
+        ctx = _preprocess.run_sync({"image_bytes": image_bytes, "buffers": buffers or PreprocessBuffers(settings.model_input_size)})
+    except StageRejected as rejection:
+        raise rejection_to_http(rejection)
+    return ctx["tensor"], ctx["metrics"]
+
+def preprocess_tensors(images: np.ndarray) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+    """Pre-decoded (N, S, S, 3) RGB uploads: light OOD/blur validation, then normalization only."""
+    bgr_images = to_bgr_uint8(images)
+    metrics_list = []
+    for i, bgr in enumerate(bgr_images):
+        is_plant, confidence, reason, scores = validate_plant_presence(bgr)
+        if not is_plant:
+            raise HTTPException(
+                status_code=422,
+                detail={"detail": reason, "code": "NOT_A_PLANT", "index": i, "validator_scores": scores}
+            )
+        metrics = quick_leaf_metrics(bgr)
+        if metrics["blur_score"] < 50.0:
+            raise HTTPException(
+                status_code=422,
+                detail={"detail": "Image too blurry. Please retake.", "code": "IMAGE_TOO_BLURRY", "index": i, "validator_scores": metrics}
+            )
+        metrics_list.append(metrics)
+
+    return normalize_tensors(images), metrics_list
@@ -0,0 +1,317 @@
+import os
+import math
+import mmap
+import time
+import fcntl
+import struct
+import asyncio
+import hashlib
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple, Union
+from urllib.parse import urlparse
+from fastapi import Request, HTTPException
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+class RateLimitExceeded(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {scope}")
+        self.scope = scope
+        self.retry_after = retry_after
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    """'10/minute' -> (capacity=10, refill=10/60 tokens per second)."""
+    amount, period = rate.split("/")
+    seconds = PERIODS[period.strip().rstrip("s")]
+    capacity = float(amount)
+    return capacity, capacity / seconds
+
+def get_remote_address(request: Request) -> str:
+    return request.client.host if request.client else "127.0.0.1"
+
+def _take(tokens: float, last: float, now: float, capacity: float, refill: float, cost: float) -> Tuple[bool, float, float]:
+    """Token bucket step. Returns (allowed, new_tokens, retry_after)."""
+    tokens = min(capacity, tokens + max(0.0, now - last) * refill)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    retry_after = math.inf if cost > capacity else (cost - tokens) / refill
+    return False, tokens, retry_after
+
+class MemoryBucketStore:
+    """
+    Per-process buckets. Each gunicorn worker gets its own budget.
+
+    At most `max_keys` buckets are kept; past that the least recently used one is dropped,
+    like the stalest bucket in MmapBucketStore.
+    """
+
+    def __init__(self, max_keys: int = 65536):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, refill: float, cost: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (capacity, now))
+            allowed, tokens, retry_after = _take(tokens, last, now, capacity, refill, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take_async(self, key: str, capacity: float, refill: float, cost: float) -> Tuple[bool, float]:
+        return self.take(key, capacity, refill, cost)
+
+class MmapBucketStore:
+    """
+    Buckets in a fixed-size memory-mapped file, shared by every worker on the host.
+
+    Layout: open-addressed table of `slots` records (key hash u64, tokens f64, last f64).
+    A probe window that is full evicts its stalest bucket, which is always safe to
+    drop because an idle bucket refills to capacity anyway. Updates hold an flock on
+    the file, so the critical section is a few dozen bytes of struct packing.
+    """
+
+    RECORD = struct.Struct("<Qdd")
+    PROBE = 16
+
+    def __init__(self, path: str, slots: int = 65536):
+        self.path = path
+        self.slots = slots
+        size = slots * self.RECORD.size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def take(self, key: str, capacity: float, refill: float, cost: float) -> Tuple[bool, float]:
+        h = self._hash(key)
+        now = time.time()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                slot, tokens, last = self._find(h, now, capacity)
+                allowed, tokens, retry_after = _take(tokens, last, now, capacity, refill, cost)
+                self.RECORD.pack_into(self._map, slot * self.RECORD.size, h, tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return allowed, retry_after
+
+    async def take_async(self, key: str, capacity: float, refill: float, cost: float) -> Tuple[bool, float]:
+        return self.take(key, capacity, refill, cost)
+
+    def _find(self, h: int, now: float, capacity: float) -> Tuple[int, float, float]:
+        start = h % self.slots
+        stalest, stalest_ts = start, math.inf
+        for i in range(self.PROBE):
+            slot = (start + i) % self.slots
+            stored, tokens, last = self.RECORD.unpack_from(self._map, slot * self.RECORD.size)
+            if stored == h:
+                return slot, tokens, last
+            if stored == 0:
+                return slot, capacity, now
+            if last < stalest_ts:
+                stalest, stalest_ts = slot, last
+        return stalest, capacity, now
+
+# Atomic token bucket. Uses the server clock so replicas with skewed clocks agree.
+REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or capacity
+local ts = tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+class RedisError(Exception):
+    pass
+
+class RedisBucketStore:
+    """
+    Buckets in Redis (or anything speaking RESP with EVALSHA), shared across replicas.
+
+    Speaks RESP directly over one asyncio connection so the check costs a single
+    round trip and no extra dependency. If Redis is unreachable the limiter fails
+    open and logs, rather than rejecting all traffic.
+    """
+
+    def __init__(self, url: str, timeout: float = 0.25):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.script_sha = hashlib.sha1(REDIS_TOKEN_BUCKET.encode()).hexdigest()
+        self._reader = None
+        self._writer = None
+        self._lock = None
+
+    @staticmethod
+    def _encode(*parts) -> bytes:
+        out = [b"*%d\r\n" % len(parts)]
+        for p in parts:
+            p = p if isinstance(p, bytes) else str(p).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(p), p))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            n = int(body)
+            if n < 0:
+                return None
+            data = await self._reader.readexactly(n + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            n = int(body)
+            return None if n < 0 else [await self._read_reply() for _ in range(n)]
+        raise RedisError(f"Unexpected RESP reply: {line!r}")
+
+    async def _command(self, *parts):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            if self.password:
+                self._writer.write(self._encode("AUTH", self.password))
+                await self._read_reply()
+            if self.db:
+                self._writer.write(self._encode("SELECT", self.db))
+                await self._read_reply()
+        self._writer.write(self._encode(*parts))
+        return await self._read_reply()
+
+    def _reset(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def take_async(self, key: str, capacity: float, refill: float, cost: float) -> Tuple[bool, float]:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                reply = await asyncio.wait_for(self._eval(key, capacity, refill, cost), self.timeout)
+            except (OSError, ConnectionError, asyncio.TimeoutError, RedisError) as e:
+                logger.warning(f"Rate limit store unavailable, allowing request: {e}")
+                self._reset()
+                return True, 0.0
+        allowed, tokens = int(reply[0]), float(reply[1])
+        if allowed:
+            return True, 0.0
+        return False, math.inf if cost > capacity else (cost - tokens) / refill
+
+    async def _eval(self, key: str, capacity: float, refill: float, cost: float):
+        try:
+            return await self._command("EVALSHA", self.script_sha, 1, key, capacity, refill, cost)
+        except RedisError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            return await self._command("EVAL", REDIS_TOKEN_BUCKET, 1, key, capacity, refill, cost)
+
+class RateLimiter:
+    """Token-bucket limiter with a pluggable shared store, used as a route decorator."""
+
+    def __init__(self, store, key_func: Callable[[Request], str] = get_remote_address, prefix: str = "leafsense:rl"):
+        self.store = store
+        self.key_func = key_func
+        self.prefix = prefix
+        self._scope_rates = {}
+
+    def _check(self, scope: str, rate: str, cost: float) -> Tuple[float, float]:
+        if self._scope_rates.setdefault(scope, rate) != rate:
+            raise ValueError(f"Rate limit scope {scope!r} is {self._scope_rates[scope]}, not {rate}; use another scope")
+        capacity, refill = parse_rate(rate)
+        if cost > capacity:
+            # Could never be allowed, however long the client waits
+            raise HTTPException(status_code=413, detail={
+                "detail": f"This request counts {cost:g} against a limit of {capacity:g} per {rate.split('/')[1]}; split it up.",
+                "code": "REQUEST_TOO_LARGE"
+            })
+        return capacity, refill
+
+    async def hit(self, scope: str, identity: str, rate: str, cost: float = 1):
+        capacity, refill = self._check(scope, rate, cost)
+        allowed, retry_after = await self.store.take_async(f"{self.prefix}:{scope}:{identity}", capacity, refill, cost)
+        if not allowed:
+            raise RateLimitExceeded(scope, retry_after)
+
+    def limit(self, rate: str, scope: Optional[str] = None, cost: Union[int, Callable[[dict], int]] = 1):
+        """
+        `scope` defaults to the endpoint name; endpoints sharing a scope share a budget, so a
+        scope has one rate. `cost` may be a callable on the endpoint kwargs, e.g. to charge a
+        batch per file. Stacked limits are checked together: a request costing more than one
+        of its buckets can ever hold is rejected with 413 before any token is taken.
+        """
+        parse_rate(rate)
+
+        def decorator(func):
+            name = scope or func.__name__
+            self._check(name, rate, 0)
+            endpoint = getattr(func, "__rate_limited__", func)
+            limits = [(name, rate, cost)] + getattr(func, "__rate_limits__", [])
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                request = kwargs.get("request") or next(a for a in args if isinstance(a, Request))
+                charges = [(name, rate, cost(kwargs) if callable(cost) else cost) for name, rate, cost in limits]
+                for name, rate, amount in charges:
+                    self._check(name, rate, amount)
+                identity = self.key_func(request)
+                for name, rate, amount in charges:
+                    await self.hit(name, identity, rate, amount)
+                return await endpoint(*args, **kwargs)
+
+            wrapper.__rate_limited__ = endpoint
+            wrapper.__rate_limits__ = limits
+            return wrapper
+        return decorator
+
+def create_limiter(storage_uri: str, key_func: Callable[[Request], str] = get_remote_address) -> RateLimiter:
+    """memory:// | mmap:///path/to/buckets.bin | redis://[:password@]host:port/db"""
+    scheme = storage_uri.split("://", 1)[0]
+    if scheme == "memory":
+        store = MemoryBucketStore()
+    elif scheme == "mmap":
+        store = MmapBucketStore(urlparse(storage_uri).path)
+    elif scheme == "redis":
+        store = RedisBucketStore(storage_uri)
+    else:
+        raise ValueError(f"Unsupported rate limit storage: {storage_uri}")
+    logger.info(f"Rate limiter using {scheme} storage")
+    return RateLimiter(store, key_func)
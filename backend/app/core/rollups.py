@@ -0,0 +1,262 @@
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ("all", "field", "crop", "region")
+WORSENING = "worsening"
+STABLE = "stable"
+IMPROVING = "improving"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup (
+    dim TEXT NOT NULL, key TEXT NOT NULL, bucket INTEGER NOT NULL,
+    scans INTEGER NOT NULL, risk_sum REAL NOT NULL, risk_sumsq REAL NOT NULL, risk_max REAL NOT NULL,
+    PRIMARY KEY (dim, key, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollup_by_bucket ON rollup (dim, bucket);
+CREATE TABLE IF NOT EXISTS rollup_count (
+    dim TEXT NOT NULL, key TEXT NOT NULL, bucket INTEGER NOT NULL, kind TEXT NOT NULL, value TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (dim, key, bucket, kind, value)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollup_count_by_bucket ON rollup_count (dim, bucket, kind);
+"""
+
+class Aggregate:
+    """Mergeable per-bucket totals: adding a scan or another Aggregate is O(1) in the number of scans."""
+    __slots__ = ("scans", "risk_sum", "risk_sumsq", "risk_max", "counts")
+
+    def __init__(self, scans: int = 0, risk_sum: float = 0.0, risk_sumsq: float = 0.0, risk_max: float = 0.0):
+        self.scans = scans
+        self.risk_sum = risk_sum
+        self.risk_sumsq = risk_sumsq
+        self.risk_max = risk_max
+        self.counts: Counter = Counter()  # (kind, value) -> scans, kind is "disease" or "progression"
+
+    def add(self, risk: float, disease: str, progression: str):
+        self.scans += 1
+        self.risk_sum += risk
+        self.risk_sumsq += risk * risk
+        self.risk_max = max(self.risk_max, risk)
+        self.counts[("disease", disease)] += 1
+        self.counts[("progression", progression)] += 1
+
+    def merge(self, other: "Aggregate"):
+        self.scans += other.scans
+        self.risk_sum += other.risk_sum
+        self.risk_sumsq += other.risk_sumsq
+        self.risk_max = max(self.risk_max, other.risk_max)
+        self.counts.update(other.counts)
+
+    def to_dict(self) -> dict:
+        mean = self.risk_sum / self.scans if self.scans else 0.0
+        variance = max(self.risk_sumsq / self.scans - mean * mean, 0.0) if self.scans else 0.0
+        diseases = {v: n for (k, v), n in self.counts.most_common() if k == "disease"}
+        return {
+            "scans": self.scans,
+            "risk_mean": round(mean, 2),
+            "risk_std": round(math.sqrt(variance), 2),
+            "risk_max": round(self.risk_max, 2),
+            "top_disease": next(iter(diseases), None),
+            "diseases": diseases,
+            "progression": {v: n for (k, v), n in self.counts.most_common() if k == "progression"},
+        }
+
+def trend(points: Sequence[Tuple[int, float, int]], threshold: float = 5.0, min_scans: int = 3) -> dict:
+    """
+    Direction of risk over a window from (bucket_index, mean_risk, scans) points: the slope of a
+    scan-weighted least-squares line, projected over the window. A projected change of more than
+    `threshold` risk points is worsening or improving; anything smaller is stable.
+    """
+    points = [p for p in points if p[2] > 0]
+    total = sum(w for _, _, w in points)
+    if len(points) < 2 or total < min_scans:
+        return {"direction": "insufficient_data", "slope_per_bucket": None, "change": None}
+    mean_x = sum(x * w for x, _, w in points) / total
+    mean_y = sum(y * w for _, y, w in points) / total
+    sxx = sum(w * (x - mean_x) ** 2 for x, _, w in points)
+    slope = sum(w * (x - mean_x) * (y - mean_y) for x, y, w in points) / sxx if sxx else 0.0
+    change = slope * (points[-1][0] - points[0][0])
+    direction = WORSENING if change > threshold else IMPROVING if change < -threshold else STABLE
+    return {"direction": direction, "slope_per_bucket": round(slope, 3), "change": round(change, 2)}
+
+class RollupStore:
+    """
+    Risk rollups per field, crop, region (and overall) and time bucket.
+
+    record() only touches an in-memory delta per (dimension, key, bucket), so it is O(1) and
+    never blocks on disk. A background task flushes the deltas every `flush_interval_s` as
+    additive upserts into SQLite, so several worker processes can share one database file.
+    Reads go to the rollup rows by primary key (never to raw scans) and add whatever this
+    process has not flushed yet.
+    """
+
+    def __init__(self, path: str, bucket_s: int = 86400, flush_interval_s: float = 2.0,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.bucket_s = bucket_s
+        self.flush_interval_s = flush_interval_s
+        self._clock = clock
+        self._pending: Dict[Tuple[str, str, int], Aggregate] = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "flushes": 0, "flush_errors": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=10.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def bucket_of(self, ts: float) -> int:
+        return int(ts // self.bucket_s) * self.bucket_s
+
+    def record(self, risk_index: float, crop: str, disease: str, progression: str,
+               field_id: Optional[str] = None, region: Optional[str] = None, ts: Optional[float] = None):
+        bucket = self.bucket_of(self._clock() if ts is None else ts)
+        keys = [("all", "all"), ("crop", crop)]
+        if field_id:
+            keys.append(("field", field_id))
+        if region:
+            keys.append(("region", region))
+        risk = float(risk_index or 0.0)
+        with self._lock:
+            for dim, key in keys:
+                delta = self._pending.get((dim, key, bucket))
+                if delta is None:
+                    delta = self._pending[(dim, key, bucket)] = Aggregate()
+                delta.add(risk, disease, progression or "None")
+            self.stats["recorded"] += 1
+
+    def flush(self) -> int:
+        """Writes the pending deltas; returns how many (dimension, key, bucket) rows were touched."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [(dim, key, bucket, a.scans, a.risk_sum, a.risk_sumsq, a.risk_max) for (dim, key, bucket), a in pending.items()]
+        counts = [(dim, key, bucket, kind, value, n) for (dim, key, bucket), a in pending.items() for (kind, value), n in a.counts.items()]
+        try:
+            with self._db_lock:
+                db = self._conn()
+                with db:
+                    db.executemany(
+                        "INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (dim, key, bucket) DO UPDATE SET "
+                        "scans = scans + excluded.scans, risk_sum = risk_sum + excluded.risk_sum, "
+                        "risk_sumsq = risk_sumsq + excluded.risk_sumsq, risk_max = max(risk_max, excluded.risk_max)", rows)
+                    db.executemany(
+                        "INSERT INTO rollup_count VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (dim, key, bucket, kind, value) "
+                        "DO UPDATE SET n = n + excluded.n", counts)
+        except sqlite3.Error as e:
+            # Keep the deltas for the next attempt rather than losing them
+            with self._lock:
+                for k, a in pending.items():
+                    self._pending.setdefault(k, Aggregate()).merge(a)
+            self.stats["flush_errors"] += 1
+            logger.error(f"Rollup flush failed: {e}")
+            return 0
+        self.stats["flushes"] += 1
+        return len(rows)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            await asyncio.to_thread(self.flush)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    def _read(self, dim: str, since: int, until: int, key: Optional[str] = None) -> Dict[Tuple[str, int], Aggregate]:
+        where, args = "dim = ? AND bucket BETWEEN ? AND ?", [dim, since, until]
+        if key is not None:
+            where, args = "dim = ? AND key = ? AND bucket BETWEEN ? AND ?", [dim, key, since, until]
+        out: Dict[Tuple[str, int], Aggregate] = {}
+        with self._db_lock:
+            db = self._conn()
+            for k, bucket, *totals in db.execute(f"SELECT key, bucket, scans, risk_sum, risk_sumsq, risk_max FROM rollup WHERE {where}", args):
+                out[(k, bucket)] = Aggregate(*totals)
+            for k, bucket, kind, value, n in db.execute(f"SELECT key, bucket, kind, value, n FROM rollup_count WHERE {where}", args):
+                out.setdefault((k, bucket), Aggregate()).counts[(kind, value)] += n
+        with self._lock:
+            for (d, k, bucket), delta in self._pending.items():
+                if d == dim and since <= bucket <= until and (key is None or k == key):
+                    out.setdefault((k, bucket), Aggregate()).merge(delta)
+        return out
+
+    def _window(self, days: int) -> Tuple[int, int]:
+        until = self.bucket_of(self._clock())
+        return until - (max(1, math.ceil(days * 86400 / self.bucket_s)) - 1) * self.bucket_s, until
+
+    def series(self, dim: str, key: str, days: int = 30, buckets_per_point: int = 1, threshold: float = 5.0) -> dict:
+        """Summary, trend and per-bucket series of one key over the last `days`."""
+        since, until = self._window(days)
+        step = self.bucket_s * buckets_per_point
+        # Whole points ending at the current bucket; the first one may reach back before `days`
+        since = until + self.bucket_s - math.ceil((until + self.bucket_s - since) / step) * step
+        by_bucket = {bucket: a for (_, bucket), a in self._read(dim, since, until, key).items()}
+        points, total = [], Aggregate()
+        for start in range(since, until + 1, step):
+            agg = Aggregate()
+            for bucket in range(start, min(start + step, until + 1), self.bucket_s):
+                if bucket in by_bucket:
+                    agg.merge(by_bucket[bucket])
+            total.merge(agg)
+            if agg.scans:
+                points.append({"bucket": start, "date": _iso(start), **agg.to_dict()})
+        return {
+            "dimension": dim,
+            "key": key,
+            "days": days,
+            "summary": total.to_dict(),
+            "trend": trend([((p["bucket"] - since) // step, p["risk_mean"], p["scans"]) for p in points], threshold),
+            "series": points,
+        }
+
+    def ranking(self, dim: str, days: int = 30, limit: int = 50, threshold: float = 5.0) -> List[dict]:
+        """Every key of a dimension seen in the last `days`, highest mean risk first, each with its trend."""
+        since, until = self._window(days)
+        per_key: Dict[str, Dict[int, Aggregate]] = {}
+        for (key, bucket), agg in self._read(dim, since, until).items():
+            per_key.setdefault(key, {})[bucket] = agg
+        out = []
+        for key, buckets in per_key.items():
+            total = Aggregate()
+            for agg in buckets.values():
+                total.merge(agg)
+            points = [((b - since) // self.bucket_s, a.risk_sum / a.scans, a.scans) for b, a in sorted(buckets.items()) if a.scans]
+            summary = total.to_dict()
+            summary.pop("diseases")
+            out.append({"key": key, **summary, "trend": trend(points, threshold)["direction"]})
+        out.sort(key=lambda r: r["risk_mean"], reverse=True)
+        return out[:limit]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending_rows": pending, **self.stats}
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,163 @@
+import os
+import sys
+import math
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Each profile splits one worker's cores between concurrent inferences (slots) and the
+# threads each inference may use (intra-op). Inter-op stays at 1: the models are a single
+# sequential graph, so extra inter-op threads only compete with intra-op ones.
+PROFILES = {
+    # Many small single-threaded workers: highest images/s when there is always a queue
+    "throughput": {"cores_per_worker": 2, "max_intra_op": 1, "inter_op": 1, "cv2_threads": 1},
+    # One worker spreading each inference over several cores: lowest latency per request.
+    # Intra-op scaling flattens past ~8 threads, so bigger boxes get a second slot instead.
+    "latency": {"cores_per_worker": None, "max_intra_op": 8, "inter_op": 1, "cv2_threads": 4},
+}
+
+# Read by OpenMP/BLAS/TensorFlow when they are first imported, so they have to be set
+# before app.core.model_loader pulls TensorFlow in (gunicorn.conf.py sets them in the master).
+THREAD_ENV = {
+    "OMP_NUM_THREADS": "intra_op_threads",
+    "OPENBLAS_NUM_THREADS": "intra_op_threads",
+    "MKL_NUM_THREADS": "intra_op_threads",
+    "TF_NUM_INTRAOP_THREADS": "intra_op_threads",
+    "TF_NUM_INTEROP_THREADS": "inter_op_threads",
+}
+
+WORKER_SLOT_ENV = "LEAFSENSE_WORKER_SLOT"
+
+_layout: Optional[dict] = None
+
+def cgroup_cpu_limit(root: str = "/sys/fs/cgroup") -> Optional[float]:
+    """CPU quota of the container in cores (e.g. 1.5), or None if unlimited. cgroup v2, then v1."""
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return None if quota <= 0 or period <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+def detect_cpus(cgroup_root: str = "/sys/fs/cgroup") -> dict:
+    logical = os.cpu_count() or 1
+    affinity = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(logical))
+    quota = cgroup_cpu_limit(cgroup_root)
+    effective = len(affinity)
+    if quota is not None:
+        # Rounded down: running more busy threads than the quota only buys CFS throttling
+        effective = max(1, min(effective, math.floor(quota)))
+    return {"logical": logical, "affinity": affinity, "cgroup_quota": quota, "effective": effective}
+
+def plan_layout(profile: str, cpus: dict, workers: int = 0, max_workers: int = 4,
+                max_inference_slots: int = 4, pin_cores: bool = False) -> dict:
+    """
+    Thread budget per pool so that, summed over workers, busy threads never exceed the
+    effective core count: workers x inference_slots x intra_op_threads <= cores.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown runtime profile {profile!r}; choose from {sorted(PROFILES)}")
+    spec = PROFILES[profile]
+    cores = cpus["effective"]
+
+    if not workers:
+        # Every worker holds its own copy of the model, hence the memory-driven cap
+        workers = 1 if spec["cores_per_worker"] is None else min(max_workers, cores // spec["cores_per_worker"])
+    workers = max(1, min(workers, cores))
+    per_worker = max(1, cores // workers)
+    intra_op = max(1, min(per_worker, spec["max_intra_op"]))
+    slots = max(1, min(per_worker // intra_op, max_inference_slots))
+    cv2_threads = max(1, min(spec["cv2_threads"], per_worker // slots))
+
+    usable = cpus["affinity"][:workers * per_worker]
+    return {
+        "profile": profile,
+        "cpus": cpus,
+        "workers": workers,
+        "cores_per_worker": per_worker,
+        "inference_slots": slots,
+        "intra_op_threads": intra_op,
+        "inter_op_threads": spec["inter_op"],
+        "cv2_threads": cv2_threads,
+        # One thread per slot for inference, one for its preprocessing, plus a few for
+        # file reads / validation. anyio's default of 40 lets cv2 and TF pile up.
+        "threadpool_tokens": 2 * slots + 4,
+        "pin_cores": pin_cores,
+        "worker_cores": [usable[i * per_worker:(i + 1) * per_worker] for i in range(workers)],
+    }
+
+def export_thread_env(layout: dict):
+    """Explicitly set variables win; they are reported as-is in the health snapshot."""
+    for var, key in THREAD_ENV.items():
+        os.environ.setdefault(var, str(layout[key]))
+
+def pin_worker(layout: dict, slot: int) -> List[int]:
+    cores = layout["worker_cores"][slot % layout["workers"]]
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    return cores
+
+def configure_runtime(settings, worker_slot: Optional[int] = None) -> dict:
+    """
+    Computes the layout from settings and applies the per-process parts: thread env vars,
+    OpenCV threads, TensorFlow threads if already imported, and core pinning for `worker_slot`.
+    The threadpool limit needs a running event loop; see apply_threadpool_limit.
+    """
+    global _layout
+    layout = plan_layout(settings.runtime_profile, detect_cpus(), workers=settings.runtime_workers,
+                         max_workers=settings.runtime_max_workers,
+                         max_inference_slots=settings.admission_max_limit,
+                         pin_cores=settings.runtime_pin_cores)
+    export_thread_env(layout)
+
+    import cv2
+    cv2.setNumThreads(layout["cv2_threads"])
+    if "tensorflow" in sys.modules:
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(layout["intra_op_threads"])
+            tf.config.threading.set_inter_op_parallelism_threads(layout["inter_op_threads"])
+        except RuntimeError as e:
+            logger.warning(f"TensorFlow already initialized, thread settings come from the environment: {e}")
+
+    if worker_slot is not None and layout["pin_cores"]:
+        cores = pin_worker(layout, worker_slot)
+        logger.info(f"Worker slot {worker_slot} pinned to cores {cores}")
+
+    layout["worker_slot"] = worker_slot
+    _layout = layout
+    logger.info(f"Runtime profile {layout['profile']}: {layout['workers']} worker(s) x {layout['inference_slots']} slot(s) "
+                f"x {layout['intra_op_threads']} intra-op thread(s) on {layout['cpus']['effective']} core(s)")
+    return layout
+
+def apply_threadpool_limit(tokens: int):
+    """Resizes the threadpool behind run_in_threadpool. Must be called from the event loop."""
+    from anyio.to_thread import current_default_thread_limiter
+    current_default_thread_limiter().total_tokens = tokens
+
+def runtime_snapshot() -> Optional[dict]:
+    """Planned layout plus what this process actually ended up with."""
+    if _layout is None:
+        return None
+    import cv2
+    snapshot = {k: v for k, v in _layout.items() if k != "worker_cores"}
+    snapshot["applied"] = {
+        "cv2_threads": cv2.getNumThreads(),
+        "affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "env": {var: os.environ.get(var) for var in THREAD_ENV},
+    }
+    try:
+        from anyio.to_thread import current_default_thread_limiter
+        snapshot["applied"]["threadpool_tokens"] = current_default_thread_limiter().total_tokens
+    except RuntimeError:  # No running event loop
+        pass
+    return snapshot
@@ -0,0 +1,188 @@
+import time
+import random
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Callable, Dict, Optional
+import numpy as np
+from app.core.explain import ScanTensorCache
+from app.core.stages import label_for
+
+logger = logging.getLogger(__name__)
+
+class _ClassStats:
+    __slots__ = ("n", "agree", "conf_delta", "abs_conf_delta", "primary_ms", "candidate_ms")
+
+    def __init__(self):
+        self.n = self.agree = 0
+        self.conf_delta = self.abs_conf_delta = self.primary_ms = self.candidate_ms = 0.0
+
+    def add(self, agree: bool, conf_delta: float, primary_ms: float, candidate_ms: float):
+        self.n += 1
+        self.agree += agree
+        self.conf_delta += conf_delta
+        self.abs_conf_delta += abs(conf_delta)
+        self.primary_ms += primary_ms
+        self.candidate_ms += candidate_ms
+
+    def to_dict(self) -> dict:
+        n = max(self.n, 1)
+        return {"scans": self.n, "agreement": round(self.agree / n, 4), "mean_confidence_delta": round(self.conf_delta / n, 4),
+                "mean_abs_confidence_delta": round(self.abs_conf_delta / n, 4),
+                "primary_ms_per_image": round(self.primary_ms / n, 1), "candidate_ms_per_image": round(self.candidate_ms / n, 1)}
+
+class ShadowEvaluator:
+    """
+    Runs a candidate model on a sample of live scans and compares it with the primary.
+
+    Both are scored the same way, in the same batch: one plain forward pass of each model on the
+    retained model input, calibrated with the same temperature and timed per image. The served
+    prediction adds TTA, the cascade and the centroid/kNN penalties, which the candidate never
+    gets, so it is not what the candidate is compared with. `primary_fn(version)` returns the
+    model of the version that scored a scan, or None once that version is unloaded (see ExplainWorker).
+
+    As a pipeline observer it only notes the scan_id of sampled scans; the model input is
+    read back later from the ScanTensorCache, so mirroring costs no copy on the request path.
+    A background task evaluates the queue in batches of up to `batch_max`, and only when
+    admission.try_acquire() finds a free slot with nobody waiting. Under load the queue just
+    ages: entries older than `max_age_s` (or pushed out of a full queue, or evicted from the
+    cache) are dropped and counted, never retried.
+
+    Labels and the primary's temperature come from the model bundle each scan ran with, so a
+    hot swap does not compare later evaluations against another model's classes or calibration.
+    `labels` only names scans that ran without one.
+    """
+
+    def __init__(self, cache: ScanTensorCache, candidate_fn: Callable[[], object], primary_fn: Callable[[Optional[str]], object],
+                 admission, labels=None,
+                 sample_rate: float = 0.1, batch_max: int = 8, queue_max: int = 64, max_age_s: float = 30.0,
+                 calibrate: Callable[[np.ndarray, float], np.ndarray] = None, run_blocking: Callable = None,
+                 idle_wait_s: float = 0.05, sampler: Callable[[], float] = random.random, clock=time.monotonic):
+        self.cache = cache
+        self.candidate_fn = candidate_fn
+        self.primary_fn = primary_fn
+        self.admission = admission
+        self.labels = labels
+        self.sample_rate = sample_rate
+        self.batch_max = batch_max
+        self.max_age_s = max_age_s
+        self.calibrate = calibrate or (lambda probs, temperature: probs)
+        self.run_blocking = run_blocking or asyncio.to_thread
+        self.idle_wait_s = idle_wait_s
+        self._sampler = sampler
+        self._clock = clock
+        self._queue: deque = deque(maxlen=queue_max)  # (queued_at, scan_id, labels, temperature)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.per_class: Dict[str, _ClassStats] = {}  # By primary label
+        self.disagreements: Counter = Counter()  # (primary label, candidate label) -> scans
+        self.stats = {"mirrored": 0, "evaluated": 0, "batches": 0, "dropped_queue_full": 0, "dropped_stale": 0,
+                      "dropped_evicted": 0, "dropped_unloaded": 0, "failed": 0}
+
+    def observe(self, ctx, error: Optional[BaseException] = None):
+        """Pipeline observer: queues a sample of completed scans; everything else is left for later."""
+        if error is not None or "scan_id" not in ctx or "class_idx" not in ctx or self._sampler() >= self.sample_rate:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if len(self._queue) == self._queue.maxlen:
+            self.stats["dropped_queue_full"] += 1
+        bundle = ctx.get("bundle")
+        labels, temperature = (bundle.labels, bundle.temperature) if bundle is not None else (self.labels, 1.0)
+        self._queue.append((self._clock(), ctx["scan_id"], labels, temperature))
+        self.stats["mirrored"] += 1
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        self._wakeup.set()
+
+    def _drop_stale(self):
+        cutoff = self._clock() - self.max_age_s
+        while self._queue and self._queue[0][0] < cutoff:
+            self._queue.popleft()
+            self.stats["dropped_stale"] += 1
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            self._drop_stale()
+            if not self._queue:
+                continue
+            if not self.admission.try_acquire():
+                await asyncio.sleep(self.idle_wait_s)
+                continue
+            try:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_max, len(self._queue)))]
+                await self._evaluate(batch)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Shadow evaluation failed: {e}", exc_info=True)
+            finally:
+                self.admission.release()
+
+    async def _evaluate(self, batch):
+        entries, primaries = [], {}
+        for item in batch:
+            cached = self.cache.get(item[1])
+            if cached is None:
+                self.stats["dropped_evicted"] += 1
+                continue
+            version = cached[3]
+            if version not in primaries:
+                primaries[version] = self.primary_fn(version)
+            if primaries[version] is None:
+                self.stats["dropped_unloaded"] += 1
+            else:
+                entries.append((item, cached[0], version))
+        if not entries:
+            return
+        tensors = np.stack([ScanTensorCache.tensor(rgb) for _, rgb, _ in entries])
+        candidate_probs, candidate_ms = await self._timed(self.candidate_fn(), tensors)
+        primary_probs, primary_ms = np.empty_like(candidate_probs), np.empty(len(entries))
+        for version, model in primaries.items():
+            rows = [i for i, entry in enumerate(entries) if entry[2] == version]
+            if rows:
+                primary_probs[rows], primary_ms[rows] = await self._timed(model, tensors[rows])
+        for ((_, _, labels, temperature), _, _), primary_row, candidate_row, ms in zip(entries, primary_probs, candidate_probs, primary_ms):
+            primary_row, candidate_row = self.calibrate(primary_row, temperature), self.calibrate(candidate_row, temperature)
+            primary_class, candidate_class = int(np.argmax(primary_row)), int(np.argmax(candidate_row))
+            primary, candidate = label_for(labels, primary_class), label_for(labels, candidate_class)
+            stats = self.per_class.get(primary)
+            if stats is None:
+                stats = self.per_class[primary] = _ClassStats()
+            stats.add(candidate_class == primary_class, float(candidate_row[candidate_class] - primary_row[primary_class]), ms, candidate_ms)
+            if candidate_class != primary_class:
+                self.disagreements[(primary, candidate)] += 1
+        self.stats["evaluated"] += len(entries)
+        self.stats["batches"] += 1
+
+    async def _timed(self, model, batch: np.ndarray):
+        """(probs, ms per image) of one forward pass of `model` on `batch`."""
+        started = time.perf_counter()
+        probs = await self.run_blocking(self._predict, model, batch)
+        return probs, (time.perf_counter() - started) * 1000 / len(batch)
+
+    @staticmethod
+    def _predict(model, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(model.predict(batch, verbose=0), dtype=np.float64)
+
+    def report(self) -> dict:
+        overall = _ClassStats()
+        for s in self.per_class.values():
+            for name in _ClassStats.__slots__:
+                setattr(overall, name, getattr(overall, name) + getattr(s, name))
+        return {
+            "sample_rate": self.sample_rate,
+            "queued": len(self._queue),
+            **self.stats,
+            "overall": overall.to_dict(),
+            "per_class": {label: s.to_dict() for label, s in sorted(self.per_class.items(), key=lambda kv: -kv[1].n)},
+            "top_disagreements": [{"primary": p, "candidate": c, "scans": n} for (p, c), n in self.disagreements.most_common(10)],
+        }
+
+    def snapshot(self) -> dict:
+        return {"queued": len(self._queue), **self.stats}
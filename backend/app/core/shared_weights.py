@@ -0,0 +1,97 @@
+import os
+import queue
+import logging
+import threading
+from typing import Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# MODEL_SHARING modes. "private": every worker loads the Keras model into its own memory.
+# "mmap": workers run the TFLite export of the same model, whose weights are read straight out
+# of the memory-mapped .tflite file, i.e. one copy in the page cache for the whole host.
+PRIVATE, MMAP = "private", "mmap"
+
+def tflite_paths(model_path: str) -> Tuple[str, str]:
+    """(classifier, feature extractor) .tflite files tools/export_tflite.py writes next to a Keras model."""
+    stem = os.path.splitext(model_path)[0]
+    return f"{stem}.tflite", f"{stem}_features.tflite"
+
+def _interpreter_class():
+    # tflite_runtime is a few MB and never pulls TensorFlow in; full TensorFlow works too
+    try:
+        from tflite_runtime.interpreter import Interpreter, OpResolverType
+    except ImportError:
+        import tensorflow as tf
+        Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+    return Interpreter, OpResolverType
+
+def feature_layer(model):
+    """Layer a Keras classifier's embeddings are read from: the last global pooling layer, else the one before the head."""
+    pooled = [layer for layer in model.layers if "GlobalAveragePooling" in type(layer).__name__]
+    return pooled[-1] if pooled else model.layers[-2]
+
+class MappedModel:
+    """
+    A .tflite model with the Keras predict() interface. The interpreter maps the file instead of
+    reading it, and the builtin kernels read constant tensors in place, so the weights are shared
+    through the page cache by every process that maps the same file. Only activations are per
+    process. XNNPACK is left off on purpose: it repacks the weights into private memory.
+
+    Interpreters are not thread-safe, so up to `slots` of them are created on demand (one per
+    concurrent inference) and all map the same file; a predict() beyond that waits for one.
+    """
+
+    def __init__(self, path: str, slots: int = 1, num_threads: Optional[int] = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found. Run python -m tools.export_tflite to export the model for MODEL_SHARING=mmap.")
+        self.path = path
+        self.slots = max(1, slots)
+        # Same per-inference thread budget as TensorFlow (exported by app/core/runtime.py)
+        self.num_threads = num_threads or int(os.environ.get("TF_NUM_INTRAOP_THREADS", "0")) or None
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        interpreter = self._new()
+        self._idle.put(interpreter)
+        self.input_shape = (None, *interpreter.get_input_details()[0]["shape"][1:])
+        self.output_shape = (None, *interpreter.get_output_details()[0]["shape"][1:])
+
+    def _new(self):
+        Interpreter, OpResolverType = _interpreter_class()
+        interpreter = Interpreter(model_path=self.path, num_threads=self.num_threads,
+                                  experimental_op_resolver_type=OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+        interpreter.allocate_tensors()
+        self._created += 1
+        return interpreter
+
+    def _acquire(self):
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if self._created < self.slots:
+                    return self._new()
+        return self._idle.get()
+
+    def predict(self, x, verbose=0, **kwargs) -> np.ndarray:
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        interpreter = self._acquire()
+        try:
+            (inp,), (out,) = interpreter.get_input_details(), interpreter.get_output_details()
+            if tuple(inp["shape"]) != x.shape:
+                interpreter.resize_tensor_input(inp["index"], x.shape)
+                interpreter.allocate_tensors()
+                out = interpreter.get_output_details()[0]
+            interpreter.set_tensor(inp["index"], x)
+            interpreter.invoke()
+            return interpreter.get_tensor(out["index"]).copy()
+        finally:
+            self._idle.put(interpreter)
+
+def load_centroids(path: str, num_classes: int, embedding_dim: int) -> np.ndarray:
+    """Class centroids from a .npy file, mapped read-only so every worker shares one copy."""
+    centroids = np.load(path, mmap_mode="r")
+    if centroids.shape != (num_classes, embedding_dim):
+        raise RuntimeError(f"Centroids at {path} have shape {centroids.shape}, expected {(num_classes, embedding_dim)}.")
+    return centroids if centroids.dtype == np.float32 else centroids.astype(np.float32)
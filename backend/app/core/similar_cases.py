@@ -0,0 +1,414 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY, scan_id TEXT NOT NULL UNIQUE, created REAL NOT NULL,
+    class_idx INTEGER NOT NULL, confidence REAL NOT NULL, embedding BLOB NOT NULL, model_version TEXT
+);
+CREATE TABLE IF NOT EXISTS confirmations (
+    id INTEGER PRIMARY KEY, case_id INTEGER NOT NULL, class_idx INTEGER NOT NULL, created REAL NOT NULL
+);
+"""
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-7)
+
+class _InvertedList:
+    __slots__ = ("codes", "scales", "ids", "n")
+
+    def __init__(self, code_dim: int, capacity: int = 64):
+        self.codes = np.empty((capacity, code_dim), dtype=np.int8)
+        self.scales = np.empty(capacity, dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.n = 0
+
+    def append(self, codes: np.ndarray, scales: np.ndarray, ids: np.ndarray):
+        end = self.n + len(ids)
+        if end > len(self.ids):
+            capacity = max(end, 2 * len(self.ids))
+            for name in ("codes", "scales", "ids"):
+                old = getattr(self, name)
+                grown = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                grown[:self.n] = old[:self.n]
+                setattr(self, name, grown)
+        self.codes[self.n:end] = codes
+        self.scales[self.n:end] = scales
+        self.ids[self.n:end] = ids
+        self.n = end
+
+class IVFInt8Index:
+    """
+    Approximate cosine search over unit vectors. A spherical k-means quantizer splits the
+    vectors into `nlist` inverted lists and a query only scans the `nprobe` lists whose
+    centroids are closest to it. Vectors are PCA-projected to `code_dim` dimensions and kept
+    as int8 with one float scale each: code_dim + 12 bytes per vector instead of 4 * dim.
+    Untrained, there is one list of full-dimension codes and every search is exhaustive.
+    """
+
+    def __init__(self, dim: int, code_dim: int = 256, nlist: int = 1024, nprobe: int = 16):
+        self.dim = dim
+        self.code_dim = min(code_dim, dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.components: Optional[np.ndarray] = None  # dim x code_dim
+        self.centroids: Optional[np.ndarray] = None   # lists x code_dim
+        self._lists = [_InvertedList(dim)]
+        self._lock = threading.Lock()
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return sum(lst.n for lst in self._lists)
+
+    def nbytes(self) -> int:
+        return sum(lst.n * (lst.codes.shape[1] + 12) for lst in self._lists)
+
+    def train(self, sample: np.ndarray, iters: int = 10, seed: int = 0):
+        """Fits the projection and the quantizer. Clears the index: re-add the vectors afterwards."""
+        sample = _unit(sample)
+        # Top code_dim eigenvectors of the uncentered second moment: projecting onto them keeps
+        # dot products (and so cosine ranking) as far as the dropped directions allow
+        _, vecs = np.linalg.eigh(sample.T @ sample)
+        components = np.ascontiguousarray(vecs[:, ::-1][:, :self.code_dim]).astype(np.float32)
+        projected = _unit(sample @ components)
+
+        # At least ~39 training points per list for the centroids to mean anything
+        nlist = max(1, min(self.nlist, len(sample) // 39))
+        rng = np.random.default_rng(seed)
+        centroids = projected[rng.choice(len(projected), nlist, replace=False)]
+        for _ in range(iters):
+            assign = np.argmax(projected @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, projected)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            sums[empty] = projected[rng.choice(len(projected), int(empty.sum()))]
+            centroids = _unit(sums)
+        with self._lock:
+            self.components, self.centroids = components, centroids.astype(np.float32)
+            self._lists = [_InvertedList(self.code_dim) for _ in range(nlist)]
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = _unit(vectors)
+        if self.components is None:
+            return vectors
+        return vectors @ self.components
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray):
+        projected = self._project(np.atleast_2d(vectors))
+        scales = np.abs(projected).max(axis=1) / 127.0 + 1e-12
+        codes = np.rint(projected / scales[:, None]).astype(np.int8)
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            if self.centroids is None:
+                self._lists[0].append(codes, scales, ids)
+                return
+            assign = np.argmax(_unit(projected) @ self.centroids.T, axis=1)
+            for list_no in np.unique(assign):
+                rows = assign == list_no
+                self._lists[list_no].append(codes[rows], scales[rows], ids[rows])
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, approximate cosine similarities) of the k best matches, best first. `allowed` is a bool mask by id."""
+        q = self._project(np.atleast_2d(query))[0]
+        with self._lock:
+            if self.centroids is None:
+                probe = [0]
+            else:
+                probe = np.argsort(-(self.centroids @ q))[:nprobe or self.nprobe]
+            parts = [(lst.codes[:lst.n], lst.scales[:lst.n], lst.ids[:lst.n]) for lst in (self._lists[i] for i in probe) if lst.n]
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate([p[2] for p in parts])
+        scores = np.concatenate([(codes.astype(np.float32) @ q) * scales for codes, scales, _ in parts])
+        if allowed is not None:
+            keep = ids < len(allowed)
+            keep[keep] = allowed[ids[keep]]
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > k:
+            top = np.argpartition(-scores, k)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores)
+        return ids[order], scores[order]
+
+class CaseStore:
+    """
+    Embeddings of past scans, searchable by similarity.
+
+    SQLite (one file per host, shared by the workers) is the durable log: one row per scan,
+    with the embedding as float16, plus an append-only table of confirmed diagnoses. Each
+    worker keeps an IVFInt8Index in memory and catches up with the log after every flush.
+    add() only queues the row, so it costs nothing on the request path. The index is trained
+    from the log once `train_min` scans exist, and retrained whenever the log has grown
+    `retrain_growth` times since, so rebuild work stays amortized O(1) per scan.
+
+    Embeddings of different models are not comparable, so every row carries the model version
+    that produced it and the index only holds those of `version`. use_version() switches it
+    (after a hot swap); the next sync rebuilds the index from that version's rows of the log.
+    """
+
+    def __init__(self, path: str, dim: int = 1280, code_dim: int = 256, nlist: int = 1024, nprobe: int = 16,
+                 train_min: int = 20000, train_sample: int = 50000, retrain_growth: float = 8.0, flush_interval_s: float = 2.0,
+                 version: str = "base"):
+        self.path = path
+        self.dim = dim
+        self.version = version
+        self._target = (version, dim)
+        self.index_args = (dim, code_dim, nlist, nprobe)
+        self.index = IVFInt8Index(*self.index_args)
+        self.train_min = train_min
+        self.train_sample = train_sample
+        self.retrain_growth = retrain_growth
+        self.flush_interval_s = flush_interval_s
+        self._trained_at = 0
+        self._last_case = 0
+        self._last_confirmation = 0
+        self._predicted = np.full(0, -1, dtype=np.int16)  # By case id
+        self._confirmed = np.full(0, -1, dtype=np.int16)
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # One catch-up (and retraining) at a time
+        self._db: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "flushes": 0, "flush_errors": 0, "trainings": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=10.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            if "model_version" not in {row[1] for row in db.execute("PRAGMA table_info(cases)")}:
+                # Logged before rows were tagged: their model is unknown, so no version searches them
+                db.execute("ALTER TABLE cases ADD COLUMN model_version TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS cases_version ON cases (model_version, id)")
+            self._db = db
+        return self._db
+
+    def add(self, scan_id: str, embedding: np.ndarray, class_idx: int, confidence: float, version: Optional[str] = None) -> bool:
+        """Queues a scan of model `version` (default: the indexed one) for the log."""
+        version = self.version if version is None else version
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(embedding))
+        if (version == self.version and embedding.shape[0] != self.dim) or norm < 1e-6:
+            return False
+        row = (scan_id, time.time(), int(class_idx), float(confidence), (embedding / norm).astype(np.float16).tobytes(), version)
+        with self._lock:
+            self._pending.append(row)
+            self.stats["queued"] += 1
+        return True
+
+    def flush(self):
+        """Writes queued scans to the log and brings this worker's index up to date with it."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        try:
+            if pending:
+                with self._db_lock:
+                    db = self._conn()
+                    with db:
+                        db.executemany("INSERT OR IGNORE INTO cases (scan_id, created, class_idx, confidence, embedding, model_version) "
+                                       "VALUES (?, ?, ?, ?, ?, ?)", pending)
+            self.sync()
+        except sqlite3.Error as e:
+            with self._lock:
+                self._pending[:0] = pending
+            self.stats["flush_errors"] += 1
+            logger.error(f"Case log flush failed: {e}")
+            return
+        self.stats["flushes"] += 1
+
+    def _grow(self, max_id: int):
+        if max_id >= len(self._predicted):
+            size = max(max_id + 1, 2 * len(self._predicted), 1024)
+            for name in ("_predicted", "_confirmed"):
+                old = getattr(self, name)
+                grown = np.full(size, -1, dtype=np.int16)
+                grown[:len(old)] = old
+                setattr(self, name, grown)
+
+    def use_version(self, version: str, dim: int):
+        """Searches scans of model `version` (embeddings of `dim`) from the next sync on. Cheap: the rebuild happens there."""
+        self._target = (version, dim)
+
+    def sync(self, chunk: int = 20000):
+        with self._sync_lock:
+            if self._target != (self.version, self.dim):
+                self._switch(*self._target)
+            self._catch_up(chunk)
+
+    def _switch(self, version: str, dim: int):
+        # The empty index goes in before the version does, so no search mixes the two models
+        self.index_args = (dim,) + self.index_args[1:]
+        self.index = IVFInt8Index(*self.index_args)
+        self.dim, self.version = dim, version
+        self._last_case = 0
+        self._trained_at = 0
+        logger.info(f"Similar-case index switched to model version {version}")
+
+    def _catch_up(self, chunk: int):
+        with self._db_lock:
+            db = self._conn()
+            while True:
+                rows = db.execute("SELECT id, class_idx, embedding FROM cases WHERE model_version = ? AND id > ? ORDER BY id LIMIT ?",
+                                  (self.version, self._last_case, chunk)).fetchall()
+                if not rows:
+                    break
+                ids = np.array([r[0] for r in rows], dtype=np.int64)
+                self._grow(int(ids[-1]))
+                self._predicted[ids] = [r[1] for r in rows]
+                self.index.add(ids, np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float16).reshape(len(rows), -1))
+                self._last_case = int(ids[-1])
+            for conf_id, case_id, class_idx in db.execute(
+                    "SELECT id, case_id, class_idx FROM confirmations WHERE id > ? ORDER BY id", (self._last_confirmation,)):
+                self._grow(case_id)
+                self._confirmed[case_id] = class_idx
+                self._last_confirmation = conf_id
+        size = len(self.index)
+        if size >= self.train_min and size >= self._trained_at * self.retrain_growth:
+            self._retrain(size)
+
+    def _retrain(self, size: int):
+        started = time.perf_counter()
+        step = max(1, size // self.train_sample)
+        with self._db_lock:
+            db = self._conn()
+            sample = [r[0] for r in db.execute("SELECT embedding FROM cases WHERE model_version = ? AND id % ? = 0 LIMIT ?",
+                                               (self.version, step, self.train_sample))]
+        index = IVFInt8Index(*self.index_args)
+        index.train(np.frombuffer(b"".join(sample), dtype=np.float16).reshape(len(sample), -1))
+        with self._db_lock:
+            last = 0
+            while True:
+                rows = self._conn().execute("SELECT id, embedding FROM cases WHERE model_version = ? AND id > ? AND id <= ? "
+                                            "ORDER BY id LIMIT 20000", (self.version, last, self._last_case)).fetchall()
+                if not rows:
+                    break
+                index.add([r[0] for r in rows], np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float16).reshape(len(rows), -1))
+                last = rows[-1][0]
+        self.index = index
+        self._trained_at = size
+        self.stats["trainings"] += 1
+        logger.info(f"Similar-case index trained on {len(sample)} of {size} scans in {time.perf_counter() - started:.1f} s")
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            await asyncio.to_thread(self.flush)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    def confirm(self, scan_id: str, class_idx: int) -> bool:
+        """Records a confirmed diagnosis; False if the scan is not in the log (yet)."""
+        with self._db_lock:
+            db = self._conn()
+            with db:
+                cur = db.execute("INSERT INTO confirmations (case_id, class_idx, created) "
+                                 "SELECT id, ?, ? FROM cases WHERE scan_id = ?", (int(class_idx), time.time(), scan_id))
+        return cur.rowcount > 0
+
+    def case(self, scan_id: str) -> Optional[Tuple[np.ndarray, Optional[str]]]:
+        """(embedding, model version) of a logged scan."""
+        with self._db_lock:
+            row = self._conn().execute("SELECT embedding, model_version FROM cases WHERE scan_id = ?", (scan_id,)).fetchone()
+        return None if row is None else (np.frombuffer(row[0], dtype=np.float16).astype(np.float32), row[1])
+
+    def embedding(self, scan_id: str) -> Optional[np.ndarray]:
+        case = self.case(scan_id)
+        return None if case is None else case[0]
+
+    def similar(self, embedding: np.ndarray, k: int = 5, confirmed_only: bool = True, exclude: Optional[str] = None) -> List[dict]:
+        """
+        The k most similar logged scans, best first. Candidates from the index are re-ranked by
+        their exact float16 embeddings, so the similarities reported are not the int8 estimates.
+        """
+        query = _unit(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        allowed = self._confirmed >= 0 if confirmed_only else None
+        ids, _ = self.index.search(query, 4 * k + 1, allowed=allowed)
+        if not len(ids):
+            return []
+        marks = ",".join("?" * len(ids))
+        with self._db_lock:
+            rows = self._conn().execute(f"SELECT id, scan_id, created, class_idx, confidence, embedding FROM cases WHERE id IN ({marks})",
+                                        [int(i) for i in ids]).fetchall()
+        rows = [r for r in rows if r[1] != exclude]
+        if not rows:
+            return []
+        sims = np.frombuffer(b"".join(r[5] for r in rows), dtype=np.float16).reshape(len(rows), -1).astype(np.float32) @ query
+        out = []
+        for i in np.argsort(-sims)[:k]:
+            case_id, scan_id, created, class_idx, confidence, _ = rows[i]
+            confirmed = int(self._confirmed[case_id]) if case_id < len(self._confirmed) else -1
+            out.append({"scan_id": scan_id, "similarity": round(float(sims[i]), 4), "created": created,
+                        "class_idx": confirmed if confirmed >= 0 else class_idx, "confirmed": confirmed >= 0,
+                        "predicted_class_idx": class_idx, "confidence": round(confidence, 4)})
+        return out
+
+    def knn_signal(self, embedding: np.ndarray, class_idx: int, k: int = 10) -> Dict[str, object]:
+        """
+        Neighbourhood of a new scan: mean similarity to its k nearest past scans (low means
+        unlike anything seen before) and, among the k nearest confirmed scans, the share
+        whose diagnosis agrees with `class_idx`.
+        """
+        if not len(self.index):
+            return {"knn_similarity": None, "knn_agreement": None, "knn_support": 0}
+        _, sims = self.index.search(embedding, k)
+        confirmed = self._confirmed >= 0
+        agreement, support = None, 0
+        if confirmed.any():
+            ids, _ = self.index.search(embedding, k, allowed=confirmed)
+            support = len(ids)
+            if support:
+                agreement = round(float(np.mean(self._confirmed[ids] == class_idx)), 3)
+        return {"knn_similarity": round(float(np.mean(sims)), 4) if len(sims) else None,
+                "knn_agreement": agreement, "knn_support": support}
+
+    def neighbors(self, ctx):
+        """
+        Pipeline stage: kNN signal next to the centroid distance, then queues the scan for the
+        index. With enough confirmed neighbours, mostly disagreeing ones cost the same 20%
+        confidence penalty as a far-off centroid. Scans of a model version other than the indexed
+        one (still draining, or not switched to yet) are logged but not compared.
+        """
+        features = ctx["features"]
+        if features is None:
+            return None
+        version = ctx["bundle"].version
+        if version != self.version:
+            self.add(ctx["scan_id"], features, ctx["class_idx"], ctx["confidence"], version)
+            return None
+        signal = self.knn_signal(_unit(np.asarray(features).reshape(-1)), ctx["class_idx"], ctx.params.get("knn_k", 10))
+        ctx["metrics"].update(signal)
+        self.add(ctx["scan_id"], features, ctx["class_idx"], ctx["confidence"], version)
+        if signal["knn_support"] >= ctx.params.get("knn_min_support", 3) and signal["knn_agreement"] < 0.5:
+            return {"confidence": ctx["confidence"] * 0.8}
+        return None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            queued = len(self._pending)
+        return {"model_version": self.version, "indexed": len(self.index), "trained": self.index.trained, "index_mb": round(self.index.nbytes() / 2**20, 1),
+                "confirmed": int((self._confirmed >= 0).sum()), "pending": queued, **self.stats}
@@ -0,0 +1,109 @@
+import logging
+from contextlib import nullcontext
+from typing import Tuple
+import cv2
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from app.core.pipeline import stage, StageRejected
+from app.core.ood_detector import validate_plant_presence
+from app.plant_validator import validate_image
+from app.utils.image_utils import decode_image, enhance_image_pipeline, resize_and_normalize
+from app.utils.structured_logging import log_event
+
+# Stage variants that depend only on OpenCV and the model object. Model-specific variants live
+# next to what they need: infer/calibrate/score for the cascade in app/core/concurrency.py,
+# advise in app/services/gemini_service.py ("service") and app/main.py ("legacy").
+
+logger = logging.getLogger(__name__)
+
+SCORE_KEYS = ("class_idx", "confidence", "crop", "disease", "top")
+
+def label_for(labels, idx: int) -> str:
+    """Class label from either a list or a {"0": label} mapping (class_labels.json)."""
+    if isinstance(labels, dict):
+        label = labels.get(str(idx)) or labels.get(idx)
+    else:
+        label = labels[idx] if 0 <= idx < len(labels) else None
+    return label or f"Unknown_{idx}"
+
+def split_label(label: str) -> Tuple[str, str]:
+    parts = label.split("___")
+    if len(parts) == 2:
+        return parts[0].replace("_", " "), parts[1].replace("_", " ")
+    return "Unknown Crop Type", label.replace("_", " ")
+
+def scored(ctx, probs: np.ndarray, class_idx: int, confidence: float) -> dict:
+    """The SCORE_KEYS every score variant provides."""
+    # A run's own labels (those of the model version it scores with) take precedence over the profile's
+    labels = ctx["labels"] if "labels" in ctx else ctx.params["labels"]
+    crop, disease = split_label(label_for(labels, class_idx))
+    top = [(int(i), float(probs[i])) for i in np.argsort(probs)[::-1][:3]]
+    return {"class_idx": class_idx, "confidence": float(confidence), "crop": crop, "disease": disease, "top": top}
+
+@stage("decode", "opencv", requires=("image_bytes",), provides=("image",), blocking=True)
+def decode(ctx):
+    try:
+        return {"image": decode_image(ctx["image_bytes"])}
+    except ValueError as e:
+        raise StageRejected("INVALID_FORMAT", str(e), status=400)
+
+@stage("validate", "ood", requires=("image",), provides=("validation",), blocking=True)
+def validate_ood(ctx):
+    is_plant, _, reason, scores = validate_plant_presence(ctx["image"])
+    if not is_plant:
+        raise StageRejected("NOT_A_PLANT", reason, details=scores)
+    return {"validation": scores}
+
+@stage("validate", "histogram", requires=("image",), provides=("validation",), blocking=True)
+def validate_histogram(ctx):
+    result = validate_image(ctx["image"])
+    scores = {"green_ratio": result.green_ratio, "entropy": result.entropy, "edge_density": result.edge_density}
+    log_event(logger, "validation", is_plant=result.is_plant, **scores)
+    if not result.is_plant:
+        raise StageRejected("NOT_A_PLANT", result.rejection_reason, details=scores)
+    return {"validation": scores}
+
+@stage("enhance", "full", requires=("image", "buffers"), provides=("tensor", "metrics"), blocking=True)
+def enhance_full(ctx):
+    """White balance, CLAHE, background suppression and sharpening; the tensor is row 0 of the leased buffers."""
+    buffers = ctx["buffers"]
+    enhanced, metrics = enhance_image_pipeline(ctx["image"], buffers)
+    return {"tensor": resize_and_normalize(enhanced, buffers.input_size, buffers), "metrics": metrics}
+
+@stage("enhance", "clahe", requires=("image", "buffers"), provides=("tensor", "metrics"), blocking=True)
+def enhance_clahe(ctx):
+    """CLAHE on luminance only, in place on the decoded image."""
+    image = ctx["image"]
+    b = ctx["buffers"].ensure(*image.shape[:2])
+    cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=b.plane)
+    cv2.Laplacian(b.plane, cv2.CV_16S, dst=b.laplacian)
+    blur_score = float(cv2.meanStdDev(b.laplacian)[1][0, 0] ** 2)
+    cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=b.color_a)
+    cv2.extractChannel(b.color_a, 0, dst=b.plane)
+    b.clahe.apply(b.plane, dst=b.plane)
+    cv2.insertChannel(b.plane, b.color_a, 0)
+    cv2.cvtColor(b.color_a, cv2.COLOR_LAB2BGR, dst=image)
+    return {"tensor": resize_and_normalize(image, b.input_size, b), "metrics": {"blur_score": round(blur_score, 2)}}
+
+# Cheap, but blocking so that it shares the threadpool hop of the stages around it
+@stage("quality", "blur", requires=("metrics",), blocking=True)
+def quality_blur(ctx):
+    if ctx["metrics"]["blur_score"] < ctx.params["blur_threshold"]:
+        raise StageRejected("IMAGE_TOO_BLURRY", "Image too blurry. Please retake.", details=ctx["metrics"])
+
+# "buffers" is required because the tensor is a view into them; "slot" is an optional input,
+# an async context manager around the forward pass (e.g. an admission slot)
+@stage("infer", "single", requires=("tensor", "buffers", "model"), provides=("probs",))
+async def infer_single(ctx):
+    model = ctx["model"]
+    if model is None:
+        raise StageRejected("MODEL_ERROR", "Model not loaded.", status=503)
+    async with (ctx.get("slot") or nullcontext)():
+        probs = await run_in_threadpool(model.predict, ctx["tensor"], verbose=0)
+    return {"probs": np.asarray(probs)[0]}
+
+@stage("score", "plain", requires=("probs",), provides=SCORE_KEYS)
+def score_plain(ctx):
+    probs = ctx["probs"]
+    class_idx = int(np.argmax(probs))
+    return scored(ctx, probs, class_idx, float(probs[class_idx]))
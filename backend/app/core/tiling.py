@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+from typing import List, Dict, Any, Tuple
+from app.utils.image_utils import compute_plant_masks, enhance_image_pipeline, resize_and_normalize
+
+# Plant coverage is measured on a downscaled copy; the mask only has to be good enough to drop background
+MASK_LONG_SIDE = 1024
+BLUR_THRESHOLD = 50.0
+
+def plan_tiles(height: int, width: int, tile_px: int, overlap: float) -> List[Tuple[int, int, int]]:
+    """Overlapping square tiles (y, x, side) covering the image, edge tiles snapped inwards."""
+    side = min(tile_px, height, width)
+    stride = max(1, int(side * (1.0 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        positions = list(range(0, length - side + 1, stride))
+        if positions[-1] != length - side:
+            positions.append(length - side)
+        return positions
+
+    return [(y, x, side) for y in starts(height) for x in starts(width)]
+
+def plant_coverage(image: np.ndarray, tiles: List[Tuple[int, int, int]]) -> np.ndarray:
+    """Fraction of green/brown plant pixels per tile, via one mask and an integral image."""
+    height, width = image.shape[:2]
+    scale = min(1.0, MASK_LONG_SIDE / max(height, width))
+    small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA) if scale < 1.0 else image
+    mask_green, mask_brown = compute_plant_masks(cv2.cvtColor(small, cv2.COLOR_BGR2HSV), min_value=30)
+    plant = (cv2.bitwise_or(mask_green, mask_brown) > 0).astype(np.uint8)
+    integral = cv2.integral(plant)
+
+    coverage = np.empty(len(tiles), dtype=np.float32)
+    for i, (y, x, side) in enumerate(tiles):
+        y0, x0 = int(y * scale), int(x * scale)
+        y1, x1 = max(y0 + 1, int((y + side) * scale)), max(x0 + 1, int((x + side) * scale))
+        total = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        coverage[i] = total / ((y1 - y0) * (x1 - x0))
+    return coverage
+
+def prepare_field_tiles(image: np.ndarray, tile_px: int, overlap: float, min_plant_ratio: float,
+                        max_tiles: int, input_size: int) -> Tuple[np.ndarray, List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Cuts a field photo into leaf-sized tiles and keeps the ones worth scoring.
+    Returns (normalized batch, tile records with metrics, skip counts). The batch is empty
+    when no tile survives.
+    """
+    tiles = plan_tiles(image.shape[0], image.shape[1], tile_px, overlap)
+    coverage = plant_coverage(image, tiles)
+    # Highest plant coverage first, so the cap drops the emptiest tiles
+    candidates = [int(i) for i in np.argsort(-coverage, kind="stable") if coverage[i] >= min_plant_ratio]
+    counts = {
+        "tiles_total": len(tiles),
+        "skipped_background": len(tiles) - len(candidates),
+        "skipped_blurry": 0,
+        "skipped_over_cap": max(0, len(candidates) - max_tiles),
+    }
+
+    records, tensors = [], []
+    for i in sorted(candidates[:max_tiles]):
+        y, x, side = tiles[i]
+        enhanced, metrics = enhance_image_pipeline(image[y:y + side, x:x + side])
+        if metrics["blur_score"] < BLUR_THRESHOLD:
+            counts["skipped_blurry"] += 1
+            continue
+        records.append({"box": [int(x), int(y), int(side), int(side)], "plant_coverage": round(float(coverage[i]), 3), "metrics": metrics})
+        tensors.append(resize_and_normalize(enhanced, input_size)[0])
+
+    batch = np.stack(tensors) if tensors else np.empty((0, input_size, input_size, 3), dtype=np.float32)
+    return batch, records, counts
+
+def is_healthy(prediction: Dict[str, Any]) -> bool:
+    return prediction["disease"].strip().lower() == "healthy"
+
+def aggregate_field(predictions: List[Dict[str, Any]], records: List[Dict[str, Any]], min_confidence: float = 0.6) -> Dict[str, Any]:
+    """
+    Field-level verdict from per-tile predictions. Each confident tile votes for its label
+    with weight plant_coverage * confidence. Any confident diseased tile outweighs healthy
+    ones, since a single infected plant in the row is what the farmer needs to hear about.
+    Also returns the index of the tile that best represents the verdict.
+    """
+    votes: Dict[Tuple[str, str], float] = {}
+    best_tile: Dict[Tuple[str, str], int] = {}
+    confident = [i for i, p in enumerate(predictions) if p["confidence"] >= min_confidence]
+    voters = confident or list(range(len(predictions)))
+    diseased_voters = [i for i in voters if not is_healthy(predictions[i])]
+    for i in diseased_voters or voters:
+        label = (predictions[i]["crop"], predictions[i]["disease"])
+        weight = records[i]["plant_coverage"] * predictions[i]["confidence"]
+        votes[label] = votes.get(label, 0.0) + weight
+        if label not in best_tile or predictions[i]["confidence"] > predictions[best_tile[label]]["confidence"]:
+            best_tile[label] = i
+
+    crop, disease = max(votes, key=votes.get)
+    representative = best_tile[(crop, disease)]
+    diseased = [i for i in confident if not is_healthy(predictions[i])]
+    total_weight = sum(r["plant_coverage"] for r in records)
+    # Coverage-weighted mean of per-tile confidence * lesion density over diseased tiles
+    lesion_load = sum(
+        records[i]["plant_coverage"] * predictions[i]["confidence"] * records[i]["metrics"].get("lesion_density_percent", 0.0) / 100.0
+        for i in diseased
+    ) / total_weight if total_weight > 0 else 0.0
+
+    return {
+        "crop": crop,
+        "disease": disease,
+        "vote_share": round(votes[(crop, disease)] / sum(votes.values()), 4),
+        "tiles_scored": len(predictions),
+        "diseased_tiles": len(diseased),
+        "uncertain_tiles": len(predictions) - len(confident),
+        "affected_fraction": round(sum(records[i]["plant_coverage"] for i in diseased) / total_weight, 4) if total_weight > 0 else 0.0,
+        "lesion_load": round(lesion_load, 4),
+        "representative_tile": representative,
+    }
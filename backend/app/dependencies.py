@@ -1,4 +1,4 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from app.config import get_settings
+from app.core.rate_limit import create_limiter
 
-limiter = Limiter(key_func=get_remote_address)
+limiter = create_limiter(get_settings().rate_limit_storage)
@@ -1,36 +1,100 @@
-import asyncio, os, re, json, logging
+import asyncio, os, re, json, time, logging
 import httpx
+from typing import AsyncIterator
+from .utils.json_stream import IncrementalObjectParser
+from .services.advisory_bundle import LANGUAGES
 
 logger = logging.getLogger("leafsense")
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+# Overridable so tests and load tests can point at a local stand-in
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_MODEL = "gemini-1.5-flash"
+GEMINI_TIMEOUT_S = 15.0
+REQUIRED_KEYS = ["disease_name","severity","cause","immediate_action","treatment_plan","prevention","estimated_crop_loss_risk","consult_expert"]
+
+def _gemini_url(method: str) -> str:
+    return f"{os.getenv('GEMINI_API_BASE', GEMINI_API_BASE).rstrip('/')}/models/{GEMINI_MODEL}:{method}"
 
 def _strip_markdown(text: str) -> str:
     return re.sub(r"```(?:json)?|```", "", text).strip()
 
-async def analyze_with_gemini(prediction: dict, language: str = "en") -> dict:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        return {"advisory_valid": False, "parse_error": True, "error": "API key missing"}
-    lang_names = {"en":"English","hi":"Hindi","mr":"Marathi","te":"Telugu","ta":"Tamil","kn":"Kannada","bn":"Bengali","pa":"Punjabi"}
-    lang_name = lang_names.get(language, "English")
+def _build_request(prediction: dict, language: str) -> dict:
+    lang_name = LANGUAGES.get(language, "English")
     crop, disease, conf = prediction.get("crop","Unknown"), prediction.get("disease","Unknown"), round(prediction.get("confidence",0)*100,1)
+    # immediate_action comes right after disease_name so streaming clients can show it first
     prompt = f"""You are an expert plant pathologist. DETECTED: {crop} with {disease} at {conf}% confidence.
 INSTRUCTIONS: Respond ONLY about {disease} on {crop}. No disclaimers. Output ONLY valid JSON in {lang_name}. Keep all JSON keys in English.
 REQUIRED JSON:
-{{"disease_name":"string","severity":"Low|Medium|High|Critical","cause":"string","immediate_action":"string","treatment_plan":["step1","step2","step3"],"prevention":"string","estimated_crop_loss_risk":"Low|Medium|High","consult_expert":true}}"""
+{{"disease_name":"string","immediate_action":"string","severity":"Low|Medium|High|Critical","cause":"string","treatment_plan":["step1","step2","step3"],"prevention":"string","estimated_crop_loss_risk":"Low|Medium|High","consult_expert":true}}"""
+    return {"contents":[{"parts":[{"text":prompt}]}],"generationConfig":{"temperature":0,"maxOutputTokens":600}}
+
+def _finalize(raw: str) -> dict:
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            resp = await client.post(f"{GEMINI_URL}?key={api_key}", json={"contents":[{"parts":[{"text":prompt}]}],"generationConfig":{"temperature":0,"maxOutputTokens":600}}, headers={"Content-Type":"application/json"})
+        parsed = json.loads(_strip_markdown(raw))
+        parsed["advisory_valid"] = all(k in parsed for k in REQUIRED_KEYS)
+        return parsed
+    except json.JSONDecodeError:
+        return {"advisory_valid": False, "parse_error": True, "raw_advice": raw}
+
+async def analyze_with_gemini(prediction: dict, language: str = "en", timeout: float = GEMINI_TIMEOUT_S) -> dict:
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return {"advisory_valid": False, "parse_error": True, "error": "API key missing"}
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            resp = await client.post(f"{_gemini_url('generateContent')}?key={api_key}", json=_build_request(prediction, language), headers={"Content-Type":"application/json"})
             resp.raise_for_status()
             raw = resp.json()["candidates"][0]["content"]["parts"][0]["text"]
     except httpx.TimeoutException:
         return {"advisory_valid": False, "error": "GEMINI_TIMEOUT"}
     except Exception as e:
         return {"advisory_valid": False, "error": str(e)}
+    return _finalize(raw)
+
+async def stream_gemini_advisory(prediction: dict, language: str = "en", timeout: float = GEMINI_TIMEOUT_S) -> AsyncIterator[dict]:
+    """
+    streamGenerateContent over SSE. Yields {"event": "token", "text"} for every chunk of model
+    output, {"event": "field", "key", "value"} as soon as a top-level advisory field is complete,
+    and finally {"event": "advisory", "advisory", "timing"} validated against REQUIRED_KEYS.
+    `timeout` bounds the whole stream, not just each read.
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        yield {"event": "advisory", "advisory": {"advisory_valid": False, "parse_error": True, "error": "API key missing"}, "timing": {}}
+        return
+    parser, raw_parts = IncrementalObjectParser(), []
+    started = time.perf_counter()
+    timing = {}
     try:
-        parsed = json.loads(_strip_markdown(raw))
-        required = ["disease_name","severity","cause","immediate_action","treatment_plan","prevention","estimated_crop_loss_risk","consult_expert"]
-        parsed["advisory_valid"] = all(k in parsed for k in required)
-        return parsed
-    except json.JSONDecodeError:
-        return {"advisory_valid": False, "parse_error": True, "raw_advice": raw}
+        async with httpx.AsyncClient(timeout=httpx.Timeout(timeout, read=min(8.0, timeout))) as client:
+            async with client.stream("POST", f"{_gemini_url('streamGenerateContent')}?alt=sse&key={api_key}", json=_build_request(prediction, language), headers={"Content-Type":"application/json"}) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if time.perf_counter() - started > timeout:
+                        raise httpx.ReadTimeout("Advisory stream outlived its timeout")
+                    if not line.startswith("data:"):
+                        continue
+                    try:
+                        chunk = json.loads(line[5:])
+                        text = "".join(p.get("text", "") for p in chunk["candidates"][0]["content"]["parts"])
+                    except (ValueError, KeyError, IndexError):
+                        continue
+                    if not text:
+                        continue
+                    timing.setdefault("first_token_ms", round((time.perf_counter() - started) * 1000, 1))
+                    raw_parts.append(text)
+                    yield {"event": "token", "text": text}
+                    for key, value in parser.feed(text):
+                        timing.setdefault("first_field_ms", round((time.perf_counter() - started) * 1000, 1))
+                        if key == "immediate_action":
+                            timing["immediate_action_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                        yield {"event": "field", "key": key, "value": value}
+    except httpx.TimeoutException:
+        timing["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield {"event": "advisory", "advisory": {"advisory_valid": False, "error": "GEMINI_TIMEOUT", **parser.members}, "timing": timing}
+        return
+    except Exception as e:
+        timing["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield {"event": "advisory", "advisory": {"advisory_valid": False, "error": str(e), **parser.members}, "timing": timing}
+        return
+    timing["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    yield {"event": "advisory", "advisory": _finalize("".join(raw_parts)), "timing": timing}
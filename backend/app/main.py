@@ -1,42 +1,51 @@
-import asyncio, os, time, logging
+import asyncio, os, time, logging, math
 from contextlib import asynccontextmanager
 import numpy as np
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from starlette.concurrency import run_in_threadpool
-from .model_loader import load_model, get_model, is_model_healthy, get_model_runtime
-from .predictor import predict_image
-from .gemini_client import analyze_with_gemini
-from .plant_validator import validate_plant_presence
-
-logging.basicConfig(level=logging.INFO)
+from fastapi.responses import JSONResponse, StreamingResponse
+from .gemini_client import analyze_with_gemini, stream_gemini_advisory, GEMINI_TIMEOUT_S
+from .services.advisory_bundle import load_bundle
+from .config import get_settings
+from .core.deadline import start_budget, budget_for
+from .core.pipeline import stage, StageRejected
+from .core.stages import label_for, split_label
+from .core.rate_limit import RateLimitExceeded
+from .core.runtime import configure_runtime, apply_threadpool_limit, WORKER_SLOT_ENV
+from .dependencies import limiter
+from .utils.serialization import negotiate, dumps
+from .utils.structured_logging import configure_logging, shutdown_logging, log_event, RequestContextMiddleware, get_dropped_records
+
+settings = get_settings()
+configure_logging(settings.log_dir, settings.log_level, settings.log_max_bytes, settings.log_backup_count, settings.log_tail_sampling)
 logger = logging.getLogger("leafsense")
-limiter = Limiter(key_func=get_remote_address)
-semaphore = asyncio.Semaphore(3)
+# Before the model loader imports TensorFlow, which reads its thread counts from the environment
+runtime_layout = configure_runtime(settings, worker_slot=int(os.getenv(WORKER_SLOT_ENV, "0")))
+# The app/api router (/models, /explain, /predict/batch, ...), mounted below. Importing it loads the model registry;
+# /predict runs the router's scan pipeline, so every scan is retained, indexed, mirrored and rolled up the same way.
+from .api.routes import router, run_scan, scan_until, scan_risk, risk_rollups, pipeline, drift_monitor, health_snapshot, upload_archive
+from .core.concurrency import admission
+from .core.model_loader import get_health_status
+# One breaker per worker for Gemini, whichever endpoint asks it
+from .services.gemini_service import advisory_breaker
+advisory_bundle = load_bundle(settings.advisory_bundle_path)
 requests_served = 0
 requests_failed = 0
-startup_time = 0.0
 MAX_FILE_SIZE = 5 * 1024 * 1024
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global startup_time
-    model_path = os.getenv("MODEL_PATH", "models/plant_disease_model.h5")
-    load_model(model_path)
-    try:
-        model = get_model()
-        # if model:
-        #     t0 = time.time()
-        #     await run_in_threadpool(model.predict, np.zeros((1,224,224,3), dtype=np.float32))
-        #     startup_time = round(time.time() - t0, 3)
-        #     logger.info(f"Warmup done in {startup_time}s")
-    except Exception as e:
-        logger.error(f"Warmup skipped/failed: {e}")
+    apply_threadpool_limit(runtime_layout["threadpool_tokens"])
+    # With a lifespan, Starlette does not run the router's on_startup/on_shutdown handlers itself
+    await router.startup()
+    if upload_archive is not None:
+        await upload_archive.start()
     yield
+    if upload_archive is not None:
+        # Before the router's stores close: the writer finishes what it holds, then the queue is drained
+        await upload_archive.stop()
+    await router.shutdown()
+    shutdown_logging()
 
 app = FastAPI(title="LeafSense_FIX_v1", version="2.0.0", lifespan=lifespan)
 app.state.limiter = limiter
@@ -55,93 +64,251 @@ app.add_middleware(
     allow_headers=["*"],
 )
 # ---------------------
+app.add_middleware(RequestContextMiddleware, slow_request_ms=settings.log_slow_request_ms, tail_sampling=settings.log_tail_sampling)
 
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request, exc):
-    return JSONResponse(status_code=429, content={"detail": "Too many requests. Please wait before retrying.", "code": "RATE_LIMITED"})
+    headers = {"Retry-After": str(max(1, math.ceil(exc.retry_after)))} if math.isfinite(exc.retry_after) else None
+    return JSONResponse(status_code=429, content={"detail": "Too many requests. Please wait before retrying.", "code": "RATE_LIMITED"}, headers=headers)
 
 @app.exception_handler(Exception)
 async def global_handler(request, exc):
     global requests_failed
     requests_failed += 1
-    import traceback
-    with open("crash_log.txt", "a") as f:
-        f.write(f"\n--- CRASH AT {time.ctime()} ---\n")
-        f.write(traceback.format_exc())
-    logger.error(f"Unhandled: {exc}", exc_info=True)
+    # Enqueued only; the traceback is formatted and written by the logging thread
+    logger.error("unhandled_exception", exc_info=(type(exc), exc, exc.__traceback__), extra={"event": "crash", "fields": {"path": request.url.path, "error": str(exc)}})
     return JSONResponse(status_code=500, content={"detail": str(exc), "code": "INTERNAL_ERROR"})
 
 @app.get("/health")
 async def health():
-    loaded = is_model_healthy()
+    model_status = get_health_status()
+    loaded = model_status["loaded"]
     gemini_ok = bool(os.getenv("GEMINI_API_KEY"))
     status = "healthy" if loaded and gemini_ok else "degraded" if loaded else "unhealthy"
-    return JSONResponse(content={"status": status, "model": {"loaded": loaded, "runtime": get_model_runtime(), "warmup_time_s": startup_time}, "gemini": {"api_key_present": gemini_ok}, "stats": {"requests_served": requests_served, "requests_failed": requests_failed}, "version": "2.0.0"}, status_code=503 if status == "unhealthy" else 200)
+    return JSONResponse(content={"status": status, "model": model_status, "gemini": {"api_key_present": gemini_ok}, "stats": {"requests_served": requests_served, "requests_failed": requests_failed}, "advisory_breaker": advisory_breaker.snapshot(), "logging": {"dropped_records": get_dropped_records()}, "advisory_bundle": advisory_bundle.info() if advisory_bundle else None, **health_snapshot(), "version": "2.0.0"}, status_code=503 if status == "unhealthy" else 200)
 
 @app.get("/health/ready")
 async def ready():
-    if not is_model_healthy():
+    model_status = get_health_status()
+    if not (model_status["loaded"] and model_status["warmup_passed"]):
         raise HTTPException(503, "Model not ready")
     return {"ready": True}
 
-@app.post("/predict")
-@limiter.limit("30/minute")
-async def predict(request: Request, file: UploadFile = File(...)):
-    global requests_served, requests_failed
+async def _read_upload(file: UploadFile) -> bytes:
     if file.content_type not in {"image/jpeg","image/png","image/webp","image/jpg"}:
         raise HTTPException(400, detail="Unsupported file type. Use JPEG or PNG.")
-    
     image_bytes = await file.read()
     if len(image_bytes) > MAX_FILE_SIZE:
         raise HTTPException(413, detail="File too large. Max 5MB.")
+    return image_bytes
+
+def _prediction(ctx) -> dict:
+    """The pipeline's scores in the shape /predict has always reported."""
+    top_predictions = []
+    for rank, (idx, prob) in enumerate(ctx["top"], 1):
+        crop, disease = split_label(label_for(ctx["labels"], idx))
+        top_predictions.append({"rank": rank, "display_name": f"{crop} — {disease}", "crop": crop, "disease": disease, "confidence": round(prob, 4)})
+    return {"crop": ctx["crop"], "disease": ctx["disease"], "confidence": round(ctx["confidence"], 4), "top_predictions": top_predictions,
+            "model_version": ctx["bundle"].version}
+
+def _summarize(prediction: dict) -> dict:
+    confidence = prediction["confidence"]
+    top_preds = prediction.get("top_predictions", [])
+    top2_conf = top_preds[1]["confidence"] if len(top_preds) > 1 else 0.0
+    confidence_gap = round(confidence - top2_conf, 4)
+    params = pipeline.params
+    tier = "high" if confidence >= params["tier_high"] else "moderate" if confidence >= params["tier_moderate"] else "low"
+    log_event(logger, "prediction", crop=prediction["crop"], disease=prediction["disease"], confidence=round(confidence, 4), confidence_gap=confidence_gap, tier=tier)
+    return {"crop": prediction["crop"], "diagnosis": prediction["disease"], "confidence": round(confidence, 4), "confidence_gap": confidence_gap, "tier": tier, "uncertainty_flag": confidence_gap < 0.20, "top_predictions": top_preds, "model_version": prediction["model_version"]}
+
+HEALTHY_ADVISORY = {"advisory_valid": True, "disease_name": "Healthy", "severity": "None", "cause": "No disease detected.", "immediate_action": "No action required.", "treatment_plan": [], "prevention": "Maintain regular care.", "estimated_crop_loss_risk": "Low", "consult_expert": False}
+
+def _bundled_advisory(prediction: dict, language: str):
+    """Precompiled advisory for this class/language, or None if the LLM has to write one."""
+    if advisory_bundle is None:
+        return None
+    advisory = advisory_bundle.get(prediction["crop"], prediction["disease"], language)
+    return {**advisory, "advisory_valid": True} if advisory else None
+
+def _risk(confidence: float, ai_analysis) -> dict:
+    severity = ai_analysis.get("severity","Medium") if ai_analysis else "Low"
+    sev_w = {"None":0,"Low":0.3,"Medium":0.5,"High":0.7,"Critical":1.0}.get(severity,0.5)
+    risk_score = round((confidence * 0.7 + sev_w * 0.3) * 100)
+    return {"risk_score": risk_score, "risk_category": "LOW" if risk_score < 40 else "HIGH" if risk_score >= 70 else "MODERATE"}
 
+async def _llm_advisory(prediction: dict, language: str):
+    """
+    Gemini behind the circuit breaker, given only what is left of the request budget.
+    Returns (advisory, source) where source is "llm", or "fallback" if Gemini was not asked.
+    """
+    timeout = budget_for(GEMINI_TIMEOUT_S)
+    if timeout < settings.advisory_min_budget_s:
+        return {"advisory_valid": False, "error": "ADVISORY_BUDGET_EXHAUSTED"}, "fallback"
+    # Not configured is not Gemini failing; asking would only count against the breaker
+    if not os.getenv("GEMINI_API_KEY"):
+        return {"advisory_valid": False, "error": "ADVISORY_NOT_CONFIGURED"}, "fallback"
+    if not advisory_breaker.allow():
+        return {"advisory_valid": False, "error": "ADVISORY_CIRCUIT_OPEN"}, "fallback"
+    started = time.monotonic()
     try:
-        validation = validate_plant_presence(image_bytes)
-        if not validation.is_plant:
-            raise HTTPException(422, detail=validation.rejection_reason, headers={"X-Error-Code": "NOT_A_PLANT"})
+        ai_analysis = await analyze_with_gemini(prediction, language, timeout=timeout)
+    except BaseException:
+        advisory_breaker.release()  # Cancelled (client gone); says nothing about Gemini
+        raise
+    # Unparseable output still means Gemini answered; only transport/API errors count against it
+    advisory_breaker.record("error" not in ai_analysis, time.monotonic() - started)
+    return ai_analysis, "llm"
 
-        await asyncio.wait_for(semaphore.acquire(), timeout=12.0)
-        try:
-            model = get_model()
-            if not model:
-                raise HTTPException(503, detail="Model not loaded.", headers={"X-Error-Code": "MODEL_ERROR"})
-            
-            prediction = await run_in_threadpool(predict_image, image_bytes, model)
-            confidence = prediction["confidence"]
-            top_preds = prediction.get("top_predictions", [])
-            top2_conf = top_preds[1]["confidence"] if len(top_preds) > 1 else 0.0
-            confidence_gap = round(confidence - top2_conf, 4)
-            uncertainty_flag = confidence_gap < 0.20
-            tier = "high" if confidence >= 0.70 else "moderate" if confidence >= 0.45 else "low"
-            is_healthy = "healthy" in prediction.get("disease","").lower()
-
-            advisory_skipped, advisory_valid, ai_analysis, gemini_called = False, False, None, False
-            if tier == "low" or is_healthy:
-                advisory_skipped = True
-                if is_healthy:
-                    ai_analysis = {"advisory_valid": True, "disease_name": "Healthy", "severity": "None", "cause": "No disease detected.", "immediate_action": "No action required.", "treatment_plan": [], "prevention": "Maintain regular care.", "estimated_crop_loss_risk": "Low", "consult_expert": False}
-                    advisory_valid = True
-            else:
-                gemini_called = True
-                try:
-                    ai_analysis = await analyze_with_gemini(prediction)
-                    advisory_valid = ai_analysis.get("advisory_valid", True)
-                except Exception as e:
-                    logger.error(f"Gemini failed: {e}")
-                    ai_analysis = {"advisory_valid": False, "parse_error": True}
-
-            severity = ai_analysis.get("severity","Medium") if ai_analysis else "Low"
-            sev_w = {"None":0,"Low":0.3,"Medium":0.5,"High":0.7,"Critical":1.0}.get(severity,0.5)
-            risk_score = round((confidence * 0.7 + sev_w * 0.3) * 100)
-            risk_category = "LOW" if risk_score < 40 else "HIGH" if risk_score >= 70 else "MODERATE"
-
-            logger.info(f"tier={tier} confidence={confidence:.3f} gemini_called={gemini_called} advisory_valid={advisory_valid}")
-            requests_served += 1
-            return {"crop": prediction["crop"], "diagnosis": prediction["disease"], "confidence": round(confidence, 4), "confidence_gap": confidence_gap, "tier": tier, "uncertainty_flag": uncertainty_flag, "advisory_valid": advisory_valid, "advisory_skipped": advisory_skipped, "risk_score": risk_score, "risk_category": risk_category, "top_predictions": top_preds, "validator_scores": {"green_ratio": validation.green_ratio, "entropy": validation.entropy, "edge_density": validation.edge_density}, "ai_analysis": ai_analysis}
-        finally:
-            semaphore.release()
+ADVISORY_NOT_RUN = {"ai_analysis": None, "advisory_valid": False, "advisory_skipped": True, "advisory_source": "none", "gemini_called": False}
+
+@stage("advise", "legacy", requires=("crop", "disease", "confidence", "language"), provides=("advisory",))
+async def advise_legacy(ctx):
+    """Healthy template, precompiled bundle, then Gemini. Skipped below advise_min_confidence (the "low" tier)."""
+    prediction = {"crop": ctx["crop"], "disease": ctx["disease"], "confidence": ctx["confidence"]}
+    is_healthy = "healthy" in prediction["disease"].lower()
+    if ctx["confidence"] < ctx.params["advise_min_confidence"] or is_healthy:
+        if is_healthy:
+            return {"advisory": {**ADVISORY_NOT_RUN, "ai_analysis": dict(HEALTHY_ADVISORY), "advisory_valid": True, "advisory_source": "healthy"}}
+        return {"advisory": ADVISORY_NOT_RUN}
+    if (bundled := _bundled_advisory(prediction, ctx["language"])) is not None:
+        return {"advisory": {**ADVISORY_NOT_RUN, "ai_analysis": bundled, "advisory_valid": True, "advisory_skipped": False, "advisory_source": "bundle"}}
+    try:
+        ai_analysis, source = await _llm_advisory(prediction, ctx["language"])
+    except Exception as e:
+        log_event(logger, "advisory_error", logging.ERROR, error=str(e))
+        ai_analysis, source = {"advisory_valid": False, "parse_error": True}, "none"
+    return {"advisory": {"ai_analysis": ai_analysis, "advisory_valid": ai_analysis.get("advisory_valid", True), "advisory_skipped": False,
+                         "advisory_source": source, "gemini_called": source == "llm"}}
+
+async def _run_pipeline(image_bytes: bytes, language: str):
+    """The router's scan, up to the advisory, which main writes itself (advise_legacy, or streamed)."""
+    try:
+        ctx = await run_scan(image_bytes, language, stop_after=scan_until)
+    except StageRejected as rejection:
+        raise HTTPException(rejection.status, detail=rejection.message, headers={"X-Error-Code": rejection.code})
+    log_event(logger, "pipeline_timing", logging.DEBUG, queue_limit=round(admission.limit, 2), **{f"{name}_ms": round(ms, 1) for name, ms in ctx.timings.items()})
+    return ctx
+
+def _record_scan(ctx, ai_analysis, field_id: str = None, region: str = None):
+    """Counts the scan in the /risk rollups, the way the router counts its own."""
+    severity = ai_analysis.get("severity", "Medium") if ai_analysis else "Low"
+    risk_index, progression = scan_risk(ctx["confidence"], severity, ctx["metrics"])
+    risk_rollups.record(risk_index, ctx["crop"], ctx["disease"], progression, field_id, region)
+
+@app.get("/drift")
+async def drift(samples: bool = False):
+    """
+    How far this worker's recent traffic has moved from the evaluation baseline: PSI per
+    validator score, image metric, confidence, predicted class and rejection outcome, for the
+    current and the last complete window. samples=true adds a uniform sample of the window.
+    """
+    return drift_monitor.report(samples)
+
+@app.post("/predict")
+@limiter.limit("30/minute", scope="predict")
+async def predict(request: Request, file: UploadFile = File(...), language: str = "en",
+                  field_id: str = Query(None, max_length=64), region: str = Query(None, max_length=64)):
+    global requests_served, requests_failed
+    start_budget(settings.predict_budget_s)
+    image_bytes = await _read_upload(file)
+
+    try:
+        ctx = await _run_pipeline(image_bytes, language)
+        prediction = _prediction(ctx)
+        summary = _summarize(prediction)
+        started = time.perf_counter()
+        advisory = (await advise_legacy(ctx))["advisory"]
+        ctx.timings["advise"] = (time.perf_counter() - started) * 1000
+        ai_analysis, advisory_valid, advisory_skipped = advisory["ai_analysis"], advisory["advisory_valid"], advisory["advisory_skipped"]
+        advisory_source, gemini_called = advisory["advisory_source"], advisory["gemini_called"]
+        confidence = prediction["confidence"]
+
+        risk = _risk(confidence, ai_analysis)
+        log_event(logger, "advisory", gemini_called=gemini_called, advisory_valid=advisory_valid, advisory_skipped=advisory_skipped, advisory_source=advisory_source, risk_score=risk["risk_score"])
+        _record_scan(ctx, ai_analysis, field_id, region)
+        requests_served += 1
+        response = negotiate(request, {"scan_id": ctx["scan_id"], **summary, "advisory_valid": advisory_valid, "advisory_skipped": advisory_skipped, "advisory_source": advisory_source, **risk, "validator_scores": ctx.get("validation"), "ai_analysis": ai_analysis})
+        response.headers["Server-Timing"] = ctx.server_timing()
+        return response
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"CRITICAL CRASH IN /predict: {e}", exc_info=True)
         raise HTTPException(500, detail="Internal server error occurred during prediction.")
+
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+@app.post("/predict/stream")
+@limiter.limit("30/minute", scope="predict")
+async def predict_stream(request: Request, file: UploadFile = File(...), language: str = "en",
+                         field_id: str = Query(None, max_length=64), region: str = Query(None, max_length=64)):
+    """
+    Same diagnosis as /predict, streamed as Server-Sent Events: a `prediction` event as soon as
+    the model is done, then `token` and `field` events while Gemini writes the advisory, and a
+    final `done` event with the validated advisory and risk score.
+    """
+    global requests_served
+    start_budget(settings.predict_budget_s)
+    image_bytes = await _read_upload(file)
+    # The advisory below is streamed instead of run as the advise stage
+    ctx = await _run_pipeline(image_bytes, language)
+    prediction = _prediction(ctx)
+    summary = _summarize(prediction)
+    is_healthy = "healthy" in prediction.get("disease","").lower()
+
+    async def events():
+        global requests_served
+        yield _sse("prediction", {"scan_id": ctx["scan_id"], **summary, "validator_scores": ctx.get("validation")})
+        if summary["tier"] == "low" or is_healthy:
+            ai_analysis = dict(HEALTHY_ADVISORY) if is_healthy else None
+            _record_scan(ctx, ai_analysis, field_id, region)
+            yield _sse("done", {"advisory_skipped": True, "advisory_valid": is_healthy, **_risk(prediction["confidence"], ai_analysis), "ai_analysis": ai_analysis})
+            requests_served += 1
+            return
+        bundled = _bundled_advisory(prediction, language)
+        if bundled is not None:
+            _record_scan(ctx, bundled, field_id, region)
+            for key, value in bundled.items():
+                if key != "advisory_valid":
+                    yield _sse("field", {"key": key, "value": value})
+            yield _sse("done", {"advisory_skipped": False, "advisory_valid": True, **_risk(prediction["confidence"], bundled), "ai_analysis": bundled, "timing": {}})
+            requests_served += 1
+            return
+        # Same order as _llm_advisory: what is left of the request budget, configuration, then the breaker
+        timeout = budget_for(GEMINI_TIMEOUT_S)
+        error = "ADVISORY_BUDGET_EXHAUSTED" if timeout < settings.advisory_min_budget_s else "ADVISORY_NOT_CONFIGURED" if not os.getenv("GEMINI_API_KEY") else None
+        if error is None and not advisory_breaker.allow():
+            error = "ADVISORY_CIRCUIT_OPEN"
+        if error is not None:
+            ai_analysis = {"advisory_valid": False, "error": error}
+            _record_scan(ctx, ai_analysis, field_id, region)
+            yield _sse("done", {"advisory_skipped": False, "advisory_valid": False, **_risk(prediction["confidence"], ai_analysis), "ai_analysis": ai_analysis, "timing": {}})
+            requests_served += 1
+            return
+        started, outcome = time.monotonic(), None
+        try:
+            async for event in stream_gemini_advisory(prediction, language, timeout=timeout):
+                if event["event"] == "token":
+                    yield _sse("token", {"text": event["text"]})
+                elif event["event"] == "field":
+                    yield _sse("field", {"key": event["key"], "value": event["value"]})
+                else:
+                    ai_analysis = event["advisory"]
+                    outcome = "error" not in ai_analysis
+                    _record_scan(ctx, ai_analysis, field_id, region)
+                    log_event(logger, "advisory_stream", advisory_valid=ai_analysis.get("advisory_valid", False), **event["timing"])
+                    yield _sse("done", {"advisory_skipped": False, "advisory_valid": ai_analysis.get("advisory_valid", False), **_risk(prediction["confidence"], ai_analysis), "ai_analysis": ai_analysis, "timing": event["timing"]})
+        finally:
+            # A client that hangs up mid-stream says nothing about Gemini's health
+            if outcome is None:
+                advisory_breaker.release()
+            else:
+                advisory_breaker.record(outcome, time.monotonic() - started)
+        requests_served += 1
+
+    # X-Accel-Buffering stops nginx-style proxies from holding the stream back
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": ctx.server_timing()})
+
+# The router has no path of its own that main serves above
+app.include_router(router)
@@ -17,11 +17,15 @@ class ValidationResult:
     confidence: float
 
 def validate_plant_presence(image_bytes: bytes) -> ValidationResult:
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if img is None:
+        return ValidationResult(is_plant=False, rejection_reason="Invalid image format.", green_ratio=0.0, entropy=0.0, edge_density=0.0, confidence=0.0)
+    return validate_image(img)
+
+def validate_image(img: np.ndarray) -> ValidationResult:
+    """Same checks on an already-decoded BGR image."""
     try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-            return ValidationResult(is_plant=False, rejection_reason="Invalid image format.", green_ratio=0.0, entropy=0.0, edge_density=0.0, confidence=0.0)
         img = cv2.resize(img, (256, 256))
         total_pixels = 256 * 256
         hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
@@ -21,6 +21,7 @@ class Prediction(BaseModel):
     confidence: float
     top_k: Optional[List[TopKPrediction]] = None
     metrics: Optional[Dict[str, Any]] = None
+    model_version: Optional[str] = None
 
 class DetectionResponse(BaseModel):
     scan_id: Optional[str] = None
@@ -36,3 +37,30 @@ class BatchDetectionResponse(BaseModel):
     results: List[DetectionResponse]
     overall_risk_index: float
     summary_directive: str
+
+class FieldTile(BaseModel):
+    box: List[int]  # x, y, width, height in source pixels
+    plant_coverage: float
+    prediction: Prediction
+
+class FieldVerdict(BaseModel):
+    crop: str
+    disease: str
+    vote_share: float
+    tiles_scored: int
+    diseased_tiles: int
+    uncertain_tiles: int
+    affected_fraction: float
+    lesion_load: float
+    representative_tile: int
+
+class FieldDetectionResponse(BaseModel):
+    scan_id: str
+    field_verdict: FieldVerdict
+    ai_analysis: AIAnalysis
+    risk_index: float
+    tier: Optional[str] = None
+    disease_progression: Optional[str] = None
+    model_version: Optional[str] = None
+    tiles: List[FieldTile]
+    tiling: Dict[str, int]
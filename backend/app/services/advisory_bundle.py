@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import mmap
+import zlib
+import struct
+import logging
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Layout: HEADER | index (JSON, utf-8) | data (one zlib-compressed JSON advisory per entry)
+#   HEADER = magic b"LSAB", format version, index length in bytes
+# The index maps "<advisory key>|<language>" to [offset, length] relative to the data section.
+MAGIC = b"LSAB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHI")
+LANGUAGES = {"en":"English","hi":"Hindi","mr":"Marathi","te":"Telugu","ta":"Tamil","kn":"Kannada","bn":"Bengali","pa":"Punjabi"}
+
+def advisory_key(crop: str, disease: str) -> str:
+    """Normalizes crop/disease as produced by either predictor ("Corn (maize)", "Common rust ")."""
+    return re.sub(r"[^a-z0-9]+", " ", f"{crop} {disease}".lower()).strip()
+
+def label_key(label: str) -> str:
+    """Class label from class_labels.json ("Tomato___Early_blight") -> advisory key."""
+    crop, _, disease = label.partition("___")
+    return advisory_key(crop, disease)
+
+class AdvisoryBundle:
+    """Read-only view over a bundle file. Lookups are a dict hit plus one zlib slice."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_len = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} advisory bundle")
+        meta = json.loads(self._mmap[HEADER.size:HEADER.size + index_len])
+        self._entries: Dict[str, Tuple[int, int]] = meta.pop("entries")
+        self._data_start = HEADER.size + index_len
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, crop: str, disease: str, language: str = "en") -> Optional[dict]:
+        return self.get_by_key(advisory_key(crop, disease), language)
+
+    def get_by_key(self, key: str, language: str = "en") -> Optional[dict]:
+        entry = self._entries.get(f"{key}|{language}")
+        if entry is None:
+            return None
+        offset, length = entry
+        start = self._data_start + offset
+        return json.loads(zlib.decompress(self._mmap[start:start + length]))
+
+    def items(self):
+        for composite in self._entries:
+            key, _, language = composite.rpartition("|")
+            yield key, language, self.get_by_key(key, language)
+
+    def info(self) -> dict:
+        return {"path": self.path, "entries": len(self), **self.meta}
+
+def write_bundle(path: str, advisories: Dict[Tuple[str, str], dict], meta: dict):
+    """advisories: {(advisory_key, language): advisory}. Written to a temp file and renamed into place."""
+    entries, blobs, offset = {}, [], 0
+    for (key, language), advisory in sorted(advisories.items()):
+        blob = zlib.compress(json.dumps(advisory, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+        entries[f"{key}|{language}"] = [offset, len(blob)]
+        blobs.append(blob)
+        offset += len(blob)
+    index = json.dumps({**meta, "entries": entries}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(index)))
+        f.write(index)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+@lru_cache(maxsize=None)
+def load_bundle(path: str) -> Optional[AdvisoryBundle]:
+    if not os.path.exists(path):
+        logger.warning(f"Advisory bundle not found at {path}; every advisory will go to the LLM.")
+        return None
+    try:
+        bundle = AdvisoryBundle(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Failed to load advisory bundle {path}: {e}")
+        return None
+    logger.info(f"Loaded advisory bundle {bundle.meta.get('bundle_version')} with {len(bundle)} advisories")
+    return bundle
@@ -1,21 +1,43 @@
 import json
+import time
 import logging
 import asyncio
 import google.generativeai as genai
 import re
 from app.config import get_settings
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.deadline import budget_for
+from app.core.pipeline import stage
+from app.schemas.response import AIAnalysis
+from app.services.advisory_bundle import load_bundle, advisory_key, label_key, LANGUAGES
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-if settings.gemini_api_key and settings.gemini_api_key != "your_google_gemini_api_key_here":
+if settings.gemini_api_base:
+    # Local stand-in (tools/fake_gemini.py); the SDK only reaches custom endpoints over REST
+    genai.configure(api_key=settings.gemini_api_key, transport="rest",
+                    client_options={"api_endpoint": re.sub(r"/v1(beta)?/?$", "", settings.gemini_api_base)})
+elif settings.gemini_api_key and settings.gemini_api_key != "your_google_gemini_api_key_here":
     genai.configure(api_key=settings.gemini_api_key)
 
 model = genai.GenerativeModel('gemini-1.5-flash-latest')
+LLM_TIMEOUT_S = 8.0
+ADVISORY_MIN_CONFIDENCE = 0.60  # Below this the user is asked to retake the photo instead
+advisory_breaker = CircuitBreaker(
+    "gemini",
+    window_s=settings.advisory_breaker_window_s,
+    min_calls=settings.advisory_breaker_min_calls,
+    failure_rate=settings.advisory_breaker_failure_rate,
+    slow_call_s=settings.advisory_breaker_slow_call_s,
+    slow_call_rate=settings.advisory_breaker_slow_rate,
+    open_s=settings.advisory_breaker_open_s
+)
 
-# Crop-Specific Advisory Templates Cache
+# Hand-written English advisories, keyed by class label. They seed tools/build_advisory_bundle.py
+# and still answer if no bundle is deployed.
 ADVISORY_TEMPLATES = {
-    "Tomato Early Blight": {
+    "Tomato___Early_blight": {
         "disease_name": "Early Blight (Alternaria solani)",
         "severity": "High",
         "cause": "Fungal infection thriving in warm, humid conditions.",
@@ -29,7 +51,7 @@ ADVISORY_TEMPLATES = {
         "estimated_crop_loss_risk": "High",
         "consult_expert": True
     },
-    "Apple Scab": {
+    "Apple___Apple_scab": {
         "disease_name": "Apple Scab (Venturia inaequalis)",
         "severity": "Medium",
         "cause": "Ascomycete fungus heavily dependent on spring moisture.",
@@ -42,7 +64,7 @@ ADVISORY_TEMPLATES = {
         "estimated_crop_loss_risk": "Medium",
         "consult_expert": False
     },
-    "Corn Common Rust": {
+    "Corn_(maize)___Common_rust_": {
          "disease_name": "Common Rust (Puccinia sorghi)",
          "severity": "Medium",
          "cause": "Fungal pathogen favored by cool, moist conditions.",
@@ -57,7 +79,57 @@ ADVISORY_TEMPLATES = {
     }
 }
 
-async def get_ai_analysis(crop: str, disease: str, confidence: float) -> dict:
+_TEMPLATE_INDEX = {label_key(label): template for label, template in ADVISORY_TEMPLATES.items()}
+advisory_bundle = load_bundle(settings.advisory_bundle_path)
+
+async def get_advisory(crop: str, disease: str, confidence: float, language: str = "en",
+                       min_confidence: float = ADVISORY_MIN_CONFIDENCE) -> dict:
+    """AIAnalysis-shaped advisory for a prediction: canned for low confidence and healthy leaves, else get_ai_analysis."""
+    if confidence < min_confidence:
+         return {
+             "disease_name": "Unknown",
+             "severity": "Unknown",
+             "cause": "Low confidence. Please capture a clearer image of the plant leaf.",
+             "immediate_action": "Retake photo.",
+             "treatment_plan": [],
+             "prevention": "Ensure good lighting and focus.",
+             "estimated_crop_loss_risk": "Unknown",
+             "consult_expert": False
+         }
+    if disease.strip().lower() == "healthy":
+         return {
+             "disease_name": "Healthy",
+             "severity": "None",
+             "cause": "The neural network indicates this plant is healthy.",
+             "immediate_action": "None",
+             "treatment_plan": [],
+             "prevention": "Continue current watering and fertilizing schedules. Monitor for future anomalies.",
+             "estimated_crop_loss_risk": "Low",
+             "consult_expert": False
+         }
+
+    ai_analysis_result = await get_ai_analysis(crop=crop, disease=disease, confidence=confidence, language=language)
+    # Ensure it is a dict
+    if isinstance(ai_analysis_result, dict) and "parse_error" in ai_analysis_result:
+         return {
+             "disease_name": disease,
+             "severity": "Medium",
+             "cause": ai_analysis_result.get("raw_advice", "Failed to parse AI advice"),
+             "immediate_action": "Monitor plant closely.",
+             "treatment_plan": [],
+             "prevention": "Maintain optimal growing conditions.",
+             "estimated_crop_loss_risk": "Medium",
+             "consult_expert": True
+         }
+    # LLM output is untrusted: validate against the schema, everything else here is built in-house
+    return AIAnalysis(**ai_analysis_result).model_dump()
+
+@stage("advise", "service", requires=("crop", "disease", "confidence", "language"), provides=("ai_analysis",))
+async def advise_service(ctx):
+    return {"ai_analysis": await get_advisory(ctx["crop"], ctx["disease"], ctx["confidence"], ctx["language"],
+                                              ctx.params.get("advise_min_confidence", ADVISORY_MIN_CONFIDENCE))}
+
+async def get_ai_analysis(crop: str, disease: str, confidence: float, language: str = "en") -> dict:
     if "healthy" in disease.lower():
         return {
             "disease_name": "None",
@@ -70,28 +142,31 @@ async def get_ai_analysis(crop: str, disease: str, confidence: float) -> dict:
             "consult_expert": False
         }
 
-    # 1. Check Advisory Template Cache (Differentiation feature)
-    template_key = f"{crop} {disease}".strip()
-    if template_key in ADVISORY_TEMPLATES:
-        logger.info(f"Using structured template for {template_key}")
-        return ADVISORY_TEMPLATES[template_key]
-        
-    # If not in cache but we have a matching general term
-    for key, template in ADVISORY_TEMPLATES.items():
-        if disease.lower() in key.lower():
-             logger.info(f"Using partial match structured template for {disease}")
-             return template
-
-    # 2. Fallback to Gemini LLM
+    # 1. Precompiled advisory bundle, then the built-in English templates (both O(1) lookups)
+    key = advisory_key(crop, disease)
+    if advisory_bundle is not None:
+        bundled = advisory_bundle.get_by_key(key, language)
+        if bundled is not None:
+            return bundled
+    if language == "en" and key in _TEMPLATE_INDEX:
+        logger.info(f"Using structured template for {crop} {disease}")
+        return _TEMPLATE_INDEX[key]
+
+    # 2. Fallback to Gemini LLM, only with enough of the request budget left and the breaker closed
     if not settings.gemini_api_key or settings.gemini_api_key == "your_google_gemini_api_key_here":
         return _fallback_response(f"Template not found and Gemini API key not configured for {crop} {disease}.")
+    timeout = budget_for(LLM_TIMEOUT_S)
+    if timeout < settings.advisory_min_budget_s:
+        return _fallback_response("Not enough time left to compute an AI advisory for this request.")
+    if not advisory_breaker.allow():
+        return _fallback_response("AI advisory service is temporarily unavailable.")
 
     prompt = f"""
     - Detected Crop: {crop}
     - Detected Disease: {disease}
     - Neural Network Confidence: {confidence*100:.1f}%
 
-    Respond ONLY about this disease.
+    Respond ONLY about this disease, in {LANGUAGES.get(language, "English")}. Keep all JSON keys in English.
     Do NOT speculate.
     Do NOT include disclaimers.
     Output ONLY JSON matching this exact schema:
@@ -108,9 +183,10 @@ async def get_ai_analysis(crop: str, disease: str, confidence: float) -> dict:
     }}
     """
     
+    started = time.monotonic()
     try:
         response = await asyncio.wait_for(
-            model.generate_content_async(
+            _generate(
                 prompt,
                 generation_config={
                     "temperature": 0.0,
@@ -118,30 +194,45 @@ async def get_ai_analysis(crop: str, disease: str, confidence: float) -> dict:
                     "max_output_tokens": 500,
                 }
             ),
-            timeout=8.0
+            timeout=timeout
         )
-        
-        raw_text = response.text.strip()
-        
-        # Defensive Stripping of potential markdown fences
-        raw_text = re.sub(r'^```json', '', raw_text, flags=re.IGNORECASE)
-        raw_text = re.sub(r'^```', '', raw_text)
-        raw_text = re.sub(r'```$', '', raw_text)
-        raw_text = raw_text.strip()
-
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            return {
-                "raw_advice": raw_text,
-                "parse_error": True
-            }
-
     except asyncio.TimeoutError:
+        advisory_breaker.record(False, time.monotonic() - started)
         return _fallback_response("AI advisory timed out computing treatment protocol.")
+    except asyncio.CancelledError:
+        advisory_breaker.release()
+        raise
     except Exception as e:
+        advisory_breaker.record(False, time.monotonic() - started)
         logger.error(f"Error calling Gemini API: {e}")
         return _fallback_response("Failed to generate AI analysis due to an internal error.")
+    advisory_breaker.record(True, time.monotonic() - started)
+
+    try:
+        raw_text = response.text.strip()
+    except ValueError as e:  # No text part, e.g. a blocked candidate
+        logger.error(f"Gemini returned no text: {e}")
+        return _fallback_response("Failed to generate AI analysis due to an internal error.")
+
+    # Defensive Stripping of potential markdown fences
+    raw_text = re.sub(r'^```json', '', raw_text, flags=re.IGNORECASE)
+    raw_text = re.sub(r'^```', '', raw_text)
+    raw_text = re.sub(r'```$', '', raw_text)
+    raw_text = raw_text.strip()
+
+    try:
+        return json.loads(raw_text)
+    except json.JSONDecodeError:
+        return {
+            "raw_advice": raw_text,
+            "parse_error": True
+        }
+
+async def _generate(prompt: str, generation_config: dict):
+    if settings.gemini_api_base:
+        # The SDK's async client has no working REST transport, so run the sync call in a thread
+        return await asyncio.to_thread(model.generate_content, prompt, generation_config=generation_config)
+    return await model.generate_content_async(prompt, generation_config=generation_config)
 
 def _fallback_response(msg: str, severity: str = "Unknown") -> dict:
     return {
@@ -0,0 +1,80 @@
+import threading
+import cv2
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from typing import Tuple
+
+WB_BAND_ROWS = 64
+
+class PreprocessBuffers:
+    """
+    Scratch space for one in-flight request: full-resolution planes for the enhancement
+    chain and a (3, S, S, 3) float32 tensor holding the model input and its two TTA views.
+    Full-resolution planes are (re)allocated only when the image shape changes, which in
+    practice is rare: a given phone always uploads the same resolution.
+    """
+
+    def __init__(self, input_size: int = 224, tta_views: int = 3):
+        self.input_size = input_size
+        self.shape: Tuple[int, int] = (0, 0)
+        self.tensor = np.empty((tta_views, input_size, input_size, 3), dtype=np.float32)
+        self.small = np.empty((input_size, input_size, 3), dtype=np.uint8)
+        self.small_rgb = np.empty_like(self.small)
+        # cv2.CLAHE keeps per-call state in the object, so it is no more shareable between threads than the planes
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+    def ensure(self, height: int, width: int) -> "PreprocessBuffers":
+        if self.shape != (height, width):
+            self.shape = (height, width)
+            self.color_a = np.empty((height, width, 3), dtype=np.uint8)  # LAB, then HSV
+            self.color_b = np.empty((height, width, 3), dtype=np.uint8)  # Gaussian blur, then sharpened
+            self.plane = np.empty((height, width), dtype=np.uint8)       # Gray, then L, then mask scratch
+            self.edges = np.empty((height, width), dtype=np.uint8)
+            self.mask_green = np.empty((height, width), dtype=np.uint8)
+            self.mask_brown = np.empty((height, width), dtype=np.uint8)
+            self.mask_plant = np.empty((height, width), dtype=np.uint8)
+            self.laplacian = np.empty((height, width), dtype=np.int16)
+            self.wb_scratch = np.empty((min(height, WB_BAND_ROWS), width, 3), dtype=np.float64)
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [v for v in vars(self).values() if isinstance(v, np.ndarray)]
+        return sum(a.nbytes for a in arrays)
+
+class BufferPool:
+    """
+    Leases PreprocessBuffers to requests. Up to `max_idle` buffer sets are kept between
+    requests; past that, a burst allocates fresh sets and drops them afterwards, which is
+    no worse than allocating per request.
+    """
+
+    def __init__(self, input_size: int = 224, max_idle: int = 4):
+        self.input_size = input_size
+        self.max_idle = max_idle
+        self._idle: deque = deque()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.leased = 0
+
+    @contextmanager
+    def lease(self):
+        with self._lock:
+            buffers = self._idle.pop() if self._idle else None
+            self.leased += 1
+            if buffers is None:
+                self.created += 1
+        if buffers is None:
+            buffers = PreprocessBuffers(self.input_size)
+        try:
+            yield buffers
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(buffers)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "created": self.created, "leases": self.leased,
+                    "idle_mb": round(sum(b.nbytes for b in self._idle) / 2**20, 1)}
@@ -1,8 +1,9 @@
+import math
 import logging
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
-from slowapi.errors import RateLimitExceeded
+from app.core.rate_limit import RateLimitExceeded
 from fastapi import HTTPException
 
 logger = logging.getLogger(__name__)
@@ -19,13 +20,19 @@ ERROR_CODES = {
     "VALIDATION_ERROR": "VALIDATION_ERROR"
 }
 
+def _retry_after_headers(exc: RateLimitExceeded):
+    if not math.isfinite(exc.retry_after):
+        return None
+    return {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+
 def _rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
     return JSONResponse(
         status_code=429,
         content={
             "detail": "Rate limit exceeded. Try again later.",
             "code": ERROR_CODES["RATE_LIMITED"]
-        }
+        },
+        headers=_retry_after_headers(exc)
     )
 
 async def global_exception_handler(request: Request, exc: Exception):
@@ -37,7 +44,8 @@ async def global_exception_handler(request: Request, exc: Exception):
             content={
                 "detail": "Too many requests. Please wait before retrying.",
                 "code": ERROR_CODES["RATE_LIMITED"]
-            }
+            },
+            headers=_retry_after_headers(exc)
         )
 
     if isinstance(exc, RequestValidationError):
@@ -1,7 +1,8 @@
 import cv2
 import numpy as np
 # no tf
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, Optional
+from app.utils.buffer_pool import PreprocessBuffers
 
 def decode_image(image_bytes: bytes) -> np.ndarray:
     nparr = np.frombuffer(image_bytes, np.uint8)
@@ -14,58 +15,86 @@ def compute_blur_score(image: np.ndarray) -> float:
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     return float(cv2.Laplacian(gray, cv2.CV_64F).var())
 
-def enhance_image_pipeline(image: np.ndarray) -> Tuple[np.ndarray, Dict[str, Any]]:
-    # 1. Blur Detection
-    blur_score = compute_blur_score(image)
-    
-    # 2. White Balance Normalization (Simple Grey-World)
-    result_wb = image.copy()
-    avg_b = np.average(result_wb[:, :, 0])
-    avg_g = np.average(result_wb[:, :, 1])
-    avg_r = np.average(result_wb[:, :, 2])
+def compute_plant_masks(hsv: np.ndarray, min_value: int = 40, out: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Healthy-green and brown/diseased masks over an HSV image, optionally into preallocated `out`."""
+    green_dst, brown_dst = out if out is not None else (None, None)
+    # Broad plant color range (yellowish-green to dark green)
+    mask_green = cv2.inRange(hsv, np.array([25, 40, min_value]), np.array([95, 255, 255]), dst=green_dst)
+    # Brown/diseased areas
+    mask_brown = cv2.inRange(hsv, np.array([5, 40, min_value]), np.array([25, 255, 255]), dst=brown_dst)
+    return mask_green, mask_brown
+
+def quick_leaf_metrics(image: np.ndarray) -> Dict[str, Any]:
+    """Metrics of enhance_image_pipeline without the enhancement chain, for already-resized inputs."""
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    mask_green, mask_brown = compute_plant_masks(hsv)
+    plant_pixels = cv2.countNonZero(cv2.bitwise_or(mask_green, mask_brown))
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    return {
+        "blur_score": round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 2),
+        "lesion_density_percent": round(cv2.countNonZero(mask_brown) / plant_pixels * 100, 2) if plant_pixels > 0 else 0.0,
+        "texture_complexity": round(cv2.countNonZero(edges) / (image.shape[0] * image.shape[1]), 4)
+    }
+
+_CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+def enhance_image_pipeline(image: np.ndarray, buffers: Optional[PreprocessBuffers] = None) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Blur score, white balance, CLAHE, background suppression and sharpening.
+
+    With `buffers` (a leased PreprocessBuffers) every intermediate is written into the
+    preallocated planes with OpenCV dst= operations, `image` itself is modified in place
+    and the returned image is a view that stays valid until the lease ends. Without
+    `buffers`, scratch space is allocated for this call and `image` is left untouched.
+    """
+    height, width = image.shape[:2]
+    if buffers is None:
+        buffers = PreprocessBuffers().ensure(height, width)
+        image = image.copy()
+    else:
+        buffers.ensure(height, width)
+    b = buffers
+
+    # 1. Blur Detection (16-bit Laplacian is exact for 8-bit input and half the size of CV_64F)
+    cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=b.plane)
+    cv2.Laplacian(b.plane, cv2.CV_16S, dst=b.laplacian)
+    blur_score = float(cv2.meanStdDev(b.laplacian)[1][0, 0] ** 2)
+
+    # 2. White Balance Normalization (Simple Grey-World), in place
+    avg_b, avg_g, avg_r, _ = cv2.mean(image)
     avg = (avg_b + avg_g + avg_r) / 3
-    result_wb[:, :, 0] = np.clip(result_wb[:, :, 0] * (avg / avg_b), 0, 255)
-    result_wb[:, :, 1] = np.clip(result_wb[:, :, 1] * (avg / avg_g), 0, 255)
-    result_wb[:, :, 2] = np.clip(result_wb[:, :, 2] * (avg / avg_r), 0, 255)
-    result_wb = result_wb.astype(np.uint8)
+    gains = np.array([avg / c if c > 0 else 1.0 for c in (avg_b, avg_g, avg_r)])
+    # Row bands through a small float64 scratch: same multiply/clip/truncate as whole-image
+    # numpy, without full-size float temporaries (cv2.multiply would round instead of truncate)
+    scratch = b.wb_scratch
+    for y0 in range(0, height, scratch.shape[0]):
+        band = image[y0:y0 + scratch.shape[0]]
+        work = scratch[:band.shape[0]]
+        np.multiply(band, gains, out=work)
+        np.clip(work, 0, 255, out=work)
+        np.copyto(band, work, casting="unsafe")
 
     # 3. CLAHE on Luminance Channel
-    lab = cv2.cvtColor(result_wb, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
-    limg = cv2.merge((cl, a, b))
-    enhanced_img = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
+    cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=b.color_a)
+    cv2.extractChannel(b.color_a, 0, dst=b.plane)
+    b.clahe.apply(b.plane, dst=b.plane)
+    cv2.insertChannel(b.plane, b.color_a, 0)
+    enhanced_img = cv2.cvtColor(b.color_a, cv2.COLOR_LAB2BGR, dst=image)
 
     # 4. Background Suppression (Color Masking)
-    hsv = cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2HSV)
-    # Define broad plant color range (yellowish-green to dark green)
-    lower_plant = np.array([25, 40, 40])
-    upper_plant = np.array([95, 255, 255])
-    # Also include brown/diseased areas
-    lower_brown = np.array([5, 40, 40])
-    upper_brown = np.array([25, 255, 255])
-    
-    mask_green = cv2.inRange(hsv, lower_plant, upper_plant)
-    mask_brown = cv2.inRange(hsv, lower_brown, upper_brown)
-    plant_mask = cv2.bitwise_or(mask_green, mask_brown)
-    
+    hsv = cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2HSV, dst=b.color_a)
+    mask_green, mask_brown = compute_plant_masks(hsv, out=(b.mask_green, b.mask_brown))
+    cv2.bitwise_or(mask_green, mask_brown, dst=b.plane)
+
     # Clean up mask
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    plant_mask = cv2.morphologyEx(plant_mask, cv2.MORPH_CLOSE, kernel)
-    
-    # Apply mask
-    foreground = cv2.bitwise_and(enhanced_img, enhanced_img, mask=plant_mask)
+    plant_mask = cv2.morphologyEx(b.plane, cv2.MORPH_CLOSE, _CLOSE_KERNEL, dst=b.mask_plant)
 
-    # 5. Adaptive Sharpening (Unsharp Masking)
-    gaussian = cv2.GaussianBlur(foreground, (0, 0), 2.0)
-    sharpened = cv2.addWeighted(foreground, 1.5, gaussian, -0.5, 0)
-    
     # --- Image Analysis (Part D) ---
     metrics = {
         "blur_score": round(blur_score, 2)
     }
-    
+
     # Lesion Density & Disease Progression (Brown Spots)
     total_plant_pixels = cv2.countNonZero(plant_mask)
     if total_plant_pixels > 0:
@@ -74,24 +103,68 @@ def enhance_image_pipeline(image: np.ndarray) -> Tuple[np.ndarray, Dict[str, Any
     else:
         metrics["lesion_density_percent"] = 0.0
 
-    # Dominant Color
+    # Dominant Color (of the enhanced image, before the background is zeroed below)
     if total_plant_pixels > 0:
         mean_val = cv2.mean(enhanced_img, mask=plant_mask)
         metrics["dominant_color"] = f"RGB({int(mean_val[2])},{int(mean_val[1])},{int(mean_val[0])})"
     else:
         metrics["dominant_color"] = "Unknown"
 
+    # Apply mask: zero the background in place (x - x under the inverted mask)
+    cv2.bitwise_not(plant_mask, dst=b.plane)
+    foreground = cv2.subtract(enhanced_img, enhanced_img, dst=enhanced_img, mask=b.plane)
+
+    # 5. Adaptive Sharpening (Unsharp Masking)
+    gaussian = cv2.GaussianBlur(foreground, (0, 0), 2.0, dst=b.color_b)
+    sharpened = cv2.addWeighted(foreground, 1.5, gaussian, -0.5, 0, dst=b.color_b)
+
     # Texture Complexity & Edge Roughness
-    gray = cv2.cvtColor(sharpened, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
+    gray = cv2.cvtColor(sharpened, cv2.COLOR_BGR2GRAY, dst=b.plane)
+    edges = cv2.Canny(gray, 50, 150, edges=b.edges)
     edge_density = cv2.countNonZero(edges) / (sharpened.shape[0] * sharpened.shape[1])
     metrics["texture_complexity"] = round(edge_density, 4)
 
     return sharpened, metrics
 
-def resize_and_normalize(image: np.ndarray) -> np.ndarray:
-    image_resized = cv2.resize(image, (224, 224))
-    image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
-    image_float = np.array(image_rgb, dtype=np.float32)
-    image_normalized = (image_float / 127.5) - 1.0
-    return np.expand_dims(image_normalized, axis=0)
+def resize_and_normalize(image: np.ndarray, size: int = 224, buffers: Optional[PreprocessBuffers] = None) -> np.ndarray:
+    """
+    BGR uint8 -> (1, size, size, 3) float32 in [-1, 1]. With `buffers`, the result is written
+    into row 0 of the leased TTA tensor (no allocation) and is a view into it.
+    """
+    if buffers is None:
+        image_resized = cv2.resize(image, (size, size))
+        image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
+        image_float = np.array(image_rgb, dtype=np.float32)
+        image_normalized = (image_float / 127.5) - 1.0
+        return np.expand_dims(image_normalized, axis=0)
+
+    cv2.resize(image, (size, size), dst=buffers.small)
+    cv2.cvtColor(buffers.small, cv2.COLOR_BGR2RGB, dst=buffers.small_rgb)
+    out = buffers.tensor[:1]
+    np.divide(buffers.small_rgb, np.float32(127.5), out=out[0], dtype=np.float32)
+    np.subtract(out, np.float32(1.0), out=out)
+    return out
+
+def apply_tta(image_tensor: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Applies basic Test-Time Augmentation: Original, Flipped, Brightness Shift.
+
+    For an (N, H, W, 3) batch the result is (3N, H, W, 3): all originals, then all flips, then all shifts.
+    With `out` (at least 3N rows) the views are written in place; if `image_tensor` already
+    is out[:N], the originals are not copied at all.
+    """
+    n = len(image_tensor)
+    if out is None:
+        out = np.empty((3 * n,) + image_tensor.shape[1:], dtype=np.float32)
+    else:
+        out = out[:3 * n]
+    if not np.shares_memory(out[:n], image_tensor):
+        np.copyto(out[:n], image_tensor)
+
+    np.copyto(out[n:2 * n], out[:n, :, ::-1, :])
+    
+    # Slight brightness shift (simulate by adding a small constant, since it's preprocessed, be careful)
+    # MobileNetV2 preprocess maps to [-1, 1], so we shift slightly
+    np.add(out[:n], np.float32(0.1), out=out[2 * n:])
+    np.clip(out[2 * n:], -1.0, 1.0, out=out[2 * n:])
+    
+    return out
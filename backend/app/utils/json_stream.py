@@ -0,0 +1,70 @@
+import json
+from typing import Any, List, Tuple
+
+class IncrementalObjectParser:
+    """
+    Parses one top-level JSON object fed in arbitrary text chunks and emits each
+    (key, value) member as soon as its value is complete. Text before the opening
+    brace (e.g. a ```json fence) and after the closing brace is ignored.
+
+    Values are decoded with json.loads, so nested objects/arrays come out whole once
+    their closing bracket arrives.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self._depth = 0          # Nesting inside the current member value
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []  # Current "key": value member text
+        self.members: dict = {}
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        completed = []
+        for ch in chunk:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                continue
+
+            if self._in_string:
+                self._buffer.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "]}" and self._depth > 0:
+                self._depth -= 1
+            elif self._depth == 0 and ch in ",}":
+                member = self._flush()
+                if member is not None:
+                    completed.append(member)
+                if ch == "}":
+                    self.finished = True
+                continue
+            self._buffer.append(ch)
+        return completed
+
+    def _flush(self):
+        text = "".join(self._buffer).strip()
+        self._buffer = []
+        if not text:
+            return None
+        try:
+            # Wrapping the member in braces reuses json's own string/number/literal decoding
+            ((key, value),) = json.loads("{" + text + "}").items()
+        except (ValueError, TypeError):
+            return None
+        self.members[key] = value
+        return key, value
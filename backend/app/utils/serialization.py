@@ -0,0 +1,41 @@
+import orjson
+import msgpack
+from typing import Any, Optional, Dict
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+def dumps(content: Any) -> bytes:
+    """orjson with numpy scalars/arrays from the inference path."""
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def _msgpack_default(obj):
+    # numpy scalars expose .item(), arrays .tolist()
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+class MsgPackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True, default=_msgpack_default)
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return any(t in accept for t in MSGPACK_TYPES)
+
+def negotiate(request: Request, content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serializes trusted internal dicts directly, bypassing response_model validation and
+    jsonable_encoder. Clients sending `Accept: application/msgpack` get MessagePack.
+    """
+    response_class = MsgPackResponse if wants_msgpack(request) else FastJSONResponse
+    response = response_class(content=content, status_code=status_code, headers=headers)
+    response.headers["Vary"] = "Accept"
+    return response
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import logging.handlers
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+# Correlates prediction, validation and advisory events of one request
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+# Per-request buffer of DEBUG records, flushed only if the request turns out slow
+_tail_buffer: ContextVar[Optional[deque]] = ContextVar("tail_buffer", default=None)
+
+TAIL_BUFFER_SIZE = 200
+_listener: Optional[logging.handlers.QueueListener] = None
+_dropped = 0
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields):
+    """Structured event. Fields end up as top-level keys in the JSON line."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event": event, "fields": fields})
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if hasattr(record, "event"):
+            out["event"] = record.event
+        out.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues the record as-is (formatting happens on the listener thread) and drops when full.
+    Records below `min_level` are kept in the request's tail buffer instead of being written.
+    """
+
+    def __init__(self, log_queue: queue.Queue, min_level: int = logging.INFO):
+        super().__init__(log_queue)
+        self.min_level = min_level
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Context vars are not visible from the listener thread, so capture them here
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno < self.min_level and not getattr(record, "tail_sampled", False):
+            buffer = _tail_buffer.get()
+            if buffer is not None:
+                record.request_id = request_id_var.get()
+                buffer.append(record)
+            return
+        super().emit(record)
+
+def configure_logging(log_dir: str = "logs", level: str = "INFO", max_bytes: int = 10 * 1024 * 1024,
+                      backup_count: int = 5, tail_sampling: bool = True, queue_size: int = 10000):
+    """Routes all logging through a bounded queue to a background thread writing rotated JSON lines."""
+    global _listener
+    if _listener is not None:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, "leafsense.jsonl"), maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(request_id)s: %(message)s"))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    min_level = getattr(logging, level.upper(), logging.INFO)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue, min_level))
+    # With tail sampling, records below `level` are still created, but only kept in the request buffer
+    root.setLevel(logging.DEBUG if tail_sampling else min_level)
+    # Third-party debug chatter would fill the tail buffers
+    for noisy in ("httpx", "httpcore", "asyncio", "multipart", "urllib3", "PIL"):
+        logging.getLogger(noisy).setLevel(logging.INFO)
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def get_dropped_records() -> int:
+    return _dropped
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware: assigns a request id (or honours X-Request-ID), logs one access
+    record per request and flushes buffered DEBUG records for requests slower than
+    `slow_request_ms`.
+    """
+
+    def __init__(self, app, slow_request_ms: float = 2000.0, tail_sampling: bool = True):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+        self.tail_sampling = tail_sampling
+        self.logger = logging.getLogger("leafsense.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id")
+        request_id = incoming.decode()[:64] if incoming else uuid.uuid4().hex[:16]
+        id_token = request_id_var.set(request_id)
+        buffer = deque(maxlen=TAIL_BUFFER_SIZE) if self.tail_sampling else None
+        buffer_token = _tail_buffer.set(buffer)
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            _tail_buffer.reset(buffer_token)
+            slow = duration_ms >= self.slow_request_ms
+            if slow and buffer:
+                for record in buffer:
+                    record.tail_sampled = True
+                    self.logger.handle(record)
+            log_event(self.logger, "request", logging.WARNING if slow else logging.INFO,
+                      method=scope.get("method"), path=scope.get("path"), status=status["code"],
+                      duration_ms=round(duration_ms, 1), slow=slow)
+            request_id_var.reset(id_token)
@@ -0,0 +1,101 @@
+import struct
+import numpy as np
+from typing import AsyncIterator, Tuple
+from fastapi import HTTPException
+
+# Binary tensor upload used by edge clients that already resize on-device.
+#
+#   offset size field
+#   0      4    magic  b"LST1"
+#   4      1    dtype  0 = uint8 (0..255), 1 = float16 (already scaled to [-1, 1])
+#   5      1    order  0 = RGB, 1 = BGR
+#   6      2    count  number of images in the body
+#   8      2    height
+#   10     2    width
+#   12     1    channels (must be 3)
+#   13     1    reserved
+#   14     ...  count * height * width * channels values, little-endian, row-major NHWC
+MAGIC = b"LST1"
+HEADER = struct.Struct("<4sBBHHHBx")
+DTYPES = {0: np.dtype(np.uint8), 1: np.dtype("<f2")}
+ORDERS = {0: "RGB", 1: "BGR"}
+
+def _invalid(msg: str) -> HTTPException:
+    return HTTPException(status_code=400, detail={"detail": msg, "code": "INVALID_FORMAT"})
+
+def parse_tensor_header(body: bytes) -> Tuple[np.dtype, str, int, int, int]:
+    if len(body) < HEADER.size:
+        raise _invalid("Tensor upload shorter than its header.")
+    magic, dtype_code, order_code, count, height, width, channels = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise _invalid("Not a LeafSense tensor upload (bad magic).")
+    if dtype_code not in DTYPES or order_code not in ORDERS:
+        raise _invalid("Unsupported tensor dtype or colour order.")
+    if channels != 3 or count == 0:
+        raise _invalid("Tensor uploads must hold at least one 3-channel image.")
+    return DTYPES[dtype_code], ORDERS[order_code], count, height, width
+
+def _too_large(max_count: int) -> HTTPException:
+    return HTTPException(status_code=413, detail={"detail": f"Tensor upload larger than {max_count} tensors.", "code": "FILE_TOO_LARGE"})
+
+async def read_tensor_body(chunks: AsyncIterator[bytes], expected_size: int, max_count: int) -> bytes:
+    """
+    Reads an upload body from `chunks` (request.stream()), stopping with 413 as soon as it
+    passes the largest valid body: the header plus `max_count` tensors of the header's dtype.
+    """
+    limit = HEADER.size + max_count * expected_size * expected_size * 3 * max(d.itemsize for d in DTYPES.values())
+    body = bytearray()
+    async for chunk in chunks:
+        if len(body) < HEADER.size <= len(body) + len(chunk):
+            dtype_code = (body + chunk)[4]
+            if dtype_code in DTYPES:
+                limit = HEADER.size + max_count * expected_size * expected_size * 3 * DTYPES[dtype_code].itemsize
+        body += chunk
+        if len(body) > limit:
+            raise _too_large(max_count)
+    return bytes(body)
+
+def decode_tensor_upload(body: bytes, expected_size: int, max_count: int) -> Tuple[np.ndarray, str]:
+    """
+    Returns (images, dtype_name) where images is a read-only (N, H, W, 3) view over the
+    body in RGB order. No copy is made for RGB uploads.
+    """
+    dtype, order, count, height, width = parse_tensor_header(body)
+    if (height, width) != (expected_size, expected_size):
+        raise _invalid(f"Tensor shape must be {expected_size}x{expected_size}, got {height}x{width}.")
+    if count > max_count:
+        raise _invalid(f"At most {max_count} tensors per request.")
+    expected_bytes = HEADER.size + count * height * width * 3 * dtype.itemsize
+    if len(body) != expected_bytes:
+        raise _invalid(f"Tensor body is {len(body)} bytes, header implies {expected_bytes}.")
+
+    images = np.frombuffer(body, dtype=dtype, offset=HEADER.size).reshape(count, height, width, 3)
+    if order == "BGR":
+        images = images[..., ::-1]
+    return images, dtype.name
+
+def encode_tensor_upload(images: np.ndarray, order: str = "RGB") -> bytes:
+    """Client-side helper (and used by tests/tools): NHWC uint8 or float16 array -> upload body."""
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    dtype_code = 0 if images.dtype == np.uint8 else 1
+    data = images.astype(DTYPES[dtype_code], copy=False)
+    count, height, width, channels = data.shape
+    header = HEADER.pack(MAGIC, dtype_code, 0 if order == "RGB" else 1, count, height, width, channels)
+    return header + np.ascontiguousarray(data).tobytes()
+
+def normalize_tensors(images: np.ndarray) -> np.ndarray:
+    """RGB uploads -> float32 MobileNetV2 input in [-1, 1], same as resize_and_normalize."""
+    out = np.empty(images.shape, dtype=np.float32)
+    if images.dtype == np.uint8:
+        np.multiply(images, 1.0 / 127.5, out=out, casting="unsafe")
+        out -= 1.0
+    else:
+        np.clip(images, -1.0, 1.0, out=out, casting="unsafe")
+    return out
+
+def to_bgr_uint8(images: np.ndarray) -> np.ndarray:
+    """RGB uint8/float16 uploads -> BGR uint8 for the OpenCV validators."""
+    if images.dtype != np.uint8:
+        images = np.clip((images.astype(np.float32) + 1.0) * 127.5, 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(images[..., ::-1])
@@ -0,0 +1,82 @@
+"""
+Recall and latency of the similar-case index (app/core/similar_cases.py) at scale.
+
+    python -m benchmarks.bench_ann [--n 1000000] [--queries 200] [--code-dim 256] [--nlist 1024]
+
+Vectors are synthetic 1280-d "embeddings": 38 classes of sub-clusters on a 96-dimensional
+subspace plus a little isotropic noise, generated in chunks so the float32 set (5 GB at 1M)
+is never held at once. Exact top-10 neighbours of the queries are tracked chunk by chunk.
+For each nprobe: recall@10 of the raw int8 search, recall@10 after the exact re-rank of
+the top 4k+1 candidates that CaseStore.similar() does, and per-query latency.
+"""
+import time
+import argparse
+import numpy as np
+from app.core.similar_cases import IVFInt8Index
+
+DIM = 1280
+
+class Embeddings:
+    def __init__(self, latent: int = 96, classes: int = 38, modes: int = 8, noise: float = 0.02, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.basis = (rng.standard_normal((latent, DIM)) / np.sqrt(latent)).astype(np.float32)
+        self.centers = rng.standard_normal((classes * modes, latent)).astype(np.float32)
+        self.noise = noise
+
+    def chunk(self, n: int, seed: int) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        latent = self.centers[rng.integers(0, len(self.centers), n)] + 0.5 * rng.standard_normal((n, self.centers.shape[1]), dtype=np.float32)
+        vectors = latent @ self.basis + self.noise * rng.standard_normal((n, DIM), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--code-dim", type=int, default=256)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--train", type=int, default=50_000, help="Training sample size")
+    parser.add_argument("--chunk", type=int, default=50_000)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    data = Embeddings()
+    queries = data.chunk(args.queries, seed=10**6)
+    index = IVFInt8Index(DIM, code_dim=args.code_dim, nlist=args.nlist)
+    started = time.perf_counter()
+    index.train(data.chunk(min(args.train, args.n), seed=0))
+    train_s = time.perf_counter() - started
+
+    best_ids = np.full((args.queries, args.k), -1, dtype=np.int64)
+    best_sims = np.full((args.queries, args.k), -np.inf, dtype=np.float32)
+    started = time.perf_counter()
+    for start in range(0, args.n, args.chunk):
+        vectors = data.chunk(min(args.chunk, args.n - start), seed=start + 1)
+        ids = np.arange(start, start + len(vectors))
+        index.add(ids, vectors)
+        sims = np.concatenate([best_sims, queries @ vectors.T], axis=1)
+        all_ids = np.concatenate([best_ids, np.broadcast_to(ids, (args.queries, len(ids)))], axis=1)
+        top = np.argpartition(-sims, args.k, axis=1)[:, :args.k]
+        best_sims, best_ids = np.take_along_axis(sims, top, 1), np.take_along_axis(all_ids, top, 1)
+    add_s = time.perf_counter() - started
+
+    print(f"{args.n:,} vectors: trained in {train_s:.1f} s on {min(args.train, args.n):,}, added in {add_s:.1f} s; "
+          f"index {index.nbytes() / 2**20:.0f} MB vs {args.n * DIM * 4 / 2**20:.0f} MB as float32; {len(index._lists)} lists")
+    print(f"{'nprobe':>6} | {'recall@' + str(args.k):>9} | {'reranked':>8} | {'p50 ms':>7} | {'p99 ms':>7}")
+    print("-" * 50)
+    for nprobe in (4, 8, 16, 32, 64):
+        hits = reranked = 0
+        latencies = []
+        for q, truth in zip(queries, best_ids):
+            t0 = time.perf_counter()
+            ids, _ = index.search(q, args.k, nprobe=nprobe)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            candidates, _ = index.search(q, 4 * args.k + 1, nprobe=nprobe)
+            hits += len(set(truth.tolist()) & set(ids.tolist()))
+            reranked += len(set(truth.tolist()) & set(candidates.tolist()))
+        total = args.queries * args.k
+        print(f"{nprobe:>6} | {hits / total:>9.3f} | {reranked / total:>8.3f} | "
+              f"{np.percentile(latencies, 50):>7.2f} | {np.percentile(latencies, 99):>7.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Per-request memory cost of preprocessing + TTA: the old allocating path vs leased buffers.
+
+    python -m benchmarks.bench_preprocess [--width 2000 --height 1500] [--requests 40]
+
+Each path runs in its own subprocess so peak RSS is not shared. Reported per request:
+time, tracemalloc peak (the most memory numpy/OpenCV held above steady state at any point
+during the request), memory still held after the request returned (should be ~0 for both),
+minor page faults (how much freshly mapped memory was touched), and the process' peak RSS.
+"legacy" reproduces the pipeline as it was before buffers were pooled.
+"""
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tracemalloc
+import cv2
+import numpy as np
+from app.utils.buffer_pool import BufferPool
+from app.utils.image_utils import decode_image, enhance_image_pipeline, resize_and_normalize, apply_tta
+
+def legacy_enhance(image: np.ndarray):
+    blur_score = float(cv2.Laplacian(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var())
+    result_wb = image.copy()
+    avg_b, avg_g, avg_r = (np.average(result_wb[:, :, c]) for c in range(3))
+    avg = (avg_b + avg_g + avg_r) / 3
+    result_wb[:, :, 0] = np.clip(result_wb[:, :, 0] * (avg / avg_b), 0, 255)
+    result_wb[:, :, 1] = np.clip(result_wb[:, :, 1] * (avg / avg_g), 0, 255)
+    result_wb[:, :, 2] = np.clip(result_wb[:, :, 2] * (avg / avg_r), 0, 255)
+    result_wb = result_wb.astype(np.uint8)
+    lab = cv2.cvtColor(result_wb, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+    cl = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(l)
+    enhanced_img = cv2.cvtColor(cv2.merge((cl, a, b)), cv2.COLOR_LAB2BGR)
+    hsv = cv2.cvtColor(enhanced_img, cv2.COLOR_BGR2HSV)
+    mask_green = cv2.inRange(hsv, np.array([25, 40, 40]), np.array([95, 255, 255]))
+    mask_brown = cv2.inRange(hsv, np.array([5, 40, 40]), np.array([25, 255, 255]))
+    plant_mask = cv2.morphologyEx(cv2.bitwise_or(mask_green, mask_brown), cv2.MORPH_CLOSE,
+                                  cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+    foreground = cv2.bitwise_and(enhanced_img, enhanced_img, mask=plant_mask)
+    sharpened = cv2.addWeighted(foreground, 1.5, cv2.GaussianBlur(foreground, (0, 0), 2.0), -0.5, 0)
+    cv2.mean(enhanced_img, mask=plant_mask)
+    edges = cv2.Canny(cv2.cvtColor(sharpened, cv2.COLOR_BGR2GRAY), 50, 150)
+    return sharpened, {"blur_score": blur_score, "texture_complexity": cv2.countNonZero(edges)}
+
+def legacy_request(data: bytes):
+    enhanced, _ = legacy_enhance(decode_image(data))
+    image_rgb = cv2.cvtColor(cv2.resize(enhanced, (224, 224)), cv2.COLOR_BGR2RGB)
+    tensor = np.expand_dims((np.array(image_rgb, dtype=np.float32) / 127.5) - 1.0, axis=0)
+    return np.vstack([tensor, tensor[:, :, ::-1, :], np.clip(tensor + 0.1, -1.0, 1.0)])
+
+def make_pooled_request():
+    pool = BufferPool(224, max_idle=1)
+
+    def pooled_request(data: bytes):
+        with pool.lease() as buffers:
+            enhanced, _ = enhance_image_pipeline(decode_image(data), buffers)
+            tensor = resize_and_normalize(enhanced, 224, buffers)
+            return float(apply_tta(tensor, out=buffers.tensor)[0, 0, 0, 0])
+    return pooled_request
+
+def synthetic_leaf_jpeg(width: int, height: int) -> bytes:
+    rng = np.random.default_rng(0)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = rng.integers(0, 90, (height, width))
+    image[..., 1] = rng.integers(60, 220, (height, width))
+    image[..., 2] = rng.integers(20, 160, (height, width))
+    image = cv2.GaussianBlur(image, (5, 5), 1.0)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def run_worker(mode: str, width: int, height: int, requests: int) -> dict:
+    data = synthetic_leaf_jpeg(width, height)
+    fn = legacy_request if mode == "legacy" else make_pooled_request()
+    for _ in range(3):
+        fn(data)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    faults_before = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    t0 = time.perf_counter()
+    for _ in range(requests):
+        fn(data)
+    elapsed = time.perf_counter() - t0
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults_before
+
+    tracemalloc.start()
+    fn(data)  # Let tracemalloc see steady-state buffers first
+    peaks, leftovers = [], []
+    for _ in range(min(requests, 10)):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(data)
+        after, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - current)
+        leftovers.append(after - current)
+    tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "ms_per_request": elapsed / requests * 1000,
+        "traced_peak_mib": float(np.median(peaks)) / 2**20,
+        "retained_mib": float(np.median(leftovers)) / 2**20,
+        "minor_faults": faults / requests,
+        "peak_rss_growth_mib": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--worker", choices=["legacy", "pooled"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.width, args.height, args.requests)))
+        return
+
+    print(f"{args.width}x{args.height} JPEG, {args.requests} requests per path")
+    print(f"{'Path':<7} | {'ms/req':>7} | {'traced peak MiB':>15} | {'retained MiB':>12} | {'page faults':>11} | {'peak RSS MiB':>12}")
+    print("-" * 82)
+    for mode in ("legacy", "pooled"):
+        out = subprocess.run([sys.executable, "-m", "benchmarks.bench_preprocess", "--worker", mode,
+                              "--width", str(args.width), "--height", str(args.height), "--requests", str(args.requests)],
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<7} | {r['ms_per_request']:>7.1f} | {r['traced_peak_mib']:>15.1f} | {r['retained_mib']:>12.2f} | "
+              f"{r['minor_faults']:>11.0f} | {r['peak_rss_mib']:>12.0f}")
+
+if __name__ == "__main__":
+    main()
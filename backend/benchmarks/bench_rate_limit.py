@@ -0,0 +1,52 @@
+"""
+Per-check overhead of the rate limiter backends.
+
+    python -m benchmarks.bench_rate_limit [--checks 20000] [--redis-url redis://host:6379/0]
+
+Without --redis-url the Redis backend is measured against the local stand-in
+(tools/fake_redis.py), which shows protocol + event-loop overhead but not real
+network latency.
+"""
+import time
+import asyncio
+import argparse
+import tempfile
+import os
+from app.core.rate_limit import MemoryBucketStore, MmapBucketStore, RedisBucketStore, RateLimiter, RateLimitExceeded
+
+async def bench(limiter: RateLimiter, checks: int, clients: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(checks):
+        try:
+            await limiter.hit("predict", f"10.0.{i % clients // 256}.{i % 256}", "30/minute")
+        except RateLimitExceeded:
+            pass
+    return (time.perf_counter() - t0) / checks * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--checks", type=int, default=20000)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    redis_url = args.redis_url
+    if redis_url is None:
+        from tools.fake_redis import start_in_thread
+        _, port = start_in_thread()
+        redis_url = f"redis://127.0.0.1:{port}/0"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "memory": MemoryBucketStore(),
+            "mmap": MmapBucketStore(os.path.join(tmp, "buckets.bin")),
+            "redis" + ("" if args.redis_url else " (stand-in)"): RedisBucketStore(redis_url),
+        }
+        print(f"{'Backend':<20} | {'us/check':>9}")
+        print("-" * 32)
+        for name, store in stores.items():
+            us = asyncio.run(bench(RateLimiter(store), args.checks, args.clients))
+            print(f"{name:<20} | {us:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Sweeps worker / thread layouts on this machine: images/s and end-to-end latency under load.
+
+    python -m benchmarks.bench_runtime [--requests 200] [--clients 0] [--model models/plant_disease_model.h5]
+
+Each layout runs in its own process tree, like gunicorn would: `workers` processes, each with
+`slots` request threads that run the real preprocessing (OpenCV, `cv2_threads`) and then the
+forward pass (`intra_op` threads). Without --model (or without TensorFlow) the forward pass is
+a float32 matmul of roughly MobileNetV2's cost, threaded through OpenBLAS/OpenMP instead.
+`--clients` requests are kept in flight (default: 2 per core). "unmanaged" is what you get
+with no sizing at all: every library sized to all cores and 4 concurrent inferences.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing as mp
+from app.core.runtime import detect_cpus, plan_layout, PROFILES
+
+def _worker(layout: dict, model_path: str, jobs, results):
+    import threading
+    import cv2
+    import numpy as np
+    from app.utils.image_utils import decode_image, enhance_image_pipeline, resize_and_normalize, apply_tta
+    from benchmarks.bench_preprocess import synthetic_leaf_jpeg
+
+    cv2.setNumThreads(layout["cv2_threads"])
+    data = synthetic_leaf_jpeg(1280, 960)
+    if model_path:
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path)
+        forward = lambda x: model.predict(x, verbose=0)
+    else:
+        weights = np.random.default_rng(0).standard_normal((1024, 512)).astype(np.float32)
+        forward = lambda x: x.reshape(-1, 1024) @ weights  # ~0.5 GFLOP, the order of one MobileNetV2 TTA batch
+
+    def serve():
+        while True:
+            sent = jobs.get()
+            if sent is None:
+                return
+            image, _ = enhance_image_pipeline(decode_image(data))
+            forward(apply_tta(resize_and_normalize(image, 224)))
+            results.put(time.monotonic() - sent)
+
+    threads = [threading.Thread(target=serve) for _ in range(layout["inference_slots"])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def run_layout(layout: dict, requests: int, clients: int, model_path: str) -> dict:
+    ctx = mp.get_context("spawn")
+    jobs, results = ctx.Queue(), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(layout, model_path, jobs, results)) for _ in range(layout["workers"])]
+    for p in procs:
+        p.start()
+    for _ in range(layout["workers"] * layout["inference_slots"]):  # Warmup, one per thread
+        jobs.put(time.monotonic())
+    for _ in range(layout["workers"] * layout["inference_slots"]):
+        results.get()
+
+    latencies, sent = [], 0
+    t0 = time.monotonic()
+    for _ in range(min(clients, requests)):
+        jobs.put(time.monotonic())
+        sent += 1
+    while len(latencies) < requests:
+        latencies.append(results.get())
+        if sent < requests:
+            jobs.put(time.monotonic())
+            sent += 1
+    elapsed = time.monotonic() - t0
+
+    for _ in range(layout["workers"] * layout["inference_slots"]):
+        jobs.put(None)
+    for p in procs:
+        p.join()
+    latencies.sort()
+    return {"images_per_s": requests / elapsed, "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000}
+
+def sweep(cpus: dict) -> list:
+    cores = cpus["effective"]
+    unmanaged = {"workers": 1, "inference_slots": 4, "intra_op_threads": cores, "inter_op_threads": cores, "cv2_threads": cores}
+    layouts = [("unmanaged", unmanaged)]
+    if cores >= 4:
+        layouts.append(("unmanaged", {**unmanaged, "workers": cores // 2}))
+    worker_counts = sorted({1, 2, max(1, cores // 4), max(1, cores // 2), cores})
+    for profile in PROFILES:
+        layouts.append((profile, plan_layout(profile, cpus, max_workers=cores)))
+        layouts += [(profile, plan_layout(profile, cpus, workers=w, max_workers=cores)) for w in worker_counts]
+    seen, unique = set(), []
+    for name, layout in layouts:
+        key = tuple(layout[k] for k in ("workers", "inference_slots", "intra_op_threads", "inter_op_threads", "cv2_threads"))
+        if key not in seen:
+            seen.add(key)
+            unique.append((name, layout))
+    return unique
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=0, help="Requests kept in flight (default: 2 per core)")
+    parser.add_argument("--model", default="", help="Keras model to use for the forward pass")
+    parser.add_argument("--layout", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.layout:
+        print(json.dumps(run_layout(json.loads(args.layout), args.requests, args.clients, args.model)))
+        return
+
+    cpus = detect_cpus()
+    clients = args.clients or 2 * cpus["effective"]
+    print(f"{cpus['effective']} usable core(s) (logical {cpus['logical']}, affinity {len(cpus['affinity'])}, "
+          f"cgroup quota {cpus['cgroup_quota']}); {clients} requests in flight, {args.requests} per layout")
+    print(f"{'Layout':<10} | {'workers':>7} | {'slots':>5} | {'intra':>5} | {'cv2':>3} | {'img/s':>6} | {'p50 ms':>7} | {'p99 ms':>7}")
+    print("-" * 72)
+    for name, layout in sweep(cpus):
+        # Thread env vars have to be in place before numpy / TensorFlow are imported
+        env = {**os.environ, "OMP_NUM_THREADS": str(layout["intra_op_threads"]),
+               "OPENBLAS_NUM_THREADS": str(layout["intra_op_threads"]), "MKL_NUM_THREADS": str(layout["intra_op_threads"]),
+               "TF_NUM_INTRAOP_THREADS": str(layout["intra_op_threads"]), "TF_NUM_INTEROP_THREADS": str(layout["inter_op_threads"])}
+        fields = ("workers", "inference_slots", "intra_op_threads", "inter_op_threads", "cv2_threads")
+        out = subprocess.run([sys.executable, "-m", "benchmarks.bench_runtime", "--layout", json.dumps({k: layout[k] for k in fields}),
+                              "--requests", str(args.requests), "--clients", str(clients), "--model", args.model],
+                             env=env, capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{name:<10} | {layout['workers']:>7} | {layout['inference_slots']:>5} | {layout['intra_op_threads']:>5} | "
+              f"{layout['cv2_threads']:>3} | {r['images_per_s']:>6.1f} | {r['p50_ms']:>7.0f} | {r['p99_ms']:>7.0f}")
+
+if __name__ == "__main__":
+    main()
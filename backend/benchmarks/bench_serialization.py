@@ -0,0 +1,103 @@
+"""
+Response serialization cost: the old response_model path vs the orjson / MessagePack path.
+
+    python -m benchmarks.bench_serialization [--iterations 2000]
+
+"pydantic" reproduces what FastAPI did before: build the nested models, validate
+against response_model, run jsonable_encoder and json.dumps.
+"""
+import json
+import time
+import argparse
+import orjson
+import msgpack
+from fastapi.encoders import jsonable_encoder
+from app.schemas.response import DetectionResponse, BatchDetectionResponse, Prediction, AIAnalysis, TopKPrediction
+
+def sample_result(i: int = 0) -> dict:
+    return {
+        "scan_id": f"scan_{i:012d}",
+        "prediction": {
+            "crop": "Tomato",
+            "disease": "Early blight",
+            "confidence": 0.8731,
+            "top_k": [
+                {"label": "Tomato - Early blight", "confidence": 0.8731},
+                {"label": "Tomato - Septoria leaf spot", "confidence": 0.0912},
+                {"label": "Tomato - Target Spot", "confidence": 0.0211},
+            ],
+            "metrics": {"blur_score": 412.77, "lesion_density_percent": 18.4, "dominant_color": "RGB(88,121,54)",
+                        "texture_complexity": 0.0731, "feature_distance": 0.2213, "inference_stage": "full"},
+        },
+        "ai_analysis": {
+            "disease_name": "Early Blight (Alternaria solani)",
+            "severity": "High",
+            "cause": "Fungal infection thriving in warm, humid conditions.",
+            "immediate_action": "Remove and destroy infected leaves immediately. Do not compost.",
+            "treatment_plan": ["Apply copper-based fungicide or chlorothalonil to prevent spread.",
+                               "Prune lower leaves to improve air circulation.",
+                               "Water at the base of the plant to keep leaves dry."],
+            "prevention": "Rotate crops annually. Use drip irrigation. Mulch at the base.",
+            "estimated_crop_loss_risk": "High",
+            "consult_expert": True,
+        },
+        "final_decision_score": 71.52,
+        "risk_index": 11.23,
+        "tier": "Tier 2: Probable Diagnosis",
+        "disease_progression": "Mid Stage",
+    }
+
+def pydantic_single(d: dict) -> bytes:
+    p = d["prediction"]
+    model = DetectionResponse(
+        scan_id=d["scan_id"],
+        prediction=Prediction(crop=p["crop"], disease=p["disease"], confidence=p["confidence"],
+                              top_k=[TopKPrediction(**t) for t in p["top_k"]], metrics=p["metrics"]),
+        ai_analysis=AIAnalysis(**d["ai_analysis"]),
+        final_decision_score=d["final_decision_score"], risk_index=d["risk_index"],
+        tier=d["tier"], disease_progression=d["disease_progression"],
+    )
+    validated = DetectionResponse.model_validate(model.model_dump())
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+def pydantic_batch(d: dict) -> bytes:
+    model = BatchDetectionResponse(**d)
+    validated = BatchDetectionResponse.model_validate(model.model_dump())
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+def orjson_dump(d: dict) -> bytes:
+    return orjson.dumps(d, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+def msgpack_dump(d: dict) -> bytes:
+    return msgpack.packb(d, use_bin_type=True)
+
+def timeit(fn, payload, iterations: int):
+    fn(payload)
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        out = fn(payload)
+    return (time.perf_counter() - t0) / iterations * 1e6, len(out)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    single = sample_result()
+    batch = {"batch_id": "batch_0000", "results": [sample_result(i) for i in range(50)],
+             "overall_risk_index": 11.23, "summary_directive": "Monitor field conditions."}
+    cases = [
+        ("single", single, [("pydantic", pydantic_single), ("orjson", orjson_dump), ("msgpack", msgpack_dump)], args.iterations),
+        ("batch x50", batch, [("pydantic", pydantic_batch), ("orjson", orjson_dump), ("msgpack", msgpack_dump)], max(1, args.iterations // 20)),
+    ]
+    print(f"{'Payload':<10} | {'Path':<9} | {'us/op':>9} | {'bytes':>7} | {'speedup':>7}")
+    print("-" * 54)
+    for name, payload, paths, iterations in cases:
+        baseline = None
+        for path_name, fn in paths:
+            us, size = timeit(fn, payload, iterations)
+            baseline = baseline or us
+            print(f"{name:<10} | {path_name:<9} | {us:>9.1f} | {size:>7} | {baseline / us:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Per-worker memory with private vs shared (memory-mapped) model weights, and the worker count
+that fits in a given amount of RAM.
+
+    python -m benchmarks.bench_worker_memory [--workers 4] [--weights-mb 14] [--tflite models/plant_disease_model.tflite]
+        [--import app.main] [--ram-gb 1,2,4,8]
+
+Starts `--workers` fresh interpreters (spawned, like gunicorn workers), each importing the
+app (`--import`) and then loading the weights:
+  private  read into the worker's own memory, as tf.keras.models.load_model does
+  mmap     mapped read-only from one file, as MODEL_SHARING=mmap does (app/core/shared_weights.py)
+With --tflite the weights are a real exported model, run once through the interpreter;
+otherwise a float32 array of --weights-mb (MobileNetV2 is ~14 MB), read end to end.
+
+Reported per worker from /proc/<pid>/smaps_rollup: RSS (counts shared pages in full), PSS
+(shared pages split between the processes mapping them) and USS (pages only this worker has,
+i.e. what one more worker costs). Linux only. Safe workers per RAM size =
+(RAM x (1 - headroom) - shared) / USS.
+"""
+import os
+import tempfile
+import argparse
+import multiprocessing
+import numpy as np
+
+FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+def smaps_rollup() -> dict:
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in FIELDS:
+                out[name] = int(rest.split()[0]) / 1024  # MB
+    return {"rss": out["Rss"], "pss": out["Pss"], "uss": out["Private_Clean"] + out["Private_Dirty"]}
+
+def _load(mode: str, path: str, tflite: bool):
+    if tflite:
+        from app.core.shared_weights import MappedModel, _interpreter_class
+        if mode == "mmap":
+            model = MappedModel(path)
+            model.predict(np.zeros((1, *model.input_shape[1:]), dtype=np.float32))
+            return model
+        # Private: the interpreter gets its own copy of the file's bytes
+        Interpreter, _ = _interpreter_class()
+        with open(path, "rb") as f:
+            model = Interpreter(model_content=f.read())
+        model.allocate_tensors()
+        (inp,) = model.get_input_details()
+        model.set_tensor(inp["index"], np.zeros(inp["shape"], dtype=np.float32))
+        model.invoke()
+        return model
+    weights = np.load(path, mmap_mode="r" if mode == "mmap" else None)
+    float(weights.sum())  # Inference reads every weight
+    return weights
+
+def worker(mode: str, path: str, tflite: bool, modules: list, barrier, results):
+    import importlib
+    for name in modules:
+        importlib.import_module(name)
+    before = smaps_rollup()
+    held = _load(mode, path, tflite)
+    barrier.wait()  # Everyone has mapped the file before anyone measures
+    after = smaps_rollup()
+    results.put((os.getpid(), before, after))
+    barrier.wait()
+    del held
+
+def run(mode: str, workers: int, path: str, tflite: bool, modules: list) -> list:
+    ctx = multiprocessing.get_context("spawn")
+    barrier, results = ctx.Barrier(workers), ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(mode, path, tflite, modules, barrier, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    out = [results.get(timeout=300) for _ in procs]
+    for p in procs:
+        p.join()
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--weights-mb", type=float, default=14.0)
+    parser.add_argument("--tflite", help="Exported model (tools/export_tflite.py) instead of synthetic weights")
+    parser.add_argument("--import", dest="modules", default="app.main", help="Comma-separated modules every worker imports first")
+    parser.add_argument("--ram-gb", default="1,2,4,8")
+    parser.add_argument("--headroom", type=float, default=0.2, help="Share of RAM kept free for the OS, page cache and spikes")
+    args = parser.parse_args()
+    modules = [m for m in args.modules.split(",") if m]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.tflite
+        if path is None:
+            path = os.path.join(tmp, "weights.npy")
+            np.save(path, np.random.default_rng(0).standard_normal(int(args.weights_mb * 2**20 / 4), dtype=np.float32))
+        weights_mb = os.path.getsize(path) / 2**20
+        print(f"{args.workers} workers, {weights_mb:.1f} MB of weights ({'tflite' if args.tflite else 'synthetic'}), "
+              f"importing {', '.join(modules) or 'nothing'}")
+        print(f"{'mode':>8} | {'RSS MB':>7} | {'PSS MB':>7} | {'USS MB':>7} | {'weights USS':>11} | {'total PSS':>9}")
+        print("-" * 66)
+        per_mode = {}
+        for mode in ("private", "mmap"):
+            results = run(mode, args.workers, path, bool(args.tflite), modules)
+            mean = lambda key, when: sum(r[when][key] for r in results) / len(results)
+            uss, pss = mean("uss", 2), mean("pss", 2)
+            total_pss = sum(r[2]["pss"] for r in results)
+            per_mode[mode] = (uss, total_pss - uss * len(results))
+            print(f"{mode:>8} | {mean('rss', 2):>7.1f} | {pss:>7.1f} | {uss:>7.1f} | {uss - mean('uss', 1):>11.1f} | {total_pss:>9.1f}")
+
+    print(f"\nSafe workers ({args.headroom:.0%} headroom): " + ", ".join(f"{mode} = USS {uss:.0f} MB + {shared:.0f} MB shared"
+                                                                   for mode, (uss, shared) in per_mode.items()))
+    print(f"{'RAM':>6} | " + " | ".join(f"{mode:>7}" for mode in per_mode))
+    for gb in (float(g) for g in args.ram_gb.split(",")):
+        budget = gb * 1024 * (1 - args.headroom)
+        print(f"{gb:>4g}GB | " + " | ".join(f"{max(0, int((budget - shared) // uss)):>7}" for uss, shared in per_mode.values()))
+
+if __name__ == "__main__":
+    main()
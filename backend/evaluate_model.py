@@ -1,11 +1,20 @@
 import os
 import json
+import time
+import argparse
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import load_model
 from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
 from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, top_k_accuracy_score
+from sklearn.linear_model import LogisticRegression
+from app.core.cascade import CascadeHead, extract_cascade_features, tune_cascade_thresholds
+from app.core.drift import DriftWindow, observation, profile_baseline_path
+from app.core.pipeline import PROFILES, StageRejected, build_pipeline
+import app.core.stages  # Registers the decode/validate/enhance/quality stage variants
+from app.utils.buffer_pool import BufferPool
+from app.utils.image_utils import apply_tta
 
 # ----------------- Configuration -----------------
 MODEL_PATH = "model.h5"          # Update path
@@ -18,6 +27,13 @@ IMG_SIZE = (224, 224)
 BATCH_SIZE = 32
 CONFIDENCE_THRESHOLD = 0.60
 REPORT_SAVE_PATH = "models/evaluation_report.json"
+CASCADE_HEAD_PATH = "models/cascade_head.npz"
+CASCADE_TARGET_PRECISION = 0.97  # Student must be at least this precise on the cases it exits
+CASCADE_MIN_SUPPORT = 20         # Classes with fewer confident tuning samples never exit early
+CASCADE_PROFILE = "production"   # The pipeline profile whose infer stage runs the cascade
+DRIFT_BASELINE_PATH = "models/drift_baseline.json"  # One file per pipeline profile, drift_baseline_<profile>.json
+DRIFT_BASELINE_MAX_IMAGES = 2000
+TEMPERATURE = 1.5                # Same as TEMPERATURE_CALIBRATION in app/core/model_loader.py
 # -------------------------------------------------
 
 def load_labels(path):
@@ -41,6 +57,189 @@ def format_section(title):
     print(f" {title.upper()}")
     print("="*50)
 
+def build_cascade_head(filepaths, y_true_classes, y_pred_classes, num_classes, profile=CASCADE_PROFILE):
+    """
+    Fits the early-exit student on half the evaluation set, fits its temperature and tunes its exit
+    thresholds on a quarter it was not fitted on, and reports on the remaining quarter.
+
+    The student sees what it sees in the API: the tensor of `profile`'s enhance stage, for the
+    images its validator and blur gate accept (the others never reach the cascade).
+    """
+    from train_model import fit_temperature
+    pipeline = build_pipeline(profile, inputs=("image_bytes",), resources={"buffers": BufferPool(IMG_SIZE[0]).lease}, until="quality")
+    features, accepted = [], []
+    for idx, path in enumerate(filepaths):
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        try:
+            ctx = pipeline.run_sync({"image_bytes": image_bytes})
+        except StageRejected:
+            continue
+        # The tensor is a view into the leased buffers, so it is read before the next image
+        features.append(extract_cascade_features(ctx["tensor"]))
+        accepted.append(idx)
+    features = np.stack(features)
+    y_true_classes, y_pred_classes = y_true_classes[accepted], y_pred_classes[accepted]
+
+    rng = np.random.RandomState(42)
+    perm = rng.permutation(len(features))
+    calib, tune, held_out = np.split(perm, [len(perm) // 2, 3 * len(perm) // 4])
+
+    mean, std = features[calib].mean(axis=0), features[calib].std(axis=0) + 1e-6
+    clf = LogisticRegression(max_iter=2000)
+    clf.fit((features[calib] - mean) / std, y_true_classes[calib])
+
+    # LogisticRegression only learns classes present in the calibration split
+    weights = np.zeros((features.shape[1], num_classes), dtype=np.float32)
+    bias = np.full(num_classes, -1e4, dtype=np.float32)
+    weights[:, clf.classes_] = clf.coef_.T
+    bias[clf.classes_] = clf.intercept_
+
+    # Served probabilities are used as they are, so the temperature is folded into the head (softmax(z / T))
+    temperature = fit_temperature(CascadeHead(weights, bias, mean, std, np.full(num_classes, np.inf)).predict_proba(features[tune]),
+                                  y_true_classes[tune])
+    head = CascadeHead(weights / temperature, bias / temperature, mean, std, np.full(num_classes, np.inf))
+    head.thresholds = tune_cascade_thresholds(head.predict_proba(features[tune]), y_true_classes[tune], num_classes,
+                                              CASCADE_TARGET_PRECISION, CASCADE_MIN_SUPPORT)
+
+    held_probs = head.predict_proba(features[held_out])
+    held_pred = np.argmax(held_probs, axis=1)
+    exits = np.max(held_probs, axis=1) >= head.thresholds[held_pred]
+    cascade_pred = np.where(exits, held_pred, y_pred_classes[held_out])
+
+    results = {
+        "profile": profile,
+        "images": len(accepted),
+        "temperature": temperature,
+        "exit_rate": float(np.mean(exits)) if len(exits) else 0.0,
+        "student_exit_accuracy": float(np.mean(held_pred[exits] == y_true_classes[held_out][exits])) if np.any(exits) else None,
+        "full_model_accuracy": float(accuracy_score(y_true_classes[held_out], y_pred_classes[held_out])),
+        "cascade_accuracy": float(accuracy_score(y_true_classes[held_out], cascade_pred)),
+        "classes_with_early_exit": int(np.isfinite(head.thresholds).sum())
+    }
+    return head, results
+
+def profile_probs(model, tensor, profile, cascade_head=None):
+    """
+    What `profile`'s infer and calibrate stages make of one enhanced (1, H, W, 3) tensor: a cascade
+    exit or the TTA average (cascade_tta), or a single pass, then the temperature unless the student answered.
+    """
+    stages = PROFILES[profile]["stages"]
+    if stages["infer"] == "cascade_tta":
+        if cascade_head is not None:
+            student_probs = cascade_head.try_exit(extract_cascade_features(tensor))
+            if student_probs is not None:
+                return student_probs
+        probs = np.asarray(model.predict(apply_tta(tensor), verbose=0)).mean(axis=0)
+    else:
+        probs = np.asarray(model.predict(tensor, verbose=0))[0]
+    if stages["calibrate"] == "temperature":
+        logits = np.log(probs + 1e-7) / TEMPERATURE
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+    return probs
+
+def build_drift_baseline(filepaths, model, profile, save_path, cascade_head=None, max_images=DRIFT_BASELINE_MAX_IMAGES):
+    """
+    Sketches of the test set as the API would see it through `profile`'s pipeline (app/core/drift.py):
+    the scores of its validator, the metrics of its enhancement chain and the outcome of its blur
+    gate, plus confidence, gap and predicted class of the images it accepts, scored by its infer and
+    calibrate stages (profile_probs). Like the API's, the confidence is the one before the centroid
+    and kNN penalties.
+    """
+    rng = np.random.default_rng(42)
+    picked = rng.choice(len(filepaths), min(max_images, len(filepaths)), replace=False)
+
+    pipeline = build_pipeline(profile, inputs=("image_bytes",), resources={"buffers": BufferPool(IMG_SIZE[0]).lease}, until="quality")
+    observed = []
+    pipeline.observe(lambda ctx, error: observed.append(observation(ctx, error)))
+    window = DriftWindow(started=time.time())
+    for idx in picked:
+        with open(filepaths[idx], "rb") as f:
+            image_bytes = f.read()
+        ctx = None
+        try:
+            ctx = pipeline.run_sync({"image_bytes": image_bytes})
+        except StageRejected:
+            pass
+        values, categories = observed.pop()
+        if categories["outcome"] == "accepted":
+            row = profile_probs(model, ctx["tensor"], profile, cascade_head)
+            top2 = np.sort(row)[-2:]
+            values.update(confidence=float(top2[1]), confidence_gap=float(top2[1] - top2[0]))
+            categories["predicted_class"] = str(int(np.argmax(row)))
+        window.add(values, categories)
+
+    with open(save_path, "w") as f:
+        json.dump(window.to_dict(), f)
+    return window
+
+def latency_accuracy_report(model_dirs, save_path, latency_runs=50):
+    """
+    Accuracy vs single-image CPU latency for servable model directories
+    (plant_disease_model.h5 + class_labels.json + optional calibration_metrics.json).
+    """
+    format_section("Latency vs Accuracy")
+    if not os.path.exists(TEST_DIR):
+        print("Test directory not found. Skipping latency report.")
+        return []
+
+    rows = []
+    for model_dir in model_dirs:
+        model_file = os.path.join(model_dir, "plant_disease_model.h5")
+        if not os.path.exists(model_file):
+            print(f"[Warning] {model_file} not found, skipping.")
+            continue
+        calibration = load_history(os.path.join(model_dir, "calibration_metrics.json")) or {}
+        input_size = calibration.get("input_size", IMG_SIZE[0])
+        model = load_model(model_file, compile=False)
+
+        generator = ImageDataGenerator(preprocessing_function=preprocess_input).flow_from_directory(
+            TEST_DIR, target_size=(input_size, input_size), batch_size=BATCH_SIZE,
+            class_mode='categorical', shuffle=False
+        )
+        probs = model.predict(generator, steps=len(generator), verbose=0)
+        y_true = generator.classes
+        top1 = accuracy_score(y_true, np.argmax(probs, axis=1))
+        try:
+            top3 = top_k_accuracy_score(y_true, probs, k=min(3, probs.shape[1]), labels=range(probs.shape[1]))
+        except ValueError:
+            top3 = float('nan')
+
+        # Batch of one, same as a /predict call without TTA
+        sample = next(iter(generator))[0][:1]
+        for _ in range(5):
+            model(sample, training=False)
+        timings = []
+        for _ in range(latency_runs):
+            t0 = time.perf_counter()
+            model(sample, training=False)
+            timings.append((time.perf_counter() - t0) * 1000)
+
+        rows.append({
+            "model_dir": model_dir,
+            "arch": calibration.get("arch", "mobilenet_v2"),
+            "input_size": input_size,
+            "params": int(model.count_params()),
+            "size_mb": round(os.path.getsize(model_file) / (1024 * 1024), 2),
+            "top1_accuracy": float(top1),
+            "top3_accuracy": float(top3) if not np.isnan(top3) else None,
+            "latency_p50_ms": round(float(np.percentile(timings, 50)), 2),
+            "latency_p95_ms": round(float(np.percentile(timings, 95)), 2)
+        })
+
+    rows.sort(key=lambda r: r["latency_p50_ms"])
+    print(f"{'Model':<40} | {'Size':>4} | {'Top-1':>6} | {'p50 ms':>7} | {'p95 ms':>7} | {'MB':>6}")
+    print("-" * 85)
+    for r in rows:
+        print(f"{r['model_dir']:<40} | {r['input_size']:>4} | {r['top1_accuracy']:.4f} | {r['latency_p50_ms']:>7.2f} | {r['latency_p95_ms']:>7.2f} | {r['size_mb']:>6.2f}")
+
+    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    with open(save_path, 'w') as f:
+        json.dump(rows, f, indent=4)
+    print(f"Saved latency report to {save_path}")
+    return rows
+
 def main():
     format_section("Initialization")
     class_labels = load_labels(LABELS_PATH)
@@ -245,6 +444,31 @@ def main():
     print("\nIS THE MODEL DEMO-READY?              " + ("YES 🚀" if demo_ready else "NEEDS WORK 🔴"))
     print("="*50 + "\n")
     
+    # 11. Cascade Early-Exit Calibration
+    format_section("11. Cascade Early-Exit Calibration")
+    cascade_head, cascade_results = build_cascade_head(test_generator.filepaths, y_true_classes, y_pred_classes, num_classes)
+    cascade_head.save(CASCADE_HEAD_PATH)
+    print(f"Images through the {CASCADE_PROFILE} pipeline: {cascade_results['images']} (student temperature {cascade_results['temperature']:.2f})")
+    print(f"Classes allowed to exit early: {cascade_results['classes_with_early_exit']}/{num_classes}")
+    print(f"Held-out exit rate:            {cascade_results['exit_rate']:.2%}")
+    if cascade_results["student_exit_accuracy"] is not None:
+        print(f"Student accuracy on exits:     {cascade_results['student_exit_accuracy']:.4f}")
+    print(f"Full model accuracy:           {cascade_results['full_model_accuracy']:.4f}")
+    print(f"Cascade accuracy:              {cascade_results['cascade_accuracy']:.4f}")
+    print(f"Saved cascade head to {CASCADE_HEAD_PATH}")
+
+    # 12. Drift Baseline
+    format_section("12. Drift Baseline")
+    drift_baselines = {}
+    for profile in PROFILES:
+        path = profile_baseline_path(DRIFT_BASELINE_PATH, profile)
+        baseline = build_drift_baseline(test_generator.filepaths, model, profile, path, cascade_head)
+        outcomes = baseline.categories["outcome"]
+        print(f"[{profile}] Sketched {baseline.n} test images ({outcomes.get('accepted', 0)} would pass its validator and blur gate)")
+        print(f"[{profile}] Saved drift baseline to {path}")
+        drift_baselines[profile] = {"path": path, "images": baseline.n}
+    print("The API compares live traffic against the baseline of its pipeline profile (GET /drift)")
+
     # Save Report
     evaluation_results = {
         "top1_accuracy": float(top1_acc),
@@ -253,7 +477,9 @@ def main():
         "confusion_matrix": cm_list,
         "weak_classes": weak_classes,
         "overfitting_suspected": is_overfitting,
-        "demo_ready": demo_ready
+        "demo_ready": demo_ready,
+        "cascade": cascade_results,
+        "drift_baselines": drift_baselines
     }
     
     with open(REPORT_SAVE_PATH, 'w') as f:
@@ -267,5 +493,14 @@ if __name__ == "__main__":
     
     # Suppress TF warnings for cleaner output
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-    
-    main()
+
+    parser = argparse.ArgumentParser(description="Evaluate the LeafSense model.")
+    parser.add_argument("--latency-report", nargs="+", metavar="MODEL_DIR",
+                        help="Only build the latency-vs-accuracy report for these model directories")
+    parser.add_argument("--report-path", default="models/students/latency_report.json")
+    args = parser.parse_args()
+
+    if args.latency_report:
+        latency_accuracy_report(args.latency_report, args.report_path)
+    else:
+        main()
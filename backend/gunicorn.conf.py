@@ -0,0 +1,22 @@
+# gunicorn -c gunicorn.conf.py app.main:app
+# Worker count and thread budgets come from app/core/runtime.py (RUNTIME_PROFILE etc.)
+import os
+from app.config import get_settings
+from app.core.runtime import configure_runtime, WORKER_SLOT_ENV
+
+# In the master: exports OMP/TF thread env vars that every worker inherits
+layout = configure_runtime(get_settings())
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = layout["workers"]
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 120
+
+def pre_fork(server, worker):
+    # Lowest free slot, so a respawned worker takes over its predecessor's cores
+    taken = {getattr(w, "leafsense_slot", None) for w in server.WORKERS.values()}
+    worker.leafsense_slot = next(i for i in range(len(taken) + 1) if i not in taken)
+
+def post_fork(server, worker):
+    # Runs before the worker imports the app, whose configure_runtime() pins to this slot
+    os.environ[WORKER_SLOT_ENV] = str(worker.leafsense_slot)
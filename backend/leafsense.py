@@ -0,0 +1,310 @@
+"""
+LeafSense command-line tools.
+
+    python leafsense.py scan /media/sdcard/DCIM --output scans.csv [--workers 4] [--batch-size 32]
+
+`scan` runs the same validator, preprocessing and model as the API, in-process: a pool of
+worker processes hashes, decodes and preprocesses images, the parent batches them through
+the model and appends rows to CSV, JSONL or Parquet. Files whose content hash is already in
+the output are skipped, so an interrupted scan resumes where it stopped.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import multiprocessing
+from typing import Dict, List, Optional, Set, Tuple
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+COLUMNS = ["path", "sha256", "status", "code", "crop", "disease", "confidence", "runner_up", "runner_up_confidence",
+           "inference_stage", "blur_score", "lesion_density_percent", "texture_complexity", "detail"]
+
+def find_images(root: str) -> List[str]:
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+# --- Output ------------------------------------------------------------------
+
+# Statuses a finished row can have; "skipped" files are never written
+ROW_STATUSES = {"ok", "rejected", "error"}
+
+def _complete_lines(f):
+    """Lines of an output file, without a partial last line left by a run killed mid-write."""
+    for line in f:
+        if line.endswith("\n"):
+            yield line
+
+def _truncate_torn_line(path: str):
+    """Cuts a partial last line off, so that image is scanned again and appends start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(pos, 64 * 1024)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos < end:
+            f.truncate(pos)
+
+class CsvSink:
+    def __init__(self, path: str):
+        self.path = path
+
+    def done_hashes(self) -> Set[str]:
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            # Short rows get None for missing columns, long ones a None key for the extras
+            return {row["sha256"] for row in csv.DictReader(_complete_lines(f))
+                    if None not in row and None not in row.values() and row["sha256"] and row["status"] in ROW_STATUSES}
+
+    def open(self):
+        _truncate_torn_line(self.path)
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new_file:
+            self._writer.writeheader()
+
+    def write(self, rows: List[dict]):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class JsonlSink(CsvSink):
+    def done_hashes(self) -> Set[str]:
+        if not os.path.exists(self.path):
+            return set()
+        done = set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in _complete_lines(f):
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(row, dict) and row.get("sha256") and row.get("status") in ROW_STATUSES:
+                    done.add(row["sha256"])
+        return done
+
+    def open(self):
+        _truncate_torn_line(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, rows: List[dict]):
+        self._file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+        self._file.flush()
+
+class ParquetSink:
+    """Parquet files cannot be appended to, so the output is a directory of part files."""
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        self.schema = pyarrow.schema([
+            (c, pyarrow.float64() if c in ("confidence", "runner_up_confidence", "blur_score", "lesion_density_percent", "texture_complexity")
+             else pyarrow.string()) for c in COLUMNS
+        ])
+
+    def _parts(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, p) for p in os.listdir(self.path) if p.endswith(".parquet"))
+
+    def done_hashes(self) -> Set[str]:
+        done = set()
+        for part in self._parts():
+            done.update(self.pq.read_table(part, columns=["sha256"]).column("sha256").to_pylist())
+        return done
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._next_part = len(self._parts())
+
+    def write(self, rows: List[dict]):
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        final = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        # Write-then-rename so an interrupted run never leaves a truncated part behind
+        self.pq.write_table(table, final + ".tmp")
+        os.replace(final + ".tmp", final)
+        self._next_part += 1
+
+    def close(self):
+        pass
+
+def make_sink(path: str, fmt: Optional[str]):
+    fmt = fmt or {".csv": "csv", ".jsonl": "jsonl", ".parquet": "parquet"}.get(os.path.splitext(path)[1].lower())
+    if fmt == "csv":
+        return CsvSink(path)
+    if fmt == "jsonl":
+        return JsonlSink(path)
+    if fmt == "parquet":
+        return ParquetSink(path)
+    raise SystemExit(f"Cannot tell the output format of {path}; pass --format csv|jsonl|parquet")
+
+# --- Decode stage (worker processes) -------------------------------------------
+
+_skip: Set[str] = set()
+
+def _init_worker(skip: Set[str]):
+    global _skip
+    _skip = skip
+    import cv2
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+def _decode_worker(path: str) -> Tuple[str, str, str, object, dict]:
+    """Returns (path, sha256, status, tensor, info). status is ok | skipped | rejected | error."""
+    from fastapi import HTTPException
+    from app.core.predictor import preprocess_image
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        return path, "", "error", None, {"code": "READ_ERROR", "detail": str(e)}
+    sha = hashlib.sha256(data).hexdigest()
+    if sha in _skip:
+        return path, sha, "skipped", None, {}
+    try:
+        tensor, metrics = preprocess_image(data)
+        return path, sha, "ok", tensor[0], metrics
+    except HTTPException as he:
+        detail = he.detail if isinstance(he.detail, dict) else {"detail": he.detail}
+        return path, sha, "rejected", None, {"code": detail.get("code"), "detail": detail.get("detail"), **detail.get("validator_scores", {})}
+    except Exception as e:
+        return path, sha, "error", None, {"code": "DECODE_ERROR", "detail": str(e)}
+
+# --- Inference stage (parent process) --------------------------------------------
+
+def _row(path: str, sha: str, status: str, info: dict, prediction: Optional[dict] = None) -> dict:
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, sha256=sha, status=status, code=info.get("code"), detail=info.get("detail"))
+    metrics = (prediction or {}).get("metrics") or info
+    for key in ("blur_score", "lesion_density_percent", "texture_complexity"):
+        row[key] = metrics.get(key)
+    if prediction:
+        # Both confidences are the calibrated probabilities of top_k, so they can be compared with each
+        # other; prediction["confidence"] has the centroid penalty applied, which the runner-up never gets
+        top_k = prediction.get("top_k") or []
+        confidence = top_k[0]["confidence"] if top_k else prediction["confidence"]
+        row.update(crop=prediction["crop"], disease=prediction["disease"], confidence=round(confidence, 4),
+                   inference_stage=metrics.get("inference_stage"))
+        if len(top_k) > 1:
+            row.update(runner_up=top_k[1]["label"], runner_up_confidence=round(top_k[1]["confidence"], 4))
+    return row
+
+class Progress:
+    def __init__(self, total: int, interval_s: float = 2.0):
+        self.total = total
+        self.interval_s = interval_s
+        self.counts: Dict[str, int] = {}
+        self.started = self._last = time.monotonic()
+
+    def add(self, status: str):
+        self.counts[status] = self.counts.get(status, 0) + 1
+        now = time.monotonic()
+        if now - self._last >= self.interval_s:
+            self._last = now
+            self.report()
+
+    def report(self, final: bool = False):
+        done = sum(self.counts.values())
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        # Throughput counts only files that did real work, so resumed runs get an honest ETA
+        worked = done - self.counts.get("skipped", 0)
+        rate = worked / elapsed
+        eta = (self.total - done) / rate if rate > 0 else float("inf")
+        breakdown = " ".join(f"{k}={v}" for k, v in sorted(self.counts.items()))
+        line = f"{done}/{self.total} files | {rate:.1f} img/s | " + (f"{elapsed:.0f}s total" if final else f"ETA {eta:.0f}s")
+        print(f"{line} | {breakdown}", file=sys.stderr, flush=True)
+
+async def _scan(paths: List[str], sink, skip: Set[str], workers: int, batch_size: int, tta: bool) -> Dict[str, int]:
+    # Imported here: loading the model is the slow part and the workers never need it
+    from app.core.concurrency import _infer_batch
+    import numpy as np
+
+    progress = Progress(len(paths))
+    pending: List[Tuple[str, str, object, dict]] = []
+    seen = set(skip)
+
+    async def flush():
+        if not pending:
+            return
+        predictions = await _infer_batch(np.stack([t for _, _, t, _ in pending]), [m for _, _, _, m in pending], tta=tta)
+        sink.write([_row(path, sha, "ok", {}, p) for (path, sha, _, _), p in zip(pending, predictions)])
+        for _ in pending:
+            progress.add("ok")
+        pending.clear()
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(skip,)) as pool:
+        for path, sha, status, tensor, info in pool.imap_unordered(_decode_worker, paths, chunksize=4):
+            if status == "ok" and sha in seen:
+                status = "skipped"  # Same content twice within this run
+            if status == "ok":
+                seen.add(sha)
+                pending.append((path, sha, tensor, info))
+                if len(pending) >= batch_size:
+                    await flush()
+                continue
+            if status != "skipped":
+                seen.add(sha)
+                sink.write([_row(path, sha, status, info)])
+            progress.add(status)
+        await flush()
+
+    progress.report(final=True)
+    return progress.counts
+
+def cmd_scan(args):
+    paths = find_images(args.directory)
+    if not paths:
+        raise SystemExit(f"No images found under {args.directory}")
+    sink = make_sink(args.output, args.format)
+    skip = set() if args.no_resume else sink.done_hashes()
+    print(f"Found {len(paths)} images, {len(skip)} already in {args.output}", file=sys.stderr)
+    sink.open()
+    try:
+        asyncio.run(_scan(paths, sink, skip, args.workers, args.batch_size, not args.no_tta))
+    except KeyboardInterrupt:
+        print("Interrupted; re-run the same command to resume.", file=sys.stderr)
+    finally:
+        sink.close()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="leafsense", description="LeafSense AI command-line tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    scan = sub.add_parser("scan", help="Bulk-scan a directory of leaf images offline.")
+    scan.add_argument("directory")
+    scan.add_argument("--output", "-o", default="scans.csv", help="CSV, JSONL, or Parquet directory (by extension)")
+    scan.add_argument("--format", choices=["csv", "jsonl", "parquet"])
+    scan.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decode processes")
+    scan.add_argument("--batch-size", type=int, default=32)
+    scan.add_argument("--no-tta", action="store_true", help="Skip test-time augmentation (about 3x faster)")
+    scan.add_argument("--no-resume", action="store_true", help="Re-scan files already in the output")
+    scan.set_defaults(func=cmd_scan)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,26 @@
 import sys
+import json
+import argparse
+
+# Pretty-prints the JSON-lines log written by app/utils/structured_logging.py
+parser = argparse.ArgumentParser(description="Read LeafSense structured logs.")
+parser.add_argument("path", nargs="?", default="logs/leafsense.jsonl")
+parser.add_argument("--request-id", help="Only show records for this request id")
+parser.add_argument("--event", help="Only show records of this event type (e.g. prediction, crash)")
+args = parser.parse_args()
 
 try:
-    with open("server_debug.log", "rb") as f:
-        content = f.read().decode("utf-16le")
-        print(content)
+    with open(args.path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if args.request_id and record.get("request_id") != args.request_id:
+                continue
+            if args.event and record.get("event") != args.event:
+                continue
+            exc = record.pop("exc", None)
+            print(json.dumps(record, ensure_ascii=False))
+            if exc:
+                print(exc)
 except Exception as e:
     print(f"Error reading log: {e}")
+    sys.exit(1)
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from app.core.admission import AdmissionController, Overloaded, PRIORITY_SINGLE, PRIORITY_BATCH
+
+def test_rejects_immediately_when_deadline_cannot_be_met():
+    async def scenario():
+        ctrl = AdmissionController(initial_limit=1, max_limit=1, target_latency_s=1.0, max_queue_wait_s=0.2)
+        ctrl.ewma_service_s = 1.0
+        await ctrl.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await ctrl.acquire()
+        assert exc.value.retry_after >= 1.0
+        assert ctrl.snapshot()["rejected"] == 1
+
+    asyncio.run(scenario())
+
+def test_single_requests_jump_ahead_of_batch():
+    async def scenario():
+        ctrl = AdmissionController(initial_limit=1, max_limit=1, target_latency_s=1.0, max_queue_wait_s=5.0)
+        ctrl.ewma_service_s = 0.01
+        order = []
+
+        async def job(name, priority):
+            async with ctrl.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await ctrl.acquire()
+        tasks = [asyncio.create_task(job("batch", PRIORITY_BATCH))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("single", PRIORITY_SINGLE)))
+        await asyncio.sleep(0)
+        ctrl.release(0.01)
+        await asyncio.gather(*tasks)
+        assert order == ["single", "batch"]
+
+    asyncio.run(scenario())
+
+def test_limit_adapts_to_latency():
+    ctrl = AdmissionController(initial_limit=2, min_limit=1, max_limit=6, target_latency_s=0.5)
+    for _ in range(20):
+        ctrl.in_flight += 1
+        ctrl.release(0.1)
+    assert ctrl.limit > 2
+    grown = ctrl.limit
+    ctrl._last_decrease = 0.0
+    ctrl.in_flight += 1
+    ctrl.release(5.0)
+    assert ctrl.limit < grown
+
+def test_inference_slot_waits_no_longer_than_the_request_budget(monkeypatch):
+    import time
+    from fastapi import HTTPException
+    from app.core import concurrency
+    from app.core.deadline import start_budget
+
+    async def scenario():
+        ctrl = AdmissionController(initial_limit=1, max_limit=1, target_latency_s=1.0, max_queue_wait_s=5.0)
+        ctrl.ewma_service_s = 0.01  # The estimate fits the budget, so the request queues...
+        monkeypatch.setattr(concurrency, "admission", ctrl)
+        await ctrl.acquire()
+        start_budget(0.05)
+        started = time.monotonic()
+        with pytest.raises(HTTPException) as exc:
+            async with concurrency.inference_slot():
+                pass
+        # ...but gives up when its budget runs out, not after max_queue_wait_s
+        assert exc.value.status_code == 503 and time.monotonic() - started < 1.0
+        assert ctrl.snapshot()["timed_out"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,14 @@
+from app.services.advisory_bundle import AdvisoryBundle, label_key, write_bundle
+
+def test_bundle_roundtrip_and_key_normalization(tmp_path):
+    path = str(tmp_path / "bundle.lsab")
+    rust = {"disease_name": "Common Rust", "cause": "Puccinia sorghi", "treatment_plan": ["स्प्रे"]}
+    write_bundle(path, {(label_key("Corn_(maize)___Common_rust_"), "hi"): rust,
+                        (label_key("Tomato___healthy"), "en"): {"disease_name": "Healthy"}}, {"bundle_version": "test"})
+
+    bundle = AdvisoryBundle(path)
+    assert len(bundle) == 2 and bundle.meta["bundle_version"] == "test"
+    # Both predictors turn the label into "Corn (maize)" / "Common rust " before the lookup
+    assert bundle.get("Corn (maize)", "Common rust ", "hi") == rust
+    assert bundle.get("Corn (maize)", "Common rust ", "en") is None
+    assert bundle.get("Tomato", "healthy")["disease_name"] == "Healthy"
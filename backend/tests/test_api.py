@@ -1,9 +1,82 @@
+import os
+import sys
+import subprocess
+from collections import Counter
+import cv2
+import numpy as np
 from fastapi.testclient import TestClient
 from app.main import app
+from app.api.routes import risk_rollups, scan_tensors
+from app.utils.tensor_codec import encode_tensor_upload
 
 client = TestClient(app)
 
+def _leaf_png() -> bytes:
+    leaf = np.zeros((128, 128, 3), dtype=np.uint8)
+    cv2.randu(leaf, 0, 255)
+    leaf[..., 1] = 180
+    return cv2.imencode(".png", leaf)[1].tobytes()
+
 def test_root():
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome to LeafSense AI Production"}
+
+def test_served_app_has_the_router_and_runs_its_hooks():
+    with TestClient(app) as served:
+        # Started by the router's on_startup hooks, which only the app's lifespan runs
+        assert risk_rollups._task is not None
+        models = served.get("/models").json()
+        assert models["version"] == "base"
+        assert served.get("/risk/crop").status_code == 200
+
+        response = served.post("/predict", files={"file": ("leaf.png", _leaf_png(), "image/png")})
+        assert response.status_code == 200, response.text
+        assert response.json()["model_version"] == models["version"]
+        assert served.get("/health").json()["models"]["version"] == "base"
+        # Scanned by the router's pipeline: retained for /explain like any other scan
+        assert scan_tensors.get(response.json()["scan_id"]) is not None
+    assert risk_rollups._task is None
+
+def test_every_route_is_served_once():
+    routes = Counter((route.path, tuple(sorted(getattr(route, "methods", None) or ()))) for route in app.routes)
+    assert [route for route, n in routes.items() if n > 1] == []
+
+def test_a_missing_model_serves_an_unhealthy_health_check():
+    script = ("from fastapi.testclient import TestClient\n"
+              "from app.main import app\n"
+              "with TestClient(app) as client:\n"
+              "    health = client.get('/health')\n"
+              "    print(health.status_code, health.json()['model']['loaded'], client.get('/health/ready').status_code)\n")
+    env = {**os.environ, "MODEL_PATH": os.path.join(os.path.dirname(os.environ["MODEL_PATH"]), "missing.h5")}
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True,
+                            cwd=os.path.join(os.path.dirname(__file__), ".."), timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-3:] == ["503", "False", "503"]
+
+def test_tensor_bodies_are_capped_at_what_the_limiter_admits():
+    def post(count):
+        leaves = np.random.default_rng(0).integers(0, 255, (count, 224, 224, 3), dtype=np.uint8)
+        leaves[..., 1] = 180
+        body = encode_tensor_upload(leaves)
+        return client.post("/predict/tensor", content=body, headers={"content-type": "application/octet-stream"})
+    too_many = post(11)
+    assert too_many.status_code == 413 and "10 tensors" in too_many.text
+    response = post(1)
+    assert response.status_code == 200, response.text
+    assert response.json()["prediction"]["model_version"] == "base"
+
+def test_main_and_the_router_share_one_advisory_breaker():
+    import app.main as main
+    from app.services import gemini_service
+    assert main.advisory_breaker is gemini_service.advisory_breaker
+
+def test_field_scans_are_charged_before_the_image_is_decoded(monkeypatch):
+    import asyncio
+    import app.api.routes as routes
+    decoded = []
+    monkeypatch.setattr(routes, "get_remote_address", lambda request: "field-budget-test")
+    monkeypatch.setattr(routes, "decode_image", lambda data: decoded.append(data))
+    asyncio.run(routes.limiter.hit("api_predict", "field-budget-test", routes.API_PREDICT_RATE, cost=10))
+    response = client.post("/predict/field", files={"file": ("row.png", _leaf_png(), "image/png")})
+    assert response.status_code == 429 and decoded == []
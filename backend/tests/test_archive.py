@@ -0,0 +1,80 @@
+import os
+import asyncio
+import cv2
+import numpy as np
+from app.core.archive import UploadArchive, read_manifest
+from app.core.pipeline import PipelineContext
+
+LABELS = {"0": "Tomato___healthy", "1": "Tomato___Late_blight"}
+
+def _ctx(seed: int, size=(64, 48), class_idx: int = 1, confidence: float = 0.95) -> PipelineContext:
+    image = np.random.default_rng(seed).integers(0, 255, (*size, 3), dtype=np.uint8)
+    data = cv2.imencode(".png", image)[1].tobytes()
+    return PipelineContext({"image_bytes": data, "image": image, "class_idx": class_idx, "confidence": confidence,
+                            "validation": {"green_ratio": np.float32(0.5)}, "metrics": {"blur_score": 120.0}}, {"labels": LABELS})
+
+def test_archive_dedupes_reencodes_and_feeds_the_manifest(tmp_path):
+    archive = UploadArchive(str(tmp_path), max_side=32, queue_mb=1.0)
+    archive.observe(_ctx(0))
+    archive.observe(_ctx(0))  # Same upload twice
+    archive.observe(_ctx(1, size=(16, 16), class_idx=0, confidence=0.5))
+    archive.observe(_ctx(2), error=RuntimeError("rejected"))
+    assert archive.snapshot()["queue"] == 3
+    archive.drain()
+
+    rows = read_manifest(str(tmp_path))
+    assert [r["seen"] for r in rows] == [2, 1] and archive.stats["duplicates"] == 1
+    big, small = rows
+    assert big["label"] == "Tomato___Late_blight" and big["model_version"] == "base"
+    assert big["file"].endswith(".jpg") and (big["width"], big["height"]) == (24, 32) and archive.stats["reencoded"] == 1
+    assert small["file"].endswith(".png") and open(small["file"], "rb").read() == _ctx(1, size=(16, 16))["image_bytes"]
+    assert big["validation"] == {"green_ratio": 0.5}
+    assert [r["label"] for r in read_manifest(str(tmp_path), min_confidence=0.9)] == ["Tomato___Late_blight"]
+    assert read_manifest(str(tmp_path), model_versions=["v2"]) == []
+    # Another worker archiving the same image only counts it
+    other = UploadArchive(str(tmp_path), max_side=32)
+    other.observe(_ctx(0))
+    other.drain()
+    assert read_manifest(str(tmp_path))[0]["seen"] == 3 and other.stats["bytes_written"] == 0
+    assert sum(len(files) for _, _, files in os.walk(tmp_path / "objects")) == 2
+
+def test_full_queue_sheds_instead_of_blocking_and_writes_behind(tmp_path):
+    upload = _ctx(0)
+    archive = UploadArchive(str(tmp_path), max_side=0, queue_mb=2.5 * len(upload["image_bytes"]) / 2**20)
+
+    async def scenario():
+        for seed in range(4):
+            archive.observe(_ctx(seed))
+        assert archive.stats["dropped_backpressure"] == 2 and archive.snapshot()["queue"] == 2
+        await archive.start()
+        for _ in range(200):
+            if archive.stats["archived"] == 2:
+                break
+            await asyncio.sleep(0.005)
+        archive.observe(_ctx(5))
+        await archive.stop()
+
+    asyncio.run(scenario())
+    assert archive.stats["archived"] == 3 and len(read_manifest(str(tmp_path))) == 3
+
+def test_stop_waits_for_the_batch_being_written(tmp_path):
+    writing = []
+
+    async def slow_thread(fn, batch):
+        writing.append(len(batch))
+        await asyncio.sleep(0.05)
+        return await asyncio.to_thread(fn, batch)
+
+    archive = UploadArchive(str(tmp_path), max_side=0, batch_max=2, run_blocking=slow_thread)
+
+    async def scenario():
+        await archive.start()
+        for seed in range(3):
+            archive.observe(_ctx(seed))
+        while not writing:
+            await asyncio.sleep(0.001)
+        await archive.stop()
+
+    asyncio.run(scenario())
+    assert archive.stats["archived"] == 3 and archive.stats["failed"] == 0 and archive.stats["duplicates"] == 0
+    assert [r["seen"] for r in read_manifest(str(tmp_path))] == [1, 1, 1]
@@ -0,0 +1,40 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from app.utils.buffer_pool import BufferPool
+from app.utils.image_utils import enhance_image_pipeline, resize_and_normalize, apply_tta
+
+def _leaf(seed, height=300, width=400):
+    rng = np.random.default_rng(seed)
+    return np.stack([rng.integers(0, 90, (height, width)), rng.integers(60, 220, (height, width)),
+                     rng.integers(20, 160, (height, width))], axis=-1).astype(np.uint8)
+
+def test_pooled_pipeline_matches_allocating_pipeline():
+    pool = BufferPool(64, max_idle=1)
+    for seed in range(3):  # Reused buffers must not leak state between requests
+        expected_img, expected_metrics = enhance_image_pipeline(_leaf(seed))
+        expected = apply_tta(resize_and_normalize(expected_img, 64))
+        with pool.lease() as buffers:
+            image, metrics = enhance_image_pipeline(_leaf(seed), buffers)
+            tensor = apply_tta(resize_and_normalize(image, 64, buffers), out=buffers.tensor)
+            assert metrics == expected_metrics
+            assert np.array_equal(tensor, expected) and np.shares_memory(tensor, buffers.tensor)
+    assert pool.snapshot()["created"] == 1 and pool.snapshot()["leases"] == 3
+
+def test_pool_keeps_at_most_max_idle_sets():
+    pool = BufferPool(32, max_idle=1)
+    with pool.lease() as a, pool.lease() as b:
+        assert a is not b
+    assert pool.snapshot()["idle"] == 1
+
+def test_concurrent_requests_match_serial_output():
+    pool = BufferPool(64, max_idle=8)
+    leaves = [_leaf(seed, 120, 160) for seed in range(200)]
+    serial = [enhance_image_pipeline(leaf)[0] for leaf in leaves]
+
+    def scan(leaf):
+        with pool.lease() as buffers:
+            return enhance_image_pipeline(leaf.copy(), buffers)[0].copy()
+
+    with ThreadPoolExecutor(8) as executor:
+        concurrent = list(executor.map(scan, leaves))
+    assert all(np.array_equal(a, b) for a, b in zip(serial, concurrent))
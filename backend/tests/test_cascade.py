@@ -0,0 +1,57 @@
+import asyncio
+import numpy as np
+from app.core.cascade import CascadeHead, extract_cascade_features, tune_cascade_thresholds
+from app.core.model_registry import ModelBundle
+
+GREEN_RATIO, BROWN_RATIO = 32, 33  # Indices in extract_cascade_features()
+
+def _tensor(rgb) -> np.ndarray:
+    return np.full((224, 224, 3), rgb, dtype=np.float32) / 127.5 - 1.0
+
+def test_thresholds_are_the_lowest_confidence_that_keeps_the_target_precision():
+    # Class 0: 30 exits from 0.99 down, the last 5 of them wrong; class 1: too few to exit at all
+    conf = np.concatenate([np.linspace(0.99, 0.60, 30), [0.9] * 5])
+    predicted = np.array([0] * 30 + [1] * 5)
+    probs = np.where(np.arange(2) == predicted[:, None], conf[:, None], 1 - conf[:, None])
+    y_true = np.array([0] * 25 + [1] * 5 + [1] * 5)
+    thresholds = tune_cascade_thresholds(probs, y_true, 2, target_precision=0.95, min_support=20)
+    # 25 right out of the first 26 is 0.96; the 27th (2 wrong) is 0.926
+    assert thresholds[0] == np.float32(conf[25]) and np.isinf(thresholds[1])
+    assert tune_cascade_thresholds(probs, y_true, 2, target_precision=1.0, min_support=20)[0] == np.float32(conf[24])
+
+def test_exit_only_above_the_class_threshold():
+    features = extract_cascade_features(_tensor((40, 160, 50)))
+    weights = np.zeros((len(features), 2), dtype=np.float32)
+    weights[GREEN_RATIO, 0] = 10.0
+    head = CascadeHead(weights, np.zeros(2), np.zeros(len(features)), np.ones(len(features)), np.array([np.inf, 0.5]))
+    confidence = float(head.predict_proba(features).max())
+    assert head.try_exit(features) is None
+    head.thresholds = np.array([confidence, 0.5], dtype=np.float32)
+    assert np.argmax(head.try_exit(features)) == 0
+    head.thresholds = np.array([np.nextafter(np.float32(confidence), np.float32(1.0)), 0.5], dtype=np.float32)
+    assert head.try_exit(features) is None
+
+def test_forward_batch_sends_only_unconfident_images_to_the_model():
+    from app.core.concurrency import _forward_batch
+
+    class Model:
+        output_shape = (None, 2)
+        batches = []
+        def predict(self, x, **kwargs):
+            self.batches.append(len(x))
+            return np.tile([0.2, 0.8], (len(x), 1))
+
+    dim = len(extract_cascade_features(_tensor((40, 160, 50))))
+    weights = np.zeros((dim, 2), dtype=np.float32)
+    weights[GREEN_RATIO, 0] = weights[BROWN_RATIO, 1] = 10.0
+    # Class 0 (green) may exit, class 1 (brown) never does
+    head = CascadeHead(weights, np.zeros(2), np.zeros(dim), np.ones(dim), np.array([0.9, np.inf]))
+    extractor = type("Extractor", (), {"predict": lambda self, x, **kw: np.zeros((len(x), 4))})()
+    bundle = ModelBundle("v1", Model(), {"0": "a___healthy", "1": "a___blight"}, extractor, np.zeros((2, 4)), 1.0, head)
+    batch = np.stack([_tensor((40, 160, 50)), _tensor((140, 80, 20))])
+    metrics = [{}, {}]
+
+    outputs = asyncio.run(_forward_batch(batch, metrics, tta=False, bundle=bundle))
+    assert [m["inference_stage"] for m in metrics] == ["student", "full"]
+    assert Model.batches == [1] and outputs[0][1] is None and np.argmax(outputs[0][0]) == 0
+    assert np.allclose(outputs[1][0], [0.2, 0.8])
@@ -0,0 +1,68 @@
+import asyncio
+from app.core.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from app.core.deadline import start_budget, budget_for, remaining
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def _breaker(clock, **kwargs):
+    return CircuitBreaker("test", window_s=10.0, min_calls=4, failure_rate=0.5, slow_call_s=2.0, slow_call_rate=0.75, open_s=5.0, clock=clock, **kwargs)
+
+def test_opens_on_failure_rate_and_recovers_through_half_open():
+    clock = Clock()
+    breaker = _breaker(clock)
+    for ok in (True, False, True):
+        assert breaker.allow()
+        breaker.record(ok, 0.1)
+    assert breaker.state == CLOSED  # Below min_calls
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN and not breaker.allow()
+
+    clock.now = 5.0
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()  # One probe at a time
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN and breaker.snapshot()["opened"] == 2
+
+    clock.now = 10.0
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED and breaker.snapshot()["window_calls"] == 0
+
+def test_slow_calls_trip_and_old_calls_age_out():
+    clock = Clock()
+    breaker = _breaker(clock)
+    for _ in range(3):
+        breaker.record(True, 3.0)
+    clock.now = 11.0  # The slow calls leave the window; otherwise this would be 3 slow out of 4
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED and breaker.snapshot()["window_calls"] == 1
+    for _ in range(3):
+        breaker.record(True, 3.0)
+    assert breaker.state == OPEN
+
+def test_abandoned_probe_frees_the_slot():
+    clock = Clock()
+    breaker = _breaker(clock, half_open_calls=1)
+    for _ in range(4):
+        breaker.record(False, 0.1)
+    clock.now = 6.0
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow() and breaker.state == HALF_OPEN
+
+def test_budget_caps_timeouts_only_inside_a_request():
+    assert remaining() is None and budget_for(8.0) == 8.0
+
+    async def request():
+        start_budget(3.0)
+        await asyncio.sleep(0)
+        return budget_for(8.0), budget_for(1.0)
+
+    capped, uncapped = asyncio.run(request())
+    assert 2.5 < capped <= 3.0 and uncapped == 1.0
+    assert remaining() is None
@@ -0,0 +1,87 @@
+import json
+import asyncio
+import random
+from app.core.drift import BinnedQuantiles, DriftWindow, DriftMonitor, DRIFT, STABLE, profile_baseline_path
+from app.core.pipeline import Pipeline, Stage, StageRejected
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def _ctx(rng, blur_mu=300.0, green=0.5, cls="3"):
+    confidence = rng.uniform(0.6, 0.95)
+    return {"validation": {"green_ratio": green + rng.uniform(-0.1, 0.1), "entropy": rng.uniform(6, 7), "edge_density": 0.05},
+            "metrics": {"blur_score": rng.lognormvariate(0, 0.3) * blur_mu, "lesion_density_percent": rng.uniform(0, 20)},
+            "confidence": confidence, "class_idx": int(cls), "top": [(int(cls), confidence), (1, 0.05)]}
+
+def test_quantiles_and_roundtrip():
+    sketch = BinnedQuantiles(0.0, 1.0, 100)
+    for i in range(1000):
+        sketch.add(i / 1000)
+    sketch.add(-1.0)
+    sketch.add(5.0)
+    assert abs(sketch.quantile(0.5) - 0.5) < 0.01 and sketch.quantile(0.0) == 0.0 and sketch.quantile(1.0) == 1.0
+    window = DriftWindow()
+    window.add({"blur_score": 250.0, "confidence": 0.8}, {"outcome": "accepted", "predicted_class": "2"})
+    again = DriftWindow.from_dict(json.loads(json.dumps(window.to_dict())))
+    assert again.n == 1 and again.features["blur_score"].counts == window.features["blur_score"].counts
+    assert again.categories["predicted_class"] == {"2": 1}
+
+def test_monitor_flags_a_shift_and_ignores_infrastructure_errors(tmp_path):
+    rng = random.Random(0)
+    baseline = DriftWindow()
+    for _ in range(2000):
+        ctx = _ctx(rng)
+        baseline.add({**ctx["validation"], **ctx["metrics"], "confidence": ctx["confidence"], "confidence_gap": ctx["confidence"] - 0.05},
+                     {"outcome": "accepted", "predicted_class": "3"})
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps(baseline.to_dict()))
+
+    clock = Clock()
+    monitor = DriftMonitor(str(path), window_s=60, min_samples=100, clock=clock)
+    for _ in range(300):
+        monitor.observe(_ctx(rng))
+    report = monitor.report()
+    assert report["current"]["features"]["blur_score"]["status"] == STABLE and report["status"] == STABLE
+
+    clock.now += 61  # A new phone camera: softer images, and more of them rejected as not a plant
+    for _ in range(300):
+        monitor.observe(_ctx(rng, blur_mu=90.0))
+        monitor.observe({"metrics": {}}, StageRejected("NOT_A_PLANT", "no", details={"green_ratio": 0.01, "entropy": 2.0, "edge_density": 0.0}))
+    monitor.observe({}, RuntimeError("model crashed"))
+    report = monitor.report(samples=True)
+    current = report["current"]
+    assert report["status"] == DRIFT and current["scans"] == 600
+    assert current["features"]["blur_score"]["status"] == DRIFT and current["categories"]["outcome"]["status"] == DRIFT
+    assert current["features"]["green_ratio"]["scans"] == 600  # Rejected images still count
+    assert report["previous"]["scans"] == 300 and 0 < len(report["samples"]) <= 64
+
+def test_pipeline_observers_see_rejected_runs():
+    seen = []
+
+    def reject(ctx):
+        raise StageRejected("NOT_A_PLANT", "no", details={"green_ratio": 0.0})
+
+    pipeline = Pipeline([Stage("decode", "a", lambda ctx: {"image": 1}, provides=("image",)),
+                         Stage("validate", "a", reject, requires=("image",))])
+    pipeline.observe(lambda ctx, error: seen.append((dict(ctx), error)))
+    try:
+        asyncio.run(pipeline.run({}))
+    except StageRejected:
+        pass
+    assert seen[0][0] == {"image": 1} and seen[0][1].code == "NOT_A_PLANT"
+
+def test_each_profile_has_its_own_baseline():
+    assert profile_baseline_path("models/drift_baseline.json", "legacy") == "models/drift_baseline_legacy.json"
+    from app.api.routes import drift_monitor
+    assert drift_monitor.baseline_path == "models/drift_baseline_production.json"
+
+def test_confidence_is_recorded_before_the_centroid_and_knn_penalties():
+    from app.core.drift import observation
+    ctx = {"metrics": {}, "confidence": 0.4, "class_idx": 3, "top": [(3, 0.9), (1, 0.05)]}
+    values, categories = observation(ctx)
+    assert values["confidence"] == 0.9 and abs(values["confidence_gap"] - 0.85) < 1e-9
+    assert categories == {"outcome": "accepted", "predicted_class": "3"}
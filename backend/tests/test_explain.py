@@ -0,0 +1,77 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+import numpy as np
+from app.core import explain
+from app.core.explain import ScanTensorCache, HeatmapStore, ExplainWorker, occlusion_maps
+
+class PatchModel:
+    """Class 1 probability is the mean brightness of the top-left 32x32 patch."""
+
+    def predict(self, x, verbose=0):
+        p1 = (x[:, :32, :32].mean(axis=(1, 2, 3)) + 1.0) / 2.0
+        return np.stack([1.0 - p1, p1], axis=1)
+
+class FlatModel(PatchModel):
+    """A Keras-looking model without any spatial layer, so Grad-CAM has nothing to work on."""
+    inputs = []
+    layers = [type("Dense", (), {"output": type("Tensor", (), {"shape": (None, 2)})()})()]
+
+def _tensor(value: float = 1.0) -> np.ndarray:
+    return np.full((1, 64, 64, 3), value, dtype=np.float32)
+
+def test_cache_roundtrip_is_exact_and_bounded():
+    cache = ScanTensorCache(max_bytes=2 * 64 * 64 * 3)
+    tensor = (np.arange(64 * 64 * 3, dtype=np.float32).reshape(1, 64, 64, 3) % 256) / np.float32(127.5) - np.float32(1.0)
+    cache.put("a", tensor, 1, "A")
+    rgb, class_idx, label, _ = cache.get("a")
+    assert rgb.dtype == np.uint8 and np.array_equal(ScanTensorCache.tensor(rgb), tensor[0]) and class_idx == 1
+
+    cache.put("b", tensor, 0, "B")
+    cache.get("a")  # a is now the most recently used
+    cache.put("c", tensor, 0, "C")
+    assert cache.get("b") is None and cache.get("a") is not None and cache.snapshot()["evicted"] == 1
+
+def test_occlusion_finds_the_patch_the_model_uses():
+    (heat,) = occlusion_maps(PatchModel().predict, _tensor(), [1])
+    assert heat.shape == (2, 2)
+    assert np.unravel_index(np.argmax(heat), heat.shape) == (0, 0) and heat[1, 1] == 0
+
+def test_worker_explains_queued_scans_in_one_batch(tmp_path):
+    cache = ScanTensorCache()
+    for scan_id in ("s1", "s2", "s3"):
+        cache.put(scan_id, _tensor(), 1, "Tomato - Early blight")
+    slots = []
+
+    @asynccontextmanager
+    async def slot():
+        slots.append(1)
+        yield
+
+    worker = ExplainWorker(cache, HeatmapStore(str(tmp_path)), lambda version: PatchModel(), slot, batch_max=8)
+
+    async def scenario():
+        assert worker.request("missing") is None
+        states = [worker.request(s) for s in ("s1", "s2", "s3")]
+        assert {s["status"] for s in states} == {"queued"}
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if all(worker.results[s]["status"] == "ready" for s in ("s1", "s2", "s3")):
+                break
+        return [worker.request(s) for s in ("s1", "s2", "s3")]
+
+    results = asyncio.run(scenario())
+    assert all(r["status"] == "ready" and r["method"] == "occlusion" for r in results)
+    assert len(slots) == 1 and worker.stats["batches"] == 1
+    # Identical inputs render identical overlays, stored once under their hash
+    assert len({r["sha256"] for r in results}) == 1
+    assert os.path.exists(worker.store.path(results[0]["sha256"]))
+    assert results[0]["peak"] == {"x": 0.25, "y": 0.25}
+
+def test_worker_falls_back_to_occlusion_when_gradcam_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(explain, "supports_gradcam", lambda model: True)
+    cache = ScanTensorCache()
+    cache.put("s1", _tensor(), 1, "Tomato - Early blight")
+    worker = ExplainWorker(cache, HeatmapStore(str(tmp_path)), lambda version: FlatModel(), slot=None)
+    ((method, _, peak),) = worker._compute([cache.get("s1")], {None: FlatModel()})
+    assert method == "occlusion" and peak == {"x": 0.25, "y": 0.25}
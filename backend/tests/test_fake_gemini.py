@@ -0,0 +1,36 @@
+import json
+from fastapi.testclient import TestClient
+from app.gemini_client import _build_request, _finalize
+from tools.fake_gemini import FakeGemini, create_app
+
+PREDICTION = {"crop": "Tomato", "disease": "Late blight", "confidence": 0.9}
+
+def _post(client, method="generateContent", params="?key=test"):
+    return client.post(f"/v1beta/models/gemini-1.5-flash:{method}{params}", json=_build_request(PREDICTION, "en"))
+
+def _text(chunk: dict) -> str:
+    return chunk["candidates"][0]["content"]["parts"][0]["text"]
+
+def test_answers_are_advisories_for_the_prompted_disease():
+    client = TestClient(create_app(FakeGemini(latency_ms=0, fenced_rate=1.0)))
+    text = _text(_post(client).json())
+    assert text.startswith("```json")
+    advisory = _finalize(text)
+    assert advisory["advisory_valid"] and advisory["disease_name"] == "Late blight (Tomato)"
+    assert _post(client, params="").status_code == 403
+
+def test_stream_chunks_reassemble_and_malformed_fails_validation():
+    client = TestClient(create_app(FakeGemini(latency_ms=0, fenced_rate=0.0, malformed_rate=1.0)))
+    lines = [line for line in _post(client, "streamGenerateContent", "?alt=sse&key=test").text.splitlines() if line.startswith("data:")]
+    assert len(lines) > 1
+    assert _finalize("".join(_text(json.loads(line[5:])) for line in lines))["parse_error"]
+    # Without alt=sse the SDK's REST transport expects one JSON array of chunks
+    chunks = _post(client, "streamGenerateContent").json()
+    assert len(chunks) > 1 and "".join(map(_text, chunks))
+
+def test_burst_window_returns_429_and_counts():
+    fake = FakeGemini(latency_ms=0, burst_every_s=10.0, burst_length_s=10.0)
+    client = TestClient(create_app(fake))
+    response = _post(client)
+    assert response.status_code == 429 and response.json()["error"]["status"] == "RESOURCE_EXHAUSTED"
+    assert client.get("/stats").json()["rate_limited"] == 1
@@ -0,0 +1,79 @@
+import json
+import asyncio
+from app.gemini_client import stream_gemini_advisory
+from app.utils.json_stream import IncrementalObjectParser
+
+ADVISORY = {"disease_name": "Early Blight", "immediate_action": "Remove infected leaves {now}, \"today\".", "severity": "High",
+            "cause": "Fungus", "treatment_plan": ["Copper spray", "Prune [lower] leaves"], "prevention": "Rotate crops",
+            "estimated_crop_loss_risk": "High", "consult_expert": True}
+
+def test_parser_emits_fields_as_they_complete():
+    text = "```json\n" + json.dumps(ADVISORY) + "\n```"
+    parser, seen = IncrementalObjectParser(), []
+    for i in range(0, len(text), 7):
+        seen.extend(key for key, _ in parser.feed(text[i:i + 7]))
+        if "immediate_action" in seen:
+            # Emitted long before the whole object has arrived
+            assert i < len(text) // 2
+            break
+    for i in range(i + 7, len(text), 7):
+        seen.extend(key for key, _ in parser.feed(text[i:i + 7]))
+    assert seen == list(ADVISORY) and parser.members == ADVISORY and parser.finished
+
+async def _fake_stream_server(chunks):
+    async def handle(reader, writer):
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass  # Headers; the request body is left unread
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+        for chunk in chunks:
+            payload = {"candidates": [{"content": {"parts": [{"text": chunk}]}}]}
+            writer.write(b"data: " + json.dumps(payload).encode() + b"\r\n\r\n")
+            await writer.drain()
+            await asyncio.sleep(0.005)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+def test_stream_against_local_fake(monkeypatch):
+    text = "```json\n" + json.dumps(ADVISORY) + "\n```"
+    chunks = [text[i:i + 11] for i in range(0, len(text), 11)]
+
+    async def scenario():
+        server, port = await _fake_stream_server(chunks)
+        monkeypatch.setenv("GEMINI_API_KEY", "test")
+        monkeypatch.setenv("GEMINI_API_BASE", f"http://127.0.0.1:{port}/v1beta")
+        async with server:
+            return [e async for e in stream_gemini_advisory({"crop": "Tomato", "disease": "Early blight", "confidence": 0.9})]
+
+    events = asyncio.run(scenario())
+    fields = [e["key"] for e in events if e["event"] == "field"]
+    assert fields == list(ADVISORY)
+    assert "".join(e["text"] for e in events if e["event"] == "token") == text
+    final = events[-1]
+    assert final["event"] == "advisory" and final["advisory"]["advisory_valid"]
+    assert final["timing"]["immediate_action_ms"] <= final["timing"]["total_ms"]
+
+def test_stream_stops_at_its_timeout(monkeypatch):
+    text = "```json\n" + json.dumps(ADVISORY) + "\n```"
+    chunks = [text[i:i + 5] for i in range(0, len(text), 5)]
+
+    async def scenario():
+        server, port = await _fake_stream_server(chunks)
+        monkeypatch.setenv("GEMINI_API_KEY", "test")
+        monkeypatch.setenv("GEMINI_API_BASE", f"http://127.0.0.1:{port}/v1beta")
+        async with server:
+            return [e async for e in stream_gemini_advisory({"crop": "Tomato", "disease": "Early blight", "confidence": 0.9}, timeout=0.2)]
+
+    events = asyncio.run(scenario())
+    # Every read was quick; it is the stream as a whole that ran out of time
+    assert events[-1]["advisory"]["error"] == "GEMINI_TIMEOUT"
+    assert sum(e["event"] == "token" for e in events) < len(chunks)
+
+def test_advisory_without_api_key_leaves_the_breaker_alone(monkeypatch):
+    from app import main
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    before = main.advisory_breaker.snapshot()["window_calls"]
+    advisory, source = asyncio.run(main._llm_advisory({"crop": "Tomato", "disease": "Early blight", "confidence": 0.9}, "en"))
+    assert source == "fallback" and advisory["error"] == "ADVISORY_NOT_CONFIGURED"
+    assert main.advisory_breaker.snapshot()["window_calls"] == before
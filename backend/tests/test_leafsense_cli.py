@@ -0,0 +1,27 @@
+from leafsense import CsvSink, JsonlSink, _row
+
+def test_sinks_resume_from_interrupted_output(tmp_path):
+    for sink_class, name in ((CsvSink, "scans.csv"), (JsonlSink, "scans.jsonl")):
+        path = str(tmp_path / name)
+        sink = sink_class(path)
+        sink.open()
+        sink.write([_row("a.jpg", "aaa", "rejected", {"code": "NOT_A_PLANT"}), _row("b.jpg", "bbb", "error", {})])
+        sink.close()
+        # Simulate a run killed halfway through a line
+        with open(path, "a") as f:
+            f.write('c.jpg,ccc,o' if sink_class is CsvSink else '{"path": "c.jpg", "sha256": "ccc", "status": "ok"')
+
+        resumed = sink_class(path)
+        assert resumed.done_hashes() == {"aaa", "bbb"}
+        resumed.open()
+        resumed.write([_row("d.jpg", "ddd", "error", {})])
+        resumed.close()
+        assert sink_class(path).done_hashes() == {"aaa", "bbb", "ddd"}
+        with open(path) as f:
+            assert "ccc" not in f.read()
+
+def test_row_confidences_share_one_scale():
+    prediction = {"crop": "Tomato", "disease": "Early blight", "confidence": 0.48, "metrics": {"inference_stage": "full"},
+                  "top_k": [{"label": "Tomato - Early blight", "confidence": 0.6}, {"label": "Tomato - Late blight", "confidence": 0.3}]}
+    row = _row("a.jpg", "aaa", "ok", {}, prediction)  # 0.48: the centroid penalty, which the runner-up never gets
+    assert (row["confidence"], row["runner_up_confidence"]) == (0.6, 0.3)
@@ -0,0 +1,38 @@
+import asyncio
+import numpy as np
+from app.core.live_scan import dhash, FrameDeduper, LatestFrameSlot, MicroBatcher
+
+def test_near_duplicate_frames_hit_the_ring_buffer():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    jittered = np.clip(frame.astype(np.int16) + rng.integers(-4, 5, frame.shape), 0, 255).astype(np.uint8)
+    deduper = FrameDeduper(capacity=2, max_distance=6)
+    deduper.add(dhash(frame), {"prediction": "a"})
+    assert deduper.lookup(dhash(jittered)) == {"prediction": "a"}
+    assert deduper.lookup(dhash(frame[::-1])) is None
+    # Ring buffer forgets the oldest entry
+    deduper.add(1, {}), deduper.add(2, {})
+    assert deduper.lookup(dhash(frame)) is None
+
+def test_latest_frame_wins():
+    async def scenario():
+        slot = LatestFrameSlot()
+        for frame in (b"1", b"2", b"3"):
+            slot.put(frame)
+        return await slot.take(), slot.dropped
+
+    assert asyncio.run(scenario()) == (b"3", 2)
+
+def test_micro_batcher_coalesces_sessions():
+    calls = []
+
+    async def infer(batch, metrics_list):
+        calls.append(len(batch))
+        return [{"i": m["i"]} for m in metrics_list]
+
+    async def scenario():
+        batcher = MicroBatcher(infer, max_batch=4, max_wait_s=0.01)
+        return await asyncio.gather(*(batcher.submit(np.zeros((2, 2, 3)), {"i": i}) for i in range(6)))
+
+    assert [r["i"] for r in asyncio.run(scenario())] == list(range(6))
+    assert calls == [4, 2]
@@ -0,0 +1,102 @@
+import os
+import json
+import asyncio
+import pytest
+from app.core.model_registry import ModelBundle, ModelRegistry, ModelRegistryError, BASE_VERSION
+
+def _version(root, name: str, broken: bool = False):
+    os.makedirs(os.path.join(root, name))
+    with open(os.path.join(root, name, "model.json"), "w") as f:
+        json.dump({"broken": broken}, f)
+
+def _build(version: str, directory: str) -> ModelBundle:
+    with open(os.path.join(directory, "model.json")) as f:
+        return ModelBundle(version, json.load(f), {"0": "Tomato___healthy"})
+
+def _warm(bundle: ModelBundle):
+    if bundle.model.get("broken"):
+        raise RuntimeError("warmup produced NaN")
+
+def _registry(root, **kwargs) -> ModelRegistry:
+    return ModelRegistry(str(root), _build, _warm, fallback=lambda: ModelBundle(BASE_VERSION, {}, {}), **kwargs)
+
+async def _settle(registry: ModelRegistry):
+    for _ in range(200):
+        if registry.loading is None:
+            return
+        await asyncio.sleep(0.005)
+
+def test_activate_swaps_after_warmup_and_rollback_returns(tmp_path):
+    _version(tmp_path, "v1")
+    _version(tmp_path, "v2")
+    registry = _registry(tmp_path)
+    registry.load_initial()
+    assert registry.current.version == BASE_VERSION and registry.versions() == [BASE_VERSION, "v1", "v2"]
+    swapped = []
+    registry.on_swap(lambda bundle: swapped.append(bundle.version))
+
+    async def scenario():
+        held = registry.current  # An in-flight request
+        assert registry.activate("v1")["status"] == "loading"
+        with pytest.raises(ModelRegistryError) as busy:
+            registry.activate("v2")
+        assert busy.value.code == "MODEL_LOADING"
+        await _settle(registry)
+        assert registry.current.version == "v1" and held.version == BASE_VERSION
+        assert registry.snapshot()["draining"] == [BASE_VERSION] and registry.get(BASE_VERSION) is held
+
+        registry.activate("v2")
+        await _settle(registry)
+        assert registry.read_pointer()["previous"] == [BASE_VERSION, "v1"]
+        registry.rollback()
+        await _settle(registry)
+        return registry.read_pointer()
+
+    pointer = asyncio.run(scenario())
+    assert registry.current.version == "v1" and pointer == {**pointer, "version": "v1", "previous": [BASE_VERSION]}
+    assert registry.stats["activations"] == 2 and registry.stats["rollbacks"] == 1
+    assert swapped == [BASE_VERSION, "v1", "v2", "v1"]
+    with pytest.raises(ModelRegistryError) as missing:
+        registry.activate("v9")
+    assert missing.value.status == 404
+    # A restarted worker comes back on the active version
+    restarted = _registry(tmp_path)
+    restarted.load_initial()
+    assert restarted.current.version == "v1"
+
+def test_failed_version_never_replaces_the_current_one_and_others_follow(tmp_path):
+    _version(tmp_path, "v1")
+    _version(tmp_path, "bad", broken=True)
+    registry = _registry(tmp_path)
+    follower = _registry(tmp_path, poll_s=0.01)
+    registry.load_initial()
+    follower.load_initial()
+
+    async def scenario():
+        follower.start()
+        registry.activate("bad")
+        await _settle(registry)
+        assert registry.current.version == BASE_VERSION and registry.last_error["version"] == "bad"
+        assert registry.read_pointer() == {}
+
+        registry.activate("v1")
+        await _settle(registry)
+        for _ in range(200):
+            if follower.current.version == "v1":
+                break
+            await asyncio.sleep(0.005)
+        follower.stop()
+
+    asyncio.run(scenario())
+    assert registry.stats["failed"] == 1 and follower.current.version == "v1" and follower.stats["followed"] == 1
+
+def test_base_model_uses_the_temperature_exported_next_to_it(tmp_path, monkeypatch):
+    from app.core.model_loader import settings, load_base, TEMPERATURE_CALIBRATION
+    student = tmp_path / "student"
+    student.mkdir()
+    with open(settings.model_path, "rb") as src, open(student / "plant_disease_model.h5", "wb") as dst:
+        dst.write(src.read())
+    monkeypatch.setattr(settings, "model_path", str(student / "plant_disease_model.h5"))
+    assert load_base().temperature == TEMPERATURE_CALIBRATION
+    (student / "calibration.json").write_text(json.dumps({"temperature": 1.2}))
+    assert load_base().temperature == 1.2
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import cv2
+import numpy as np
+import pytest
+from app.core.pipeline import Pipeline, Stage, StageRejected, build_pipeline, parse_overrides
+from app.core.stages import enhance_clahe, split_label
+from app.utils.buffer_pool import BufferPool
+
+def _threads(log):
+    def fn(ctx):
+        log.append(threading.get_ident())
+        return {"n": ctx.get("n", 0) + 1}
+    return fn
+
+def test_graph_is_validated_at_build_time():
+    with pytest.raises(ValueError, match="requires tensor"):
+        Pipeline([Stage("infer", "x", lambda ctx: None, requires=("tensor",))], inputs=("image_bytes",))
+    with pytest.raises(ValueError, match="No infer stage variant"):
+        build_pipeline("legacy", {"infer": "missing"})
+    assert parse_overrides("validate=ood, calibrate=none") == {"validate": "ood", "calibrate": None}
+    with pytest.raises(ValueError):
+        parse_overrides("colour=red")
+
+def test_blocking_stages_share_one_threadpool_hop_and_resources_span_their_users():
+    hops, events = [], []
+
+    @contextmanager
+    def lease():
+        events.append("acquire")
+        yield "buffers"
+        events.append("release")
+
+    def uses_buffers(ctx):
+        assert ctx["buffers"] == "buffers"
+        events.append("use")
+
+    def after(ctx):
+        events.append("after:" + ("held" if "buffers" in ctx else "free"))
+        return {"done": True}
+
+    stages = [Stage("decode", "a", _threads(hops), provides=("n",), blocking=True),
+              Stage("validate", "a", _threads(hops), requires=("n",), provides=("n",), blocking=True),
+              Stage("enhance", "a", uses_buffers, requires=("buffers",), blocking=True),
+              Stage("score", "a", after, provides=("done",))]
+    pipeline = Pipeline(stages, resources={"buffers": lease})
+    ctx = asyncio.run(pipeline.run({}))
+
+    assert ctx["n"] == 2 and ctx["done"]
+    assert len(set(hops)) == 1 and hops[0] != threading.get_ident()
+    assert events == ["acquire", "use", "release", "after:free"]
+    assert list(ctx.timings) == ["decode", "validate", "enhance", "score"]
+    assert "enhance;dur=" in ctx.server_timing()
+    assert pipeline.snapshot()["timing_ms"]["decode"]["calls"] == 1
+
+def test_rejection_stops_the_run_and_releases_resources():
+    released = []
+
+    @contextmanager
+    def lease():
+        yield object()
+        released.append(True)
+
+    def reject(ctx):
+        raise StageRejected("NOT_A_PLANT", "no leaf", details={"green_ratio": 0.0})
+
+    pipeline = Pipeline([Stage("validate", "a", reject, requires=("buffers",)),
+                         Stage("score", "a", lambda ctx: {"x": 1})], resources={"buffers": lease})
+    with pytest.raises(StageRejected) as info:
+        asyncio.run(pipeline.run({}))
+    assert info.value.code == "NOT_A_PLANT" and info.value.status == 422
+    assert released == [True]
+
+def test_profiles_share_stages_and_can_skip_them():
+    pool = BufferPool(64)
+    leaf = np.zeros((128, 128, 3), dtype=np.uint8)
+    cv2.randu(leaf, 0, 255)
+    leaf[..., 1] = 180
+    inputs = {"image_bytes": cv2.imencode(".png", leaf)[1].tobytes()}
+
+    for profile in ("legacy", "production"):
+        pipeline = build_pipeline(profile, {"validate": None}, inputs=("image_bytes",),
+                                  resources={"buffers": pool.lease}, until="quality")
+        assert pipeline.describe()[:2] == ["decode:opencv", "enhance:" + ("clahe" if profile == "legacy" else "full")]
+        ctx = pipeline.run_sync(inputs)
+        assert ctx["tensor"].shape == (1, 64, 64, 3) and "blur_score" in ctx["metrics"]
+        assert "validate" not in ctx.timings
+
+    blurry = build_pipeline("legacy", {"validate": None}, {"blur_threshold": 1e9}, inputs=("image_bytes",),
+                            resources={"buffers": pool.lease}, until="quality")
+    with pytest.raises(StageRejected, match="blurry"):
+        blurry.run_sync(inputs)
+    assert pool.snapshot()["idle"] == 1
+
+def test_legacy_clahe_stage_is_thread_safe():
+    pool = BufferPool(64, max_idle=8)
+    rng = np.random.default_rng(0)
+    leaves = [rng.integers(0, 256, (120, 160, 3), dtype=np.uint8) for _ in range(100)]
+
+    def scan(leaf):
+        with pool.lease() as buffers:
+            return enhance_clahe({"image": leaf.copy(), "buffers": buffers})["tensor"].copy()
+
+    serial = [scan(leaf) for leaf in leaves]
+    with ThreadPoolExecutor(8) as executor:
+        assert all(np.array_equal(a, b) for a, b in zip(serial, executor.map(scan, leaves)))
+
+def test_split_label():
+    assert split_label("Corn_(maize)___Common_rust_") == ("Corn (maize)", "Common rust ")
+    assert split_label("mystery") == ("Unknown Crop Type", "mystery")
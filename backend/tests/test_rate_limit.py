@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from fastapi import HTTPException, Request
+from app.core.rate_limit import MemoryBucketStore, MmapBucketStore, RedisBucketStore, RateLimiter, RateLimitExceeded, parse_rate
+from tools.fake_redis import start_in_thread
+
+def test_parse_rate():
+    assert parse_rate("30/minute") == (30.0, 0.5)
+    assert parse_rate("5/hours") == (5.0, 5 / 3600)
+
+def test_mmap_buckets_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "buckets.bin")
+    worker_a, worker_b = MmapBucketStore(path, slots=64), MmapBucketStore(path, slots=64)
+    results = [store.take("client", 4, 4 / 60, 1)[0] for store in (worker_a, worker_b) * 3]
+    assert results == [True, True, True, True, False, False]
+
+def test_weighted_cost_and_oversized_batches():
+    store = MemoryBucketStore()
+    assert store.take("client", 10, 10 / 60, 7) == (True, 0.0)
+    allowed, retry_after = store.take("client", 10, 10 / 60, 7)
+    assert not allowed and retry_after == pytest.approx(24, rel=0.01)
+    assert store.take("other", 10, 10 / 60, 11)[1] == float("inf")
+
+def test_redis_store_against_stand_in():
+    fake, port = start_in_thread()
+    limiter = RateLimiter(RedisBucketStore(f"redis://127.0.0.1:{port}/0"))
+
+    async def scenario():
+        await limiter.hit("predict", "1.2.3.4", "3/minute", cost=2)
+        with pytest.raises(RateLimitExceeded):
+            await limiter.hit("predict", "1.2.3.4", "3/minute", cost=2)
+        await limiter.hit("predict", "5.6.7.8", "3/minute", cost=2)
+
+    asyncio.run(scenario())
+    assert len(fake.buckets) == 2
+
+def test_memory_store_keeps_most_recent_buckets():
+    store = MemoryBucketStore(max_keys=3)
+    for client in ("a", "b", "c"):
+        store.take(client, 2, 2 / 60, 2)
+    store.take("a", 2, 2 / 60, 1)  # Touching "a" makes "b" the oldest
+    store.take("d", 2, 2 / 60, 1)
+    assert len(store) == 3
+    assert store.take("a", 2, 2 / 60, 1)[0] is False  # Kept, and still empty
+    assert store.take("b", 2, 2 / 60, 2)[0] is True  # Dropped, so it starts full again
+
+def test_scope_has_one_rate():
+    limiter = RateLimiter(MemoryBucketStore())
+
+    @limiter.limit("10/minute", scope="scan")
+    async def single(request):
+        return "ok"
+
+    with pytest.raises(ValueError):
+        limiter.limit("30/minute", scope="scan")(single)
+
+def test_oversized_batch_is_rejected_before_any_token_is_taken():
+    store = MemoryBucketStore()
+    limiter = RateLimiter(store)
+    request = Request({"type": "http", "client": ("1.2.3.4", 0), "headers": []})
+
+    @limiter.limit("5/minute", scope="batch")
+    @limiter.limit("10/minute", scope="scan", cost=lambda kwargs: len(kwargs["files"]))
+    async def batch(request, files):
+        return len(files)
+
+    async def scenario():
+        with pytest.raises(HTTPException) as exc:
+            await batch(request=request, files=list(range(11)))
+        assert exc.value.status_code == 413 and exc.value.detail["code"] == "REQUEST_TOO_LARGE"
+        assert len(store) == 0
+        assert await batch(request=request, files=list(range(10))) == 10
+        with pytest.raises(RateLimitExceeded) as exc:
+            await batch(request=request, files=[1])
+        assert exc.value.scope == "scan"
+
+    asyncio.run(scenario())
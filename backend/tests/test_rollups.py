@@ -0,0 +1,57 @@
+import asyncio
+from app.core.rollups import RollupStore, trend
+
+DAY = 86400
+
+class Clock:
+    def __init__(self, now: float = 100 * DAY):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_pending_and_flushed_deltas_read_the_same(tmp_path):
+    clock = Clock()
+    store = RollupStore(str(tmp_path / "r.sqlite3"), clock=clock)
+    store.record(40.0, "Tomato", "Early blight", "Mid Stage", field_id="f1", region="north")
+    store.record(20.0, "Tomato", "healthy", "None", field_id="f1")
+    before = store.series("field", "f1", days=7)
+    assert store.flush() == 4  # all, crop, field, region rows of today's bucket
+    after = store.series("field", "f1", days=7)
+    assert before == after
+    assert after["summary"]["scans"] == 2 and after["summary"]["risk_mean"] == 30.0 and after["summary"]["risk_max"] == 40.0
+    assert after["summary"]["diseases"] == {"Early blight": 1, "healthy": 1}
+    assert store.series("region", "north")["summary"]["scans"] == 1
+
+    # A second process flushing into the same file adds to the rows instead of replacing them
+    other = RollupStore(str(tmp_path / "r.sqlite3"), clock=clock)
+    other.record(60.0, "Tomato", "Early blight", "Advanced Stage", field_id="f1")
+    other.flush()
+    summary = store.series("field", "f1")["summary"]
+    assert summary["scans"] == 3 and summary["progression"]["Advanced Stage"] == 1
+
+def test_trend_over_daily_buckets(tmp_path):
+    clock = Clock()
+    store = RollupStore(str(tmp_path / "r.sqlite3"), clock=clock)
+    for day, risk in enumerate([10.0, 20.0, 30.0, 45.0]):
+        clock.now = (100 + day) * DAY + 3600
+        store.record(risk, "Corn", "Common rust", "Mid Stage", field_id="worse")
+        store.record(50.0 - risk, "Corn", "Common rust", "Mid Stage", field_id="better")
+        store.record(25.0, "Corn", "healthy", "None", field_id="flat")
+    store.flush()
+    directions = {r["key"]: r["trend"] for r in store.ranking("field", days=7)}
+    assert directions == {"worse": "worsening", "better": "improving", "flat": "stable"}
+    assert [r["key"] for r in store.ranking("field", days=7)] == ["worse", "flat", "better"]  # Highest mean risk first
+    assert store.series("field", "worse", days=7, buckets_per_point=2)["series"][-1]["scans"] == 2
+    assert trend([(0, 50.0, 1)])["direction"] == "insufficient_data"
+
+def test_stop_flushes_what_is_pending(tmp_path):
+    store = RollupStore(str(tmp_path / "r.sqlite3"), flush_interval_s=60)
+
+    async def scenario():
+        await store.start()
+        store.record(12.0, "Apple", "Apple scab", "Early Stage")
+        await store.stop()
+
+    asyncio.run(scenario())
+    assert store.snapshot()["pending_rows"] == 0 and store.snapshot()["flushes"] == 1
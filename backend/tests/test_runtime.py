@@ -0,0 +1,38 @@
+import pytest
+from app.core.runtime import cgroup_cpu_limit, detect_cpus, plan_layout
+
+def test_cgroup_quota_v2_and_v1(tmp_path):
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert cgroup_cpu_limit(str(tmp_path)) == 2.5
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert cgroup_cpu_limit(str(tmp_path)) is None
+
+    v1 = tmp_path / "v1"
+    (v1 / "cpu").mkdir(parents=True)
+    (v1 / "cpu" / "cpu.cfs_quota_us").write_text("300000")
+    (v1 / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    assert cgroup_cpu_limit(str(v1)) == 3.0
+    assert cgroup_cpu_limit(str(tmp_path / "missing")) is None
+
+def test_quota_caps_effective_cores(tmp_path):
+    (tmp_path / "cpu.max").write_text("50000 100000\n")
+    assert detect_cpus(str(tmp_path))["effective"] == 1
+
+@pytest.mark.parametrize("profile", ["latency", "throughput"])
+@pytest.mark.parametrize("cores", [1, 2, 6, 16, 64])
+def test_layout_never_oversubscribes(profile, cores):
+    cpus = {"logical": cores, "affinity": list(range(cores)), "cgroup_quota": None, "effective": cores}
+    layout = plan_layout(profile, cpus, max_workers=4)
+    assert layout["workers"] * layout["inference_slots"] * layout["intra_op_threads"] <= cores
+    assert layout["inference_slots"] * layout["cv2_threads"] <= layout["cores_per_worker"]
+    pinned = [c for group in layout["worker_cores"] for c in group]
+    assert len(pinned) == len(set(pinned)) and len(layout["worker_cores"]) == layout["workers"]
+
+def test_profiles_trade_workers_for_threads():
+    cpus = {"logical": 16, "affinity": list(range(16)), "cgroup_quota": None, "effective": 16}
+    latency = plan_layout("latency", cpus)
+    throughput = plan_layout("throughput", cpus, max_workers=8)
+    assert (latency["workers"], latency["intra_op_threads"], latency["inference_slots"]) == (1, 8, 2)
+    assert (throughput["workers"], throughput["intra_op_threads"], throughput["inference_slots"]) == (8, 1, 2)
+    with pytest.raises(ValueError):
+        plan_layout("fastest", cpus)
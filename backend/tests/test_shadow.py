@@ -0,0 +1,101 @@
+import asyncio
+import numpy as np
+from app.core.admission import AdmissionController
+from app.core.explain import ScanTensorCache
+from app.core.model_registry import ModelBundle
+from app.core.pipeline import PipelineContext
+from app.core.shadow import ShadowEvaluator
+
+LABELS = {"0": "Tomato___healthy", "1": "Tomato___Early_blight"}
+
+class Candidate:
+    """Says class 1 for bright inputs, class 0 otherwise."""
+
+    def predict(self, x, verbose=0):
+        p1 = (x.mean(axis=(1, 2, 3)) > 0).astype(np.float32) * 0.8 + 0.1
+        return np.stack([1.0 - p1, p1], axis=1)
+
+class Primary:
+    """Says class 1 for inputs above 0.3, class 0 otherwise, both at 0.7."""
+
+    def predict(self, x, verbose=0):
+        p1 = np.where(x.mean(axis=(1, 2, 3)) > 0.3, 0.7, 0.3)
+        return np.stack([1.0 - p1, p1], axis=1)
+
+def _scan(cache, scan_id, value, class_idx, version=None):
+    cache.put(scan_id, np.full((1, 8, 8, 3), value, dtype=np.float32), class_idx, "x", version)
+    ctx = PipelineContext({"scan_id": scan_id, "class_idx": class_idx, "confidence": 0.7}, {})
+    ctx.timings["infer"] = 40.0
+    return ctx
+
+def test_try_acquire_only_takes_free_slots_and_leaves_the_limit_alone():
+    admission = AdmissionController(initial_limit=1, max_limit=1)
+    ewma = admission.ewma_service_s
+    assert admission.try_acquire() and not admission.try_acquire()
+    admission.release()
+    assert admission.in_flight == 0 and admission.ewma_service_s == ewma
+
+def test_mirrored_scans_are_compared_in_one_batch_and_dropped_under_load():
+    cache = ScanTensorCache()
+    admission = AdmissionController(initial_limit=1, max_limit=1)
+    shadow = ShadowEvaluator(cache, lambda: Candidate(), lambda version: Primary(), admission, LABELS, sample_rate=1.0, batch_max=8,
+                             idle_wait_s=0.01)
+
+    async def scenario():
+        # The served class is not what is compared: both models are re-scored on the same input
+        for scan_id, value, class_idx in (("a", 0.5, 1), ("b", -0.5, 0), ("c", 0.2, 0)):
+            shadow.observe(_scan(cache, scan_id, value, class_idx))
+        shadow.observe(PipelineContext({"scan_id": "x"}, {}), RuntimeError("rejected"))  # Failed runs are not mirrored
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if shadow.stats["evaluated"] == 3:
+                break
+
+        # A busy server: the candidate never gets a slot and the queue ages out
+        assert admission.try_acquire()
+        shadow.max_age_s = 0.05
+        shadow.observe(_scan(cache, "d", 0.5, 1))
+        await asyncio.sleep(0.2)
+        admission.release()
+
+    asyncio.run(scenario())
+    report = shadow.report()
+    assert report["batches"] == 1 and report["evaluated"] == 3 and report["mirrored"] == 4 and report["dropped_stale"] == 1
+    assert report["overall"]["agreement"] == round(2 / 3, 4)
+    assert report["per_class"]["Tomato___healthy"]["scans"] == 2 and report["per_class"]["Tomato___Early_blight"]["agreement"] == 1.0
+    assert report["top_disagreements"] == [{"primary": "Tomato___healthy", "candidate": "Tomato___Early_blight", "scans": 1}]
+    assert abs(report["per_class"]["Tomato___Early_blight"]["mean_confidence_delta"] - 0.2) < 1e-4
+
+def test_each_scan_is_compared_with_the_labels_and_temperature_it_ran_with():
+    cache = ScanTensorCache()
+    admission = AdmissionController(initial_limit=1, max_limit=1)
+    seen = []
+
+    def calibrate(probs, temperature):
+        seen.append(temperature)
+        return probs
+
+    primaries = {"v1": Primary(), "v2": Primary()}  # "v0" was unloaded before its scan was evaluated
+    shadow = ShadowEvaluator(cache, lambda: Candidate(), primaries.get, admission, sample_rate=1.0, calibrate=calibrate,
+                             idle_wait_s=0.01)
+    renamed = ModelBundle("v2", None, {"0": "Potato___healthy", "1": "Potato___Late_blight"}, temperature=2.0)
+
+    async def scenario():
+        old = _scan(cache, "a", 0.5, 1, "v1")
+        old["bundle"] = ModelBundle("v1", None, LABELS, temperature=1.5)
+        shadow.observe(old)
+        new = _scan(cache, "b", 0.5, 1, "v2")  # Scored after a hot swap to a model with other labels
+        new["bundle"] = renamed
+        shadow.observe(new)
+        gone = _scan(cache, "c", 0.5, 1, "v0")
+        gone["bundle"] = ModelBundle("v0", None, LABELS)
+        shadow.observe(gone)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if shadow.stats["evaluated"] + shadow.stats["dropped_unloaded"] == 3:
+                break
+
+    asyncio.run(scenario())
+    # Primary and candidate rows alike, with the temperature of the scan's own bundle
+    assert sorted(seen) == [1.5, 1.5, 2.0, 2.0] and shadow.stats["dropped_unloaded"] == 1
+    assert set(shadow.report()["per_class"]) == {"Tomato___Early_blight", "Potato___Late_blight"}
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from app.core.shared_weights import MappedModel, load_centroids, tflite_paths
+
+def test_centroids_are_mapped_read_only_and_shape_checked(tmp_path):
+    path = str(tmp_path / "centroids.npy")
+    np.save(path, np.arange(6, dtype=np.float32).reshape(2, 3))
+    centroids = load_centroids(path, 2, 3)
+    assert isinstance(centroids, np.memmap) and not centroids.flags.writeable
+    with pytest.raises(RuntimeError):
+        load_centroids(path, 3, 3)
+
+def test_missing_export_names_the_tool(tmp_path):
+    model, features = tflite_paths(str(tmp_path / "plant_disease_model.h5"))
+    assert features.endswith("plant_disease_model_features.tflite")
+    with pytest.raises(FileNotFoundError, match="export_tflite"):
+        MappedModel(model)
@@ -0,0 +1,78 @@
+import numpy as np
+from app.core.similar_cases import IVFInt8Index, CaseStore
+
+def _clustered(n: int, dim: int = 64, clusters: int = 20, seed: int = 0, latent: int = 16):
+    """Clusters on a `latent`-dimensional subspace, like CNN embeddings (and unlike isotropic noise)."""
+    basis = np.random.default_rng(42).standard_normal((latent, dim))
+    rng = np.random.default_rng(seed)
+    centers = np.random.default_rng(7).standard_normal((clusters, latent))
+    labels = rng.integers(0, clusters, n)
+    vectors = (centers[labels] + 0.3 * rng.standard_normal((n, latent))) @ basis
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32), labels
+
+def test_ivf_int8_recall_against_exact_search():
+    vectors, _ = _clustered(4000)
+    index = IVFInt8Index(64, code_dim=32, nlist=32, nprobe=4)
+    index.train(vectors)
+    index.add(np.arange(len(vectors)), vectors)
+    assert index.trained and len(index) == 4000 and index.nbytes() == 4000 * (32 + 12)
+
+    queries, _ = _clustered(50, seed=1)
+    hits = 0
+    for q in queries:
+        exact = set(np.argsort(-(vectors @ q))[:10])
+        ids, scores = index.search(q, 10)
+        hits += len(exact & set(ids.tolist()))
+        assert np.all(np.diff(scores) <= 0)
+    assert hits / 500 > 0.8
+
+def test_case_log_confirmations_and_knn_signal(tmp_path):
+    vectors, labels = _clustered(60, dim=32, clusters=3)
+    store = CaseStore(str(tmp_path / "cases.sqlite3"), dim=32, code_dim=16, nlist=4, train_min=1000)
+    assert not store.add("zeros", np.zeros(32), 0, 0.9)  # Feature-less scans are not indexed
+    for i, (v, label) in enumerate(zip(vectors, labels)):
+        store.add(f"s{i}", v, int(label), 0.9)
+    assert store.similar(vectors[0], confirmed_only=False) == []  # Searchable only once flushed
+    store.flush()
+    assert store.snapshot()["indexed"] == 60 and not store.index.trained
+
+    nearest = store.similar(store.embedding("s0"), k=3, confirmed_only=False, exclude="s0")
+    assert len(nearest) == 3 and all(c["class_idx"] == labels[0] for c in nearest)
+    assert store.similar(vectors[0], confirmed_only=True) == []
+
+    same = [i for i in range(1, 60) if labels[i] == labels[0]][:4]
+    for i in same:
+        assert store.confirm(f"s{i}", (int(labels[0]) + 1) % 3)
+    assert not store.confirm("missing", 0)
+    store.flush()
+    confirmed = store.similar(vectors[0], k=10)
+    assert {c["scan_id"] for c in confirmed} == {f"s{i}" for i in same} and all(c["confirmed"] for c in confirmed)
+
+    signal = store.knn_signal(vectors[0], int(labels[0]), k=4)
+    assert signal["knn_support"] == 4 and signal["knn_agreement"] == 0.0 and signal["knn_similarity"] > 0.5
+
+    # A second worker catches up from the same log, confirmations included
+    other = CaseStore(str(tmp_path / "cases.sqlite3"), dim=32, code_dim=16, nlist=4, train_min=50)
+    other.sync()
+    assert other.index.trained and len(other.index) == 60 and other.snapshot()["confirmed"] == 4
+
+def test_only_scans_of_the_indexed_model_version_are_searched(tmp_path):
+    vectors, labels = _clustered(40, dim=32, clusters=2)
+    store = CaseStore(str(tmp_path / "cases.sqlite3"), dim=32, code_dim=16, nlist=4, train_min=1000, version="v1")
+    for i in range(20):
+        store.add(f"a{i}", vectors[i], int(labels[i]), 0.9)
+    # A model with a different embedding size, swapped in while v1 scans are still logged
+    store.add("b0", np.ones(48), 0, 0.9, version="v2")
+    store.flush()
+    assert len(store.index) == 20 and store.case("b0")[1] == "v2"
+
+    store.use_version("v2", 48)
+    assert store.version == "v1"  # Switched on the next sync, off the request path
+    store.flush()
+    assert store.version == "v2" and store.dim == 48 and len(store.index) == 1
+    assert store.similar(np.ones(48), confirmed_only=False)[0]["scan_id"] == "b0"
+    assert not store.add("b1", np.ones(32), 0, 0.9)  # Wrong size for the indexed version
+
+    store.use_version("v1", 32)
+    store.flush()
+    assert len(store.index) == 20 and store.similar(vectors[0], k=1, confirmed_only=False)[0]["scan_id"].startswith("a")
@@ -0,0 +1,38 @@
+import asyncio
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from app.utils.tensor_codec import decode_tensor_upload, encode_tensor_upload, normalize_tensors, read_tensor_body
+
+def test_roundtrip_and_bgr_order():
+    rgb = np.random.default_rng(0).integers(0, 256, size=(2, 8, 8, 3), dtype=np.uint8)
+    images, dtype = decode_tensor_upload(encode_tensor_upload(rgb), expected_size=8, max_count=4)
+    assert dtype == "uint8" and np.array_equal(images, rgb)
+    images, _ = decode_tensor_upload(encode_tensor_upload(rgb[..., ::-1], order="BGR"), expected_size=8, max_count=4)
+    assert np.array_equal(images, rgb)
+    # Matches resize_and_normalize's (x / 127.5) - 1 scaling
+    assert np.allclose(normalize_tensors(images), rgb / 127.5 - 1.0, atol=1e-6)
+
+def test_rejects_wrong_shape_count_and_truncation():
+    body = encode_tensor_upload(np.zeros((3, 8, 8, 3), dtype=np.float16))
+    for kwargs in ({"expected_size": 16, "max_count": 4}, {"expected_size": 8, "max_count": 2}):
+        with pytest.raises(HTTPException) as exc:
+            decode_tensor_upload(body, **kwargs)
+        assert exc.value.detail["code"] == "INVALID_FORMAT"
+    with pytest.raises(HTTPException):
+        decode_tensor_upload(body[:-2], expected_size=8, max_count=4)
+
+def test_streamed_body_stops_past_the_largest_valid_upload():
+    async def chunked(body, size=5):
+        for i in range(0, len(body), size):
+            yield body[i:i + size]
+
+    body = encode_tensor_upload(np.zeros((2, 4, 4, 3), dtype=np.uint8))
+    assert asyncio.run(read_tensor_body(chunked(body), 4, max_count=2)) == body
+    # A uint8 body is capped at half the float16 size, whatever the header claims
+    for oversized in (encode_tensor_upload(np.zeros((3, 4, 4, 3), dtype=np.uint8)), body + b"\0" * 200):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(read_tensor_body(chunked(oversized), 4, max_count=2))
+        assert exc.value.status_code == 413
+    half = encode_tensor_upload(np.zeros((2, 4, 4, 3), dtype=np.float16))
+    assert asyncio.run(read_tensor_body(chunked(half, 1), 4, max_count=2)) == half
@@ -0,0 +1,27 @@
+import numpy as np
+from app.core.tiling import plan_tiles, prepare_field_tiles, aggregate_field
+
+def test_tiles_cover_the_image_with_overlap():
+    tiles = plan_tiles(700, 1200, tile_px=512, overlap=0.25)
+    assert {side for _, _, side in tiles} == {512}
+    assert max(y + s for y, _, s in tiles) == 700 and max(x + s for _, x, s in tiles) == 1200
+    assert sorted({x for _, x, _ in tiles}) == [0, 384, 688]
+
+def test_background_tiles_are_dropped_and_capped():
+    rng = np.random.default_rng(0)
+    image = np.full((512, 1536, 3), 200, dtype=np.uint8)  # grey background
+    # Textured green leaf in the left third only
+    image[:, :512] = np.stack([rng.integers(0, 60, (512, 512)), rng.integers(90, 200, (512, 512)), rng.integers(0, 60, (512, 512))], axis=-1)
+    batch, records, counts = prepare_field_tiles(image, tile_px=256, overlap=0.0, min_plant_ratio=0.2, max_tiles=3, input_size=32)
+    assert counts["tiles_total"] == 12 and counts["skipped_background"] == 8 and counts["skipped_over_cap"] == 1
+    assert batch.shape == (3, 32, 32, 3) and all(r["box"][0] < 512 for r in records)
+
+def test_confident_diseased_tiles_drive_the_verdict():
+    def pred(disease, confidence):
+        return {"crop": "Tomato", "disease": disease, "confidence": confidence}
+    predictions = [pred("healthy", 0.95), pred("healthy", 0.9), pred("Early blight", 0.8), pred("Late blight", 0.4)]
+    records = [{"plant_coverage": 1.0, "metrics": {"lesion_density_percent": 20.0}} for _ in predictions]
+    verdict = aggregate_field(predictions, records)
+    assert verdict["disease"] == "Early blight" and verdict["representative_tile"] == 2
+    assert verdict["diseased_tiles"] == 1 and verdict["uncertain_tiles"] == 1
+    assert verdict["affected_fraction"] == 0.25 and verdict["lesion_load"] == 0.04
@@ -0,0 +1,136 @@
+"""
+Builds the precompiled advisory bundle: one validated advisory per class label x language.
+
+    GEMINI_API_KEY=... python -m tools.build_advisory_bundle [--labels models/class_labels.json]
+        [--output models/advisory_bundle.lsab] [--languages en,hi] [--concurrency 4] [--offline] [--rebuild]
+
+Entries already in an existing bundle are reused unless --rebuild is given, so an interrupted or
+partially failed build can simply be re-run. English advisories for labels in
+gemini_service.ADVISORY_TEMPLATES and healthy classes are written without calling the LLM.
+Anything that fails schema validation is left out and reported; at request time those
+class/language pairs fall back to the LLM.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from pydantic import ValidationError
+from app.config import get_settings
+from app.schemas.response import AIAnalysis
+from app.gemini_client import analyze_with_gemini
+from app.services.gemini_service import ADVISORY_TEMPLATES
+from app.services.advisory_bundle import AdvisoryBundle, LANGUAGES, label_key, write_bundle
+
+HEALTHY_ADVISORY = {
+    "disease_name": "Healthy",
+    "severity": "None",
+    "cause": "No disease detected.",
+    "immediate_action": "No action required.",
+    "treatment_plan": [],
+    "prevention": "Continue current watering and fertilizing schedules. Monitor for future anomalies.",
+    "estimated_crop_loss_risk": "Low",
+    "consult_expert": False
+}
+
+def validate(advisory: dict) -> dict:
+    """Schema check; returns the advisory reduced to the AIAnalysis fields."""
+    return AIAnalysis(**advisory).model_dump()
+
+def seed_advisory(label: str, language: str):
+    if language != "en":
+        return None
+    if label in ADVISORY_TEMPLATES:
+        return ADVISORY_TEMPLATES[label]
+    if label.partition("___")[2].strip("_").lower() == "healthy":
+        return HEALTHY_ADVISORY
+    return None
+
+async def generate(label: str, language: str, semaphore: asyncio.Semaphore, retries: int = 2):
+    crop, _, disease = label.partition("___")
+    prediction = {"crop": crop.replace("_", " "), "disease": disease.replace("_", " "), "confidence": 1.0}
+    error = None
+    for attempt in range(retries + 1):
+        async with semaphore:
+            advisory = await analyze_with_gemini(prediction, language)
+        if advisory.get("advisory_valid"):
+            try:
+                return validate(advisory), None
+            except ValidationError as e:
+                error = f"schema: {e.errors()[0]['loc']} {e.errors()[0]['msg']}"
+        else:
+            error = advisory.get("error") or ("unparseable JSON" if advisory.get("parse_error") else "missing keys")
+        await asyncio.sleep(2 ** attempt)
+    return None, error
+
+async def build(args) -> int:
+    with open(args.labels, encoding="utf-8") as f:
+        labels = sorted(set(json.load(f).values()))
+    languages = args.languages.split(",") if args.languages else list(LANGUAGES)
+    unknown = [lang for lang in languages if lang not in LANGUAGES]
+    if unknown:
+        raise SystemExit(f"Unknown languages: {unknown}; choose from {list(LANGUAGES)}")
+
+    existing = {}
+    if os.path.exists(args.output) and not args.rebuild:
+        existing = {(key, lang): advisory for key, lang, advisory in AdvisoryBundle(args.output).items()}
+
+    advisories, todo, counts = {}, [], {"reused": 0, "seeded": 0, "generated": 0, "failed": 0}
+    for label in labels:
+        for language in languages:
+            key = (label_key(label), language)
+            if key in existing:
+                advisories[key] = existing[key]
+                counts["reused"] += 1
+            elif (seed := seed_advisory(label, language)) is not None:
+                advisories[key] = validate(seed)
+                counts["seeded"] += 1
+            else:
+                todo.append((label, language))
+
+    failures = []
+    if todo and args.offline:
+        failures = [(label, language, "skipped (--offline)") for label, language in todo]
+    elif todo:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        results = await asyncio.gather(*(generate(label, language, semaphore) for label, language in todo))
+        for (label, language), (advisory, error) in zip(todo, results):
+            if advisory is None:
+                failures.append((label, language, error))
+            else:
+                advisories[(label_key(label), language)] = advisory
+                counts["generated"] += 1
+    counts["failed"] = len(failures)
+
+    with open(args.labels, "rb") as f:
+        labels_sha256 = hashlib.sha256(f.read()).hexdigest()
+    meta = {
+        "bundle_version": args.version or time.strftime("%Y%m%d-%H%M%S"),
+        "created": int(time.time()),
+        "labels_sha256": labels_sha256,
+        "languages": languages,
+    }
+    write_bundle(args.output, advisories, meta)
+
+    print(f"Wrote {len(advisories)} advisories ({len(labels)} labels x {len(languages)} languages) to {args.output}")
+    print(" ".join(f"{k}={v}" for k, v in counts.items()))
+    for label, language, error in failures:
+        print(f"  missing {label} [{language}]: {error}", file=sys.stderr)
+    return 1 if failures and not args.offline else 0
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", default=settings.labels_path)
+    parser.add_argument("--output", default=settings.advisory_bundle_path)
+    parser.add_argument("--languages", help=f"Comma-separated subset of {','.join(LANGUAGES)}")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--version", help="Bundle version string (default: build timestamp)")
+    parser.add_argument("--offline", action="store_true", help="Only templates and reused entries, no LLM calls")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore entries in an existing bundle")
+    sys.exit(asyncio.run(build(parser.parse_args())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Exports a Keras model for MODEL_SHARING=mmap: the classifier and its feature extractor as
+float32 .tflite files next to it, which every worker maps instead of loading.
+
+    python -m tools.export_tflite [models/plant_disease_model.h5] [--input-size 224]
+
+Writes <stem>.tflite and <stem>_features.tflite (see app/core/shared_weights.py). The
+feature extractor ends at the last global pooling layer, as app/core/model_loader.py expects.
+Each is checked against the Keras model on random inputs before it replaces the previous
+export, so a failed check leaves the files workers map untouched.
+For a registry version, point it at <registry>/<version>/model.h5.
+"""
+import os
+import sys
+import argparse
+import numpy as np
+from app.config import get_settings
+from app.core.shared_weights import MappedModel, feature_layer, tflite_paths
+
+def convert(model, path: str, size: int, tolerance: float) -> float:
+    """Writes `path` only once the converted model matches `model`; a worker never maps a bad export."""
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)  # No quantization: outputs have to match Keras
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(converter.convert())
+    try:
+        diff = check(model, tmp, size, tolerance)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return diff
+
+def check(keras_model, path: str, size: int, tolerance: float) -> float:
+    x = np.random.default_rng(0).uniform(-1.0, 1.0, (4, size, size, 3)).astype(np.float32)
+    diff = float(np.abs(MappedModel(path).predict(x) - keras_model.predict(x, verbose=0)).max())
+    if diff > tolerance:
+        raise SystemExit(f"{path} differs from the Keras model by up to {diff:.2e} (tolerance {tolerance:.0e}); not exported")
+    return diff
+
+def main():
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", nargs="?", default=settings.model_path)
+    parser.add_argument("--input-size", type=int, default=settings.model_input_size)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    if not os.path.exists(args.model):
+        sys.exit(f"Model not found: {args.model}")
+    model = tf.keras.models.load_model(args.model)
+    features = tf.keras.Model(model.inputs, feature_layer(model).output)
+    for keras_model, path in zip((model, features), tflite_paths(args.model)):
+        diff = convert(keras_model, path, args.input_size, args.tolerance)
+        print(f"{path}: {os.path.getsize(path) / 2**20:.1f} MB, max |tflite - keras| = {diff:.2e}")
+
+if __name__ == "__main__":
+    main()
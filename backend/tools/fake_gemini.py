@@ -0,0 +1,193 @@
+"""
+Local stand-in for the Gemini API, for load tests and failure drills.
+
+    python -m tools.fake_gemini --port 8089 [--latency-ms 900 --latency-sigma 0.6]
+        [--error-rate 0.02] [--malformed-rate 0.02] [--fenced-rate 0.3]
+        [--burst-every 60 --burst-length 5] [--seed 0]
+
+Point the backend at it with GEMINI_API_BASE=http://127.0.0.1:8089/v1beta (any GEMINI_API_KEY).
+app/gemini_client.py uses it directly. gemini_service.py switches the SDK to its REST transport
+whenever GEMINI_API_BASE is set.
+
+Serves models/{model}:generateContent and :streamGenerateContent. Streaming works both as SSE
+(?alt=sse) and as a JSON array, which is what the SDK's REST transport reads. Answers are
+well-formed advisories for the crop/disease named in the prompt. A seeded random draw can turn
+any answer into one of the following:
+  - a 500 / 503 error
+  - truncated JSON
+  - JSON wrapped in a ```json fence
+  - a 429 RESOURCE_EXHAUSTED, for every request inside a burst window
+Latency is lognormal around --latency-ms; streamed answers spread it over the chunks.
+GET /stats returns the counters. POST /stats/reset clears them.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SEVERITIES = ["Low", "Medium", "High", "Critical"]
+
+class FakeGemini:
+    def __init__(self, latency_ms: float = 900.0, latency_sigma: float = 0.6, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, fenced_rate: float = 0.3, burst_every_s: float = 0.0,
+                 burst_length_s: float = 0.0, chunk_chars: int = 40, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.fenced_rate = fenced_rate
+        self.burst_every_s = burst_every_s
+        self.burst_length_s = burst_length_s
+        self.chunk_chars = chunk_chars
+        self.rng = random.Random(seed)
+        self.started = time.monotonic()
+        self.stats = Counter()
+
+    def in_burst(self) -> bool:
+        if self.burst_every_s <= 0 or self.burst_length_s <= 0:
+            return False
+        return (time.monotonic() - self.started) % self.burst_every_s >= self.burst_every_s - self.burst_length_s
+
+    def latency_s(self) -> float:
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000.0
+        return self.rng.lognormvariate(0.0, self.latency_sigma) * self.latency_ms / 1000.0
+
+    @staticmethod
+    def advisory_for(prompt: str) -> dict:
+        # Both prompt styles: "DETECTED: Tomato with Early blight at" and "Detected Crop: / Detected Disease:"
+        match = (re.search(r"DETECTED: (.+?) with (.+?) at ", prompt)
+                 or re.search(r"Detected Crop: (.+)\n\s*- Detected Disease: (.+)", prompt))
+        crop, disease = (g.strip() for g in match.groups()) if match else ("Unknown", "Unknown")
+        severity = SEVERITIES[sum(map(ord, disease)) % len(SEVERITIES)]
+        return {
+            "disease_name": f"{disease} ({crop})",
+            "immediate_action": f"Isolate affected {crop.lower()} plants and remove visibly infected leaves.",
+            "severity": severity,
+            "cause": f"Pathogen responsible for {disease.lower()}, favoured by humid conditions.",
+            "treatment_plan": ["Remove and destroy infected tissue.", "Apply a registered fungicide as per label.",
+                               "Improve airflow and avoid overhead irrigation."],
+            "prevention": "Rotate crops, use resistant varieties and keep foliage dry.",
+            "estimated_crop_loss_risk": "High" if severity in ("High", "Critical") else "Medium",
+            "consult_expert": severity == "Critical",
+        }
+
+    def outcome(self) -> str:
+        """Decides, once per request, what this answer will be."""
+        if self.in_burst():
+            return "rate_limited"
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            return "error"
+        roll -= self.error_rate
+        if roll < self.malformed_rate:
+            return "malformed"
+        roll -= self.malformed_rate
+        return "fenced" if roll < self.fenced_rate else "ok"
+
+    def answer_text(self, prompt: str, outcome: str) -> str:
+        text = json.dumps(self.advisory_for(prompt), ensure_ascii=False)
+        if outcome == "malformed":
+            return text[:len(text) * 2 // 3]
+        if outcome == "fenced":
+            return f"```json\n{text}\n```"
+        return text
+
+def _prompt(body: dict) -> str:
+    try:
+        return "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+    except AttributeError:
+        return ""
+
+def _candidate(text: str, finish: bool = True) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate], "usageMetadata": {"promptTokenCount": 120, "candidatesTokenCount": len(text) // 4}}
+
+def _error(code: int, status: str, message: str, headers: dict = None) -> JSONResponse:
+    return JSONResponse(status_code=code, content={"error": {"code": code, "message": message, "status": status}}, headers=headers)
+
+def create_app(fake: FakeGemini) -> FastAPI:
+    app = FastAPI(title="fake-gemini")
+
+    @app.get("/stats")
+    async def stats():
+        return {"in_burst": fake.in_burst(), **fake.stats}
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        fake.stats.clear()
+        return {"ok": True}
+
+    @app.post("/{version}/models/{model_method}")
+    async def generate(version: str, model_method: str, request: Request):
+        model, _, method = model_method.partition(":")
+        if method not in ("generateContent", "streamGenerateContent"):
+            return _error(404, "NOT_FOUND", f"Method {method!r} not found")
+        if not (request.query_params.get("key") or request.headers.get("x-goog-api-key")):
+            return _error(403, "PERMISSION_DENIED", "Method doesn't allow unregistered callers.")
+        body = await request.json()
+        outcome = fake.outcome()
+        fake.stats["requests"] += 1
+        fake.stats[f"{method}"] += 1
+        fake.stats[outcome] += 1
+
+        if outcome == "rate_limited":
+            return _error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).", {"Retry-After": "1"})
+        latency = fake.latency_s()
+        if outcome == "error":
+            await asyncio.sleep(latency / 4)
+            code = fake.rng.choice([500, 503])
+            return _error(code, "INTERNAL" if code == 500 else "UNAVAILABLE", "The service is currently unavailable.")
+
+        text = fake.answer_text(_prompt(body), outcome)
+        if method == "generateContent":
+            await asyncio.sleep(latency)
+            return JSONResponse(_candidate(text))
+
+        chunks = [text[i:i + fake.chunk_chars] for i in range(0, len(text), fake.chunk_chars)] or [""]
+        first_token_s = latency * 0.3
+        per_chunk_s = (latency - first_token_s) / max(len(chunks) - 1, 1)
+        sse = request.query_params.get("alt") == "sse"
+
+        async def stream():
+            await asyncio.sleep(first_token_s)
+            for i, chunk in enumerate(chunks):
+                payload = json.dumps(_candidate(chunk, finish=i == len(chunks) - 1), ensure_ascii=False)
+                if sse:
+                    yield f"data: {payload}\r\n\r\n"
+                else:
+                    yield ("[" if i == 0 else ",\r\n") + payload + ("]" if i == len(chunks) - 1 else "")
+                if i < len(chunks) - 1:
+                    await asyncio.sleep(per_chunk_s)
+
+        return StreamingResponse(stream(), media_type="text/event-stream" if sse else "application/json")
+
+    return app
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=900.0, help="Median response time")
+    parser.add_argument("--latency-sigma", type=float, default=0.6, help="Lognormal sigma; 0 for a fixed latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--fenced-rate", type=float, default=0.3)
+    parser.add_argument("--burst-every", type=float, default=0.0, help="Seconds between 429 bursts (0 = none)")
+    parser.add_argument("--burst-length", type=float, default=0.0, help="Seconds each burst lasts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    fake = FakeGemini(args.latency_ms, args.latency_sigma, args.error_rate, args.malformed_rate, args.fenced_rate,
+                      args.burst_every, args.burst_length, seed=args.seed)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Minimal RESP server standing in for Redis in tests and benchmarks.
+
+Understands just enough of the protocol for the rate limiter: PING, AUTH, SELECT,
+SCRIPT LOAD, EVAL/EVALSHA of the token-bucket script (executed in Python) and FLUSHALL.
+
+    python -m tools.fake_redis --port 6399
+"""
+import time
+import asyncio
+import hashlib
+import argparse
+import threading
+from app.core.rate_limit import REDIS_TOKEN_BUCKET, _take
+
+class FakeRedis:
+    def __init__(self):
+        self.buckets = {}
+        self.scripts = {hashlib.sha1(REDIS_TOKEN_BUCKET.encode()).hexdigest(): REDIS_TOKEN_BUCKET}
+        self.commands = 0
+
+    @staticmethod
+    def _bulk(value) -> bytes:
+        value = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _run_script(self, script: str, args) -> bytes:
+        if script != REDIS_TOKEN_BUCKET:
+            return b"-ERR fake redis only runs the rate limiter script\r\n"
+        key, capacity, refill, cost = args[1], float(args[2]), float(args[3]), float(args[4])
+        now = time.time()
+        tokens, last = self.buckets.get(key, (capacity, now))
+        allowed, tokens, _ = _take(tokens, last, now, capacity, refill, cost)
+        self.buckets[key] = (tokens, now)
+        return b"*2\r\n:%d\r\n%s" % (int(allowed), self._bulk(tokens))
+
+    def handle(self, parts) -> bytes:
+        self.commands += 1
+        cmd = parts[0].upper()
+        if cmd == "PING":
+            return b"+PONG\r\n"
+        if cmd in ("AUTH", "SELECT"):
+            return b"+OK\r\n"
+        if cmd == "FLUSHALL":
+            self.buckets.clear()
+            return b"+OK\r\n"
+        if cmd == "SCRIPT" and parts[1].upper() == "LOAD":
+            sha = hashlib.sha1(parts[2].encode()).hexdigest()
+            self.scripts[sha] = parts[2]
+            return self._bulk(sha)
+        if cmd == "EVALSHA":
+            if parts[1] not in self.scripts:
+                return b"-NOSCRIPT No matching script.\r\n"
+            return self._run_script(self.scripts[parts[1]], parts[2:])
+        if cmd == "EVAL":
+            return self._run_script(parts[1], parts[2:])
+        return b"-ERR unknown command '%s'\r\n" % cmd.encode()
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                parts = []
+                for _ in range(int(header[1:-2])):
+                    size = int((await reader.readline())[1:-2])
+                    parts.append((await reader.readexactly(size + 2))[:-2].decode())
+                writer.write(self.handle(parts))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6399) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._serve_client, host, port)
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 0):
+    """Runs a FakeRedis on a background event loop. Returns (fake, port)."""
+    fake = FakeRedis()
+    ready = threading.Event()
+    bound = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(fake.serve(host, port))
+        bound["port"] = server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait(5)
+    return fake, bound["port"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+
+    async def main():
+        server = await FakeRedis().serve(args.host, args.port)
+        print(f"Fake redis listening on {args.host}:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
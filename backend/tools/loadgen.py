@@ -0,0 +1,240 @@
+"""
+Open-loop load generator: replays an image corpus against the running app at a target rate.
+
+    python -m tools.loadgen --url http://127.0.0.1:8000 --rps 5 --duration 60
+        [--corpus data/loadtest] [--path /predict] [--language en]
+        [--fake-gemini http://127.0.0.1:8089] [--json report.json]
+
+--corpus is a directory of images. The first subdirectory level names each image's category,
+e.g. leaf/ and non_leaf/, and outcomes are broken down per category. Without --corpus, a
+small synthetic set of leaf and non-leaf images is generated.
+
+Arrivals are Poisson at --rps, or evenly spaced with --constant. They keep coming whether or
+not the server keeps up, so queueing shows up as latency and 503s instead of a slower client.
+
+The report covers:
+  - achieved throughput
+  - latency percentiles, overall and for 200s
+  - a breakdown of rejection codes (the X-Error-Code header or the "code" field of the body)
+  - advisory sources (bundle / llm / healthy / none). From these it computes the share of
+    advisories answered without the LLM.
+With --fake-gemini, the fake's counters are read before and after the run, which also gives
+the number of upstream calls and how many were 429s or errors.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+import cv2
+import httpx
+import numpy as np
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+MIME = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
+
+def load_corpus(root: str) -> List[Tuple[str, str, bytes, str]]:
+    """[(category, filename, bytes, mime)]; the category is the first directory under root."""
+    corpus = []
+    for dirpath, _, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        category = "." if rel == "." else rel.split(os.sep)[0]
+        for name in sorted(filenames):
+            ext = os.path.splitext(name)[1].lower()
+            if ext in IMAGE_EXTENSIONS:
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    corpus.append((category, name, f.read(), MIME[ext]))
+    if not corpus:
+        raise SystemExit(f"No images found under {root}")
+    return corpus
+
+def synthetic_corpus(seed: int = 0, size: int = 640) -> List[Tuple[str, str, bytes, str]]:
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for i in range(6):
+        # Textured green leaf on soil, with a few brown lesions
+        image = np.dstack([rng.integers(40, 80, (size, size)), rng.integers(50, 90, (size, size)),
+                           rng.integers(70, 110, (size, size))]).astype(np.uint8)
+        leaf = np.zeros((size, size), dtype=np.uint8)
+        cv2.ellipse(leaf, (size // 2, size // 2), (size // 3, size // 5), 30 * i, 0, 360, 255, -1)
+        green = np.dstack([rng.integers(20, 70, (size, size)), rng.integers(110, 200, (size, size)),
+                           rng.integers(30, 90, (size, size))]).astype(np.uint8)
+        image[leaf > 0] = green[leaf > 0]
+        for _ in range(i):
+            center = tuple(int(c) for c in rng.integers(size // 3, 2 * size // 3, 2))
+            cv2.circle(image, center, int(rng.integers(8, 25)), (30, 70, 110), -1)
+        corpus.append(("leaf", f"leaf_{i}.jpg", cv2.imencode(".jpg", cv2.GaussianBlur(image, (3, 3), 0))[1].tobytes(), "image/jpeg"))
+    non_leaf = [
+        np.full((size, size, 3), (200, 150, 90), dtype=np.uint8),                               # sky
+        rng.integers(100, 160, (size, size, 1)).repeat(3, axis=2).astype(np.uint8),           # concrete
+        np.full((size, size, 3), 245, dtype=np.uint8),                                        # document
+    ]
+    for y in range(40, size - 40, 30):
+        cv2.putText(non_leaf[2], "lorem ipsum dolor sit amet", (30, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+    for i, image in enumerate(non_leaf):
+        corpus.append(("non_leaf", f"non_leaf_{i}.jpg", cv2.imencode(".jpg", image)[1].tobytes(), "image/jpeg"))
+    return corpus
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": round(float(p50), 1), "p90": round(float(p90), 1), "p99": round(float(p99), 1), "max": round(max(values), 1)}
+
+def outcome_of(response: httpx.Response) -> Tuple[str, dict]:
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code == 200:
+        return "200", body
+    code = response.headers.get("X-Error-Code")
+    if not code and isinstance(body, dict):
+        detail = body.get("detail")
+        code = body.get("code") or (detail.get("code") if isinstance(detail, dict) else None)
+    return f"{response.status_code} {code or ''}".strip(), body
+
+class LoadGenerator:
+    def __init__(self, url: str, corpus, rps: float, duration_s: float, language: str = "en",
+                 constant: bool = False, max_in_flight: int = 256, timeout_s: float = 30.0, seed: int = 0):
+        self.url = url
+        self.corpus = corpus
+        self.rps = rps
+        self.duration_s = duration_s
+        self.language = language
+        self.constant = constant
+        self.max_in_flight = max_in_flight
+        self.timeout_s = timeout_s
+        self.rng = random.Random(seed)
+        self.latencies: List[float] = []
+        self.ok_latencies: List[float] = []
+        self.outcomes = Counter()
+        self.by_category: Dict[str, Counter] = defaultdict(Counter)
+        self.advisory_sources = Counter()
+        self.in_flight = 0
+        self.sent = 0
+
+    async def _one(self, client: httpx.AsyncClient, item):
+        category, name, data, mime = item
+        started = time.perf_counter()
+        try:
+            response = await client.post(self.url, params={"language": self.language}, files={"file": (name, data, mime)})
+            outcome, body = outcome_of(response)
+        except httpx.TimeoutException:
+            outcome, body = "client timeout", {}
+        except httpx.HTTPError as e:
+            outcome, body = f"client {type(e).__name__}", {}
+        finally:
+            self.in_flight -= 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.latencies.append(elapsed_ms)
+        self.outcomes[outcome] += 1
+        self.by_category[category][outcome] += 1
+        if outcome == "200":
+            self.ok_latencies.append(elapsed_ms)
+            source = body.get("advisory_source") if isinstance(body, dict) else None
+            self.advisory_sources[source or "unknown"] += 1
+            if source == "llm":
+                self.advisory_sources["llm_valid" if body.get("advisory_valid") else "llm_invalid"] += 1
+
+    async def run(self) -> float:
+        tasks = set()
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(timeout=self.timeout_s, limits=limits) as client:
+            started = time.perf_counter()
+            next_at = started
+            while next_at - started < self.duration_s:
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                if self.in_flight >= self.max_in_flight:
+                    self.outcomes["client dropped (max in flight)"] += 1
+                else:
+                    self.in_flight += 1
+                    self.sent += 1
+                    task = asyncio.create_task(self._one(client, self.rng.choice(self.corpus)))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                next_at += 1.0 / self.rps if self.constant else self.rng.expovariate(self.rps)
+            if tasks:
+                await asyncio.gather(*tasks)
+            return time.perf_counter() - started
+
+    def report(self, elapsed_s: float, upstream: Optional[dict] = None) -> dict:
+        completed = len(self.latencies)
+        answered = self.advisory_sources["bundle"] + self.advisory_sources["llm"]
+        report = {
+            "offered_rps": self.rps,
+            "sent": self.sent,
+            "completed": completed,
+            "elapsed_s": round(elapsed_s, 2),
+            "throughput_rps": round(completed / elapsed_s, 2) if elapsed_s else 0.0,
+            "ok_rps": round(len(self.ok_latencies) / elapsed_s, 2) if elapsed_s else 0.0,
+            "latency_ms": percentiles(self.latencies),
+            "ok_latency_ms": percentiles(self.ok_latencies),
+            "outcomes": dict(self.outcomes.most_common()),
+            "by_category": {k: dict(v.most_common()) for k, v in sorted(self.by_category.items())},
+            "advisory_sources": dict(self.advisory_sources.most_common()),
+            # Share of advisories that did not need the LLM (bundle hits / all advisories written)
+            "advisory_cache_hit_ratio": round(self.advisory_sources["bundle"] / answered, 3) if answered else None,
+        }
+        if upstream is not None:
+            report["upstream"] = upstream
+        return report
+
+def fake_gemini_stats(base: str) -> Optional[dict]:
+    try:
+        return httpx.get(f"{base.rstrip('/')}/stats", timeout=5.0).json()
+    except (httpx.HTTPError, ValueError):
+        return None
+
+def print_report(report: dict):
+    print(f"offered {report['offered_rps']} rps for {report['elapsed_s']}s: sent {report['sent']}, "
+          f"completed {report['completed']} ({report['throughput_rps']} rps, {report['ok_rps']} rps OK)")
+    for key, title in (("latency_ms", "latency (all)"), ("ok_latency_ms", "latency (200)")):
+        p = report[key]
+        print(f"{title:<14} p50 {p['p50']} ms  p90 {p['p90']} ms  p99 {p['p99']} ms  max {p['max']} ms")
+    print("outcomes:")
+    for outcome, count in report["outcomes"].items():
+        print(f"  {outcome:<36} {count:>6}  ({count / max(report['completed'], 1):.1%})")
+    for category, outcomes in report["by_category"].items():
+        print(f"  [{category}] " + ", ".join(f"{k}: {v}" for k, v in outcomes.items()))
+    print("advisories: " + ", ".join(f"{k}={v}" for k, v in report["advisory_sources"].items())
+          + f"; cache hit ratio {report['advisory_cache_hit_ratio']}")
+    if "upstream" in report:
+        print("fake gemini: " + ", ".join(f"{k}={v}" for k, v in report["upstream"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/predict")
+    parser.add_argument("--corpus", help="Directory of images, one subdirectory per category")
+    parser.add_argument("--rps", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of arrivals")
+    parser.add_argument("--constant", action="store_true", help="Evenly spaced instead of Poisson arrivals")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--fake-gemini", help="Base URL of tools.fake_gemini, to report upstream calls")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.seed)
+    gen = LoadGenerator(args.url.rstrip("/") + args.path, corpus, args.rps, args.duration, args.language,
+                        args.constant, args.max_in_flight, args.timeout, args.seed)
+    before = fake_gemini_stats(args.fake_gemini) if args.fake_gemini else None
+    elapsed = asyncio.run(gen.run())
+    upstream = None
+    if before is not None and (after := fake_gemini_stats(args.fake_gemini)) is not None:
+        upstream = {k: v - before.get(k, 0) for k, v in after.items() if isinstance(v, int) and not isinstance(v, bool)}
+
+    report = gen.report(elapsed, upstream)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import os
 import json
+import argparse
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+from tensorflow.keras.applications import MobileNetV2, MobileNetV3Small
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Activation, Lambda
 from tensorflow.keras.models import Model
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from app.config import get_settings
@@ -18,6 +19,19 @@ CALIBRATION_SAVE_PATH = 'models/calibration_metrics.json'
 BATCH_SIZE = 32
 IMG_SIZE = (224, 224)
 EPOCHS = 10
+MERGED_DATASET_PATH = 'dataset/merged'  # DATASET_PATH plus archived uploads, rebuilt by --archive
+
+# ==========================================
+# DISTILLATION CONFIGURATIONS
+# ==========================================
+STUDENTS_DIR = 'models/students'
+DISTILL_TEMPERATURE = 4.0
+DISTILL_ALPHA = 0.3  # Weight of the hard (mixup) labels; the rest goes to the teacher's soft labels
+STUDENT_SPECS = {
+    "mobilenetv3_small_128": {"arch": "mobilenet_v3_small", "alpha": 1.0, "input_size": 128},
+    "mobilenetv2_050_128": {"arch": "mobilenet_v2", "alpha": 0.5, "input_size": 128},
+    "mobilenetv2_035_96": {"arch": "mobilenet_v2", "alpha": 0.35, "input_size": 96},
+}
 
 def mixup_data(x, y, alpha=0.2):
     """Returns mixed inputs, pairs of targets, and lambda"""
@@ -51,20 +65,12 @@ def compute_class_weights(generator):
     )
     return dict(enumerate(class_weights))
 
-def train_model():
-    """
-    Compiles and trains a MobileNetV2 transfer learning model on a plant disease dataset
-    with advanced augmentations, mixup, and class balancing.
-    """
-    if not os.path.exists('models'):
-        os.makedirs('models')
+def class_weight_vector(class_weights, num_classes):
+    """Class-weight dict as a vector so it can be applied to soft (mixup / teacher) targets."""
+    return np.array([class_weights.get(i, 1.0) for i in range(num_classes)], dtype=np.float32)
 
-    if not os.path.exists(DATASET_PATH):
-        print(f"Dataset path {DATASET_PATH} not found. Please add your datasets.")
-        return
-
-    # Advanced Data Augmentation
-    datagen = ImageDataGenerator(
+def make_datagen():
+    return ImageDataGenerator(
         preprocessing_function=tf.keras.applications.mobilenet_v2.preprocess_input,
         validation_split=0.2, # 80-20 train-test split
         rotation_range=20,
@@ -77,8 +83,202 @@ def train_model():
         fill_mode='nearest'
     )
 
+def build_classifier_head(base_model, num_classes):
+    """Shared top layers. Returns the pre-softmax logits tensor."""
+    x = base_model.output
+    x = GlobalAveragePooling2D(name="feature_extractor_pool")(x)
+    x = Dropout(0.3)(x)
+    x = Dense(128, activation='relu')(x)
+    return Dense(num_classes, name="logits")(x)
+
+def build_student_base(spec):
+    input_shape = (spec["input_size"], spec["input_size"], 3)
+    if spec["arch"] == "mobilenet_v3_small":
+        # Inputs are already MobileNetV2-normalized to [-1, 1], same as the serving pipeline
+        return MobileNetV3Small(weights='imagenet', include_top=False, input_shape=input_shape,
+                                alpha=spec["alpha"], include_preprocessing=False)
+    return MobileNetV2(weights='imagenet', include_top=False, input_shape=input_shape, alpha=spec["alpha"])
+
+def distillation_generator(generator, teacher, class_weight_vec, input_size, temperature=DISTILL_TEMPERATURE, alpha=0.2):
+    """Mixup batches labelled by the teacher: yields (student_x, (hard, soft), (w, w))."""
+    for mixed_x, mixed_y in mixup_generator(generator, alpha=alpha):
+        teacher_probs = teacher.predict_on_batch(mixed_x)
+        teacher_logits = np.log(np.clip(teacher_probs, 1e-7, 1.0)) / temperature
+        soft = np.exp(teacher_logits - teacher_logits.max(axis=1, keepdims=True))
+        soft = soft / soft.sum(axis=1, keepdims=True)
+
+        student_x = tf.image.resize(mixed_x, (input_size, input_size)).numpy()
+        sample_weights = mixed_y @ class_weight_vec
+        yield student_x, (mixed_y, soft), (sample_weights, sample_weights)
+
+def fit_temperature(probs, y_true, grid=np.linspace(0.5, 5.0, 91)):
+    """Temperature that minimizes the NLL of held-out labels, applied the way serving does (log-probs / T)."""
+    logits = np.log(np.asarray(probs, dtype=np.float64) + 1e-7)
+    best, best_nll = 1.0, np.inf
+    for t in grid:
+        z = logits / t
+        z = z - z.max(axis=1, keepdims=True)
+        log_probs = z - np.log(np.exp(z).sum(axis=1, keepdims=True))
+        nll = -log_probs[np.arange(len(y_true)), y_true].mean()
+        if nll < best_nll:
+            best, best_nll = round(float(t), 3), nll
+    return best
+
+def distill_student(name, spec, teacher, class_labels, class_weights):
+    """Trains one student on teacher soft labels and saves it as a servable artifact directory."""
+    input_size = spec["input_size"]
+    num_classes = len(class_labels)
+    datagen = make_datagen()
+    # Teacher sees full-resolution mixup batches; the student gets them resized
+    train_generator = datagen.flow_from_directory(
+        DATASET_PATH, target_size=IMG_SIZE, batch_size=BATCH_SIZE,
+        class_mode='categorical', subset='training', shuffle=True
+    )
+    val_generator = datagen.flow_from_directory(
+        DATASET_PATH, target_size=(input_size, input_size), batch_size=BATCH_SIZE,
+        class_mode='categorical', subset='validation', shuffle=False
+    )
+
+    base_model = build_student_base(spec)
+    base_model.trainable = False
+    logits = build_classifier_head(base_model, num_classes)
+    probs = Activation('softmax', name="probs")(logits)
+    soft_probs = Activation('softmax', name="soft_probs")(Lambda(lambda z: z / DISTILL_TEMPERATURE)(logits))
+
+    train_net = Model(inputs=base_model.input, outputs=[probs, soft_probs])
+    train_net.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
+        loss=['categorical_crossentropy', tf.keras.losses.KLDivergence()],
+        # T^2 keeps soft-label gradients on the same scale as the hard-label term (Hinton et al.)
+        loss_weights=[DISTILL_ALPHA, (1 - DISTILL_ALPHA) * DISTILL_TEMPERATURE ** 2],
+        metrics=[['accuracy'], []]
+    )
+    serve_net = Model(inputs=base_model.input, outputs=probs)
+    serve_net.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
+    train_data = distillation_generator(train_generator, teacher, class_weight_vector(class_weights, num_classes), input_size)
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_probs_loss', patience=3, restore_best_weights=True)
+    val_data = ((x, (y, y)) for x, y in val_generator)
+
+    print(f"Distilling student '{name}' ({spec['arch']}, alpha={spec['alpha']}, {input_size}px)...")
+    train_net.fit(
+        train_data,
+        steps_per_epoch=train_generator.samples // BATCH_SIZE,
+        validation_data=val_data,
+        validation_steps=len(val_generator),
+        epochs=EPOCHS,
+        callbacks=[early_stopping]
+    )
+
+    # Calibrate on the validation split without augmentation, as the student is served
+    calib_generator = ImageDataGenerator(preprocessing_function=tf.keras.applications.mobilenet_v2.preprocess_input,
+                                         validation_split=0.2).flow_from_directory(
+        DATASET_PATH, target_size=(input_size, input_size), batch_size=BATCH_SIZE,
+        class_mode='categorical', subset='validation', shuffle=False
+    )
+    temperature = fit_temperature(serve_net.predict(calib_generator, steps=len(calib_generator), verbose=0), calib_generator.classes)
+    print(f"Student '{name}' temperature: {temperature:.2f}")
+
+    out_dir = os.path.join(STUDENTS_DIR, name)
+    os.makedirs(out_dir, exist_ok=True)
+    serve_net.save(os.path.join(out_dir, 'plant_disease_model.h5'))
+    with open(os.path.join(out_dir, 'class_labels.json'), 'w') as f:
+        json.dump(class_labels, f)
+    with open(os.path.join(out_dir, 'calibration_metrics.json'), 'w') as f:
+        json.dump({
+            "temperature": temperature,
+            "input_size": input_size,
+            "arch": spec["arch"],
+            "width_alpha": spec["alpha"],
+            "teacher": MODEL_SAVE_PATH,
+            "distill_temperature": DISTILL_TEMPERATURE,
+            "distill_alpha": DISTILL_ALPHA,
+            "mixup_alpha": 0.2
+        }, f)
+    # What the serving loader reads (load_version / load_base); calibration_metrics.json is the training record
+    with open(os.path.join(out_dir, 'calibration.json'), 'w') as f:
+        json.dump({"temperature": temperature}, f)
+    print(f"Student '{name}' saved to {out_dir}")
+    return out_dir
+
+def distill_students(student_names=None):
+    """
+    Uses the trained model as teacher to distill smaller serving models, then
+    writes a latency-vs-accuracy report with evaluate_model.py.
+    """
+    if not os.path.exists(MODEL_SAVE_PATH):
+        print(f"Teacher model {MODEL_SAVE_PATH} not found. Train it first with `python train_model.py`.")
+        return
+    if not os.path.exists(DATASET_PATH):
+        print(f"Dataset path {DATASET_PATH} not found. Please add your datasets.")
+        return
+
+    teacher = tf.keras.models.load_model(MODEL_SAVE_PATH, compile=False)
+    with open(LABELS_SAVE_PATH, 'r') as f:
+        class_labels = json.load(f)
+
+    label_generator = make_datagen().flow_from_directory(
+        DATASET_PATH, target_size=IMG_SIZE, batch_size=BATCH_SIZE,
+        class_mode='categorical', subset='training', shuffle=False
+    )
+    class_weights = compute_class_weights(label_generator)
+
+    out_dirs = []
+    for name in student_names or list(STUDENT_SPECS):
+        if name not in STUDENT_SPECS:
+            print(f"Unknown student '{name}'. Choose from: {', '.join(STUDENT_SPECS)}")
+            continue
+        out_dirs.append(distill_student(name, STUDENT_SPECS[name], teacher, class_labels, class_weights))
+
+    from evaluate_model import latency_accuracy_report
+    latency_accuracy_report([os.path.dirname(MODEL_SAVE_PATH)] + out_dirs, os.path.join(STUDENTS_DIR, 'latency_report.json'))
+
+def merge_archive(archive_dir, min_confidence):
+    """
+    Builds MERGED_DATASET_PATH from symlinks: every DATASET_PATH image, plus the uploads in an
+    archive (app/core/archive.py) predicted with at least `min_confidence`, in the folder of their
+    predicted class. Uploads of classes the dataset does not have are left out, so class indices
+    do not change.
+    """
+    import shutil
+    from app.core.archive import read_manifest
+
+    shutil.rmtree(MERGED_DATASET_PATH, ignore_errors=True)
+    classes = sorted(d for d in os.listdir(DATASET_PATH) if os.path.isdir(os.path.join(DATASET_PATH, d)))
+    for name in classes:
+        os.makedirs(os.path.join(MERGED_DATASET_PATH, name))
+        for file in os.listdir(os.path.join(DATASET_PATH, name)):
+            os.symlink(os.path.abspath(os.path.join(DATASET_PATH, name, file)), os.path.join(MERGED_DATASET_PATH, name, file))
+
+    added, skipped = 0, 0
+    for row in read_manifest(archive_dir, min_confidence):
+        if row["label"] not in classes or not row["file"].endswith((".jpg", ".png")) or not os.path.exists(row["file"]):
+            skipped += 1
+            continue
+        # "~" sorts after dataset file names, and validation_split validates on the first files of each
+        # class, so the archived (model-labelled) images go to the training subset
+        os.symlink(row["file"], os.path.join(MERGED_DATASET_PATH, row["label"], "~" + os.path.basename(row["file"])))
+        added += 1
+    print(f"Merged {added} archived uploads into {MERGED_DATASET_PATH} (skipped {skipped}: unknown class, format or missing file)")
+    return MERGED_DATASET_PATH
+
+def train_model(dataset_path=DATASET_PATH):
+    """
+    Compiles and trains a MobileNetV2 transfer learning model on a plant disease dataset
+    with advanced augmentations, mixup, and class balancing.
+    """
+    if not os.path.exists('models'):
+        os.makedirs('models')
+
+    if not os.path.exists(dataset_path):
+        print(f"Dataset path {dataset_path} not found. Please add your datasets.")
+        return
+
+    # Advanced Data Augmentation
+    datagen = make_datagen()
+
     train_generator = datagen.flow_from_directory(
-        DATASET_PATH,
+        dataset_path,
         target_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
         class_mode='categorical',
@@ -87,7 +287,7 @@ def train_model():
     )
 
     val_generator = datagen.flow_from_directory(
-        DATASET_PATH,
+        dataset_path,
         target_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
         class_mode='categorical',
@@ -110,11 +310,7 @@ def train_model():
     base_model.trainable = False # Freeze base layers temporarily
 
     # Custom Classification Top Layers
-    x = base_model.output
-    x = GlobalAveragePooling2D(name="feature_extractor_pool")(x)
-    x = Dropout(0.3)(x)
-    x = Dense(128, activation='relu')(x)
-    predictions = Dense(train_generator.num_classes, activation='softmax')(x)
+    predictions = Activation('softmax')(build_classifier_head(base_model, train_generator.num_classes))
 
     # Compile Final Model
     model = Model(inputs=base_model.input, outputs=predictions)
@@ -167,4 +363,21 @@ def train_model():
     print(f"Calibration data saved to {CALIBRATION_SAVE_PATH}")
 
 if __name__ == "__main__":
-    train_model()
+    parser = argparse.ArgumentParser(description="Train the LeafSense model or distill smaller students from it.")
+    parser.add_argument("--distill", action="store_true", help="Distill students from the trained model instead of training it")
+    parser.add_argument("--students", nargs="*", help=f"Students to distill (default: all of {', '.join(STUDENT_SPECS)})")
+    parser.add_argument("--archive", help="Also train on the accepted uploads archived by the backend (its ARCHIVE_DIR)")
+    parser.add_argument("--archive-min-confidence", type=float, default=0.9, help="Only archived uploads predicted at least this confidently")
+    args = parser.parse_args()
+    if args.students is not None and not args.distill:
+        parser.error("--students only applies to --distill")
+
+    if args.distill:
+        distill_students(args.students)
+    elif args.archive:
+        if not os.path.exists(DATASET_PATH):
+            print(f"Dataset path {DATASET_PATH} not found. Please add your datasets.")
+        else:
+            train_model(merge_archive(args.archive, args.archive_min_confidence))
+    else:
+        train_model()